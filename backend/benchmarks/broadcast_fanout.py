@@ -0,0 +1,120 @@
+"""
+Pulse Backend - Broadcast Fan-out Benchmark
+CPU cost per recipient of one chat broadcast, encoded per member vs once per protocol
+
+Run from backend/:  python -m benchmarks.broadcast_fanout [--binary-share 0.5]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+
+from realtime.connection_registry import ConnectionRegistry
+from realtime.wire_protocol import MSGPACK_AVAILABLE, Frame, negotiate
+
+ROUNDS = 20
+
+
+class NullWebSocket:
+    """Accepts frames without touching the network"""
+
+    async def send_text(self, message: str):
+        pass
+
+    async def send_bytes(self, message: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _message_payload() -> dict:
+    """A new_message frame shaped like serialize_mongo_doc(Message(...).dict())"""
+    return {
+        "type": "new_message",
+        "data": {
+            "message_id": str(uuid.uuid4()),
+            "chat_id": str(uuid.uuid4()),
+            "sender_id": str(uuid.uuid4()),
+            "content": "See you at the station at half past six, I'll bring the tickets",
+            "message_type": "text",
+            "file_name": None,
+            "file_size": None,
+            "file_data": None,
+            "voice_duration": None,
+            "reply_to": None,
+            "reactions": {},
+            "read_by": [],
+            "is_encrypted": True,
+            "encrypted_content": "gAAAAABm" + "x" * 120,
+            "timestamp": datetime.utcnow().isoformat(),
+            "expires_at": None,
+        }
+    }
+
+
+def _registry(members: int, binary_share: float) -> ConnectionRegistry:
+    registry = ConnectionRegistry(max_concurrency=256)
+    binary_every = round(1 / binary_share) if binary_share else 0
+    for i in range(members):
+        codec = None
+        if binary_every and i % binary_every == 0:
+            codec, _ = negotiate(["pulse.msgpack+deflate"], None)
+        registry.add(f"user{i}", NullWebSocket(), codec=codec)
+    return registry
+
+
+async def _per_member(registry: ConnectionRegistry, user_ids, payload: dict):
+    """The previous shape: serialize inside the member loop, each socket re-encodes its copy"""
+    for user_id in user_ids:
+        registry.send_to_user(user_id, json.dumps(payload, default=str))
+    await registry.flush()
+
+
+async def _encode_once(registry: ConnectionRegistry, user_ids, payload: dict):
+    registry.fan_out(Frame(payload), user_ids)
+    await registry.flush()
+
+
+async def bench(members: int, binary_share: float, broadcast) -> float:
+    """Median CPU microseconds per recipient of one broadcast"""
+    registry = _registry(members, binary_share)
+    user_ids = list(registry.user_connections)
+    await broadcast(registry, user_ids, _message_payload())  # start the writer tasks
+    timings = []
+    for _ in range(ROUNDS):
+        payload = _message_payload()
+        start = time.process_time()
+        await broadcast(registry, user_ids, payload)
+        timings.append(time.process_time() - start)
+    for connection_id in list(registry.connections):
+        registry.remove(connection_id)
+    timings.sort()
+    return timings[len(timings) // 2] / members * 1e6
+
+
+async def run(member_counts, binary_share: float):
+    print(f"binary (msgpack+deflate) share: {binary_share:.0%}")
+    print(f"{'members':>8} {'per member (us)':>16} {'encode once (us)':>17} {'saved':>7}")
+    for members in member_counts:
+        before = await bench(members, binary_share, _per_member)
+        after = await bench(members, binary_share, _encode_once)
+        print(f"{members:>8} {before:>16.2f} {after:>17.2f} {1 - after / before:>7.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--max-members", type=int, default=2000)
+    parser.add_argument("--binary-share", type=float, default=0.5, help="fraction of sockets on MessagePack")
+    args = parser.parse_args()
+
+    binary_share = args.binary_share if MSGPACK_AVAILABLE else 0.0
+    member_counts = [count for count in (10, 100, 500, 2000) if count <= args.max_members]
+    asyncio.run(run(member_counts, binary_share))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Pulse Backend - Disconnect Cleanup Benchmark
+Per-disconnect cost as the number of tracked rooms grows
+
+Run from backend/:  python -m benchmarks.disconnect_cleanup [--max-rooms 1000000]
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from realtime.room_index import RoomIndex, RoomOwnerIndex
+from realtime.typing_coalescer import TypingCoalescer
+
+USERS_PER_ROOM = 4
+ROOMS_PER_USER = 3
+SAMPLES = 200
+
+
+async def _noop_flush(chat_id, typing_users):
+    pass
+
+
+def _time_per_call(setup: Callable[[], Callable[[], None]], samples: int) -> float:
+    """Median seconds of one cleanup call; setup re-adds the user each time"""
+    timings = []
+    for _ in range(samples):
+        cleanup = setup()
+        start = time.perf_counter()
+        cleanup()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def bench_indexed(room_count: int) -> float:
+    voice = RoomIndex()
+    screens = RoomOwnerIndex()
+    typing = TypingCoalescer(_noop_flush)
+    for i in range(room_count):
+        for j in range(USERS_PER_ROOM):
+            voice.join(f"room{i}", f"user{i}-{j}")
+        screens.set(f"room{i}", f"user{i}-0")
+        typing.set_typing(f"chat{i}", f"user{i}-1", True)
+
+    def setup():
+        for k in range(ROOMS_PER_USER):
+            voice.join(f"room{k}", "leaver")
+            typing.set_typing(f"chat{k}", "leaver", True)
+        screens.set("room0", "leaver")
+
+        def cleanup():
+            typing.clear_user("leaver")
+            voice.remove_user("leaver")
+            screens.remove_user("leaver")
+        return cleanup
+
+    return _time_per_call(setup, SAMPLES)
+
+
+def bench_scan(room_count: int) -> float:
+    """The previous approach: dicts of lists scanned on every disconnect"""
+    voice_rooms: Dict[str, List[str]] = {
+        f"room{i}": [f"user{i}-{j}" for j in range(USERS_PER_ROOM)] for i in range(room_count)
+    }
+    typing_users: Dict[str, List[str]] = {f"chat{i}": [f"user{i}-1"] for i in range(room_count)}
+
+    def setup():
+        for k in range(ROOMS_PER_USER):
+            voice_rooms[f"room{k}"].append("leaver")
+            typing_users[f"chat{k}"].append("leaver")
+
+        def cleanup():
+            for chat_id in list(typing_users.keys()):
+                if "leaver" in typing_users[chat_id]:
+                    typing_users[chat_id].remove("leaver")
+            for room_id in list(voice_rooms.keys()):
+                if "leaver" in voice_rooms[room_id]:
+                    voice_rooms[room_id].remove("leaver")
+        return cleanup
+
+    # Full scans are slow at the top end; a handful of samples is enough
+    return _time_per_call(setup, max(3, SAMPLES * 1000 // room_count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--max-rooms", type=int, default=1_000_000)
+    parser.add_argument("--skip-scan", action="store_true", help="only measure the indexed cleanup")
+    args = parser.parse_args()
+
+    room_counts = [count for count in (1_000, 10_000, 100_000, 1_000_000) if count <= args.max_rooms]
+    print(f"{'rooms':>10} {'indexed (us)':>14} {'scan (us)':>12}")
+    for room_count in room_counts:
+        indexed = bench_indexed(room_count) * 1e6
+        scan = "-" if args.skip_scan else f"{bench_scan(room_count) * 1e6:.1f}"
+        print(f"{room_count:>10} {indexed:>14.1f} {scan:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Pulse Backend - Message Commit Benchmark
+Group-chat send throughput, one insert and chat update per message vs group commit
+
+Run from backend/:  python -m benchmarks.message_commit [--rtt-ms 1.0] [--senders 200]
+
+The store models MongoDB as a connection pool where every operation holds a
+connection for one round trip plus a per-document cost; the numbers show how
+the two write shapes scale, not what a given cluster will do.
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+from realtime.message_pipeline import MessagePipeline
+
+
+class SimulatedStore:
+    """Each operation holds one of `pool` connections for rtt + per-document time"""
+
+    def __init__(self, rtt: float, per_document: float, pool: int):
+        self.rtt = rtt
+        self.per_document = per_document
+        self.pool = asyncio.Semaphore(pool)
+        self.operations = 0
+
+    async def operation(self, documents: int = 1):
+        async with self.pool:
+            self.operations += 1
+            await asyncio.sleep(self.rtt + self.per_document * documents)
+
+    async def insert_many(self, messages):
+        await self.operation(len(messages))
+        return set()
+
+    async def update_chats(self, latest):
+        await self.operation(len(latest))
+
+
+def _message(chat_id: str) -> dict:
+    return {"message_id": str(uuid.uuid4()), "chat_id": chat_id, "timestamp": datetime.utcnow()}
+
+
+async def _per_message(store: SimulatedStore, message: dict):
+    """The previous shape: insert_one, then update_one on the chat, then broadcast"""
+    await store.operation()
+    await store.operation()
+
+
+async def bench(args: argparse.Namespace, pipelined: bool) -> dict:
+    store = SimulatedStore(args.rtt_ms / 1000, args.per_doc_us / 1e6, args.pool)
+    pipeline = None
+    if pipelined:
+        async def fanout(messages):
+            pass
+        pipeline = MessagePipeline(store.insert_many, store.update_chats, fanout, window=args.window_ms / 1000)
+        pipeline.start()
+
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+
+    async def sender(index: int):
+        chat_id = f"chat{index % args.chats}"
+        while time.perf_counter() < deadline:
+            message = _message(chat_id)
+            start = time.perf_counter()
+            if pipeline is not None:
+                await pipeline.submit(message)
+            else:
+                await _per_message(store, message)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(sender(i) for i in range(args.senders)))
+    if pipeline is not None:
+        await pipeline.stop()
+    latencies.sort()
+    return {
+        "sends_per_s": len(latencies) / args.duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "ops_per_send": store.operations / len(latencies),
+    }
+
+
+async def run(args: argparse.Namespace):
+    print(f"rtt {args.rtt_ms}ms, pool {args.pool}, {args.senders} concurrent senders over {args.chats} chats")
+    print(f"{'shape':>14} {'sends/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'db ops/send':>12}")
+    for name, pipelined in (("per message", False), ("group commit", True)):
+        result = await bench(args, pipelined)
+        print(
+            f"{name:>14} {result['sends_per_s']:>9.0f} {result['p50_ms']:>9.2f} "
+            f"{result['p99_ms']:>9.2f} {result['ops_per_send']:>12.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="round trip to the primary")
+    parser.add_argument("--per-doc-us", type=float, default=20.0, help="server time per written document")
+    parser.add_argument("--pool", type=int, default=100, help="driver connection pool size")
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--window-ms", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Pulse Backend - Message Decrypt Benchmark
+History page decryption: a Fernet per message vs cached cipher, batch, and worker thread
+
+Run from backend/:  python -m benchmarks.message_decrypt [--pages 1000,10000]
+
+"loop blocked" is the longest stretch the event loop could not run other
+requests while a page was decrypted; offloading trades it for a thread hop.
+"""
+
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import time
+
+from cryptography.fernet import Fernet
+
+ROUNDS = 5
+
+
+def _per_message(encrypted, key):
+    """The previous shape: MessageEncryption.decrypt_message once per message, new Fernet each time"""
+    contents = []
+    for encrypted_message in encrypted:
+        f = Fernet(key.encode())
+        contents.append(f.decrypt(base64.urlsafe_b64decode(encrypted_message.encode())).decode())
+    return contents
+
+
+async def _loop_blocked(decrypt) -> float:
+    """Longest gap between ticks of a 1 ms heartbeat while `decrypt` runs"""
+    longest = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    ticker = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.005)
+    await decrypt()
+    done = True
+    await ticker
+    return longest
+
+
+async def bench(size: int, encryption) -> None:
+    key = encryption.generate_key()
+    encrypted = [encryption.encrypt_message(f"message {i} " + "x" * 80, key) for i in range(size)]
+
+    async def per_message():
+        _per_message(encrypted, key)
+
+    async def batch_inline():
+        encryption.decrypt_messages(encrypted, key)
+
+    async def batch_offloaded():
+        await encryption.decrypt_page(encrypted, key)
+
+    for name, decrypt in (("per message", per_message), ("cached batch", batch_inline), ("batch + thread", batch_offloaded)):
+        wall, blocked = [], []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            blocked.append(await _loop_blocked(decrypt))
+            wall.append(time.perf_counter() - start)
+        wall.sort()
+        blocked.sort()
+        print(
+            f"{size:>7} {name:>15} {wall[ROUNDS // 2] * 1000:>10.1f} "
+            f"{wall[ROUNDS // 2] / size * 1e6:>10.2f} {blocked[ROUNDS // 2] * 1000:>13.1f}"
+        )
+
+
+async def run(sizes):
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    logging.disable(logging.WARNING)
+    from server import MessageEncryption
+
+    print(f"offload threshold: {MessageEncryption.DECRYPT_OFFLOAD_THRESHOLD} messages")
+    print(f"{'page':>7} {'shape':>15} {'page (ms)':>10} {'per msg (us)':>10} {'loop blocked (ms)':>13}")
+    for size in sizes:
+        await bench(size, MessageEncryption)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--pages", default="1000,10000", help="comma-separated page sizes")
+    args = parser.parse_args()
+    asyncio.run(run([int(size) for size in args.pages.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
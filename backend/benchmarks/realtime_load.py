@@ -0,0 +1,616 @@
+"""
+Pulse Backend - Realtime Load Test Harness
+Simulated clients against /api/ws/{user_id} and /ws/games/{room_id}
+
+Run from backend/:
+    python -m benchmarks.realtime_load all --db memory --users 2000 --duration 60
+    python -m benchmarks.realtime_load serve --db mongo --users 20000 --fixture /tmp/pulse_load.json
+    python -m benchmarks.realtime_load run --fixture /tmp/pulse_load.json --server-pid <pid>
+
+`serve` seeds users, group chats (members are mutual contacts) and Ludo
+rooms into a local Mongo (MONGO_URL/DB_NAME) or an in-memory mongomock-motor
+database, and runs the app under uvicorn. `run` connects every user and every
+game player, drives messages (HTTP), typing and presence (chat WS) and dice
+rolls (game WS) at the requested rates, then reports fan-out latency
+percentiles, dropped frames, server CPU/RSS and the server's own realtime
+counters. `all` does both.
+
+Requires websockets and httpx (plus mongomock-motor for --db memory). Past
+~25k sockets raise `ulimit -n` and net.ipv4.ip_local_port_range, or spread
+clients over several loopback source addresses with --client-ips.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+try:
+    import httpx
+    import websockets
+    LOADTEST_DEPS_AVAILABLE = True
+except ImportError:
+    LOADTEST_DEPS_AVAILABLE = False
+
+LOADTEST_USER_AGENT = "pulse-loadtest/1.0"
+GAME_TYPE = "ludo"
+
+
+# ==========================================
+# SEEDING + SERVER
+# ==========================================
+
+async def seed(server: Any, args: argparse.Namespace) -> Dict[str, Any]:
+    """Create load-test users, chats and game rooms; returns the fixture"""
+    db = server.db
+    await db.users.delete_many({"loadtest": True})
+    await db.chats.delete_many({"loadtest": True})
+    await db.game_rooms.delete_many({"loadtest": True})
+    await db.contacts.delete_many({"loadtest": True})
+
+    users = []
+    for i in range(args.users):
+        user_id = str(uuid.uuid4())
+        users.append({
+            "user_id": user_id,
+            "username": f"load_{i}",
+            "email": f"load_{i}@loadtest.local",
+            "display_name": f"Load {i}",
+            "loadtest": True
+        })
+    await db.users.insert_many(users)
+    user_ids = [user["user_id"] for user in users]
+
+    chats = []
+    for start in range(0, len(user_ids) - args.chat_size + 1, args.chat_size):
+        chats.append({
+            "chat_id": str(uuid.uuid4()),
+            "chat_type": "group",
+            "name": f"load chat {len(chats)}",
+            "members": user_ids[start:start + args.chat_size],
+            "encryption_enabled": False,
+            "loadtest": True
+        })
+    if chats:
+        await db.chats.insert_many(chats)
+        # Chat members are each other's contacts, so presence changes have watchers
+        await db.contacts.insert_many([
+            {"contact_id": str(uuid.uuid4()), "user_id": member, "contact_user_id": other, "loadtest": True}
+            for chat in chats for member in chat["members"] for other in chat["members"] if other != member
+        ])
+
+    rooms = []
+    for i in range(args.rooms):
+        players = random.sample(user_ids, min(args.room_size, len(user_ids)))
+        rooms.append({
+            "room_id": str(uuid.uuid4()),
+            "game_type": GAME_TYPE,
+            "players": players,
+            "status": "playing",
+            "game_state": await server.initialize_game_state(GAME_TYPE, players),
+            "loadtest": True
+        })
+    if rooms:
+        await db.game_rooms.insert_many(rooms)
+
+    token_ttl = server.timedelta(hours=12)
+    return {
+        "users": [
+            {"user_id": user_id, "token": server.create_access_token({"sub": user_id}, token_ttl)}
+            for user_id in user_ids
+        ],
+        "chats": [{"chat_id": chat["chat_id"], "members": chat["members"]} for chat in chats],
+        "rooms": [{"room_id": room["room_id"], "players": room["players"]} for room in rooms],
+    }
+
+
+async def serve(args: argparse.Namespace):
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "pulse_loadtest")
+    import uvicorn
+    import server
+
+    if args.db == "memory":
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[os.environ["DB_NAME"]]
+        server.presence_writer.collection = server.db.users
+
+    fixture = await seed(server, args)
+    fixture["server_pid"] = os.getpid()
+    with open(args.fixture + ".tmp", "w") as f:
+        json.dump(fixture, f)
+    os.replace(args.fixture + ".tmp", args.fixture)
+    print(f"Seeded {len(fixture['users'])} users, {len(fixture['chats'])} chats, "
+          f"{len(fixture['rooms'])} rooms -> {args.fixture}", flush=True)
+
+    config = uvicorn.Config(
+        server.app,
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+        backlog=8192,
+        ws_ping_interval=None  # the app runs its own heartbeat
+    )
+    await uvicorn.Server(config).serve()
+
+
+# ==========================================
+# MEASUREMENT
+# ==========================================
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "p999": None, "max": None}
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "p50": at(0.50),
+        "p90": at(0.90),
+        "p99": at(0.99),
+        "p999": at(0.999),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+class ServerSampler:
+    """CPU and RSS of the server process, sampled from /proc once a second"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.cpu_samples: List[float] = []
+        self.rss_samples: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_ticks = int(fields[11]) + int(fields[12])  # utime + stime
+        rss_kb = 0
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+        return cpu_ticks, rss_kb
+
+    async def _run(self):
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+        last_ticks, _ = self._read()
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            ticks, rss_kb = self._read()
+            now = time.monotonic()
+            self.cpu_samples.append((ticks - last_ticks) / ticks_per_second / (now - last_time) * 100)
+            self.rss_samples.append(rss_kb)
+            last_ticks, last_time = ticks, now
+
+    def start(self):
+        if self.pid and os.path.exists(f"/proc/{self.pid}/stat"):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, FileNotFoundError, ProcessLookupError):
+                pass
+
+    def report(self) -> Dict[str, Any]:
+        if not self.cpu_samples:
+            return {"available": False}
+        return {
+            "available": True,
+            "cpu_percent_avg": round(sum(self.cpu_samples) / len(self.cpu_samples), 1),
+            "cpu_percent_max": round(max(self.cpu_samples), 1),
+            "rss_mb_max": round(max(self.rss_samples) / 1024, 1),
+            "rss_mb_end": round(self.rss_samples[-1] / 1024, 1),
+        }
+
+
+class LoadStats:
+    """Shared bookkeeping between senders and simulated clients"""
+
+    def __init__(self):
+        self.sent_messages: Dict[str, float] = {}  # message tag -> send time
+        self.expected_message_frames = 0
+        self.received_message_frames = 0
+        self.room_moves: Dict[str, List[float]] = {}  # room_id -> send times, in order
+        self.expected_game_frames = 0
+        self.received_game_frames = 0
+        self.unmatched_game_frames = 0
+        self.frames_by_type: Dict[str, int] = {}
+        self.message_latency: List[float] = []
+        self.game_latency: List[float] = []
+        self.http_errors = 0
+        self.connect_errors = 0
+        self.disconnects = 0
+
+    def count_frame(self, frame_type: str):
+        self.frames_by_type[frame_type] = self.frames_by_type.get(frame_type, 0) + 1
+
+
+# ==========================================
+# SIMULATED CLIENTS
+# ==========================================
+
+class ChatClient:
+    """One user's socket on /api/ws/{user_id}"""
+
+    def __init__(self, user_id: str, stats: LoadStats):
+        self.user_id = user_id
+        self.stats = stats
+        self.ws = None
+
+    async def connect(self, base_ws_url: str, local_addr: Optional[tuple]):
+        self.ws = await websockets.connect(
+            f"{base_ws_url}/api/ws/{self.user_id}",
+            max_size=None,
+            ping_interval=None,
+            local_addr=local_addr,
+            user_agent_header=LOADTEST_USER_AGENT
+        )
+        asyncio.get_running_loop().create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                received_at = time.perf_counter()
+                frame = json.loads(raw)
+                frame_type = frame.get("type", "?")
+                self.stats.count_frame(frame_type)
+                if frame_type == "ping":
+                    await self.ws.send(json.dumps({"type": "pong"}))
+                elif frame_type == "new_message":
+                    sent_at = self.stats.sent_messages.get(frame["data"].get("content", ""))
+                    if sent_at is not None:
+                        self.stats.received_message_frames += 1
+                        self.stats.message_latency.append(received_at - sent_at)
+        except websockets.ConnectionClosed:
+            self.stats.disconnects += 1
+
+    async def send(self, payload: Dict[str, Any]):
+        try:
+            await self.ws.send(json.dumps(payload))
+        except websockets.ConnectionClosed:
+            pass
+
+
+class GameClient:
+    """One player's socket on /ws/games/{room_id}"""
+
+    def __init__(self, room_id: str, player_id: str, stats: LoadStats):
+        self.room_id = room_id
+        self.player_id = player_id
+        self.stats = stats
+        self.updates = 0
+        self.ws = None
+
+    async def connect(self, base_ws_url: str, local_addr: Optional[tuple]):
+        self.ws = await websockets.connect(
+            f"{base_ws_url}/ws/games/{self.room_id}",
+            max_size=None,
+            ping_interval=None,
+            local_addr=local_addr,
+            user_agent_header=LOADTEST_USER_AGENT
+        )
+        asyncio.get_running_loop().create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                received_at = time.perf_counter()
+                frame = json.loads(raw)
+                frame_type = frame.get("type", "?")
+                self.stats.count_frame(f"game:{frame_type}")
+                if frame_type == "ping":
+                    await self.ws.send(json.dumps({"type": "pong"}))
+                elif frame_type == "game_state_update":
+                    # Moves in a room are matched to updates in send order
+                    sends = self.stats.room_moves.get(self.room_id, [])
+                    if self.updates < len(sends):
+                        self.stats.received_game_frames += 1
+                        self.stats.game_latency.append(received_at - sends[self.updates])
+                    else:
+                        self.stats.unmatched_game_frames += 1
+                    self.updates += 1
+        except websockets.ConnectionClosed:
+            self.stats.disconnects += 1
+
+    async def roll(self):
+        self.stats.room_moves.setdefault(self.room_id, []).append(time.perf_counter())
+        try:
+            await self.ws.send(json.dumps({
+                "type": "game_move",
+                "player_id": self.player_id,
+                "move": {"type": "roll_dice"}
+            }))
+        except websockets.ConnectionClosed:
+            pass
+
+
+# ==========================================
+# LOAD RUN
+# ==========================================
+
+class LoadRun:
+    def __init__(self, fixture: Dict[str, Any], args: argparse.Namespace):
+        self.fixture = fixture
+        self.args = args
+        self.stats = LoadStats()
+        self.tokens = {user["user_id"]: user["token"] for user in fixture["users"]}
+        self.chat_clients: Dict[str, ChatClient] = {}
+        self.game_clients: Dict[str, List[GameClient]] = {}
+        self.user_chats: Dict[str, List[Dict[str, Any]]] = {}
+        for chat in fixture["chats"]:
+            for member in chat["members"]:
+                self.user_chats.setdefault(member, []).append(chat)
+        self.local_addrs = [(ip, 0) for ip in args.client_ips.split(",")] if args.client_ips else [None]
+        self.http: Optional["httpx.AsyncClient"] = None
+
+    # Connection phase
+
+    async def _connect_all(self, clients: List[Any]):
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def connect(index: int, client: Any):
+            async with semaphore:
+                try:
+                    await client.connect(self.args.ws_url, self.local_addrs[index % len(self.local_addrs)])
+                except Exception:
+                    self.stats.connect_errors += 1
+                    client.ws = None
+
+        await asyncio.gather(*(connect(i, client) for i, client in enumerate(clients)))
+
+    async def connect(self):
+        chat_clients = [ChatClient(user["user_id"], self.stats) for user in self.fixture["users"]]
+        game_clients = []
+        for room in self.fixture["rooms"]:
+            room_clients = [GameClient(room["room_id"], player, self.stats) for player in room["players"]]
+            self.game_clients[room["room_id"]] = room_clients
+            game_clients.extend(room_clients)
+
+        started = time.perf_counter()
+        await self._connect_all(chat_clients + game_clients)
+        self.chat_clients = {client.user_id: client for client in chat_clients if client.ws is not None}
+        for room_id, clients in self.game_clients.items():
+            self.game_clients[room_id] = [client for client in clients if client.ws is not None]
+        return time.perf_counter() - started
+
+    # Traffic
+
+    async def _paced(self, rate: float, action, deadline: float):
+        """Poisson arrivals at `rate` per second until the deadline"""
+        if rate <= 0:
+            return
+        tasks = set()
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(random.expovariate(rate))
+            task = asyncio.get_running_loop().create_task(action())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def send_message(self):
+        chat = random.choice(self.fixture["chats"])
+        sender = random.choice(chat["members"])
+        tag = f"loadtest:{uuid.uuid4().hex}"
+        self.stats.expected_message_frames += sum(1 for member in chat["members"] if member in self.chat_clients)
+        self.stats.sent_messages[tag] = time.perf_counter()
+        try:
+            response = await self.http.post(
+                f"{self.args.url}/api/chats/{chat['chat_id']}/messages",
+                json={"content": tag},
+                headers={"Authorization": f"Bearer {self.tokens[sender]}"}
+            )
+            if response.status_code != 200:
+                self.stats.http_errors += 1
+        except httpx.HTTPError:
+            self.stats.http_errors += 1
+
+    async def send_typing(self):
+        client = random.choice(list(self.chat_clients.values()))
+        chats = self.user_chats.get(client.user_id)
+        if not chats:
+            return
+        chat_id = random.choice(chats)["chat_id"]
+        await client.send({"type": "typing", "chat_id": chat_id, "is_typing": True})
+        await asyncio.sleep(random.uniform(0.5, 3.0))
+        await client.send({"type": "typing", "chat_id": chat_id, "is_typing": False})
+
+    async def send_presence(self):
+        client = random.choice(list(self.chat_clients.values()))
+        await client.send({"type": "user_status", "status": random.choice(["online", "away", "busy"])})
+
+    async def send_move(self):
+        room_id = random.choice(list(self.game_clients))
+        clients = self.game_clients[room_id]
+        if clients:
+            self.stats.expected_game_frames += len(clients)
+            await random.choice(clients).roll()
+
+    async def drive(self):
+        deadline = time.perf_counter() + self.args.duration
+        await asyncio.gather(
+            self._paced(self.args.message_rate, self.send_message, deadline),
+            self._paced(self.args.typing_rate, self.send_typing, deadline),
+            self._paced(self.args.presence_rate, self.send_presence, deadline),
+            self._paced(self.args.move_rate if self.game_clients else 0, self.send_move, deadline),
+        )
+
+    async def server_stats(self) -> Optional[Dict[str, Any]]:
+        token = self.fixture["users"][0]["token"]
+        try:
+            response = await self.http.get(
+                f"{self.args.url}/api/admin/performance",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            return {key: data.get(key) for key in (
+                "realtime_stats", "heartbeat_stats", "presence_write_stats", "message_pipeline_stats", "game_room_stats"
+            )}
+        except httpx.HTTPError:
+            return None
+
+    async def execute(self) -> Dict[str, Any]:
+        self.http = httpx.AsyncClient(
+            timeout=30,
+            headers={"User-Agent": LOADTEST_USER_AGENT},
+            limits=httpx.Limits(max_connections=self.args.http_connections)
+        )
+        sampler = ServerSampler(self.args.server_pid or self.fixture.get("server_pid"))
+        sampler.start()
+        try:
+            connect_seconds = await self.connect()
+            print(f"Connected {len(self.chat_clients)} chat and "
+                  f"{sum(len(c) for c in self.game_clients.values())} game sockets "
+                  f"in {connect_seconds:.1f}s", flush=True)
+            await self.drive()
+            await asyncio.sleep(self.args.drain)
+            server_stats = await self.server_stats()
+        finally:
+            await sampler.stop()
+            await self.http.aclose()
+
+        stats = self.stats
+        return {
+            "clients": {
+                "chat_sockets": len(self.chat_clients),
+                "game_sockets": sum(len(clients) for clients in self.game_clients.values()),
+                "connect_errors": stats.connect_errors,
+                "connect_seconds": round(connect_seconds, 2),
+                "disconnects": stats.disconnects,
+            },
+            "message_fanout_ms": percentiles(stats.message_latency),
+            "game_fanout_ms": percentiles(stats.game_latency),
+            "dropped_frames": {
+                "messages": stats.expected_message_frames - stats.received_message_frames,
+                "game_updates": stats.expected_game_frames - stats.received_game_frames,
+                "unmatched_game_updates": stats.unmatched_game_frames,
+            },
+            "sent": {
+                "messages": len(stats.sent_messages),
+                "moves": sum(len(moves) for moves in stats.room_moves.values()),
+                "http_errors": stats.http_errors,
+            },
+            "frames_received": stats.frames_by_type,
+            "server_process": sampler.report(),
+            "server_stats": server_stats,
+        }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with open(args.fixture) as f:
+        fixture = json.load(f)
+    report = await LoadRun(fixture, args).execute()
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def run_all(args: argparse.Namespace):
+    """Spawn `serve` in a child process, run the load against it, stop it"""
+    if os.path.exists(args.fixture):
+        os.remove(args.fixture)
+    command = [sys.executable, "-m", "benchmarks.realtime_load", "serve"] + [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in ("db", "host", "port", "users", "chat_size", "rooms", "room_size", "fixture")
+    ]
+    server_process = subprocess.Popen(command)
+    try:
+        deadline = time.monotonic() + args.startup_timeout
+        while not os.path.exists(args.fixture):
+            if server_process.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit("Load-test server failed to start")
+            time.sleep(0.2)
+        time.sleep(1.0)  # let uvicorn bind after seeding
+        args.server_pid = server_process.pid
+        asyncio.run(run(args))
+    finally:
+        server_process.terminate()
+        server_process.wait(timeout=30)
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pulse realtime load-test harness")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_server_args(sub):
+        sub.add_argument("--db", choices=["memory", "mongo"], default="memory")
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=8765)
+        sub.add_argument("--users", type=int, default=2000)
+        sub.add_argument("--chat-size", type=int, default=8, help="members per group chat")
+        sub.add_argument("--rooms", type=int, default=100, help="Ludo rooms")
+        sub.add_argument("--room-size", type=int, default=4, help="players per room")
+        sub.add_argument("--fixture", default="/tmp/pulse_load_fixture.json")
+
+    def add_run_args(sub):
+        sub.add_argument("--url", help="HTTP base URL (default from --host/--port)")
+        sub.add_argument("--ws-url", help="WebSocket base URL (default derived from --url)")
+        sub.add_argument("--duration", type=float, default=60.0, help="seconds of traffic")
+        sub.add_argument("--drain", type=float, default=5.0, help="seconds to wait for late frames")
+        sub.add_argument("--message-rate", type=float, default=50.0, help="messages per second")
+        sub.add_argument("--typing-rate", type=float, default=100.0, help="typing bursts per second")
+        sub.add_argument("--presence-rate", type=float, default=20.0, help="status changes per second")
+        sub.add_argument("--move-rate", type=float, default=50.0, help="game moves per second")
+        sub.add_argument("--connect-concurrency", type=int, default=500)
+        sub.add_argument("--http-connections", type=int, default=200)
+        sub.add_argument("--client-ips", help="comma-separated local source addresses")
+        sub.add_argument("--server-pid", type=int, help="sample CPU/RSS of this process")
+        sub.add_argument("--report", help="also write the JSON report here")
+        sub.add_argument("--startup-timeout", type=float, default=300.0)
+
+    add_server_args(subparsers.add_parser("serve", help="seed data and run the app"))
+    run_parser = subparsers.add_parser("run", help="drive load against a running server")
+    run_parser.add_argument("--fixture", default="/tmp/pulse_load_fixture.json")
+    add_run_args(run_parser)
+    all_parser = subparsers.add_parser("all", help="serve in a child process and run against it")
+    add_server_args(all_parser)
+    add_run_args(all_parser)
+
+    args = parser.parse_args()
+    if not LOADTEST_DEPS_AVAILABLE:
+        raise SystemExit("The load-test harness needs: pip install websockets httpx")
+    raise_fd_limit()
+
+    if args.command == "serve":
+        asyncio.run(serve(args))
+        return
+
+    if not args.url:
+        args.url = f"http://{getattr(args, 'host', '127.0.0.1')}:{getattr(args, 'port', 8765)}"
+    if not args.ws_url:
+        args.ws_url = args.url.replace("http", "ws", 1)
+
+    if args.command == "all":
+        run_all(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
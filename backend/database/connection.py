@@ -74,7 +74,8 @@ class Database:
             # Messages collection
             await cls.db[Collections.MESSAGES].create_index([
                 ("chat_id", 1),
-                ("timestamp", -1)
+                ("timestamp", 1),
+                ("message_id", 1)
             ])
             await cls.db[Collections.MESSAGES].create_index("sender_id")
             await cls.db[Collections.MESSAGES].create_index("is_deleted")
@@ -0,0 +1,78 @@
+"""
+Pulse Backend - Realtime Package
+WebSocket connection management and delivery infrastructure
+"""
+
+from .connection_registry import ConnectionRegistry
+from .outbound_queue import OutboundQueue, QueuePolicy
+from .membership_cache import ChatMembership, ChatMembershipCache
+from .typing_coalescer import TypingCoalescer
+from .presence_service import PresenceService
+from .cluster_presence import ClusterPresence
+from .presence_writer import PresenceWriter
+from .heartbeat import HeartbeatScheduler
+from .room_index import RoomIndex, RoomOwnerIndex
+from .move_log import decode_records, encode_move, encode_reset
+from .game_rooms import GameRoom, GameRoomEngine
+from .room_affinity import GameRoomRouter, HashRing, RemoteGameSocket
+from .matchmaking import DEFAULT_QUEUES, Matchmaker, QueueSpec, Ticket
+from .call_signaling import CallSignaling, CallState
+from .call_quality import CallQualityAggregator, QualityHistogram, QualityMetrics
+from .chat_sequences import ChatSequencer
+from .chat_inbox import ChatInbox, chat_summary, direct_peer_id, message_preview
+from .message_pipeline import MessagePipeline
+from .reaction_aggregator import ReactionAggregator
+from .delivery_outbox import DeliveryOutbox, ReceiptWatermarks
+from .wire_protocol import MSGPACK_AVAILABLE, Frame, FrameError, MsgpackCodec, WireCodec, negotiate
+from .fanout_bus import FanoutBus, LoopbackBus, RedisFanoutBus, create_fanout_bus
+
+__all__ = [
+    'ConnectionRegistry',
+    'OutboundQueue',
+    'QueuePolicy',
+    'ChatMembership',
+    'ChatMembershipCache',
+    'TypingCoalescer',
+    'PresenceService',
+    'ClusterPresence',
+    'PresenceWriter',
+    'HeartbeatScheduler',
+    'RoomIndex',
+    'RoomOwnerIndex',
+    'decode_records',
+    'encode_move',
+    'encode_reset',
+    'GameRoom',
+    'GameRoomEngine',
+    'GameRoomRouter',
+    'HashRing',
+    'RemoteGameSocket',
+    'DEFAULT_QUEUES',
+    'Matchmaker',
+    'QueueSpec',
+    'Ticket',
+    'CallSignaling',
+    'CallState',
+    'CallQualityAggregator',
+    'QualityHistogram',
+    'QualityMetrics',
+    'ChatSequencer',
+    'ChatInbox',
+    'chat_summary',
+    'direct_peer_id',
+    'message_preview',
+    'MessagePipeline',
+    'ReactionAggregator',
+    'DeliveryOutbox',
+    'ReceiptWatermarks',
+    'MSGPACK_AVAILABLE',
+    'Frame',
+    'FrameError',
+    'MsgpackCodec',
+    'WireCodec',
+    'negotiate',
+    'FanoutBus',
+    'LoopbackBus',
+    'RedisFanoutBus',
+    'create_fanout_bus',
+]
@@ -0,0 +1,305 @@
+"""
+Pulse Backend - Call Quality Telemetry
+In-memory histograms of client quality samples, per call and per region
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SummaryWriter = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Upper bounds per metric; one overflow bucket follows the last bound
+METRIC_BUCKETS = {
+    "rtt_ms": (50, 100, 150, 250, 400, 700, 1000),
+    "jitter_ms": (5, 10, 20, 30, 50, 100),
+    "packet_loss": (0.5, 1, 2, 5, 10, 20),  # percent
+    "bitrate_kbps": (32, 64, 128, 256, 512, 1000, 2500),
+}
+METRIC_LIMITS = {"rtt_ms": 60000, "jitter_ms": 10000, "packet_loss": 100, "bitrate_kbps": 100000}
+
+
+class QualityHistogram:
+    """Fixed-bucket counts plus count, sum and extremes for one metric"""
+
+    __slots__ = ("bounds", "counts", "count", "total", "min", "max")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float):
+        index = len(self.bounds)
+        for position, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = position
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'QualityHistogram'):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given fraction (the max for the overflow bucket)"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 2),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return {**self.summary(), "buckets": dict(zip(labels, self.counts))}
+
+
+class QualityMetrics:
+    """One histogram per metric"""
+
+    __slots__ = ("histograms",)
+
+    def __init__(self):
+        self.histograms = {metric: QualityHistogram(bounds) for metric, bounds in METRIC_BUCKETS.items()}
+
+    def add(self, sample: Dict[str, float]):
+        for metric, value in sample.items():
+            self.histograms[metric].add(value)
+
+    def merge(self, other: 'QualityMetrics'):
+        for metric, histogram in other.histograms.items():
+            self.histograms[metric].merge(histogram)
+
+    def summary(self) -> Dict[str, Any]:
+        return {metric: histogram.summary() for metric, histogram in self.histograms.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {metric: histogram.to_dict() for metric, histogram in self.histograms.items()}
+
+
+class _CallQuality:
+    __slots__ = ("metrics", "regions", "participants", "samples", "first_at", "last_at")
+
+    def __init__(self, now: float):
+        self.metrics = QualityMetrics()
+        self.regions: Set[str] = set()
+        self.participants: Set[str] = set()
+        self.samples = 0
+        self.first_at = now
+        self.last_at = now
+
+
+class CallQualityAggregator:
+    """
+    Aggregates periodic client quality samples (RTT, jitter, loss, bitrate)
+
+    Raw samples are never stored: each one lands in fixed-size histograms for
+    its call and for its region. Region histograms are kept in `region_slot`
+    second slots and only the last `region_window` seconds are reported.
+    When a call ends (or goes quiet for `idle_ttl`) its histograms are reduced
+    to a compact summary and handed to `writer`.
+    """
+
+    def __init__(
+        self,
+        writer: Optional[SummaryWriter] = None,
+        region_window: float = 3600.0,
+        region_slot: float = 300.0,
+        idle_ttl: float = 900.0,
+        sweep_interval: float = 60.0,
+        max_regions: int = 256
+    ):
+        self.writer = writer
+        self.region_window = region_window
+        self.region_slot = region_slot
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.max_regions = max_regions
+        self.calls: Dict[str, _CallQuality] = {}
+        self.regions: Dict[str, Deque[Tuple[int, QualityMetrics]]] = {}  # region -> [(slot, metrics)]
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'samples': 0, 'rejected': 0, 'summaries': 0, 'summary_errors': 0, 'expired': 0}
+
+    # ==========================================
+    # SAMPLES
+    # ==========================================
+
+    @staticmethod
+    def clean_sample(sample: Dict[str, Any]) -> Dict[str, float]:
+        """Known numeric metrics only, within sane limits"""
+        cleaned = {}
+        for metric, limit in METRIC_LIMITS.items():
+            value = sample.get(metric)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if 0 <= value <= limit:
+                cleaned[metric] = float(value)
+        return cleaned
+
+    def record(
+        self,
+        call_id: str,
+        user_id: str,
+        sample: Dict[str, Any],
+        region: Optional[str] = None,
+        now: Optional[float] = None
+    ) -> bool:
+        """Add one sample; False if it carried no usable metric"""
+        cleaned = self.clean_sample(sample)
+        if not call_id or not cleaned:
+            self.stats['rejected'] += 1
+            return False
+        now = time.monotonic() if now is None else now
+        region = (region or "unknown")[:32]
+
+        call = self.calls.get(call_id)
+        if call is None:
+            call = self.calls[call_id] = _CallQuality(now)
+        call.metrics.add(cleaned)
+        call.regions.add(region)
+        call.participants.add(user_id)
+        call.samples += 1
+        call.last_at = now
+
+        self._region_slot(region, now).add(cleaned)
+        self.stats['samples'] += 1
+        return True
+
+    def _region_slot(self, region: str, now: float) -> QualityMetrics:
+        slot = int(now // self.region_slot)
+        slots = self.regions.get(region)
+        if slots is None:
+            if len(self.regions) >= self.max_regions:
+                region = "other"
+                slots = self.regions.get(region)
+            if slots is None:
+                slots = self.regions[region] = deque()
+        if not slots or slots[-1][0] != slot:
+            slots.append((slot, QualityMetrics()))
+            self._trim(slots, now)
+        return slots[-1][1]
+
+    def _trim(self, slots: Deque[Tuple[int, QualityMetrics]], now: float):
+        oldest = int((now - self.region_window) // self.region_slot)
+        while slots and slots[0][0] <= oldest:
+            slots.popleft()
+
+    # ==========================================
+    # SUMMARIES
+    # ==========================================
+
+    def call_summary(self, call_id: str) -> Optional[Dict[str, Any]]:
+        call = self.calls.get(call_id)
+        if call is None:
+            return None
+        return {
+            "samples": call.samples,
+            "participants": len(call.participants),
+            "regions": sorted(call.regions),
+            "sampled_seconds": round(call.last_at - call.first_at, 1),
+            "metrics": call.metrics.summary()
+        }
+
+    async def finish(self, call_id: str) -> Optional[Dict[str, Any]]:
+        """Persist and forget a call's histograms; returns the summary"""
+        summary = self.call_summary(call_id)
+        if summary is None:
+            return None
+        del self.calls[call_id]
+        if self.writer is not None:
+            try:
+                await self.writer(call_id, summary)
+                self.stats['summaries'] += 1
+            except Exception as e:
+                self.stats['summary_errors'] += 1
+                logger.error(f"Call quality summary error for {call_id}: {e}")
+        return summary
+
+    def region_report(self, region: Optional[str] = None, now: Optional[float] = None) -> Dict[str, Any]:
+        """Rolling-window histograms per region (or for one region)"""
+        now = time.monotonic() if now is None else now
+        report = {}
+        for name, slots in list(self.regions.items()):
+            if region is not None and name != region:
+                continue
+            self._trim(slots, now)
+            if not slots:
+                del self.regions[name]
+                continue
+            merged = QualityMetrics()
+            for _, metrics in slots:
+                merged.merge(metrics)
+            report[name] = merged.to_dict()
+        return report
+
+    # ==========================================
+    # EXPIRY
+    # ==========================================
+
+    async def expire_idle(self, now: Optional[float] = None) -> int:
+        """Summarise calls that stopped sending samples without an end_call"""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_ttl
+        idle = [call_id for call_id, call in self.calls.items() if call.last_at < cutoff]
+        for call_id in idle:
+            await self.finish(call_id)
+        self.stats['expired'] += len(idle)
+        return len(idle)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.expire_idle()
+            except Exception as e:
+                logger.error(f"Call quality sweep error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop sweeping and persist every call still being sampled"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for call_id in list(self.calls):
+            await self.finish(call_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'active_calls': len(self.calls), 'regions': len(self.regions), **self.stats}
@@ -0,0 +1,268 @@
+"""
+Pulse Backend - Call Signaling
+In-memory call state and WebRTC signal relay with batched ICE candidates
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CallLoader = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+SignalDeliver = Callable[[List[str], Dict[str, Any]], Awaitable[None]]
+
+SIGNAL_KINDS = ("offer", "answer", "ice")
+
+
+class CallState:
+    """What signaling needs to know about a live call"""
+
+    __slots__ = ("call_id", "chat_id", "caller_id", "participants", "call_type", "status", "started_at", "last_activity")
+
+    def __init__(self, call: Dict[str, Any]):
+        self.call_id = call["call_id"]
+        self.chat_id = call.get("chat_id")
+        self.caller_id = call.get("caller_id")
+        self.participants: Set[str] = set(call.get("participants", ()))
+        self.call_type = call.get("call_type", "voice")
+        self.status = call.get("status", "ringing")
+        self.started_at = call.get("started_at")
+        self.last_activity = time.monotonic()
+
+
+class CallSignaling:
+    """
+    Relays WebRTC offers, answers and ICE candidates between call participants
+
+    Calls are registered when they are created and kept in memory until they
+    end, so a signal costs a dict lookup instead of a database read. A call
+    created on another worker is loaded once on first use. Call ids that are
+    unknown or ended are remembered for `missing_ttl` seconds, so repeated
+    lookups of a dead call do not each read the database. Status changes and
+    ends made on other workers are applied with `set_status` and `end`.
+
+    Trickle ICE produces a burst of candidates per peer; they are buffered
+    per (call, sender, recipient) and delivered as one frame after
+    `ice_window` seconds, as soon as `ice_max_batch` are waiting, or when the
+    sender signals end-of-candidates. An offer or answer flushes the sender's
+    pending candidates first so frames keep their order.
+    """
+
+    def __init__(
+        self,
+        loader: CallLoader,
+        deliver: SignalDeliver,
+        ice_window: float = 0.05,
+        ice_max_batch: int = 16,
+        idle_ttl: float = 4 * 3600,
+        sweep_interval: float = 60.0,
+        missing_ttl: float = 30.0
+    ):
+        self.loader = loader
+        self.deliver = deliver
+        self.ice_window = ice_window
+        self.ice_max_batch = ice_max_batch
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.missing_ttl = missing_ttl
+        self.calls: Dict[str, CallState] = {}
+        self._missing: Dict[str, float] = {}  # call_id -> when the negative lookup expires (monotonic)
+        self._ice: Dict[Tuple[str, str, Optional[str]], List[Any]] = {}  # (call, from, to) -> candidates
+        self._timers: Dict[Tuple[str, str, Optional[str]], asyncio.TimerHandle] = {}
+        self._flushes: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'loads': 0, 'missing_hits': 0, 'offers': 0, 'answers': 0, 'ice_candidates': 0, 'ice_frames': 0,
+            'rejected': 0, 'expired': 0
+        }
+
+    # ==========================================
+    # CALL STATE
+    # ==========================================
+
+    def register(self, call: Dict[str, Any]) -> CallState:
+        state = CallState(call)
+        self.calls[state.call_id] = state
+        self._missing.pop(state.call_id, None)
+        return state
+
+    async def get(self, call_id: str) -> Optional[CallState]:
+        """The call if it is still ringing or active; loaded once if unknown here"""
+        state = self.calls.get(call_id)
+        if state is not None:
+            return state
+        if self._missing.get(call_id, 0) > time.monotonic():
+            self.stats['missing_hits'] += 1
+            return None
+        self.stats['loads'] += 1
+        call = await self.loader(call_id)
+        if call is None:
+            self._missing[call_id] = time.monotonic() + self.missing_ttl
+            return None
+        if self._missing.get(call_id, 0) > time.monotonic():
+            return None  # ended while it was loading
+        return self.calls.setdefault(call_id, CallState(call))
+
+    def set_status(self, call_id: str, status: str):
+        state = self.calls.get(call_id)
+        if state is not None:
+            state.status = status
+            state.last_activity = time.monotonic()
+
+    def end(self, call_id: str) -> Optional[CallState]:
+        """Forget a call and drop its undelivered candidates"""
+        for key in [key for key in self._ice if key[0] == call_id]:
+            self._discard_ice(key)
+        self._missing[call_id] = time.monotonic() + self.missing_ttl
+        return self.calls.pop(call_id, None)
+
+    # ==========================================
+    # SIGNALS
+    # ==========================================
+
+    async def relay(
+        self,
+        call_id: str,
+        user_id: str,
+        kind: str,
+        data: Dict[str, Any],
+        to_user_id: Optional[str] = None
+    ):
+        """
+        Forward one signal from a participant
+
+        Goes to `to_user_id` when given (mesh group calls), otherwise to every
+        other participant. Raises LookupError for an unknown or ended call and
+        PermissionError if the sender is not in it.
+        """
+        if kind not in SIGNAL_KINDS:
+            raise ValueError(f"Unknown signal {kind}")
+        state = await self.get(call_id) if call_id else None
+        if state is None:
+            self.stats['rejected'] += 1
+            raise LookupError("Call not found")
+        if user_id not in state.participants or (to_user_id is not None and to_user_id not in state.participants):
+            self.stats['rejected'] += 1
+            raise PermissionError("Not in this call")
+        state.last_activity = time.monotonic()
+
+        if kind == "ice":
+            candidates = data.get("candidates")
+            if candidates is None:
+                candidates = [data.get("candidate")]
+            await self._add_ice(state, user_id, to_user_id, candidates)
+            return
+
+        # Candidates gathered before a renegotiation must not overtake it
+        await self._flush_sender(call_id, user_id)
+        self.stats['offers' if kind == "offer" else 'answers'] += 1
+        await self.deliver(self._recipients(state, user_id, to_user_id), {
+            "type": f"webrtc_{kind}",
+            "data": {
+                "call_id": call_id,
+                "from_user_id": user_id,
+                kind: data.get(kind),
+                "ice_candidates": data.get("ice_candidates", [])
+            }
+        })
+
+    @staticmethod
+    def _recipients(state: CallState, user_id: str, to_user_id: Optional[str]) -> List[str]:
+        if to_user_id is not None:
+            return [to_user_id]
+        return [participant for participant in state.participants if participant != user_id]
+
+    async def _add_ice(self, state: CallState, user_id: str, to_user_id: Optional[str], candidates: List[Any]):
+        key = (state.call_id, user_id, to_user_id)
+        pending = self._ice.setdefault(key, [])
+        finished = False
+        for candidate in candidates:
+            # None or "" is the browser's end-of-candidates marker
+            if not candidate:
+                finished = True
+                continue
+            pending.append(candidate)
+            self.stats['ice_candidates'] += 1
+
+        if not pending:
+            self._ice.pop(key, None)
+        elif finished or len(pending) >= self.ice_max_batch:
+            await self._flush_ice(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.ice_window, self._flush_later, key)
+
+    def _flush_later(self, key: Tuple[str, str, Optional[str]]):
+        task = asyncio.get_running_loop().create_task(self._flush_ice(key))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _discard_ice(self, key: Tuple[str, str, Optional[str]]) -> List[Any]:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return self._ice.pop(key, [])
+
+    async def _flush_ice(self, key: Tuple[str, str, Optional[str]]):
+        candidates = self._discard_ice(key)
+        call_id, user_id, to_user_id = key
+        state = self.calls.get(call_id)
+        if not candidates or state is None:
+            return
+        self.stats['ice_frames'] += 1
+        try:
+            await self.deliver(self._recipients(state, user_id, to_user_id), {
+                "type": "webrtc_ice",
+                "data": {"call_id": call_id, "from_user_id": user_id, "candidates": candidates}
+            })
+        except Exception as e:
+            logger.error(f"ICE delivery error for call {call_id}: {e}")
+
+    async def _flush_sender(self, call_id: str, user_id: str):
+        for key in [key for key in self._ice if key[0] == call_id and key[1] == user_id]:
+            await self._flush_ice(key)
+
+    # ==========================================
+    # EXPIRY
+    # ==========================================
+
+    def expire_idle(self, now: Optional[float] = None) -> int:
+        """Forget calls with no signaling for idle_ttl (ended elsewhere or abandoned)"""
+        now = now if now is not None else time.monotonic()
+        cutoff = now - self.idle_ttl
+        idle = [call_id for call_id, state in self.calls.items() if state.last_activity < cutoff]
+        for call_id in idle:
+            self.end(call_id)
+        self.stats['expired'] += len(idle)
+        for call_id in [call_id for call_id, expires in self._missing.items() if expires <= now]:
+            del self._missing[call_id]
+        return len(idle)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.expire_idle()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for key in list(self._ice):
+            await self._flush_ice(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'calls': len(self.calls),
+            'missing': len(self._missing),
+            'pending_ice': sum(len(candidates) for candidates in self._ice.values()),
+            **self.stats
+        }
@@ -0,0 +1,311 @@
+"""
+Pulse Backend - Chat Inbox View
+Per-user chat list rows maintained incrementally with coalesced bulk writes
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+InboxWriter = Callable[[List[Any]], Awaitable[None]]
+ChatLoader = Callable[[List[str]], Awaitable[List[Dict[str, Any]]]]
+PeerLoader = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+# Chat fields not copied into inbox rows (each row keeps its own last message)
+CHAT_EXCLUDED_FIELDS = ("_id", "last_message")
+PREVIEW_LENGTH = 120
+
+
+def message_preview(message: Dict[str, Any]) -> Dict[str, Any]:
+    """What the chat list shows of the newest message"""
+    content = message.get("content") or ""
+    return {
+        "message_id": message.get("message_id"),
+        "sender_id": message.get("sender_id"),
+        "message_type": message.get("message_type", "text"),
+        "content": content[:PREVIEW_LENGTH],
+        "timestamp": message.get("timestamp")
+    }
+
+
+def chat_summary(chat: Dict[str, Any]) -> Dict[str, Any]:
+    """The chat document as stored on inbox rows"""
+    return {field: value for field, value in chat.items() if field not in CHAT_EXCLUDED_FIELDS}
+
+
+def direct_peer_id(chat: Dict[str, Any], user_id: str) -> Optional[str]:
+    """The other member of a direct chat; None for groups"""
+    if chat.get("chat_type") != "direct" and chat.get("type") != "direct":
+        return None
+    return next((member for member in chat.get("members", []) if member != user_id), None)
+
+
+class _ChatActivity:
+    __slots__ = ("preview", "at", "by_sender")
+
+    def __init__(self):
+        self.preview: Optional[Dict[str, Any]] = None
+        self.at: Optional[datetime] = None
+        self.by_sender: Dict[str, int] = {}  # sender -> messages this flush
+
+    def merge(self, other: '_ChatActivity'):
+        """Fold in activity from a flush that never reached the database"""
+        if other.at is not None and (self.at is None or other.at > self.at):
+            self.preview, self.at = other.preview, other.at
+        for sender_id, count in other.by_sender.items():
+            self.by_sender[sender_id] = self.by_sender.get(sender_id, 0) + count
+
+
+class ChatInbox:
+    """
+    Write-behind maintenance of the `chat_inbox` collection
+
+    One row per (user, chat) holds the chat document, the last message
+    preview, the user's unread count, the other member of a direct chat and
+    a `sort_key`, so the chat list is driven by one indexed query.
+
+    Messages are coalesced per chat: a burst of N messages between flushes
+    becomes one preview update for the chat plus one unread increment per
+    distinct sender, regardless of member count. A flush writes in up to
+    three unordered batches: rows (created and deleted), then unread
+    activity, then idempotent updates (reads, edits, membership lists,
+    profiles), so reads always land after the messages they cover.
+
+    When a batch fails, everything idempotent is retried on the next flush;
+    only unread increments, which could apply twice, are dropped. Every
+    update is conditional or commutative, so several workers can maintain
+    the same rows.
+    """
+
+    def __init__(
+        self,
+        writer: InboxWriter,
+        chat_loader: ChatLoader,
+        peer_loader: PeerLoader,
+        interval: float = 0.1
+    ):
+        self.writer = writer
+        self.chat_loader = chat_loader
+        self.peer_loader = peer_loader
+        self.interval = interval
+        self._chats: Dict[str, Dict[str, Any]] = {}  # chat_id -> chat needing rows for all members
+        self._joins: Dict[Tuple[str, str], None] = {}  # (chat_id, user_id), insertion ordered
+        self._leaves: Dict[Tuple[str, str], None] = {}
+        self._removed_chats: Dict[str, None] = {}
+        self._operations: List[Any] = []  # idempotent: edits, reads, member lists, profile changes
+        self._activity: Dict[str, _ChatActivity] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'messages': 0, 'flushes': 0, 'operations': 0, 'errors': 0, 'retried': 0, 'dropped_increments': 0}
+
+    # ==========================================
+    # CHANGES
+    # ==========================================
+
+    def chat_created(self, chat: Dict[str, Any]):
+        self._chats[chat["chat_id"]] = chat
+
+    def member_added(self, chat_id: str, user_id: str):
+        self._leaves.pop((chat_id, user_id), None)
+        self._joins[(chat_id, user_id)] = None
+        # Every member's copy of the chat lists members
+        self._operations.append(UpdateMany({"chat_id": chat_id}, {"$addToSet": {"chat.members": user_id}}))
+
+    def member_removed(self, chat_id: str, user_id: str):
+        self._joins.pop((chat_id, user_id), None)
+        self._leaves[(chat_id, user_id)] = None
+        self._operations.append(UpdateMany({"chat_id": chat_id}, {"$pull": {"chat.members": user_id}}))
+
+    def chat_removed(self, chat_id: str):
+        self._chats.pop(chat_id, None)
+        self._removed_chats[chat_id] = None
+
+    def chat_updated(self, chat_id: str, fields: Dict[str, Any]):
+        self._operations.append(UpdateMany(
+            {"chat_id": chat_id},
+            {"$set": {f"chat.{field}": value for field, value in fields.items()}}
+        ))
+
+    def message_posted(self, chat_id: str, message: Dict[str, Any]):
+        activity = self._activity.get(chat_id)
+        if activity is None:
+            activity = self._activity[chat_id] = _ChatActivity()
+        at = message.get("timestamp") or datetime.utcnow()
+        if activity.at is None or at >= activity.at:
+            activity.preview = message_preview(message)
+            activity.at = at
+        sender_id = message.get("sender_id")
+        activity.by_sender[sender_id] = activity.by_sender.get(sender_id, 0) + 1
+        self.stats['messages'] += 1
+
+    def message_changed(self, chat_id: str, message_id: str, content: Optional[str] = None, deleted: bool = False):
+        """Keep the preview right when the newest message is edited or deleted"""
+        changes = {"last_message.is_deleted": True} if deleted else {"last_message.content": (content or "")[:PREVIEW_LENGTH]}
+        self._operations.append(UpdateMany({"chat_id": chat_id, "last_message.message_id": message_id}, {"$set": changes}))
+
+    def mark_read(self, chat_id: str, user_id: str, at: datetime):
+        """Clear unread unless something newer than the read watermark arrived"""
+        self._operations.append(UpdateOne(
+            {"chat_id": chat_id, "user_id": user_id, "sort_key": {"$lte": at}},
+            {"$set": {"unread_count": 0, "read_at": at}}
+        ))
+
+    def peer_updated(self, peer: Dict[str, Any]):
+        self._operations.append(UpdateMany({"peer.user_id": peer["user_id"]}, {"$set": {"peer": peer}}))
+
+    # ==========================================
+    # FLUSH
+    # ==========================================
+
+    async def _row_operations(self, chats: List[Dict[str, Any]], joins: List[Tuple[str, str]]) -> List[Any]:
+        """Upserts for every member of new chats and for joined members"""
+        wanted = [(chat, member) for chat in chats for member in chat.get("members", [])]
+        if joins:
+            known = {chat["chat_id"]: chat for chat in chats}
+            missing = list({chat_id for chat_id, _ in joins if chat_id not in known})
+            if missing:
+                for chat in await self.chat_loader(missing):
+                    known[chat["chat_id"]] = chat
+            wanted += [(known[chat_id], user_id) for chat_id, user_id in joins if chat_id in known]
+
+        peer_ids = set()
+        for chat, user_id in wanted:
+            peer_id = direct_peer_id(chat, user_id)
+            if peer_id:
+                peer_ids.add(peer_id)
+        peers = await self.peer_loader(list(peer_ids)) if peer_ids else {}
+
+        operations = []
+        for chat, user_id in wanted:
+            row = {"chat": chat_summary(chat), "peer": peers.get(direct_peer_id(chat, user_id))}
+            created_at = chat.get("created_at") or datetime.utcnow()
+            operations.append(UpdateOne(
+                {"chat_id": chat["chat_id"], "user_id": user_id},
+                {
+                    "$set": row,
+                    "$setOnInsert": {"unread_count": 0, "last_message": None, "sort_key": created_at}
+                },
+                upsert=True
+            ))
+        return operations
+
+    @staticmethod
+    def _preview_operation(chat_id: str, activity: _ChatActivity) -> Any:
+        # Only move the preview forward (other workers write the same rows)
+        return UpdateMany(
+            {"chat_id": chat_id, "sort_key": {"$lte": activity.at}},
+            {"$set": {"last_message": activity.preview, "sort_key": activity.at}}
+        )
+
+    def _activity_operations(self, activity: Dict[str, _ChatActivity]) -> List[Any]:
+        operations = []
+        for chat_id, chat_activity in activity.items():
+            operations.append(self._preview_operation(chat_id, chat_activity))
+            for sender_id, count in chat_activity.by_sender.items():
+                operations.append(UpdateMany(
+                    {"chat_id": chat_id, "user_id": {"$ne": sender_id}},
+                    {"$inc": {"unread_count": count}}
+                ))
+        return operations
+
+    async def _write(self, operations: List[Any], what: str) -> bool:
+        if not operations:
+            return True
+        try:
+            await self.writer(operations)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Chat inbox {what} write failed ({len(operations)} operations): {e}")
+            return False
+        self.stats['operations'] += len(operations)
+        return True
+
+    def _requeue_structure(self, chats, joins, leaves, removed_chats):
+        for chat in chats:
+            if chat["chat_id"] not in self._removed_chats:
+                self._chats.setdefault(chat["chat_id"], chat)
+        for key in joins:
+            if key not in self._leaves:
+                self._joins.setdefault(key, None)
+        for key in leaves:
+            if key not in self._joins:
+                self._leaves.setdefault(key, None)
+        for chat_id in removed_chats:
+            self._removed_chats.setdefault(chat_id, None)
+        self.stats['retried'] += len(chats) + len(joins) + len(leaves) + len(removed_chats)
+
+    def _requeue_operations(self, operations: List[Any]):
+        self._operations[:0] = operations
+        self.stats['retried'] += len(operations)
+
+    async def flush_pending(self):
+        if not (self._chats or self._joins or self._leaves or self._removed_chats or self._operations or self._activity):
+            return
+        chats, self._chats = list(self._chats.values()), {}
+        joins, self._joins = list(self._joins), {}
+        leaves, self._leaves = list(self._leaves), {}
+        removed_chats, self._removed_chats = list(self._removed_chats), {}
+        pending, self._operations = self._operations, []
+        activity, self._activity = self._activity, {}
+        self.stats['flushes'] += 1
+
+        # 1. Rows: created before anything updates them; idempotent, so retried on failure
+        try:
+            structure = await self._row_operations(chats, joins)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Chat inbox row load failed: {e}")
+            structure = None
+        if structure is not None:
+            structure += [DeleteOne({"chat_id": chat_id, "user_id": user_id}) for chat_id, user_id in leaves]
+            structure += [DeleteMany({"chat_id": chat_id}) for chat_id in removed_chats]
+        if structure is None or not await self._write(structure, "row"):
+            # Nothing later in this flush is safe without its rows: retry all of it, nothing was applied
+            self._requeue_structure(chats, joins, leaves, removed_chats)
+            self._requeue_operations(pending)
+            for chat_id, chat_activity in activity.items():
+                self._activity.setdefault(chat_id, _ChatActivity()).merge(chat_activity)
+            return
+
+        # 2. Unread activity: increments may have partly applied, so only the previews are retried
+        if not await self._write(self._activity_operations(activity), "activity"):
+            self.stats['dropped_increments'] += sum(len(chat_activity.by_sender) for chat_activity in activity.values())
+            self._requeue_operations([
+                self._preview_operation(chat_id, chat_activity) for chat_id, chat_activity in activity.items()
+            ])
+
+        # 3. Idempotent updates: reads land after the messages they cover
+        if not await self._write(pending, "update"):
+            self._requeue_operations(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pending_chats': len(self._activity),
+            'pending_rows': len(self._chats) + len(self._joins) + len(self._leaves) + len(self._removed_chats),
+            'pending_operations': len(self._operations),
+            **self.stats
+        }
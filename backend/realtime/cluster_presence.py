@@ -0,0 +1,212 @@
+"""
+Pulse Backend - Cluster Presence
+Which users have a socket on any worker, shared over the fan-out bus
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+PresenceCallback = Callable[[str], Awaitable[None]]
+
+
+class ClusterPresence:
+    """
+    Cluster-wide online state on top of each worker's own registry
+
+    A worker's registry only knows its own sockets. Workers publish
+    `presence_worker` envelopes when a user's first socket arrives or last
+    socket leaves, so each worker also knows the users connected elsewhere
+    and a user is only reported offline once no worker holds them.
+
+    Call `connected`/`disconnected` on a user's first and last local socket;
+    they return True when the change is cluster-wide and the caller should
+    report it. A worker that let go of a user still held elsewhere remembers
+    them and reports the offline itself when that other worker lets go
+    without reporting (both let go at once). Users of a worker that stops
+    announcing for `worker_ttl` are reported offline by the live worker with
+    the lowest id. Heartbeats carry each worker's user count; a mismatch
+    (lost envelopes) asks that worker for its full set.
+    """
+
+    def __init__(
+        self,
+        local_users: Callable[[], Iterable[str]],
+        is_local: Callable[[str], bool],
+        on_online: PresenceCallback,
+        on_offline: PresenceCallback,
+        announce_interval: float = 5.0,
+        worker_ttl: float = 15.0
+    ):
+        self.local_users = local_users
+        self.is_local = is_local
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.announce_interval = announce_interval
+        self.worker_ttl = worker_ttl
+        self.bus = None
+        self.worker_id = "local"
+        self.remote: Dict[str, Set[str]] = {}  # worker_id -> users with a socket there
+        self.workers: Dict[str, float] = {}  # worker_id -> last envelope (monotonic)
+        self._deferred: Set[str] = set()  # left here while still connected elsewhere
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'remote_online': 0, 'remote_offline': 0, 'deferred_offline': 0, 'resyncs': 0,
+            'expired_workers': 0, 'errors': 0
+        }
+
+    # ==========================================
+    # QUERIES
+    # ==========================================
+
+    def is_online(self, user_id: str) -> bool:
+        """True if the user has a socket on this or any other live worker"""
+        return self.is_local(user_id) or self.is_remote(user_id)
+
+    def is_remote(self, user_id: str) -> bool:
+        return any(user_id in users for users in self.remote.values())
+
+    # ==========================================
+    # LOCAL CHANGES
+    # ==========================================
+
+    async def connected(self, user_id: str) -> bool:
+        """First local socket of a user; True if they were offline everywhere"""
+        self._deferred.discard(user_id)
+        await self._publish({"type": "presence_worker", "online": [user_id]})
+        return not self.is_remote(user_id)
+
+    async def disconnected(self, user_id: str) -> bool:
+        """Last local socket of a user closed; True if they are now offline everywhere"""
+        elsewhere = self.is_remote(user_id)
+        if elsewhere:
+            self._deferred.add(user_id)
+        await self._publish({"type": "presence_worker", "offline": [user_id], "reported": not elsewhere})
+        return not elsewhere
+
+    # ==========================================
+    # BUS
+    # ==========================================
+
+    async def _publish(self, envelope: Dict[str, Any]):
+        if self.bus is None:
+            return
+        try:
+            await self.bus.publish(envelope)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Cluster presence publish error: {e}")
+
+    async def _send_users(self, target: Optional[str] = None, hello: bool = False):
+        envelope = {"type": "presence_worker", "users": list(self.local_users()), "hello": hello}
+        if target is not None:
+            envelope["target"] = target
+        await self._publish(envelope)
+
+    async def handle_envelope(self, envelope: Dict[str, Any]):
+        """Apply a presence_worker envelope from another worker"""
+        origin = envelope["origin"]
+        if envelope.get("leaving"):
+            await self._drop_worker(origin)
+            return
+        known = origin in self.workers
+        self.workers[origin] = time.monotonic()
+        users = self.remote.setdefault(origin, set())
+
+        if envelope.get("sync"):
+            await self._send_users(target=origin)
+        if "users" in envelope:
+            fresh = set(envelope["users"])
+            self.remote[origin] = fresh
+            await self._gone(users - fresh, by_leader=True)
+            if envelope.get("hello"):
+                await self._send_users(target=origin)
+        for user_id in envelope.get("online", ()):
+            users.add(user_id)
+            self.stats['remote_online'] += 1
+        for user_id in envelope.get("offline", ()):
+            users.discard(user_id)
+            self.stats['remote_offline'] += 1
+            if envelope.get("reported"):
+                self._deferred.discard(user_id)
+                if self.is_local(user_id):
+                    # They reconnected here before that worker heard; undo its offline
+                    await self.on_online(user_id)
+            else:
+                await self._gone([user_id], by_leader=False)
+        if "count" in envelope and (not known or envelope["count"] != len(self.remote[origin])):
+            self.stats['resyncs'] += 1
+            await self._publish({"type": "presence_worker", "sync": True, "target": origin})
+
+    async def _gone(self, user_ids: Iterable[str], by_leader: bool):
+        """Report users that no worker holds any more, once"""
+        for user_id in user_ids:
+            if self.is_online(user_id):
+                continue
+            if user_id in self._deferred:
+                self._deferred.discard(user_id)
+                if by_leader and not self._is_leader():
+                    continue
+                self.stats['deferred_offline'] += 1
+                await self.on_offline(user_id)
+            elif by_leader and self._is_leader():
+                await self.on_offline(user_id)
+
+    def _is_leader(self) -> bool:
+        return self.worker_id == min([self.worker_id, *self.workers])
+
+    async def _drop_worker(self, worker_id: str):
+        self.workers.pop(worker_id, None)
+        users = self.remote.pop(worker_id, set())
+        await self._gone(users, by_leader=True)
+
+    # ==========================================
+    # LIFECYCLE
+    # ==========================================
+
+    async def _expire_workers(self):
+        cutoff = time.monotonic() - self.worker_ttl
+        for worker_id in [worker_id for worker_id, seen in self.workers.items() if seen < cutoff]:
+            self.stats['expired_workers'] += 1
+            logger.warning(f"Presence worker {worker_id} went silent; its users are offline")
+            await self._drop_worker(worker_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.announce_interval)
+            try:
+                await self._publish({"type": "presence_worker", "count": sum(1 for _ in self.local_users())})
+                await self._expire_workers()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Cluster presence error: {e}")
+
+    async def start(self, bus: Any = None):
+        """Announce this worker's users; pass the started fan-out bus, or None for single-worker"""
+        self.bus = bus
+        if bus is None:
+            return
+        self.worker_id = bus.worker_id
+        await self._send_users(hello=True)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self._publish({"type": "presence_worker", "leaving": True})
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'remote_workers': len(self.remote),
+            'remote_users': sum(len(users) for users in self.remote.values()),
+            'deferred': len(self._deferred),
+            **self.stats
+        }
@@ -0,0 +1,199 @@
+"""
+Pulse Backend - Realtime Connection Registry
+Tracks every live WebSocket per user (multi-device) and fans out concurrently
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .outbound_queue import OutboundQueue, QueuePolicy
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionRegistry:
+    """
+    Multi-device socket registry with per-socket outbound queues
+
+    Every socket gets its own bounded queue and writer task, so fan-out is a
+    non-blocking enqueue and a slow receiver only ever delays itself. At most
+    `max_concurrency` socket writes are in flight across all writers.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 64,
+        send_timeout: float = 5.0,
+        queue_policy: Optional[QueuePolicy] = None
+    ):
+        self.connections: Dict[str, Any] = {}  # connection_id -> websocket
+        self.user_connections: Dict[str, Set[str]] = {}  # user_id -> {connection_ids}
+        self.connection_users: Dict[str, str] = {}  # connection_id -> user_id
+        self.queues: Dict[str, OutboundQueue] = {}  # connection_id -> outbound queue
+        self.max_concurrency = max_concurrency
+        self.send_timeout = send_timeout
+        self.queue_policy = queue_policy or QueuePolicy()
+        self.evictions = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    # ==========================================
+    # REGISTRATION
+    # ==========================================
+
+    def add(self, user_id: str, websocket: Any, codec: Optional[Any] = None) -> str:
+        """Register a socket for a user and return its connection id
+
+        `codec` is the socket's negotiated wire protocol; None means JSON.
+        """
+        connection_id = str(uuid.uuid4())
+        self.connections[connection_id] = websocket
+        self.connection_users[connection_id] = user_id
+        self.user_connections.setdefault(user_id, set()).add(connection_id)
+
+        async def on_evict(reason: str):
+            await self._evict(connection_id, reason)
+
+        self.queues[connection_id] = OutboundQueue(
+            websocket,
+            policy=self.queue_policy,
+            send_timeout=self.send_timeout,
+            semaphore=self._get_semaphore(),
+            on_evict=on_evict,
+            codec=codec
+        )
+        return connection_id
+
+    def remove(self, connection_id: str) -> Optional[str]:
+        """Unregister a socket; returns the owning user id if it was known"""
+        self.connections.pop(connection_id, None)
+        queue = self.queues.pop(connection_id, None)
+        if queue is not None:
+            queue.close()
+        user_id = self.connection_users.pop(connection_id, None)
+        if user_id is not None:
+            user_conns = self.user_connections.get(user_id)
+            if user_conns is not None:
+                user_conns.discard(connection_id)
+                if not user_conns:
+                    del self.user_connections[user_id]
+        return user_id
+
+    async def _evict(self, connection_id: str, reason: str):
+        """Drop a consumer that fell too far behind or stopped accepting writes"""
+        websocket = self.connections.get(connection_id)
+        if websocket is None:
+            return
+        self.evictions += 1
+        logger.warning(f"Evicted WebSocket connection {connection_id}: {reason}")
+        self.remove(connection_id)
+        try:
+            # Closing wakes the endpoint's receive loop so it runs its own cleanup
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def codec(self, connection_id: str) -> Optional[Any]:
+        """The wire codec a socket negotiated, if any"""
+        queue = self.queues.get(connection_id)
+        return queue.codec if queue is not None else None
+
+    def is_online(self, user_id: str) -> bool:
+        """True if the user has at least one live socket on this worker"""
+        return bool(self.user_connections.get(user_id))
+
+    def connection_count(self, user_id: Optional[str] = None) -> int:
+        """Number of live sockets, overall or for a single user"""
+        if user_id is None:
+            return len(self.connections)
+        return len(self.user_connections.get(user_id, ()))
+
+    def get_user_sockets(self, user_id: str) -> List[Tuple[str, Any]]:
+        """All (connection_id, websocket) pairs for a user"""
+        return [
+            (connection_id, self.connections[connection_id])
+            for connection_id in self.user_connections.get(user_id, ())
+            if connection_id in self.connections
+        ]
+
+    # ==========================================
+    # DELIVERY
+    # ==========================================
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def send_to_connection(
+        self,
+        connection_id: str,
+        message: Any,
+        frame_type: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ) -> bool:
+        """Queue a frame for one socket without waiting on the network"""
+        queue = self.queues.get(connection_id)
+        if queue is None:
+            return False
+        return queue.enqueue(message, frame_type=frame_type, coalesce_key=coalesce_key)
+
+    def send_to_user(self, user_id: str, message: Any, frame_type: Optional[str] = None) -> int:
+        """Queue a frame for every device of a user; returns sockets reached"""
+        return self.fan_out(message, [user_id], frame_type=frame_type)
+
+    def fan_out(
+        self,
+        message: Any,
+        user_ids: Iterable[str],
+        exclude: Optional[str] = None,
+        frame_type: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ) -> int:
+        """
+        Queue one frame for all sockets of all given users
+
+        Pass a Frame to share one encoding per wire protocol across every
+        recipient instead of re-encoding per socket.
+
+        Returns:
+            Number of socket queues that accepted the frame
+        """
+        accepted = 0
+        seen = set()
+        for user_id in user_ids:
+            if user_id == exclude or user_id in seen:
+                continue
+            seen.add(user_id)
+            for connection_id in list(self.user_connections.get(user_id, ())):
+                if self.send_to_connection(connection_id, message, frame_type, coalesce_key):
+                    accepted += 1
+        return accepted
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Wait until every socket queue has been drained"""
+        queues = list(self.queues.values())
+        if queues:
+            await asyncio.gather(*(queue.join(timeout=timeout) for queue in queues))
+
+    def get_queue_stats(self, connection_id: str) -> Optional[Dict[str, Any]]:
+        queue = self.queues.get(connection_id)
+        return queue.get_stats() if queue is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Registry statistics, including aggregate queue depth and drop counters"""
+        totals = {'queued': 0, 'max_depth': 0, 'sent': 0, 'dropped': 0, 'coalesced': 0, 'overflows': 0}
+        for queue in self.queues.values():
+            depth = queue.depth
+            totals['queued'] += depth
+            totals['max_depth'] = max(totals['max_depth'], depth)
+            for key in ('sent', 'dropped', 'coalesced', 'overflows'):
+                totals[key] += queue.stats[key]
+        return {
+            'connections': len(self.connections),
+            'users': len(self.user_connections),
+            'max_concurrency': self.max_concurrency,
+            'evictions': self.evictions,
+            'queues': totals,
+        }
@@ -0,0 +1,206 @@
+"""
+Pulse Backend - Offline Delivery Outbox
+Undelivered message ids per user, drained on reconnect, plus coalesced receipt watermarks
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+OutboxWriter = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+OutboxReader = Callable[[str, int], Awaitable[Tuple[List[Dict[str, Any]], bool]]]
+OutboxRemover = Callable[[str, List[str]], Awaitable[None]]
+WatermarkWriter = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+WatermarkPublisher = Callable[[str, List[Dict[str, Any]]], Awaitable[None]]
+
+RECEIPT_KINDS = ("delivered", "read")
+
+
+class DeliveryOutbox:
+    """
+    At-least-once delivery for recipients without a live socket
+
+    `record` buffers (user, message) entries and `flush_pending` writes them
+    in one batch through `writer`, so a message to a 500-member group with
+    200 offline members costs one bulk write rather than 200. On reconnect
+    `drain` returns up to `drain_limit` missed messages in one read; entries
+    stay until the client acks them, and acks are buffered and removed in
+    one delete per user on the next flush.
+    """
+
+    def __init__(
+        self,
+        writer: OutboxWriter,
+        reader: OutboxReader,
+        remover: OutboxRemover,
+        interval: float = 0.05,
+        drain_limit: int = 500
+    ):
+        self.writer = writer
+        self.reader = reader
+        self.remover = remover
+        self.interval = interval
+        self.drain_limit = drain_limit
+        self._pending: List[Dict[str, Any]] = []
+        self._acks: Dict[str, Set[str]] = {}  # user_id -> acked message ids
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'recorded': 0, 'drains': 0, 'drained': 0, 'acked': 0, 'flushes': 0, 'errors': 0}
+
+    def record(self, user_ids: List[str], chat_id: str, message_id: str, at: Optional[datetime] = None):
+        """Remember a message for every given user until they ack it"""
+        at = at or datetime.utcnow()
+        for user_id in user_ids:
+            self._pending.append({"user_id": user_id, "chat_id": chat_id, "message_id": message_id, "created_at": at})
+        self.stats['recorded'] += len(user_ids)
+
+    def ack(self, user_id: str, message_ids: List[str]):
+        """Client confirmed receipt; removed on the next flush"""
+        if not message_ids:
+            return
+        self._acks.setdefault(user_id, set()).update(message_ids)
+        self.stats['acked'] += len(message_ids)
+
+    async def drain(self, user_id: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Missed messages for a reconnecting user (oldest first) and whether more remain"""
+        # Entries still buffered or acked since the last flush must be visible to the read
+        await self.flush_pending()
+        messages, more = await self.reader(user_id, self.drain_limit)
+        self.stats['drains'] += 1
+        self.stats['drained'] += len(messages)
+        return messages, more
+
+    async def flush_pending(self):
+        if not self._pending and not self._acks:
+            return
+        pending, self._pending = self._pending, []
+        acks, self._acks = self._acks, {}
+        self.stats['flushes'] += 1
+        if pending:
+            try:
+                await self.writer(pending)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Outbox write failed ({len(pending)} entries): {e}")
+                self._pending[:0] = pending
+        for user_id, message_ids in acks.items():
+            try:
+                await self.remover(user_id, list(message_ids))
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Outbox ack removal failed for {user_id}: {e}")
+                self._acks.setdefault(user_id, set()).update(message_ids)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pending': len(self._pending),
+            'pending_acks': sum(len(ids) for ids in self._acks.values()),
+            **self.stats
+        }
+
+
+class ReceiptWatermarks:
+    """
+    Delivery and read receipts as per-(chat, user) watermarks
+
+    A receipt means "everything in this chat up to `at` was delivered/read",
+    so a burst of receipts collapses to the newest one per chat, user and
+    kind. Every `interval` seconds the survivors are written in one batch and
+    each chat's members get a single `receipt_update` frame.
+    """
+
+    def __init__(self, writer: WatermarkWriter, publisher: WatermarkPublisher, interval: float = 1.0):
+        self.writer = writer
+        self.publisher = publisher
+        self.interval = interval
+        self._pending: Dict[Tuple[str, str, str], Dict[str, Any]] = {}  # (chat, user, kind) -> watermark
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'receipts': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'errors': 0}
+
+    def mark(self, chat_id: str, user_id: str, kind: str, at: datetime, message_id: Optional[str] = None):
+        if kind not in RECEIPT_KINDS:
+            raise ValueError(f"Unknown receipt kind {kind}")
+        self.stats['receipts'] += 1
+        # Read implies delivered
+        for implied in (("delivered", "read") if kind == "read" else ("delivered",)):
+            self._advance(chat_id, user_id, implied, at, message_id)
+
+    def _advance(self, chat_id: str, user_id: str, kind: str, at: datetime, message_id: Optional[str]):
+        key = (chat_id, user_id, kind)
+        current = self._pending.get(key)
+        if current is not None:
+            self.stats['coalesced'] += 1
+            if current["at"] >= at:
+                return
+        self._pending[key] = {"chat_id": chat_id, "user_id": user_id, "kind": kind, "at": at, "message_id": message_id}
+
+    async def flush_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.stats['flushes'] += 1
+        watermarks = list(pending.values())
+        try:
+            await self.writer(watermarks)
+            self.stats['written'] += len(watermarks)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Receipt watermark write failed ({len(watermarks)}): {e}")
+            for key, watermark in pending.items():
+                newer = self._pending.get(key)
+                if newer is None or newer["at"] < watermark["at"]:
+                    self._pending[key] = watermark
+            return
+
+        by_chat: Dict[str, List[Dict[str, Any]]] = {}
+        for watermark in watermarks:
+            by_chat.setdefault(watermark["chat_id"], []).append(watermark)
+        for chat_id, chat_watermarks in by_chat.items():
+            try:
+                await self.publisher(chat_id, chat_watermarks)
+            except Exception as e:
+                logger.error(f"Receipt publish failed for chat {chat_id}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'pending': len(self._pending), **self.stats}
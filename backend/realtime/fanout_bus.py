@@ -0,0 +1,207 @@
+"""
+Pulse Backend - Realtime Fan-out Bus
+Cross-worker pub/sub backplane so every worker delivers to the sockets it owns
+"""
+
+import abc
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EnvelopeHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class FanoutBus(abc.ABC):
+    """
+    Base class for fan-out backplanes
+
+    A worker publishes an envelope after delivering to its own sockets; every
+    other worker receives it and delivers to the sockets it owns. Envelopes
+    published by a worker are never handed back to that same worker, and an
+    envelope with a `target` is only handled by that worker.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or str(uuid.uuid4())
+        self._handler: Optional[EnvelopeHandler] = None
+        self.stats = {'published': 0, 'received': 0, 'errors': 0}
+
+    def set_handler(self, handler: EnvelopeHandler):
+        """Register the coroutine that delivers received envelopes locally"""
+        self._handler = handler
+
+    @abc.abstractmethod
+    async def start(self):
+        """Connect and begin handing received envelopes to the handler"""
+
+    @abc.abstractmethod
+    async def stop(self):
+        """Stop receiving and release the connection"""
+
+    @abc.abstractmethod
+    async def publish(self, envelope: Dict[str, Any]):
+        """Send an envelope to every other worker (or only to its `target`)"""
+
+    async def _dispatch(self, envelope: Dict[str, Any]):
+        if envelope.get("origin") == self.worker_id or self._handler is None:
+            return
+        target = envelope.get("target")
+        if target is not None and target != self.worker_id:
+            return
+        self.stats['received'] += 1
+        try:
+            await self._handler(envelope)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Fan-out bus handler error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'worker_id': self.worker_id, 'backend': self.__class__.__name__, **self.stats}
+
+
+class LoopbackBus(FanoutBus):
+    """
+    In-process bus for tests and single-host simulations
+
+    Buses sharing the same `hub` list behave like workers subscribed to the
+    same channel. Envelopes are JSON round-tripped to mirror the wire format.
+    """
+
+    def __init__(self, hub: Optional[List['LoopbackBus']] = None, worker_id: Optional[str] = None):
+        super().__init__(worker_id)
+        self.hub = hub if hub is not None else []
+
+    async def start(self):
+        if self not in self.hub:
+            self.hub.append(self)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+    async def publish(self, envelope: Dict[str, Any]):
+        wire = json.dumps({**envelope, "origin": self.worker_id})
+        self.stats['published'] += 1
+        for bus in list(self.hub):
+            if bus is not self:
+                await bus._dispatch(json.loads(wire))
+
+
+class RedisFanoutBus(FanoutBus):
+    """
+    Redis pub/sub backplane shared by all uvicorn workers
+
+    If the subscription drops (Redis restart, failover, network), the
+    listener resubscribes with exponential backoff from `reconnect_delay`
+    up to `max_reconnect_delay`. Envelopes published while disconnected are
+    lost, as with any pub/sub; `connected` and `disconnects` in the stats
+    show the outage.
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        channel: str = "pulse:ws:fanout",
+        worker_id: Optional[str] = None,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 30.0,
+        client: Optional[Any] = None
+    ):
+        super().__init__(worker_id)
+        self.url = url
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._redis = client
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self.stats.update({'connected': False, 'disconnects': 0, 'reconnects': 0})
+
+    async def start(self):
+        if self._redis is None:
+            import redis.asyncio as aioredis
+
+            self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"Fan-out bus subscribed to {self.channel} as worker {self.worker_id}")
+
+    async def _subscribe(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._pubsub = pubsub
+        self.stats['connected'] = True
+
+    async def _drop_subscription(self):
+        pubsub, self._pubsub = self._pubsub, None
+        self.stats['connected'] = False
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            try:
+                await self._pubsub.unsubscribe(self.channel)
+            except Exception:
+                pass
+            await self._drop_subscription()
+        if self._redis:
+            await self._redis.aclose()
+
+    async def publish(self, envelope: Dict[str, Any]):
+        await self._redis.publish(self.channel, json.dumps({**envelope, "origin": self.worker_id}))
+        self.stats['published'] += 1
+
+    async def _listen(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    self.stats['reconnects'] += 1
+                    logger.info(f"Fan-out bus resubscribed to {self.channel}")
+                    delay = self.reconnect_delay
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    try:
+                        envelope = json.loads(item["data"])
+                    except (TypeError, ValueError):
+                        self.stats['errors'] += 1
+                        continue
+                    await self._dispatch(envelope)
+                raise ConnectionError("subscription closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._pubsub is not None:
+                    self.stats['disconnects'] += 1
+                logger.error(f"Fan-out bus subscription lost, retrying in {delay:.1f}s: {e}")
+                await self._drop_subscription()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+
+def create_fanout_bus(backend: str, redis_url: str = "redis://localhost:6379/0") -> Optional[FanoutBus]:
+    """Build the configured bus; 'local' means single-worker (no backplane)"""
+    if backend == "redis":
+        return RedisFanoutBus(url=redis_url)
+    if backend == "loopback":
+        return LoopbackBus()
+    if backend == "local":
+        return None
+    raise ValueError(f"Unknown fan-out bus backend {backend!r} (expected local, redis or loopback)")
@@ -0,0 +1,525 @@
+"""
+Pulse Backend - Game Room Engine
+One in-memory actor per active game room with a move log and periodic snapshots
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .move_log import decode_records, encode_move, encode_reset
+from .outbound_queue import OutboundQueue, QueuePolicy
+
+logger = logging.getLogger(__name__)
+
+RoomLoader = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+MoveProcessor = Callable[[str, Dict[str, Any], Dict[str, Any], Optional[str]], Awaitable[Dict[str, Any]]]
+MoveResolver = Callable[[str, Dict[str, Any]], Dict[str, Any]]
+SnapshotWriter = Callable[[str, Dict[str, Any], bool, int], Awaitable[None]]
+LogWriter = Callable[[str, int, int, bytes], Awaitable[None]]
+LogReader = Callable[[str, int], Awaitable[List[bytes]]]
+
+FINISHED_STATUSES = ("finished", "won", "lost")
+
+
+def is_game_over(state: Optional[Dict[str, Any]]) -> bool:
+    return bool(state) and state.get("status") in FINISHED_STATUSES
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _settle(applied: Optional[asyncio.Future], result: Optional[int] = None, error: Optional[Exception] = None):
+    """Resolve a submitted move's future; nobody has to await it"""
+    if applied is None or applied.done():
+        return
+    if error is not None:
+        applied.set_exception(error)
+        applied.exception()  # retrieved: an unawaited failure is already logged
+    else:
+        applied.set_result(result)
+
+
+def _public_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    if "reset" in record:
+        return {"seq": record["seq"], "ts": record["ts"], "game_state": record["reset"]}
+    return {"seq": record["seq"], "ts": record["ts"], "player_id": record["player_id"], "move": record["move"]}
+
+
+class GameRoom:
+    """Authoritative state and sockets of one room"""
+
+    def __init__(self, room_id: str, game_type: Optional[str], state: Optional[Dict[str, Any]], seq: int = 0,
+                 tail_size: int = 512):
+        self.room_id = room_id
+        self.game_type = game_type
+        self.state = state  # None when the room does not exist in the database
+        self.seq = seq  # sequence number of the last applied move
+        self.sockets: Dict[Any, OutboundQueue] = {}  # websocket -> outbound queue
+        self.mailbox: asyncio.Queue = asyncio.Queue()
+        self.log_buffer: List[Tuple[int, bytes]] = []  # encoded records not yet in the log
+        self.log_lock = asyncio.Lock()  # one log append at a time, so a batch is written and removed once
+        self.tail: Deque[Tuple[int, bytes]] = deque(maxlen=tail_size)  # recent records for catch-up
+        self.moves_applied = 0
+        self.dirty = False
+        self.finished = is_game_over(state)
+        self.task: Optional[asyncio.Task] = None
+
+    def record(self, seq: int, encoded: bytes, log: bool = True):
+        self.tail.append((seq, encoded))
+        if log:
+            self.log_buffer.append((seq, encoded))
+
+    def broadcast(self, payload: Dict[str, Any]) -> int:
+        """Encode once and queue for every socket in the room"""
+        text = json.dumps(payload, default=str)
+        return sum(1 for queue in list(self.sockets.values()) if queue.enqueue(text, frame_type=payload.get("type")))
+
+
+class GameRoomEngine:
+    """
+    Active game rooms held in memory
+
+    Each room has a mailbox drained by a single task, so moves are applied
+    one at a time in arrival order and concurrent moves never overwrite each
+    other. Every applied move gets a sequence number and a compact binary
+    record; randomness (e.g. dice) is resolved before the record is written,
+    so replaying the log reproduces the state exactly.
+
+    Records are appended to the move log every `log_flush_interval` seconds
+    and the state is snapshotted every `snapshot_interval` seconds, when the
+    game ends and when the last socket leaves. Loading a room replays the log
+    after its last snapshot; reconnecting clients can ask for just the moves
+    after the last sequence number they saw.
+    """
+
+    def __init__(
+        self,
+        loader: RoomLoader,
+        processor: MoveProcessor,
+        snapshot: SnapshotWriter,
+        resolver: Optional[MoveResolver] = None,
+        log_writer: Optional[LogWriter] = None,
+        log_reader: Optional[LogReader] = None,
+        snapshot_interval: float = 5.0,
+        log_flush_interval: float = 1.0,
+        max_catch_up: int = 500,
+        send_timeout: float = 5.0,
+        queue_policy: Optional[QueuePolicy] = None,
+        max_concurrency: int = 64
+    ):
+        self.loader = loader
+        self.processor = processor
+        self.snapshot = snapshot
+        self.resolver = resolver
+        self.log_writer = log_writer
+        self.log_reader = log_reader
+        self.snapshot_interval = snapshot_interval
+        self.log_flush_interval = log_flush_interval
+        self.max_catch_up = max_catch_up
+        self.send_timeout = send_timeout
+        self.queue_policy = queue_policy or QueuePolicy()
+        self.max_concurrency = max_concurrency
+        self.rooms: Dict[str, GameRoom] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._unloading: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'loads': 0, 'replayed': 0, 'moves': 0, 'ignored_moves': 0, 'move_errors': 0, 'snapshots': 0, 'snapshot_errors': 0,
+            'log_writes': 0, 'log_bytes': 0, 'log_errors': 0, 'catch_ups': 0, 'full_resyncs': 0
+        }
+
+    # ==========================================
+    # ROOM LIFECYCLE
+    # ==========================================
+
+    async def attach(self, room_id: str, websocket: Any) -> GameRoom:
+        """Add a socket to a room, loading the room on first use"""
+        room = await self._get_room(room_id)
+
+        async def on_evict(reason: str):
+            logger.warning(f"Evicted game socket in room {room_id}: {reason}")
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        room.sockets[websocket] = OutboundQueue(
+            websocket,
+            policy=self.queue_policy,
+            send_timeout=self.send_timeout,
+            semaphore=self._semaphore,
+            on_evict=on_evict
+        )
+        return room
+
+    async def detach(self, room_id: str, websocket: Any):
+        """Remove a socket; the last one out unloads the room"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        queue = room.sockets.pop(websocket, None)
+        if queue is not None:
+            queue.close()
+        if not room.sockets:
+            await self._unload(room)
+
+    async def _get_room(self, room_id: str) -> GameRoom:
+        unloading = self._unloading.get(room_id)
+        if unloading is not None:
+            await asyncio.shield(unloading)
+
+        room = self.rooms.get(room_id)
+        if room is not None:
+            return room
+
+        pending = self._loading.get(room_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[room_id] = future
+        try:
+            self.stats['loads'] += 1
+            room = await self._rebuild(room_id)
+            room.task = asyncio.get_running_loop().create_task(self._run_room(room))
+            self.rooms[room_id] = room
+            future.set_result(room)
+            return room
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._loading[room_id]
+
+    async def _rebuild(self, room_id: str) -> GameRoom:
+        """Last snapshot plus every logged move after it"""
+        doc = await self.loader(room_id)
+        if doc is None:
+            return GameRoom(room_id, None, None)
+        room = GameRoom(room_id, doc.get("game_type"), doc.get("game_state") or {}, doc.get("move_seq", 0))
+        for record in await self._read_log(room_id, room.seq):
+            if "reset" in record:
+                room.state = record["reset"]
+                room.record(record["seq"], encode_reset(record["seq"], record["ts"], record["reset"]), log=False)
+            else:
+                room.state = await self.processor(room.game_type, room.state, record["move"], record["player_id"])
+                room.record(
+                    record["seq"],
+                    encode_move(record["seq"], record["ts"], record["player_id"], record["move"]),
+                    log=False
+                )
+            room.seq = record["seq"]
+            room.dirty = True
+            self.stats['replayed'] += 1
+        room.finished = is_game_over(room.state)
+        return room
+
+    async def _read_log(self, room_id: str, after_seq: int) -> List[Dict[str, Any]]:
+        if self.log_reader is None:
+            return []
+        # A retried or overlapping append can log a record twice; replay each seq once
+        records: Dict[int, Dict[str, Any]] = {}
+        for chunk in await self.log_reader(room_id, after_seq):
+            for record in decode_records(chunk):
+                if record["seq"] > after_seq:
+                    records.setdefault(record["seq"], record)
+        return [records[seq] for seq in sorted(records)]
+
+    async def _unload(self, room: GameRoom, drain: bool = False):
+        if self.rooms.get(room.room_id) is not room:
+            return
+        del self.rooms[room.room_id]
+        done = asyncio.get_running_loop().create_future()
+        self._unloading[room.room_id] = done
+        try:
+            if drain:
+                await self._drain_room(room)
+            else:
+                await self._stop_room(room)
+            await self._write_snapshot(room)
+        finally:
+            del self._unloading[room.room_id]
+            done.set_result(None)
+
+    async def release(self, room_id: str) -> Optional[GameRoom]:
+        """
+        Give up a room that another worker now owns
+
+        Applies the moves already queued, flushes the log and writes the
+        snapshot before returning, so the new owner loads the final state.
+        Returns the released room (its sockets are left to the caller), or
+        None if the room was not active here.
+        """
+        pending = self._loading.get(room_id)
+        if pending is not None:
+            try:
+                await asyncio.shield(pending)
+            except Exception:
+                return None
+        room = self.rooms.get(room_id)
+        if room is None:
+            unloading = self._unloading.get(room_id)
+            if unloading is not None:
+                await asyncio.shield(unloading)
+            return None
+        await self._unload(room, drain=True)
+        return room
+
+    @staticmethod
+    async def _drain_room(room: GameRoom):
+        """Let the actor apply what is already in its mailbox, then stop it"""
+        if room.task is not None:
+            room.mailbox.put_nowait(("stop", None, None, None))
+            await room.task
+            room.task = None
+
+    @staticmethod
+    async def _stop_room(room: GameRoom):
+        if room.task is not None:
+            room.task.cancel()
+            try:
+                await room.task
+            except asyncio.CancelledError:
+                pass
+            room.task = None
+        while not room.mailbox.empty():
+            _, _, _, applied = room.mailbox.get_nowait()
+            _settle(applied, error=RuntimeError("Game room closed"))
+
+    # ==========================================
+    # MOVES
+    # ==========================================
+
+    def submit_move(self, room_id: str, player_id: Optional[str], move: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """
+        Queue a move for the room's actor; None if the room is not active
+
+        The returned future resolves to the move's sequence number, or None
+        if the game no longer takes moves, and raises if the move failed.
+        Awaiting it is optional.
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        applied = asyncio.get_running_loop().create_future()
+        room.mailbox.put_nowait(("move", player_id, move, applied))
+        return applied
+
+    def set_state(self, room_id: str, state: Dict[str, Any]) -> bool:
+        """Replace the state of an active room (e.g. the game was started over HTTP)"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return False
+        room.mailbox.put_nowait(("reset", None, state, None))
+        return True
+
+    def broadcast(self, room_id: str, payload: Dict[str, Any]) -> int:
+        room = self.rooms.get(room_id)
+        return room.broadcast(payload) if room is not None else 0
+
+    async def _run_room(self, room: GameRoom):
+        while True:
+            kind, player_id, payload, applied = await room.mailbox.get()
+            if kind == "stop":
+                return
+            if kind == "reset":
+                room.state = payload
+                room.seq += 1
+                room.record(room.seq, encode_reset(room.seq, _now_ms(), payload))
+                update = {"type": "game_state_update", "game_state": room.state, "seq": room.seq}
+            elif room.state is None or room.finished:
+                self.stats['ignored_moves'] += 1
+                _settle(applied)
+                continue
+            else:
+                try:
+                    # Resolve randomness first so the logged move replays deterministically
+                    move = self.resolver(room.game_type, payload) if self.resolver else payload
+                    # The processor gets a copy: a move that fails halfway leaves the room untouched
+                    state = await self.processor(room.game_type, copy.deepcopy(room.state), move, player_id)
+                    encoded = encode_move(room.seq + 1, _now_ms(), player_id, move)
+                except Exception as e:
+                    self.stats['ignored_moves'] += 1
+                    self.stats['move_errors'] += 1
+                    logger.error(f"Game move error in room {room.room_id}: {e}")
+                    _settle(applied, error=e)
+                    continue
+                room.state = state
+                room.seq += 1
+                room.record(room.seq, encoded)
+                room.moves_applied += 1
+                self.stats['moves'] += 1
+                update = {
+                    "type": "game_state_update",
+                    "game_state": room.state,
+                    "seq": room.seq,
+                    "player_id": player_id,
+                    "move": move
+                }
+            room.dirty = True
+            room.broadcast(update)
+            _settle(applied, room.seq)
+
+            if not room.finished and is_game_over(room.state):
+                room.finished = True
+                await self._write_snapshot(room)
+
+    # ==========================================
+    # CATCH-UP
+    # ==========================================
+
+    async def catch_up(self, room_id: str, since: int) -> Optional[Dict[str, Any]]:
+        """
+        What a client that last saw `since` needs to be current
+
+        Returns {"seq", "moves"} when the missed moves are available and few
+        enough, otherwise {"seq", "game_state"}; None if the room is unknown.
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            unloading = self._unloading.get(room_id)
+            if unloading is not None:
+                await asyncio.shield(unloading)
+            room = await self._rebuild(room_id)
+        if room.state is None:
+            return None
+
+        seq = room.seq
+        if 0 <= since <= seq and seq - since <= self.max_catch_up:
+            records = await self._records_since(room, since, seq)
+            if records is not None:
+                self.stats['catch_ups'] += 1
+                return {"seq": seq, "moves": [_public_record(record) for record in records]}
+
+        self.stats['full_resyncs'] += 1
+        return {"seq": seq, "game_state": room.state}
+
+    async def _records_since(self, room: GameRoom, since: int, seq: int) -> Optional[List[Dict[str, Any]]]:
+        if since == seq:
+            return []
+        tail = [(record_seq, encoded) for record_seq, encoded in list(room.tail) if since < record_seq <= seq]
+        if tail and tail[0][0] == since + 1:
+            return decode_records(b"".join(encoded for _, encoded in tail))
+
+        # Older than the in-memory tail: logged records plus the unflushed buffer
+        records = {record["seq"]: record for record in await self._read_log(room.room_id, since)}
+        for record in decode_records(b"".join(encoded for _, encoded in list(room.log_buffer))):
+            records.setdefault(record["seq"], record)
+        wanted = [records.get(number) for number in range(since + 1, seq + 1)]
+        return None if any(record is None for record in wanted) else wanted
+
+    async def send_catch_up(self, room_id: str, websocket: Any, since: int) -> bool:
+        """Answer a reconnecting socket's sync request on its own queue"""
+        if self._queue(room_id, websocket) is None:
+            return False
+        result = await self.catch_up(room_id, since)
+        if result is None:
+            return False
+        frame_type = "game_moves" if "moves" in result else "game_state_update"
+        return self.send_to_socket(room_id, websocket, json.dumps({"type": frame_type, **result}, default=str), frame_type)
+
+    def send_to_socket(self, room_id: str, websocket: Any, message: str, frame_type: str) -> bool:
+        """Queue a frame for one socket in a room, behind its backpressure"""
+        queue = self._queue(room_id, websocket)
+        return queue is not None and queue.enqueue(message, frame_type=frame_type)
+
+    def _queue(self, room_id: str, websocket: Any) -> Optional[OutboundQueue]:
+        room = self.rooms.get(room_id)
+        return room.sockets.get(websocket) if room is not None else None
+
+    # ==========================================
+    # PERSISTENCE
+    # ==========================================
+
+    async def _flush_log(self, room: GameRoom) -> bool:
+        """Append buffered records to the move log as one chunk"""
+        if self.log_writer is None:
+            room.log_buffer.clear()
+            return True
+        async with room.log_lock:
+            if not room.log_buffer:
+                return True
+            # The batch stays buffered while it is written so catch-up can still serve it
+            batch = list(room.log_buffer)
+            data = b"".join(encoded for _, encoded in batch)
+            try:
+                await self.log_writer(room.room_id, batch[0][0], batch[-1][0], data)
+            except Exception as e:
+                self.stats['log_errors'] += 1
+                logger.error(f"Move log write error for room {room.room_id}: {e}")
+                return False
+            del room.log_buffer[:len(batch)]
+            self.stats['log_writes'] += 1
+            self.stats['log_bytes'] += len(data)
+            return True
+
+    async def _write_snapshot(self, room: GameRoom):
+        await self._flush_log(room)
+        if not room.dirty or room.state is None:
+            return
+        room.dirty = False
+        # Copy: the database driver may encode while the actor keeps mutating
+        state = copy.deepcopy(room.state)
+        try:
+            await self.snapshot(room.room_id, state, room.finished, room.seq)
+            self.stats['snapshots'] += 1
+        except Exception as e:
+            room.dirty = True
+            self.stats['snapshot_errors'] += 1
+            logger.error(f"Game snapshot error for room {room.room_id}: {e}")
+
+    async def flush_logs(self):
+        rooms = [room for room in self.rooms.values() if room.log_buffer]
+        if rooms:
+            await asyncio.gather(*(self._flush_log(room) for room in rooms))
+
+    async def snapshot_dirty(self):
+        """Write every room whose state changed since its last snapshot"""
+        rooms = [room for room in self.rooms.values() if room.dirty]
+        if rooms:
+            await asyncio.gather(*(self._write_snapshot(room) for room in rooms))
+
+    async def _run(self):
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while True:
+            await asyncio.sleep(self.log_flush_interval)
+            await self.flush_logs()
+            if time.monotonic() >= next_snapshot:
+                next_snapshot = time.monotonic() + self.snapshot_interval
+                await self.snapshot_dirty()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop snapshotting and room actors, writing any unsaved state"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for room in list(self.rooms.values()):
+            await self._stop_room(room)
+        await self.snapshot_dirty()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active_rooms': len(self.rooms),
+            'sockets': sum(len(room.sockets) for room in self.rooms.values()),
+            'queued_moves': sum(room.mailbox.qsize() for room in self.rooms.values()),
+            'unflushed_records': sum(len(room.log_buffer) for room in self.rooms.values()),
+            **self.stats
+        }
@@ -0,0 +1,179 @@
+"""
+Pulse Backend - Heartbeat Scheduler
+Hashed timing wheel for pings and idle timeouts across all sockets
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+HeartbeatAction = Callable[[], Awaitable[Any]]
+
+# Histogram bucket upper bounds, in seconds
+AGE_BUCKETS = (60, 300, 900, 3600, 14400, 86400)
+LIVENESS_BUCKETS = (5, 15, 30, 45, 60, 120)
+
+
+class _Heartbeat:
+    __slots__ = ('connected_at', 'last_seen', 'ping', 'close', 'slot')
+
+    def __init__(self, now: float, ping: HeartbeatAction, close: HeartbeatAction):
+        self.connected_at = now
+        self.last_seen = now
+        self.ping = ping
+        self.close = close
+        self.slot = -1
+
+
+def _histogram(values: List[float], bounds: Tuple[int, ...]) -> Dict[str, int]:
+    labels = [f"<={bound}s" for bound in bounds] + [f">{bounds[-1]}s"]
+    counts = dict.fromkeys(labels, 0)
+    for value in values:
+        for label, bound in zip(labels, bounds):
+            if value <= bound:
+                counts[label] += 1
+                break
+        else:
+            counts[labels[-1]] += 1
+    return counts
+
+
+class HeartbeatScheduler:
+    """
+    One timer for every socket
+
+    Sockets sit in the slot of a timing wheel where they are next due for a
+    check. Inbound traffic only updates `last_seen`; nothing moves in the
+    wheel until the slot comes round. Each tick visits one slot: sockets idle
+    past `timeout` are closed, sockets idle past `ping_interval` are pinged
+    (as one batch), and active sockets are re-slotted for later.
+    """
+
+    def __init__(
+        self,
+        ping_interval: float = 30,
+        timeout: float = 60,
+        tick: float = 1.0,
+        batch_size: int = 500
+    ):
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+        self.tick = tick
+        self.batch_size = batch_size
+        self._wheel: List[Set[str]] = [set() for _ in range(math.ceil(ping_interval / tick) + 1)]
+        self._cursor = 0
+        self._next_tick_at: Optional[float] = None
+        self._entries: Dict[str, _Heartbeat] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'pings': 0, 'timeouts': 0, 'ticks': 0, 'errors': 0}
+
+    # ==========================================
+    # REGISTRATION
+    # ==========================================
+
+    def register(self, key: str, ping: HeartbeatAction, close: HeartbeatAction, now: Optional[float] = None):
+        """Track a socket; `ping` and `close` are called by the scheduler"""
+        now = time.monotonic() if now is None else now
+        if self._next_tick_at is None:
+            self._next_tick_at = now + self.tick
+        entry = _Heartbeat(now, ping, close)
+        self._entries[key] = entry
+        self._schedule(key, entry, self.ping_interval)
+
+    def unregister(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._wheel[entry.slot].discard(key)
+
+    def touch(self, key: str, now: Optional[float] = None):
+        """Record inbound traffic (any frame counts as proof of life)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_seen = time.monotonic() if now is None else now
+
+    def _schedule(self, key: str, entry: _Heartbeat, delay: float):
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self._wheel) - 1)
+        entry.slot = (self._cursor + ticks) % len(self._wheel)
+        self._wheel[entry.slot].add(key)
+
+    # ==========================================
+    # TICK
+    # ==========================================
+
+    async def advance(self, now: Optional[float] = None):
+        """Process every slot that has come due by `now`"""
+        now = time.monotonic() if now is None else now
+        if self._next_tick_at is None:
+            self._next_tick_at = now + self.tick
+        while self._next_tick_at <= now:
+            self._next_tick_at += self.tick
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            await self._process_slot(now)
+
+    async def _process_slot(self, now: float):
+        self.stats['ticks'] += 1
+        due, self._wheel[self._cursor] = self._wheel[self._cursor], set()
+        pings: List[HeartbeatAction] = []
+        closes: List[HeartbeatAction] = []
+
+        for key in due:
+            entry = self._entries[key]
+            idle = now - entry.last_seen
+            if idle >= self.timeout:
+                del self._entries[key]
+                closes.append(entry.close)
+                self.stats['timeouts'] += 1
+            elif idle >= self.ping_interval - self.tick:
+                pings.append(entry.ping)
+                self._schedule(key, entry, min(self.ping_interval, self.timeout - idle))
+            else:
+                self._schedule(key, entry, self.ping_interval - idle)
+
+        self.stats['pings'] += len(pings)
+        await self._run_batch(closes)
+        await self._run_batch(pings)
+
+    async def _run_batch(self, actions: List[HeartbeatAction]):
+        for start in range(0, len(actions), self.batch_size):
+            results = await asyncio.gather(
+                *(action() for action in actions[start:start + self.batch_size]),
+                return_exceptions=True
+            )
+            self.stats['errors'] += sum(1 for result in results if isinstance(result, Exception))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.advance()
+            except Exception as e:
+                logger.error(f"Heartbeat tick error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """Counters plus connection-age and time-since-last-frame histograms"""
+        now = time.monotonic() if now is None else now
+        entries = list(self._entries.values())
+        return {
+            'tracked': len(entries),
+            'wheel_slots': len(self._wheel),
+            'connection_age': _histogram([now - entry.connected_at for entry in entries], AGE_BUCKETS),
+            'liveness': _histogram([now - entry.last_seen for entry in entries], LIVENESS_BUCKETS),
+            **self.stats
+        }
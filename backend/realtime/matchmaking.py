@@ -0,0 +1,294 @@
+"""
+Pulse Backend - Game Matchmaking
+Per-game-type queues that form matches and push them to the players
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MatchCreator = Callable[[str, List[str]], Awaitable[Dict[str, Any]]]
+MatchNotifier = Callable[[List[str], Dict[str, Any]], Awaitable[None]]
+
+
+class QueueSpec:
+    """
+    Match size rules for one game type
+
+    Args:
+        min_players: Smallest match that may start
+        max_players: Match starts at once when this many are compatible
+        fill_wait: Seconds the oldest ticket waits for a fuller match before
+            starting with at least min_players
+    """
+
+    def __init__(self, min_players: int, max_players: int, fill_wait: float = 0.0):
+        self.min_players = min_players
+        self.max_players = max_players
+        self.fill_wait = fill_wait
+
+
+DEFAULT_QUEUES = {
+    "tic-tac-toe": QueueSpec(2, 2),
+    "ludo": QueueSpec(2, 4, fill_wait=15.0),
+    "mafia": QueueSpec(5, 10, fill_wait=30.0),
+}
+
+
+class Ticket:
+    """One player waiting in a queue"""
+
+    __slots__ = ("user_id", "game_type", "rating", "joined_at")
+
+    def __init__(self, user_id: str, game_type: str, rating: Optional[float], joined_at: float):
+        self.user_id = user_id
+        self.game_type = game_type
+        self.rating = rating
+        self.joined_at = joined_at
+
+
+class Matchmaker:
+    """
+    In-memory matchmaking queues
+
+    Players join a queue for a game type instead of polling the room list.
+    Every `tick` seconds each queue is scanned oldest ticket first and groups
+    of compatible players are handed to `create_match`, which creates the
+    room with its initial state in one write; `notify` then pushes the match
+    to every player.
+
+    Ratings are optional. Rated players in a group must all be within
+    `rating_window` of each other, which widens by `window_growth` per second
+    waited (by the group's newest player) so nobody waits forever; unrated
+    players match anyone. Rated tickets are sorted once per pass and a
+    group's rated players are a contiguous run of that order, so a pass costs
+    O(n log n) rather than a scan of the queue per ticket.
+
+    Queues live in this process only: with several workers behind a fan-out
+    bus, players queued on different workers are never matched together.
+    Run matchmaking on a single worker (or pin its endpoints to one).
+    """
+
+    def __init__(
+        self,
+        create_match: MatchCreator,
+        notify: MatchNotifier,
+        specs: Optional[Dict[str, QueueSpec]] = None,
+        tick: float = 1.0,
+        rating_window: float = 100.0,
+        window_growth: float = 10.0,
+        match_ttl: float = 60.0
+    ):
+        self.create_match = create_match
+        self.notify = notify
+        self.specs = specs or DEFAULT_QUEUES
+        self.tick = tick
+        self.rating_window = rating_window
+        self.window_growth = window_growth
+        self.match_ttl = match_ttl
+        self.queues: Dict[str, Dict[str, Ticket]] = {game_type: {} for game_type in self.specs}  # insertion = FIFO
+        self.tickets: Dict[str, Ticket] = {}  # user_id -> ticket
+        self._matching: Dict[str, Ticket] = {}  # user_id -> ticket whose match is being created
+        self.recent_matches: Dict[str, Dict[str, Any]] = {}  # user_id -> match, for clients without a socket
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'joined': 0, 'left': 0, 'matches': 0, 'matched_players': 0, 'match_errors': 0}
+
+    # ==========================================
+    # QUEUES
+    # ==========================================
+
+    def join(self, user_id: str, game_type: str, rating: Optional[float] = None, now: Optional[float] = None) -> Dict[str, Any]:
+        """Queue a player, moving them if they were waiting for another game"""
+        if game_type not in self.specs:
+            raise ValueError(f"Matchmaking is not available for {game_type}")
+        existing = self.tickets.get(user_id)
+        if existing is not None and existing.game_type == game_type:
+            existing.rating = rating
+            return self.status(user_id)
+        self.leave(user_id)
+
+        ticket = Ticket(user_id, game_type, rating, now if now is not None else time.monotonic())
+        self.queues[game_type][user_id] = ticket
+        self.tickets[user_id] = ticket
+        self.recent_matches.pop(user_id, None)
+        self.stats['joined'] += 1
+        return self.status(user_id)
+
+    def leave(self, user_id: str) -> bool:
+        ticket = self.tickets.pop(user_id, None)
+        if ticket is None:
+            # Leaving while the match is being created: not re-queued if creation fails
+            return self._matching.pop(user_id, None) is not None
+        self.queues[ticket.game_type].pop(user_id, None)
+        self.stats['left'] += 1
+        return True
+
+    def status(self, user_id: str) -> Dict[str, Any]:
+        ticket = self.tickets.get(user_id)
+        if ticket is None:
+            match = self.recent_matches.get(user_id)
+            if match is not None and match["expires_at"] > time.monotonic():
+                return {"status": "matched", **match["match"]}
+            return {"status": "idle"}
+        queue = self.queues[ticket.game_type]
+        return {
+            "status": "queued",
+            "game_type": ticket.game_type,
+            "position": list(queue).index(user_id) + 1,
+            "waiting": len(queue)
+        }
+
+    # ==========================================
+    # MATCHING
+    # ==========================================
+
+    def _fits(self, run: List[Ticket], now: float) -> bool:
+        """Every pair of rated players in the run is within the window"""
+        waited = now - max(ticket.joined_at for ticket in run)
+        return run[-1].rating - run[0].rating <= self.rating_window + self.window_growth * waited
+
+    def _best_run(self, rated: List[Ticket], pos: int, limit: int, now: float) -> Tuple[int, int]:
+        """The largest, then tightest, compatible run of `rated` containing `pos`"""
+        for size in range(min(limit, len(rated)), 0, -1):
+            runs = [
+                (rated[start + size - 1].rating - rated[start].rating, start)
+                for start in range(max(0, pos - size + 1), min(pos, len(rated) - size) + 1)
+                if self._fits(rated[start:start + size], now)
+            ]
+            if runs:
+                start = min(runs)[1]
+                return start, start + size
+        return pos, pos
+
+    def _form_groups(self, game_type: str, now: float) -> List[List[Ticket]]:
+        spec = self.specs[game_type]
+        waiting = list(self.queues[game_type].values())  # oldest first
+        order = {ticket.user_id: index for index, ticket in enumerate(waiting)}
+        rated = sorted(
+            (ticket for ticket in waiting if ticket.rating is not None),
+            key=lambda ticket: (ticket.rating, order[ticket.user_id])
+        )
+        keys = [(ticket.rating, order[ticket.user_id]) for ticket in rated]
+        unrated: Deque[Ticket] = deque(ticket for ticket in waiting if ticket.rating is None)
+        oldest_rated = 0  # index into waiting, only moves forward
+        taken = set()
+        groups = []
+        for anchor in waiting:
+            if anchor.user_id in taken:
+                continue
+            # Rated players are the anchor's run (or the oldest rated ticket's); unrated ones fill the rest
+            pivot = anchor
+            if anchor.rating is None:
+                while oldest_rated < len(waiting) and (
+                    waiting[oldest_rated].rating is None or waiting[oldest_rated].user_id in taken
+                ):
+                    oldest_rated += 1
+                pivot = waiting[oldest_rated] if oldest_rated < len(waiting) else None
+            start = end = 0
+            if pivot is not None:
+                position = bisect.bisect_left(keys, (pivot.rating, order[pivot.user_id]))
+                limit = spec.max_players - (1 if anchor.rating is None else 0)
+                start, end = self._best_run(rated, position, limit, now)
+            group = rated[start:end]
+            if anchor.rating is None:
+                group.append(anchor)
+            while unrated and unrated[0].user_id in taken:
+                unrated.popleft()
+            for ticket in unrated:
+                if len(group) >= spec.max_players:
+                    break
+                if ticket is not anchor and ticket.user_id not in taken:
+                    group.append(ticket)
+            if len(group) < spec.min_players:
+                continue
+            if len(group) < spec.max_players and now - anchor.joined_at < spec.fill_wait:
+                continue
+            taken.update(ticket.user_id for ticket in group)
+            del rated[start:end]
+            del keys[start:end]
+            groups.append(sorted(group, key=lambda ticket: order[ticket.user_id]))
+        return groups
+
+    async def match(self, now: Optional[float] = None) -> int:
+        """Form every match currently possible; returns how many were created"""
+        now = now if now is not None else time.monotonic()
+        formed = 0
+        for game_type in self.specs:
+            for group in self._form_groups(game_type, now):
+                for ticket in group:
+                    self.tickets.pop(ticket.user_id, None)
+                    self.queues[game_type].pop(ticket.user_id, None)
+                    self._matching[ticket.user_id] = ticket
+                if await self._create(game_type, group):
+                    formed += 1
+        self._expire_matches()
+        return formed
+
+    async def _create(self, game_type: str, group: List[Ticket]) -> bool:
+        user_ids = [ticket.user_id for ticket in group]
+        try:
+            match = await self.create_match(game_type, user_ids)
+        except Exception as e:
+            self.stats['match_errors'] += 1
+            logger.error(f"Match creation error for {game_type}: {e}")
+            # Back in the queue with their original wait time, unless they re-queued or left meanwhile
+            for ticket in group:
+                if self._matching.get(ticket.user_id) is not ticket:
+                    continue
+                del self._matching[ticket.user_id]
+                if ticket.user_id not in self.tickets:
+                    self.queues[game_type][ticket.user_id] = ticket
+                    self.tickets[ticket.user_id] = ticket
+            return False
+        for ticket in group:
+            if self._matching.get(ticket.user_id) is ticket:
+                del self._matching[ticket.user_id]
+
+        self.stats['matches'] += 1
+        self.stats['matched_players'] += len(user_ids)
+        expires_at = time.monotonic() + self.match_ttl
+        for user_id in user_ids:
+            self.recent_matches[user_id] = {"match": match, "expires_at": expires_at}
+        try:
+            await self.notify(user_ids, {"type": "match_found", **match})
+        except Exception as e:
+            logger.error(f"Match notification error for {game_type}: {e}")
+        return True
+
+    def _expire_matches(self):
+        now = time.monotonic()
+        expired = [user_id for user_id, match in self.recent_matches.items() if match["expires_at"] <= now]
+        for user_id in expired:
+            del self.recent_matches[user_id]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.match()
+            except Exception as e:
+                logger.error(f"Matchmaking error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'queued': {game_type: len(queue) for game_type, queue in self.queues.items()},
+            **self.stats
+        }
@@ -0,0 +1,145 @@
+"""
+Pulse Backend - Chat Membership Cache
+In-memory chat -> members index with write-through updates and TTL fallback
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+ChatLoader = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class ChatMembership:
+    """Cached members of one chat plus the few chat fields hot paths need"""
+
+    __slots__ = ('chat_id', 'members', 'meta', 'expires')
+
+    def __init__(self, chat_id: str, members: Iterable[str], meta: Dict[str, Any], expires: float):
+        self.chat_id = chat_id
+        self.members: Set[str] = set(members)
+        self.meta = meta
+        self.expires = expires
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.meta.get(key, default)
+
+
+class ChatMembershipCache:
+    """
+    LRU + TTL cache of chat membership
+
+    Writers that change membership (chat creation, team join/leave, chat
+    deletion) update the cache directly; the TTL only bounds staleness for
+    changes made by code paths or workers that do not write through.
+    """
+
+    def __init__(
+        self,
+        loader: ChatLoader,
+        ttl: float = 300,
+        max_entries: int = 100_000,
+        meta_fields: Optional[Iterable[str]] = None
+    ):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.meta_fields = tuple(meta_fields) if meta_fields is not None else None
+        self._entries: "OrderedDict[str, ChatMembership]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0, 'expired': 0, 'write_through': 0}
+
+    # ==========================================
+    # READS
+    # ==========================================
+
+    async def get(self, chat_id: str) -> Optional[ChatMembership]:
+        """Membership for a chat, loading it from the database on a miss"""
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            if entry.expires > time.monotonic():
+                self._entries.move_to_end(chat_id)
+                self.stats['hits'] += 1
+                return entry
+            del self._entries[chat_id]
+            self.stats['expired'] += 1
+
+        self.stats['misses'] += 1
+
+        # Single-flight: concurrent misses for the same chat share one query
+        pending = self._inflight.get(chat_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[chat_id] = future
+        try:
+            self.stats['loads'] += 1
+            doc = await self.loader(chat_id)
+            entry = self.set_chat(doc) if doc else None
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure does not warn at GC time
+            future.exception()
+            raise
+        finally:
+            del self._inflight[chat_id]
+
+    async def get_members(self, chat_id: str) -> Optional[Set[str]]:
+        entry = await self.get(chat_id)
+        return entry.members if entry is not None else None
+
+    async def is_member(self, chat_id: str, user_id: str) -> bool:
+        entry = await self.get(chat_id)
+        return entry is not None and user_id in entry.members
+
+    # ==========================================
+    # WRITE-THROUGH
+    # ==========================================
+
+    def set_chat(self, chat: Dict[str, Any]) -> ChatMembership:
+        """Cache a chat document (or projection) that was just read or written"""
+        if self.meta_fields is not None:
+            meta = {key: chat[key] for key in self.meta_fields if key in chat}
+        else:
+            meta = {key: value for key, value in chat.items() if key not in ('members', '_id')}
+        entry = ChatMembership(chat['chat_id'], chat.get('members', []), meta, time.monotonic() + self.ttl)
+        self._entries[entry.chat_id] = entry
+        self._entries.move_to_end(entry.chat_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        return entry
+
+    def add_member(self, chat_id: str, user_id: str):
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            entry.members.add(user_id)
+            self.stats['write_through'] += 1
+
+    def remove_member(self, chat_id: str, user_id: str):
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            entry.members.discard(user_id)
+            self.stats['write_through'] += 1
+
+    def invalidate(self, chat_id: str):
+        self._entries.pop(chat_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] / lookups * 100) if lookups > 0 else 0
+        return {
+            'entries': len(self._entries),
+            'hit_rate': round(hit_rate, 2),
+            **self.stats
+        }
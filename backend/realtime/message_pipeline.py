@@ -0,0 +1,174 @@
+"""
+Pulse Backend - Message Write Pipeline
+Group commit for chat messages, with fan-out moved off the request path
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+MessageWriter = Callable[[List[Dict[str, Any]]], Awaitable[Set[int]]]
+ChatUpdater = Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]
+MessageFanout = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+class MessagePipeline:
+    """
+    Three-stage ingestion: buffer, commit, fan out
+
+    `submit` adds a message to the open batch and waits for it to be
+    committed. A batch closes `window` seconds after its first message or
+    once it holds `max_batch` messages, and is written with one call to
+    `writer`, which returns the positions that failed. The submitters are
+    then released and the batch joins the fan-out queue, so broadcasts and
+    outbox bookkeeping never delay the response. Last, the newest message of
+    each chat in the batch goes to `chat_updater` in a single call.
+
+    Batches commit concurrently; fan-out runs on one background task in
+    commit order.
+    """
+
+    def __init__(
+        self,
+        writer: MessageWriter,
+        chat_updater: ChatUpdater,
+        fanout: MessageFanout,
+        window: float = 0.003,
+        max_batch: int = 256
+    ):
+        self.writer = writer
+        self.chat_updater = chat_updater
+        self.fanout = fanout
+        self.window = window
+        self.max_batch = max_batch
+        self._batch: List[Dict[str, Any]] = []
+        self._waiters: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._commits: Set[asyncio.Task] = set()
+        self._fanout_queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'messages': 0, 'batches': 0, 'largest_batch': 0, 'failed': 0, 'errors': 0, 'fanout_errors': 0}
+
+    # ==========================================
+    # INGEST
+    # ==========================================
+
+    async def submit(self, message: Dict[str, Any]):
+        """Returns once the message is written; raises if its write failed"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append(message)
+        self._waiters.append(future)
+        if len(self._batch) >= self.max_batch:
+            self._close_batch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._close_batch)
+        await future
+
+    def _close_batch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        waiters, self._waiters = self._waiters, []
+        task = asyncio.get_running_loop().create_task(self._commit(batch, waiters))
+        self._commits.add(task)
+        task.add_done_callback(self._commits.discard)
+
+    # ==========================================
+    # COMMIT
+    # ==========================================
+
+    async def _commit(self, batch: List[Dict[str, Any]], waiters: List[asyncio.Future]):
+        self.stats['batches'] += 1
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+        try:
+            failed = await self.writer(batch)
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.stats['failed'] += len(batch)
+            logger.error(f"Message batch write failed ({len(batch)} messages): {e}")
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        committed = [message for index, message in enumerate(batch) if index not in failed]
+        self.stats['messages'] += len(committed)
+        self.stats['failed'] += len(failed)
+        for index, future in enumerate(waiters):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(RuntimeError("Message write failed"))
+            else:
+                future.set_result(None)
+        if not committed:
+            return
+
+        if self._task is None:
+            # Not started (no background stage): fan out here, after the submitters are released
+            await self._fan_out(committed)
+        else:
+            self._fanout_queue.put_nowait(committed)
+
+        # Neither the response nor the broadcast needs the denormalized chat fields, so they go last
+        latest: Dict[str, Dict[str, Any]] = {}
+        for message in committed:
+            current = latest.get(message["chat_id"])
+            if current is None or message["timestamp"] >= current["timestamp"]:
+                latest[message["chat_id"]] = message
+        try:
+            await self.chat_updater(latest)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Chat metadata update failed for {len(latest)} chats: {e}")
+
+    # ==========================================
+    # FAN-OUT
+    # ==========================================
+
+    async def _run(self):
+        while True:
+            batch = await self._fanout_queue.get()
+            if batch is None:
+                return
+            await self._fan_out(batch)
+
+    async def _fan_out(self, batch: List[Dict[str, Any]]):
+        try:
+            await self.fanout(batch)
+        except Exception as e:
+            self.stats['fanout_errors'] += 1
+            logger.error(f"Message fan-out failed ({len(batch)} messages): {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Commit the open batch, wait for in-flight commits and fan out what they wrote"""
+        self._close_batch()
+        if self._commits:
+            await asyncio.gather(*self._commits, return_exceptions=True)
+        if self._task is not None:
+            # Queued after every committed batch, so the loop drains them first
+            self._fanout_queue.put_nowait(None)
+            await self._task
+            self._task = None
+        while not self._fanout_queue.empty():
+            batch = self._fanout_queue.get_nowait()
+            if batch is not None:
+                await self._fan_out(batch)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'open_batch': len(self._batch),
+            'committing': len(self._commits),
+            'fanout_backlog': self._fanout_queue.qsize(),
+            **self.stats
+        }
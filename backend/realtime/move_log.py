@@ -0,0 +1,222 @@
+"""
+Pulse Backend - Game Move Log Encoding
+Compact binary records for the append-only per-room move log
+"""
+
+import logging
+import struct
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Move types and dict keys that get a one-byte code instead of a string
+MOVE_TYPES = ("cell_click", "letter_guess", "roll_dice", "move_piece", "vote", "night_action")
+KNOWN_KEYS = (
+    "position", "letter", "dice_value", "piece", "piece_id", "target", "target_id",
+    "action", "player_id", "steps", "status", "board", "players", "winner", "current_player"
+)
+_MOVE_TYPE_CODES = {name: code for code, name in enumerate(MOVE_TYPES, start=1)}
+_KEY_CODES = {name: code for code, name in enumerate(KNOWN_KEYS, start=1)}
+
+CUSTOM_TYPE = 0x00
+UNTYPED_MOVE = 0xFE  # move dict has no "type" key
+RESET_RECORD = 0xFF  # whole state replaced (e.g. game started over HTTP)
+
+# Value tags
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _UUID = range(9)
+
+
+# ==========================================
+# PRIMITIVES
+# ==========================================
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_str(out: bytearray, value: str):
+    raw = value.encode("utf-8")
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def _as_uuid(value: str) -> Optional[uuid.UUID]:
+    if len(value) != 36:
+        return None
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        return None
+    return parsed if str(parsed) == value else None
+
+
+def encode_value(out: bytearray, value: Any):
+    """Append a JSON-like value; UUID strings take 17 bytes instead of 37"""
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(out, value << 1 if value >= 0 else ((-value) << 1) - 1)  # zigzag
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += struct.pack("<d", value)
+    elif isinstance(value, str):
+        parsed = _as_uuid(value)
+        if parsed is not None:
+            out.append(_UUID)
+            out += parsed.bytes
+        else:
+            out.append(_STR)
+            _write_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            code = _KEY_CODES.get(key)
+            if code is not None:
+                _write_varint(out, code)
+            else:
+                _write_varint(out, 0)
+                _write_str(out, str(key))
+            encode_value(out, item)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} in a move record")
+
+
+def decode_value(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        raw, pos = _read_varint(data, pos)
+        return (raw >> 1 if not raw & 1 else -((raw + 1) >> 1)), pos
+    if tag == _FLOAT:
+        return struct.unpack_from("<d", data, pos)[0], pos + 8
+    if tag == _STR:
+        return _read_str(data, pos)
+    if tag == _UUID:
+        return str(uuid.UUID(bytes=bytes(data[pos:pos + 16]))), pos + 16
+    if tag == _LIST:
+        length, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(length):
+            item, pos = decode_value(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == _DICT:
+        length, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(length):
+            code, pos = _read_varint(data, pos)
+            if code:
+                key = KNOWN_KEYS[code - 1]
+            else:
+                key, pos = _read_str(data, pos)
+            result[key], pos = decode_value(data, pos)
+        return result, pos
+    raise ValueError(f"Unknown value tag {tag} in move record")
+
+
+# ==========================================
+# RECORDS
+# ==========================================
+
+def _frame(body: bytearray) -> bytes:
+    out = bytearray()
+    _write_varint(out, len(body))
+    return bytes(out + body)
+
+
+def encode_move(seq: int, timestamp_ms: int, player_id: Optional[str], move: Dict[str, Any]) -> bytes:
+    """
+    One length-prefixed move record
+
+    Layout: seq, timestamp (ms), type code (+ name if custom), player,
+    remaining move fields. Records can be concatenated into one blob.
+    """
+    body = bytearray()
+    _write_varint(body, seq)
+    _write_varint(body, timestamp_ms)
+    move_type = move.get("type")
+    code = _MOVE_TYPE_CODES.get(move_type)
+    if "type" not in move:
+        body.append(UNTYPED_MOVE)
+    elif code is not None:
+        body.append(code)
+    else:
+        body.append(CUSTOM_TYPE)
+        encode_value(body, move_type)
+    encode_value(body, player_id)
+    encode_value(body, {key: value for key, value in move.items() if key != "type"})
+    return _frame(body)
+
+
+def encode_reset(seq: int, timestamp_ms: int, state: Dict[str, Any]) -> bytes:
+    body = bytearray()
+    _write_varint(body, seq)
+    _write_varint(body, timestamp_ms)
+    body.append(RESET_RECORD)
+    encode_value(body, state)
+    return _frame(body)
+
+
+def decode_records(data: bytes) -> List[Dict[str, Any]]:
+    """Split a blob of concatenated records back into dicts"""
+    records = []
+    pos = 0
+    while pos < len(data):
+        length, pos = _read_varint(data, pos)
+        end = pos + length
+        seq, cursor = _read_varint(data, pos)
+        timestamp_ms, cursor = _read_varint(data, cursor)
+        code = data[cursor]
+        cursor += 1
+        if code == RESET_RECORD:
+            state, cursor = decode_value(data, cursor)
+            records.append({"seq": seq, "ts": timestamp_ms, "reset": state})
+        else:
+            move = {}
+            if code == CUSTOM_TYPE:
+                move["type"], cursor = decode_value(data, cursor)
+            elif code != UNTYPED_MOVE:
+                move["type"] = MOVE_TYPES[code - 1]
+            player_id, cursor = decode_value(data, cursor)
+            fields, cursor = decode_value(data, cursor)
+            move.update(fields)
+            records.append({"seq": seq, "ts": timestamp_ms, "player_id": player_id, "move": move})
+        pos = end
+    return records
@@ -0,0 +1,213 @@
+"""
+Pulse Backend - Realtime Outbound Queues
+Bounded per-socket send queues drained by a dedicated writer task
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from .wire_protocol import JSON_CODEC
+
+logger = logging.getLogger(__name__)
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class QueuePolicy:
+    """
+    Backpressure policy for one outbound queue
+
+    Args:
+        max_size: Frames buffered before the queue counts as overflowing
+        droppable_types: Frame types that may be discarded (oldest first) to make room
+        coalesce_types: Frame types where a newer frame with the same coalesce key
+            replaces the pending one instead of queueing behind it; only for
+            frames that carry the full current state of their key
+        max_overflows: Overflows tolerated before the consumer is evicted; the
+            count restarts whenever the queue drains, so only a consumer that
+            stays behind is evicted
+    """
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        droppable_types: Iterable[str] = ("typing_status",),
+        coalesce_types: Iterable[str] = ("typing_status", "message_reaction"),
+        max_overflows: int = 32
+    ):
+        self.max_size = max_size
+        self.droppable_types = frozenset(droppable_types)
+        self.coalesce_types = frozenset(coalesce_types)
+        self.max_overflows = max_overflows
+
+
+class OutboundQueue:
+    """
+    Non-blocking send queue for a single WebSocket
+
+    `enqueue` never awaits the network: producers (HTTP handlers, other
+    sockets) return immediately while the writer task drains frames in order.
+    The writer encodes each frame for the socket's negotiated `codec`
+    (JSON by default), so producers hand over JSON text or a shared Frame.
+    """
+
+    def __init__(
+        self,
+        websocket: Any,
+        policy: Optional[QueuePolicy] = None,
+        send_timeout: float = 5.0,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        on_evict: Optional[Callable[[str], Awaitable[None]]] = None,
+        codec: Optional[Any] = None
+    ):
+        self.websocket = websocket
+        self.codec = codec or JSON_CODEC
+        self.policy = policy or QueuePolicy()
+        self.send_timeout = send_timeout
+        self.semaphore = semaphore
+        self.on_evict = on_evict
+
+        self._frames: deque = deque()  # [frame_type, coalesce_key, message]
+        self._pending_by_key: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+        self._overflow_streak = 0  # overflows since the queue was last empty
+        self.closed = False
+
+        self.stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'overflows': 0,
+        }
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    # ==========================================
+    # PRODUCER SIDE
+    # ==========================================
+
+    def enqueue(self, message: Any, frame_type: Optional[str] = None, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a frame without blocking; returns False if it was rejected"""
+        if self.closed:
+            return False
+
+        # Replace a still-pending frame for the same key (e.g. presence of one user)
+        if coalesce_key and frame_type in self.policy.coalesce_types:
+            pending = self._pending_by_key.get(coalesce_key)
+            if pending is not None:
+                pending[2] = message
+                self.stats['coalesced'] += 1
+                return True
+
+        if len(self._frames) >= self.policy.max_size and not self._make_room():
+            self.stats['overflows'] += 1
+            self.stats['dropped'] += 1
+            self._overflow_streak += 1
+            if self._overflow_streak >= self.policy.max_overflows:
+                self._evict("slow consumer")
+            return False
+
+        entry = [frame_type, coalesce_key, message]
+        self._frames.append(entry)
+        if coalesce_key and frame_type in self.policy.coalesce_types:
+            self._pending_by_key[coalesce_key] = entry
+
+        self.stats['enqueued'] += 1
+        self._idle.clear()
+        self._wakeup.set()
+        self._ensure_writer()
+        return True
+
+    def _make_room(self) -> bool:
+        """Drop the oldest droppable frame, if any"""
+        for entry in self._frames:
+            if entry[0] in self.policy.droppable_types:
+                self._frames.remove(entry)
+                self._forget(entry)
+                self.stats['dropped'] += 1
+                return True
+        return False
+
+    def _forget(self, entry: list):
+        if entry[1] and self._pending_by_key.get(entry[1]) is entry:
+            del self._pending_by_key[entry[1]]
+
+    # ==========================================
+    # WRITER SIDE
+    # ==========================================
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        while not self.closed:
+            if not self._frames:
+                # Caught up: earlier overflows were a burst, not a slow consumer
+                self._overflow_streak = 0
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            entry = self._frames.popleft()
+            self._forget(entry)
+            try:
+                if self.semaphore is not None:
+                    async with self.semaphore:
+                        await self._send(entry[2])
+                else:
+                    await self._send(entry[2])
+                self.stats['sent'] += 1
+            except asyncio.TimeoutError:
+                self._evict("send timeout")
+                return
+            except Exception as e:
+                self._evict(f"send error: {e}")
+                return
+
+    async def _send(self, message: Any):
+        message = self.codec.encode(message)
+        if isinstance(message, (bytes, bytearray)):
+            await asyncio.wait_for(self.websocket.send_bytes(message), timeout=self.send_timeout)
+        else:
+            await asyncio.wait_for(self.websocket.send_text(message), timeout=self.send_timeout)
+
+    def _evict(self, reason: str):
+        if self.closed:
+            return
+        logger.warning(f"Evicting WebSocket consumer: {reason}")
+        self.close()
+        if self.on_evict is not None:
+            asyncio.get_running_loop().create_task(self.on_evict(reason))
+
+    async def join(self, timeout: Optional[float] = None):
+        """Wait until every queued frame has been written"""
+        await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+
+    def close(self):
+        """Stop the writer and discard pending frames"""
+        self.closed = True
+        self._frames.clear()
+        self._pending_by_key.clear()
+        self._idle.set()
+        self._wakeup.set()
+        writer = self._writer
+        if writer is not None and not writer.done() and writer is not _current_task():
+            writer.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'depth': self.depth, **self.stats}
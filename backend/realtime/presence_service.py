@@ -0,0 +1,190 @@
+"""
+Pulse Backend - Presence Service
+Reverse subscription index (who watches whom) with batched presence diffs
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+WatcherLoader = Callable[[List[str]], Awaitable[Dict[str, Iterable[str]]]]
+DiffDelivery = Callable[[Dict[str, Dict[str, Dict[str, Any]]]], Awaitable[None]]
+
+
+class PresenceService:
+    """
+    In-memory presence with periodic per-subscriber diffs
+
+    Status changes are only recorded when they happen. Every `interval`
+    seconds the changes are grouped by subscriber, so a subscriber gets one
+    frame listing everyone who changed, however many contacts changed at once,
+    and the whole flush goes to `deliver` as {subscriber: changes} in one call.
+
+    Watcher lists of the users that changed are loaded together with one
+    `watcher_loader(user_ids)` call (uncapped) and then kept current through
+    add_watch/remove_watch; `watcher_ttl` bounds staleness for writers that do
+    not go through the service, and expired lists are evicted. If the load
+    fails, the changes wait for the next flush.
+    """
+
+    def __init__(
+        self,
+        watcher_loader: WatcherLoader,
+        deliver: DiffDelivery,
+        interval: float = 1.0,
+        watcher_ttl: float = 600
+    ):
+        self.watcher_loader = watcher_loader
+        self.deliver = deliver
+        self.interval = interval
+        self.watcher_ttl = watcher_ttl
+        self.statuses: Dict[str, Dict[str, Any]] = {}  # user_id -> {status, activity, game}
+        self._watchers: Dict[str, Set[str]] = {}  # target user_id -> {subscriber user_ids}
+        self._watchers_expire: Dict[str, float] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}  # user_id -> latest status not yet sent
+        self._next_eviction = time.monotonic() + watcher_ttl
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'changes': 0, 'flushes': 0, 'frames': 0, 'watcher_loads': 0, 'watcher_load_errors': 0,
+            'evicted_watchers': 0, 'delivery_errors': 0
+        }
+
+    # ==========================================
+    # STATUS CHANGES
+    # ==========================================
+
+    def update(self, user_id: str, status: Dict[str, Any]):
+        """Record a status change; subscribers learn about it on the next flush"""
+        self.statuses[user_id] = status
+        self._pending[user_id] = status
+        self.stats['changes'] += 1
+
+    def set_offline(self, user_id: str):
+        self.statuses.pop(user_id, None)
+        self._pending[user_id] = {"status": "offline"}
+        self.stats['changes'] += 1
+
+    # ==========================================
+    # SUBSCRIPTION INDEX
+    # ==========================================
+
+    async def watchers_of(self, user_ids: Iterable[str]) -> Dict[str, Set[str]]:
+        """Watcher sets of many users, loading the missing or expired ones in one call"""
+        now = time.monotonic()
+        user_ids = list(user_ids)
+        stale = [user_id for user_id in user_ids if self._watchers_expire.get(user_id, 0) <= now]
+        if stale:
+            self.stats['watcher_loads'] += 1
+            loaded = await self.watcher_loader(stale)
+            expires = time.monotonic() + self.watcher_ttl
+            for user_id in stale:
+                self._watchers[user_id] = set(loaded.get(user_id, ()))
+                self._watchers_expire[user_id] = expires
+        return {user_id: self._watchers[user_id] for user_id in user_ids}
+
+    def evict_expired(self) -> int:
+        """Drop watcher lists past their TTL; users who stay quiet stop costing memory"""
+        now = time.monotonic()
+        expired = [user_id for user_id, expires in self._watchers_expire.items() if expires <= now]
+        for user_id in expired:
+            self.forget_watchers(user_id)
+        self.stats['evicted_watchers'] += len(expired)
+        return len(expired)
+
+    def add_watch(self, subscriber_id: str, target_id: str):
+        """subscriber_id now sees target_id's presence (e.g. contact added)"""
+        watchers = self._watchers.get(target_id)
+        if watchers is not None:
+            watchers.add(subscriber_id)
+
+    def remove_watch(self, subscriber_id: str, target_id: str):
+        watchers = self._watchers.get(target_id)
+        if watchers is not None:
+            watchers.discard(subscriber_id)
+
+    def forget_watchers(self, target_id: str):
+        """Drop the cached watcher list so the next change reloads it"""
+        self._watchers.pop(target_id, None)
+        self._watchers_expire.pop(target_id, None)
+
+    # ==========================================
+    # QUERIES
+    # ==========================================
+
+    def snapshot(self, user_ids: Iterable[str], is_online: Callable[[str], bool]) -> Dict[str, Dict[str, Any]]:
+        """Presence of many users at once, answered from memory"""
+        result = {}
+        for user_id in user_ids:
+            online = is_online(user_id)
+            status = self.statuses.get(user_id) if online else None
+            result[user_id] = {"is_online": online, **(status or {"status": "online" if online else "offline"})}
+        return result
+
+    # ==========================================
+    # BATCHED DIFFS
+    # ==========================================
+
+    async def flush_pending(self):
+        """Send one diff frame per subscriber covering all pending changes"""
+        if time.monotonic() >= self._next_eviction:
+            self._next_eviction = time.monotonic() + self.watcher_ttl
+            self.evict_expired()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.stats['flushes'] += 1
+
+        try:
+            watcher_sets = await self.watchers_of(pending)
+        except Exception as e:
+            self.stats['watcher_load_errors'] += 1
+            logger.error(f"Presence watcher load failed for {len(pending)} users: {e}")
+            # Retry with the next flush; a change recorded meanwhile is newer and wins
+            for user_id, status in pending.items():
+                self._pending.setdefault(user_id, status)
+            return
+
+        diffs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for user_id, status in pending.items():
+            for subscriber_id in watcher_sets[user_id]:
+                diffs.setdefault(subscriber_id, {})[user_id] = status
+
+        if diffs:
+            try:
+                await self.deliver(diffs)
+                self.stats['frames'] += len(diffs)
+            except Exception as e:
+                self.stats['delivery_errors'] += 1
+                logger.error(f"Presence diff delivery error for {len(diffs)} subscribers: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_pending()
+            except Exception as e:
+                logger.error(f"Presence flush error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'tracked_statuses': len(self.statuses),
+            'indexed_targets': len(self._watchers),
+            'pending': len(self._pending),
+            **self.stats
+        }
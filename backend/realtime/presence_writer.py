@@ -0,0 +1,87 @@
+"""
+Pulse Backend - Presence Write-Behind
+Coalesces is_online/last_seen writes per user and flushes them in bulk
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceWriter:
+    """
+    Write-behind buffer for user presence fields
+
+    `mark` only records the latest state per user; every `interval` seconds
+    the buffer is written with unordered `bulk_write` batches. A user who
+    connects and disconnects ten times between flushes costs one write.
+    Live online state should be read from the connection registry; the
+    stored fields are for last_seen and for readers outside this process.
+    """
+
+    def __init__(self, collection: Any, interval: float = 2.0, batch_size: int = 1000):
+        self.collection = collection
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Dict[str, Tuple[bool, datetime]] = {}  # user_id -> (is_online, last_seen)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'marks': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'errors': 0}
+
+    def mark(self, user_id: str, is_online: bool, at: Optional[datetime] = None):
+        """Record a presence change to be persisted on the next flush"""
+        self.stats['marks'] += 1
+        if user_id in self._pending:
+            self.stats['coalesced'] += 1
+        self._pending[user_id] = (is_online, at or datetime.utcnow())
+
+    async def flush_pending(self):
+        """Write everything buffered so far"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self.stats['flushes'] += 1
+
+        items = list(pending.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            operations = [
+                UpdateOne({"user_id": user_id}, {"$set": {"is_online": is_online, "last_seen": last_seen}})
+                for user_id, (is_online, last_seen) in batch
+            ]
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                self.stats['written'] += len(operations)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Presence bulk write failed ({len(operations)} users): {e}")
+                # Retry next flush unless a newer state was recorded meanwhile
+                for user_id, state in batch:
+                    self._pending.setdefault(user_id, state)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'pending': len(self._pending), **self.stats}
@@ -0,0 +1,93 @@
+"""
+Pulse Backend - Reaction Aggregator
+Coalesces reaction bursts on a message into one broadcast per window
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ReactionPublisher = Callable[[str, str, Dict[str, Any], List[Dict[str, Any]]], Awaitable[None]]
+
+
+class _PendingReactions:
+    __slots__ = ("chat_id", "version", "state", "changes")
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.version = -1
+        self.state: Dict[str, Any] = {}
+        self.changes: List[Dict[str, Any]] = []
+
+
+class ReactionAggregator:
+    """
+    One reaction broadcast per message per window
+
+    Each toggle records the message's reaction state after it was applied,
+    tagged with the message's `reaction_version`. Requests can finish out of
+    order, so the highest version seen in a window is the one published.
+    Every `window` seconds `publisher(chat_id, message_id, state, changes)`
+    runs once per message that changed, with the newest `max_changes`
+    individual toggles for clients that animate them. A storm of N
+    reactions on a message in a group of M members costs about M frames
+    per window instead of N * M.
+    """
+
+    def __init__(self, publisher: ReactionPublisher, window: float = 0.25, max_changes: int = 20):
+        self.publisher = publisher
+        self.window = window
+        self.max_changes = max_changes
+        self._pending: Dict[str, _PendingReactions] = {}  # message_id -> state to publish
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'reactions': 0, 'coalesced': 0, 'broadcasts': 0, 'errors': 0}
+
+    def record(self, chat_id: str, message_id: str, version: int, state: Dict[str, Any], change: Dict[str, Any]):
+        pending = self._pending.get(message_id)
+        if pending is None:
+            pending = self._pending[message_id] = _PendingReactions(chat_id)
+        else:
+            self.stats['coalesced'] += 1
+        if version > pending.version:
+            pending.version = version
+            pending.state = state
+        pending.changes.append(change)
+        if len(pending.changes) > self.max_changes:
+            del pending.changes[0]
+        self.stats['reactions'] += 1
+
+    async def flush_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        for message_id, reactions in pending.items():
+            try:
+                await self.publisher(reactions.chat_id, message_id, reactions.state, reactions.changes)
+                self.stats['broadcasts'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Reaction broadcast failed for message {message_id}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'pending_messages': len(self._pending), **self.stats}
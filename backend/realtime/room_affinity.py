@@ -0,0 +1,521 @@
+"""
+Pulse Backend - Game Room Affinity
+Consistent-hash room ownership across workers with socket proxying over the fan-out bus
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .outbound_queue import OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+FrameHandler = Callable[[str, Any, Dict[str, Any]], Awaitable[None]]
+IdleResetHandler = Callable[[str], Awaitable[None]]
+
+CLOSE_ROOM_MOVED = 1012  # "service restart": the client reconnects and is routed to the new owner
+
+
+# ==========================================
+# HASH RING
+# ==========================================
+
+class HashRing:
+    """
+    Consistent hashing with virtual nodes
+
+    Adding or removing a worker only moves the keys that hashed to that
+    worker's points, about 1/N of all rooms.
+    """
+
+    def __init__(self, vnodes: int = 64):
+        self.vnodes = vnodes
+        self.nodes: Set[str] = set()
+        self._points: List[int] = []  # sorted
+        self._owners: Dict[int, str] = {}  # point -> node
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def add(self, node: str) -> bool:
+        if node in self.nodes:
+            return False
+        self.nodes.add(node)
+        for replica in range(self.vnodes):
+            point = self._hash(f"{node}#{replica}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+        return True
+
+    def remove(self, node: str) -> bool:
+        if node not in self.nodes:
+            return False
+        self.nodes.discard(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+        return True
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect_right(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+    def copy(self) -> 'HashRing':
+        ring = HashRing(self.vnodes)
+        ring.nodes = set(self.nodes)
+        ring._points = list(self._points)
+        ring._owners = dict(self._owners)
+        return ring
+
+
+# ==========================================
+# REMOTE SOCKETS
+# ==========================================
+
+class RemoteGameSocket:
+    """
+    Owner-side stand-in for a socket accepted by another worker
+
+    The room engine treats it like any WebSocket; frames it sends are
+    published to the proxying worker. Envelopes from that worker are applied
+    in order by a dedicated task so a slow room load never stalls the bus.
+    """
+
+    def __init__(self, router: 'GameRoomRouter', room_id: str, worker_id: str, conn_id: str):
+        self.router = router
+        self.room_id = room_id
+        self.worker_id = worker_id
+        self.conn_id = conn_id
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def send_text(self, message: str):
+        await self.router._publish({
+            "type": "game_deliver", "target": self.worker_id, "conn_id": self.conn_id, "message": message
+        })
+
+    async def close(self, code: int = 1000):
+        await self.router._publish({"type": "game_close", "target": self.worker_id, "conn_id": self.conn_id, "code": code})
+
+    async def _run(self):
+        engine = self.router.engine
+        try:
+            await engine.attach(self.room_id, self)
+            while True:
+                data = await self.inbox.get()
+                if data is None:
+                    break
+                try:
+                    await self.router.frame_handler(self.room_id, self, data)
+                except Exception as e:
+                    self.router.stats['errors'] += 1
+                    logger.error(f"Forwarded game frame error in room {self.room_id}: {e}")
+        finally:
+            await engine.detach(self.room_id, self)
+
+
+# ==========================================
+# ROUTER
+# ==========================================
+
+class GameRoomRouter:
+    """
+    Routes game sockets to the worker that owns their room
+
+    Each room is owned by exactly one worker, chosen by hashing the room id
+    onto a ring of live workers, so a room has a single actor no matter where
+    its players connect. A socket accepted elsewhere is proxied: its frames
+    are forwarded to the owner over the fan-out bus and the owner's frames
+    come back the same way. Workers announce themselves periodically; when
+    the ring changes, rooms that moved are closed with 1012 so clients
+    reconnect and land on the new owner.
+
+    Hand-off is fenced: the old owner applies the room's queued moves and
+    writes its log and snapshot before closing the sockets, and the new
+    owner asks for that release and waits for it (up to `worker_ttl`)
+    before loading the room, so two actors never write the same room. A
+    worker that just started waits `sync_wait` seconds for the other
+    workers to answer its hello before it claims any room.
+
+    `catch_up` is answered by the owner as well, since only its actor has
+    the moves not yet flushed to the log.
+
+    Without a bus the ring holds only this worker and every room is local.
+    """
+
+    def __init__(
+        self,
+        engine: Any,
+        frame_handler: FrameHandler,
+        on_idle_reset: Optional[IdleResetHandler] = None,
+        announce_interval: float = 2.0,
+        worker_ttl: float = 6.0,
+        sync_wait: float = 1.0,
+        vnodes: int = 64
+    ):
+        self.engine = engine
+        self.frame_handler = frame_handler
+        self.on_idle_reset = on_idle_reset
+        self.announce_interval = announce_interval
+        self.worker_ttl = worker_ttl
+        self.sync_wait = sync_wait
+        self.ring = HashRing(vnodes)
+        self._previous_ring: Optional[HashRing] = None  # before the last membership change
+        self._changed_at = 0.0
+        self._synced = asyncio.Event()
+        self._handoffs: Dict[str, asyncio.Future] = {}  # room_id -> release from the previous owner
+        self._catch_ups: Dict[str, asyncio.Future] = {}  # request id -> owner's answer
+        self.bus = None
+        self.worker_id = "local"
+        self.workers: Dict[str, float] = {}  # worker_id -> last announcement (monotonic)
+        self.proxies: Dict[str, Tuple[str, Any, str, OutboundQueue]] = {}  # conn_id -> (room, ws, owner, queue)
+        self.remote: Dict[str, RemoteGameSocket] = {}  # conn_id -> stand-in, on the owning worker
+        self._task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self.stats = {
+            'local_attaches': 0, 'proxied_attaches': 0, 'forwarded_frames': 0, 'remote_frames': 0,
+            'rebalanced_rooms': 0, 'handoffs': 0, 'handoff_timeouts': 0, 'remote_catch_ups': 0,
+            'catch_up_timeouts': 0, 'errors': 0
+        }
+
+    # ==========================================
+    # MEMBERSHIP
+    # ==========================================
+
+    async def start(self, bus: Any = None):
+        """Join the ring; pass the started fan-out bus, or None for single-worker"""
+        self.bus = bus
+        if bus is not None:
+            self.worker_id = bus.worker_id
+        self.ring.add(self.worker_id)
+        if bus is None:
+            self._synced.set()
+            return
+        await self._announce(hello=True)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        asyncio.get_running_loop().call_later(self.sync_wait, self._finish_sync)
+
+    def _finish_sync(self):
+        """Live workers have answered the hello: rooms they held are handed off, not claimed"""
+        self._previous_ring = self.ring.copy()
+        self._previous_ring.remove(self.worker_id)
+        self._changed_at = time.monotonic()
+        self._synced.set()
+
+    async def stop(self):
+        """Leave the ring so other workers take over this worker's rooms at once"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # Persist every room before the others are told to take them over
+            await asyncio.gather(*(self._release(room_id) for room_id in list(self.engine.rooms)))
+            await self._publish({"type": "game_worker", "leaving": True})
+        for remote in list(self.remote.values()):
+            remote.inbox.put_nowait(None)
+
+    def owner(self, room_id: str) -> str:
+        return self.ring.owner(room_id) or self.worker_id
+
+    def is_local(self, room_id: str) -> bool:
+        return self.owner(room_id) == self.worker_id
+
+    async def _announce(self, hello: bool = False):
+        await self._publish({"type": "game_worker", "hello": hello})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.announce_interval)
+            try:
+                await self._announce()
+                await self._expire_workers()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Game router membership error: {e}")
+
+    def _spawn(self, coro: Awaitable[None]):
+        """Run slow envelope work off the bus listener"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _ring_changing(self):
+        if self._synced.is_set():
+            self._previous_ring = self.ring.copy()
+            self._changed_at = time.monotonic()
+
+    async def _worker_seen(self, worker_id: str, hello: bool):
+        is_new = worker_id not in self.workers
+        self.workers[worker_id] = time.monotonic()
+        if hello:
+            # A worker just started: tell it about us right away
+            await self._announce()
+        if is_new and worker_id not in self.ring.nodes:
+            self._ring_changing()
+            self.ring.add(worker_id)
+            logger.info(f"Game worker {worker_id} joined the ring")
+            await self._rebalance()
+
+    async def _expire_workers(self, leaving: Optional[str] = None):
+        cutoff = time.monotonic() - self.worker_ttl
+        gone = [worker_id for worker_id, seen in self.workers.items() if seen < cutoff or worker_id == leaving]
+        if gone:
+            self._ring_changing()
+        for worker_id in gone:
+            del self.workers[worker_id]
+            self.ring.remove(worker_id)
+            logger.warning(f"Game worker {worker_id} left the ring")
+            for conn_id, (_, _, owner, _) in list(self.proxies.items()):
+                if owner == worker_id:
+                    self._spawn(self._close_proxy(conn_id, CLOSE_ROOM_MOVED))
+            for conn_id, remote in list(self.remote.items()):
+                if remote.worker_id == worker_id:
+                    self.remote.pop(conn_id, None)
+                    remote.inbox.put_nowait(None)
+        if gone:
+            await self._rebalance()
+
+    async def _rebalance(self):
+        """Release rooms this worker no longer owns; their clients reconnect to the new owner"""
+        for room_id in list(self.engine.rooms):
+            if not self.is_local(room_id):
+                self.stats['rebalanced_rooms'] += 1
+                self._spawn(self._release(room_id))
+
+    async def _release(self, room_id: str):
+        """Persist a room and stop its actor, then send its sockets to the new owner"""
+        room = await self.engine.release(room_id)
+        if room is None:
+            return
+
+        async def close(websocket: Any, queue: OutboundQueue):
+            await queue.join(timeout=self.engine.send_timeout)
+            queue.close()
+            try:
+                await websocket.close(code=CLOSE_ROOM_MOVED)
+            except Exception:
+                pass
+
+        await asyncio.gather(*(close(websocket, queue) for websocket, queue in list(room.sockets.items())))
+
+    async def _answer_handoff(self, room_id: str, worker_id: str):
+        await self._release(room_id)
+        await self._publish({"type": "game_released", "target": worker_id, "room_id": room_id})
+
+    async def _await_handoff(self, room_id: str):
+        """Before loading a room that just moved here, wait for its previous owner to let go"""
+        if room_id in self.engine.rooms or self._previous_ring is None:
+            return
+        if time.monotonic() - self._changed_at > self.worker_ttl:
+            return
+        previous = self._previous_ring.owner(room_id)
+        if previous is None or previous == self.worker_id or previous not in self.ring.nodes:
+            return  # ours before, or its owner is gone and has nothing left to write
+        released = self._handoffs.get(room_id)
+        if released is None:
+            released = self._handoffs[room_id] = asyncio.get_running_loop().create_future()
+            self.stats['handoffs'] += 1
+            await self._publish({"type": "game_handoff", "target": previous, "room_id": room_id})
+        try:
+            await asyncio.wait_for(asyncio.shield(released), timeout=self.worker_ttl)
+        except asyncio.TimeoutError:
+            self.stats['handoff_timeouts'] += 1
+            logger.warning(f"Game worker {previous} did not release room {room_id}; taking it over")
+        finally:
+            if self._handoffs.get(room_id) is released:
+                del self._handoffs[room_id]
+
+    # ==========================================
+    # SOCKETS
+    # ==========================================
+
+    async def attach(self, room_id: str, websocket: Any) -> Optional[str]:
+        """Route a newly accepted socket; returns a proxy id when another worker owns the room"""
+        await self._synced.wait()
+        owner = self.owner(room_id)
+        if owner == self.worker_id:
+            self.stats['local_attaches'] += 1
+            await self._await_handoff(room_id)
+            await self.engine.attach(room_id, websocket)
+            return None
+
+        async def on_evict(reason: str):
+            logger.warning(f"Evicted proxied game socket in room {room_id}: {reason}")
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+
+        conn_id = str(uuid.uuid4())
+        queue = OutboundQueue(
+            websocket,
+            policy=self.engine.queue_policy,
+            send_timeout=self.engine.send_timeout,
+            on_evict=on_evict
+        )
+        self.proxies[conn_id] = (room_id, websocket, owner, queue)
+        self.stats['proxied_attaches'] += 1
+        await self._publish({"type": "game_attach", "target": owner, "conn_id": conn_id, "room_id": room_id})
+        return conn_id
+
+    async def handle_frame(self, room_id: str, websocket: Any, conn_id: Optional[str], data: Dict[str, Any]):
+        """Apply a client frame locally or forward it to the owning worker"""
+        if conn_id is None:
+            await self.frame_handler(room_id, websocket, data)
+            return
+        entry = self.proxies.get(conn_id)
+        if entry is None:
+            return
+        self.stats['forwarded_frames'] += 1
+        await self._publish({"type": "game_frame", "target": entry[2], "conn_id": conn_id, "data": data})
+
+    def send(self, room_id: str, websocket: Any, conn_id: Optional[str], message: str, frame_type: str) -> bool:
+        """Queue a frame for a socket accepted on this worker, local or proxied"""
+        if conn_id is None:
+            return self.engine.send_to_socket(room_id, websocket, message, frame_type)
+        entry = self.proxies.get(conn_id)
+        return entry is not None and entry[3].enqueue(message, frame_type=frame_type)
+
+    async def detach(self, room_id: str, websocket: Any, conn_id: Optional[str]):
+        if conn_id is None:
+            await self.engine.detach(room_id, websocket)
+            return
+        entry = self.proxies.pop(conn_id, None)
+        if entry is not None:
+            entry[3].close()
+            await self._publish({"type": "game_detach", "target": entry[2], "conn_id": conn_id})
+
+    async def _close_proxy(self, conn_id: str, code: int):
+        entry = self.proxies.get(conn_id)
+        if entry is None:
+            return
+        await entry[3].join(timeout=self.engine.send_timeout)
+        try:
+            await entry[1].close(code=code)
+        except Exception:
+            pass
+
+    async def catch_up(self, room_id: str, since: int) -> Optional[Dict[str, Any]]:
+        """engine.catch_up answered by the room's owner, whose buffer holds moves not yet logged"""
+        await self._synced.wait()
+        owner = self.owner(room_id)
+        if owner == self.worker_id:
+            await self._await_handoff(room_id)
+            return await self.engine.catch_up(room_id, since)
+
+        request_id = str(uuid.uuid4())
+        answer = self._catch_ups[request_id] = asyncio.get_running_loop().create_future()
+        self.stats['remote_catch_ups'] += 1
+        try:
+            await self._publish({"type": "game_catch_up", "target": owner, "request_id": request_id, "room_id": room_id, "since": since})
+            return json.loads(await asyncio.wait_for(answer, timeout=self.worker_ttl))
+        except asyncio.TimeoutError:
+            # The owner is gone or stuck; the database log is the best left
+            self.stats['catch_up_timeouts'] += 1
+            logger.warning(f"Game worker {owner} did not answer catch-up for room {room_id}; reading the log")
+            return await self.engine.catch_up(room_id, since)
+        finally:
+            self._catch_ups.pop(request_id, None)
+
+    async def _answer_catch_up(self, envelope: Dict[str, Any]):
+        try:
+            await self._await_handoff(envelope["room_id"])
+            result = await self.engine.catch_up(envelope["room_id"], envelope["since"])
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Game catch-up error for room {envelope['room_id']}: {e}")
+            return
+        await self._publish({
+            "type": "game_caught_up",
+            "target": envelope["origin"],
+            "request_id": envelope["request_id"],
+            "result": json.dumps(result, default=str)
+        })
+
+    async def set_state(self, room_id: str, state: Dict[str, Any]):
+        """Replace a room's state on whichever worker owns it"""
+        await self._synced.wait()
+        if self.is_local(room_id):
+            await self._reset_local(room_id, state)
+        else:
+            await self._publish({"type": "game_reset", "target": self.owner(room_id), "room_id": room_id, "state": state})
+
+    async def _reset_local(self, room_id: str, state: Dict[str, Any]):
+        if not self.engine.set_state(room_id, state) and self.on_idle_reset is not None:
+            await self.on_idle_reset(room_id)
+
+    # ==========================================
+    # BUS
+    # ==========================================
+
+    async def _publish(self, envelope: Dict[str, Any]):
+        if self.bus is None:
+            return
+        try:
+            await self.bus.publish(envelope)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Game router publish error: {e}")
+
+    async def handle_envelope(self, envelope: Dict[str, Any]):
+        """Apply a game_* envelope addressed to this worker"""
+        kind = envelope.get("type")
+        conn_id = envelope.get("conn_id")
+        if kind == "game_worker":
+            if envelope.get("leaving"):
+                await self._expire_workers(leaving=envelope["origin"])
+            else:
+                await self._worker_seen(envelope["origin"], envelope.get("hello", False))
+        elif kind == "game_attach":
+            self.remote[conn_id] = RemoteGameSocket(self, envelope["room_id"], envelope["origin"], conn_id)
+        elif kind == "game_frame":
+            remote = self.remote.get(conn_id)
+            if remote is not None:
+                self.stats['remote_frames'] += 1
+                remote.inbox.put_nowait(envelope["data"])
+        elif kind == "game_detach":
+            remote = self.remote.pop(conn_id, None)
+            if remote is not None:
+                remote.inbox.put_nowait(None)
+        elif kind == "game_deliver":
+            entry = self.proxies.get(conn_id)
+            if entry is not None:
+                entry[3].enqueue(envelope["message"])
+        elif kind == "game_close":
+            self._spawn(self._close_proxy(conn_id, envelope.get("code", 1000)))
+        elif kind == "game_reset":
+            self._spawn(self._reset_local(envelope["room_id"], envelope["state"]))
+        elif kind == "game_handoff":
+            self._spawn(self._answer_handoff(envelope["room_id"], envelope["origin"]))
+        elif kind == "game_catch_up":
+            self._spawn(self._answer_catch_up(envelope))
+        elif kind == "game_caught_up":
+            answer = self._catch_ups.get(envelope["request_id"])
+            if answer is not None and not answer.done():
+                answer.set_result(envelope["result"])
+        elif kind == "game_released":
+            released = self._handoffs.get(envelope["room_id"])
+            if released is not None and not released.done():
+                released.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'worker_id': self.worker_id,
+            'workers': len(self.ring.nodes),
+            'owned_rooms': len(self.engine.rooms),
+            'proxied_sockets': len(self.proxies),
+            'remote_sockets': len(self.remote),
+            **self.stats
+        }
@@ -0,0 +1,110 @@
+"""
+Pulse Backend - Room Membership Indexes
+Room -> users and user -> rooms kept side by side for O(1) disconnect cleanup
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class RoomIndex:
+    """
+    Set-based room membership with a per-user reverse index
+
+    Removing a user touches only the rooms that user is in, so disconnect
+    cost does not grow with the number of rooms tracked on the node. Empty
+    rooms are dropped.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Set[str]] = {}  # room_id -> {user_ids}
+        self.user_rooms: Dict[str, Set[str]] = {}  # user_id -> {room_ids}
+
+    def join(self, room_id: str, user_id: str) -> bool:
+        """Add a user to a room; False if they were already in it"""
+        members = self.rooms.setdefault(room_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self.user_rooms.setdefault(user_id, set()).add(room_id)
+        return True
+
+    def leave(self, room_id: str, user_id: str) -> bool:
+        """Remove a user from a room; False if they were not in it"""
+        members = self.rooms.get(room_id)
+        if members is None or user_id not in members:
+            return False
+        self._discard(room_id, user_id)
+        return True
+
+    def remove_user(self, user_id: str) -> List[str]:
+        """Take a user out of every room they are in; returns those rooms"""
+        room_ids = list(self.user_rooms.get(user_id, ()))
+        for room_id in room_ids:
+            self._discard(room_id, user_id)
+        return room_ids
+
+    def _discard(self, room_id: str, user_id: str):
+        members = self.rooms.get(room_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self.rooms[room_id]
+        user_rooms = self.user_rooms.get(user_id)
+        if user_rooms is not None:
+            user_rooms.discard(room_id)
+            if not user_rooms:
+                del self.user_rooms[user_id]
+
+    def members(self, room_id: str) -> Set[str]:
+        return self.rooms.get(room_id, set())
+
+    def count(self, room_id: str) -> int:
+        return len(self.rooms.get(room_id, ()))
+
+    def rooms_of(self, user_id: str) -> Set[str]:
+        return self.user_rooms.get(user_id, set())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'rooms': len(self.rooms), 'users': len(self.user_rooms)}
+
+
+class RoomOwnerIndex:
+    """
+    One owner per room (e.g. who is screen sharing) with a reverse index
+    """
+
+    def __init__(self):
+        self.owners: Dict[str, str] = {}  # room_id -> user_id
+        self.user_rooms: Dict[str, Set[str]] = {}  # user_id -> {room_ids}
+
+    def set(self, room_id: str, user_id: str):
+        """Make a user the owner of a room, replacing any previous owner"""
+        self.clear(room_id)
+        self.owners[room_id] = user_id
+        self.user_rooms.setdefault(user_id, set()).add(room_id)
+
+    def clear(self, room_id: str) -> Optional[str]:
+        """Remove a room's owner; returns who it was"""
+        user_id = self.owners.pop(room_id, None)
+        if user_id is not None:
+            user_rooms = self.user_rooms[user_id]
+            user_rooms.discard(room_id)
+            if not user_rooms:
+                del self.user_rooms[user_id]
+        return user_id
+
+    def remove_user(self, user_id: str) -> List[str]:
+        """Release every room a user owns; returns those rooms"""
+        room_ids = list(self.user_rooms.pop(user_id, ()))
+        for room_id in room_ids:
+            del self.owners[room_id]
+        return room_ids
+
+    def owner(self, room_id: str) -> Optional[str]:
+        return self.owners.get(room_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'rooms': len(self.owners), 'users': len(self.user_rooms)}
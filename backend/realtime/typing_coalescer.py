@@ -0,0 +1,159 @@
+"""
+Pulse Backend - Typing Indicator Coalescing
+Aggregates typing frames per chat and flushes one compact update per tick
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+TypingFlush = Callable[[str, List[str], List[Dict[str, Any]]], Awaitable[None]]
+
+
+class TypingCoalescer:
+    """
+    Per-chat typing sets flushed on a short tick
+
+    `set_typing` is a couple of dict operations and never touches the network
+    or the database. Every `tick` seconds, chats whose typing set actually
+    changed get a single `flush(chat_id, typing_users, changes)`, where
+    `changes` lists {"user_id", "is_typing"} for each user who started or
+    stopped since the last flush. Entries expire after `ttl` seconds unless
+    the client refreshes them, so a client that vanishes stops "typing" on
+    its own.
+
+    Other workers' flushed changes are fed in with `apply_remote`, so
+    `typing_users` is the chat's set across the cluster while `changes`
+    stay this worker's own. Remote entries end with the other worker's
+    stop; `remote_ttl` only bounds them if that worker dies.
+    """
+
+    def __init__(self, flush: TypingFlush, tick: float = 0.25, ttl: float = 6.0, remote_ttl: Optional[float] = None):
+        self.flush = flush
+        self.tick = tick
+        self.ttl = ttl
+        self.remote_ttl = remote_ttl if remote_ttl is not None else ttl * 10
+        self._typing: Dict[str, Dict[str, float]] = {}  # chat_id -> {user_id: expires_at}
+        self._remote: Dict[str, Dict[str, float]] = {}  # chat_id -> {user_id: expires_at}, typing on other workers
+        self._user_chats: Dict[str, Set[str]] = {}  # user_id -> {chat_ids}
+        self._last_sent: Dict[str, frozenset] = {}  # chat_id -> typing set last flushed
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'events': 0, 'flushes': 0, 'suppressed': 0, 'expired': 0}
+
+    # ==========================================
+    # INPUT
+    # ==========================================
+
+    def set_typing(self, chat_id: str, user_id: str, is_typing: bool):
+        """Record one typing frame from a client"""
+        self.stats['events'] += 1
+        if is_typing:
+            self._typing.setdefault(chat_id, {})[user_id] = time.monotonic() + self.ttl
+            self._user_chats.setdefault(user_id, set()).add(chat_id)
+        else:
+            self._discard(chat_id, user_id)
+        self._dirty.add(chat_id)
+
+    def clear_user(self, user_id: str):
+        """Stop every typing indicator of a user (e.g. on disconnect)"""
+        for chat_id in list(self._user_chats.get(user_id, ())):
+            self._discard(chat_id, user_id)
+            self._dirty.add(chat_id)
+
+    def apply_remote(self, chat_id: str, changes: List[Dict[str, Any]]):
+        """Record typing changes another worker flushed for a chat"""
+        expires_at = time.monotonic() + self.remote_ttl
+        for change in changes:
+            if change["is_typing"]:
+                self._remote.setdefault(chat_id, {})[change["user_id"]] = expires_at
+            else:
+                remote = self._remote.get(chat_id)
+                if remote is not None:
+                    remote.pop(change["user_id"], None)
+                    if not remote:
+                        del self._remote[chat_id]
+
+    def typing_users(self, chat_id: str) -> List[str]:
+        return sorted(set(self._typing.get(chat_id, ())) | set(self._remote.get(chat_id, ())))
+
+    def _discard(self, chat_id: str, user_id: str):
+        chat_typing = self._typing.get(chat_id)
+        if chat_typing is not None:
+            chat_typing.pop(user_id, None)
+            if not chat_typing:
+                del self._typing[chat_id]
+        user_chats = self._user_chats.get(user_id)
+        if user_chats is not None:
+            user_chats.discard(chat_id)
+            if not user_chats:
+                del self._user_chats[user_id]
+
+    # ==========================================
+    # TICK
+    # ==========================================
+
+    def _expire(self, now: float):
+        for chat_id, chat_typing in list(self._typing.items()):
+            for user_id, expires_at in list(chat_typing.items()):
+                if expires_at <= now:
+                    self._discard(chat_id, user_id)
+                    self._dirty.add(chat_id)
+                    self.stats['expired'] += 1
+        for chat_id, remote in list(self._remote.items()):
+            for user_id, expires_at in list(remote.items()):
+                if expires_at <= now:
+                    del remote[user_id]
+            if not remote:
+                del self._remote[chat_id]
+
+    async def flush_pending(self):
+        """Run one tick: expire stale entries and flush changed chats"""
+        self._expire(time.monotonic())
+        dirty, self._dirty = self._dirty, set()
+
+        for chat_id in dirty:
+            current = frozenset(self._typing.get(chat_id, ()))
+            last = self._last_sent.get(chat_id, frozenset())
+            if current == last:
+                self.stats['suppressed'] += 1
+                continue
+            if current:
+                self._last_sent[chat_id] = current
+            else:
+                self._last_sent.pop(chat_id, None)
+            changes = [{"user_id": user_id, "is_typing": user_id in current} for user_id in sorted(current ^ last)]
+            self.stats['flushes'] += 1
+            try:
+                await self.flush(chat_id, self.typing_users(chat_id), changes)
+            except Exception as e:
+                logger.error(f"Typing flush error for chat {chat_id}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            await self.flush_pending()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'active_chats': len(self._typing),
+            'typing_users': len(self._user_chats),
+            'remote_chats': len(self._remote),
+            **self.stats
+        }
@@ -0,0 +1,210 @@
+"""
+Pulse Backend - WebSocket Wire Protocols
+Per-connection frame encodings negotiated at connect (JSON by default, MessagePack on request)
+"""
+
+import json
+import logging
+import zlib
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+FLAG_PLAIN = 0x00
+FLAG_DEFLATE = 0x01
+
+# Largest client frame body accepted, after inflating
+MAX_INBOUND_FRAME = 1024 * 1024
+
+
+class FrameError(ValueError):
+    """A client frame that cannot be decoded; the receiver drops it"""
+
+
+class Frame:
+    """
+    One outbound payload shared by every recipient of a broadcast
+
+    The payload is serialized at most once per codec, the first time a
+    socket using that codec writes it; every other socket reuses the cached
+    text or bytes. Built from a dict, or from JSON text that is only parsed
+    if a binary codec needs it.
+    """
+
+    __slots__ = ("_payload", "_text", "_encoded")
+
+    def __init__(self, payload: Optional[Dict[str, Any]] = None, text: Optional[str] = None):
+        if payload is None and text is None:
+            raise ValueError("Frame needs a payload or its JSON text")
+        self._payload = payload
+        self._text = text
+        self._encoded: Dict[int, Union[str, bytes]] = {}  # id(codec) -> frame
+
+    @property
+    def payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            self._payload = json.loads(self._text)
+        return self._payload
+
+    @property
+    def text(self) -> str:
+        """The JSON encoding, also what crosses the fan-out bus"""
+        if self._text is None:
+            self._text = json.dumps(self._payload, default=str)
+        return self._text
+
+    def encode(self, codec: 'WireCodec') -> Union[str, bytes]:
+        encoded = self._encoded.get(id(codec))
+        if encoded is None:
+            encoded = self._encoded[id(codec)] = codec.encode_payload(self)
+        return encoded
+
+
+class WireCodec:
+    """
+    JSON text frames, the default for every client
+
+    Producers may hand a queue an already-encoded JSON string, a payload
+    dict or a shared Frame; all leave here as the same text frame.
+    """
+
+    name = "json"
+    binary = False
+
+    def encode(self, message: Any) -> Union[str, bytes]:
+        if isinstance(message, Frame):
+            return message.encode(self)
+        if isinstance(message, (str, bytes, bytearray)):
+            return message
+        return json.dumps(message, default=str)
+
+    def encode_payload(self, frame: Frame) -> Union[str, bytes]:
+        return frame.text
+
+    def decode(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        return json.loads(data)
+
+
+class MsgpackCodec(WireCodec):
+    """
+    MessagePack binary frames, optionally deflated
+
+    Each binary frame starts with one flag byte: 0 for a plain MessagePack
+    body, 1 for a zlib-deflated one. With a `compress_threshold`, bodies at
+    least that large are deflated when that actually makes them smaller;
+    small frames are never worth the CPU. Clients send frames the same way
+    (or plain JSON text, which is always accepted).
+    """
+
+    binary = True
+
+    def __init__(self, compress_threshold: Optional[int] = None, level: int = 6):
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("msgpack is not installed")
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self.name = "msgpack+deflate" if compress_threshold is not None else "msgpack"
+
+    def encode(self, message: Any) -> Union[str, bytes]:
+        if isinstance(message, Frame):
+            return message.encode(self)
+        if isinstance(message, (bytes, bytearray)):
+            return message
+        return self._pack(json.loads(message) if isinstance(message, str) else message)
+
+    def encode_payload(self, frame: Frame) -> Union[str, bytes]:
+        return self._pack(frame.payload)
+
+    def _pack(self, payload: Any) -> bytes:
+        body = msgpack.packb(payload, default=str, use_bin_type=True)
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            compressed = zlib.compress(body, self.level)
+            if len(compressed) < len(body):
+                return bytes((FLAG_DEFLATE,)) + compressed
+        return bytes((FLAG_PLAIN,)) + body
+
+    def decode(self, data: Union[str, bytes]) -> Dict[str, Any]:
+        if isinstance(data, str):
+            return json.loads(data)
+        if not data:
+            raise FrameError("Empty binary frame")
+        body = data[1:]
+        if data[0] == FLAG_DEFLATE:
+            # Bounded inflate: a few KB of input must not expand into gigabytes
+            inflater = zlib.decompressobj()
+            try:
+                body = inflater.decompress(body, MAX_INBOUND_FRAME)
+            except zlib.error as e:
+                raise FrameError(f"Corrupt deflated frame: {e}")
+            if inflater.unconsumed_tail:
+                raise FrameError(f"Frame inflates past {MAX_INBOUND_FRAME} bytes")
+        elif data[0] != FLAG_PLAIN:
+            raise FrameError(f"Unknown frame flag {data[0]}")
+        if len(body) > MAX_INBOUND_FRAME:
+            raise FrameError(f"Frame larger than {MAX_INBOUND_FRAME} bytes")
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise FrameError(f"Invalid MessagePack frame: {e}")
+
+
+JSON_CODEC = WireCodec()
+
+# Sec-WebSocket-Protocol names, also accepted as ?protocol=<name without "pulse.">
+SUBPROTOCOLS = ("pulse.json", "pulse.msgpack", "pulse.msgpack+deflate")
+
+
+_codecs: Dict[Tuple[str, Optional[int]], WireCodec] = {}
+
+
+def create_codec(name: str, compress_threshold: int = 1024) -> Optional[WireCodec]:
+    """
+    Codec for a protocol name, or None if unknown or unavailable here
+
+    Codecs are shared between connections so a broadcast Frame is encoded
+    once per protocol variant rather than once per socket.
+    """
+    name = name.strip().lower()
+    if name.startswith("pulse."):
+        name = name[len("pulse."):]
+    if name == "json":
+        return JSON_CODEC
+    if name in ("msgpack", "msgpack+deflate") and MSGPACK_AVAILABLE:
+        threshold = compress_threshold if name == "msgpack+deflate" else None
+        codec = _codecs.get((name, threshold))
+        if codec is None:
+            codec = _codecs[(name, threshold)] = MsgpackCodec(threshold)
+        return codec
+    return None
+
+
+def negotiate(
+    subprotocols: Iterable[str] = (),
+    requested: Optional[str] = None,
+    compress_threshold: int = 1024
+) -> Tuple[WireCodec, Optional[str]]:
+    """
+    Pick a codec from the client's offer
+
+    `subprotocols` are the Sec-WebSocket-Protocol values in client preference
+    order; the chosen one must be echoed on accept. `requested` is the
+    ?protocol= query value for clients that cannot set subprotocols.
+    Anything unknown falls back to JSON.
+    """
+    for subprotocol in subprotocols:
+        if subprotocol.strip().lower() in SUBPROTOCOLS:
+            codec = create_codec(subprotocol, compress_threshold)
+            if codec is not None:
+                return codec, subprotocol.strip()
+    if requested:
+        codec = create_codec(requested, compress_threshold)
+        if codec is not None:
+            return codec, None
+    return JSON_CODEC, None
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, File, Form, UploadFile, BackgroundTasks, Request
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, File, Form, UploadFile, BackgroundTasks, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
@@ -9,17 +9,20 @@ from slowapi.middleware import SlowAPIMiddleware
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 import redis
 import hashlib
 import time
+from functools import lru_cache
 import re
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any, Union
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import jwt
 from passlib.context import CryptContext
@@ -37,6 +40,11 @@ import qrcode
 from io import BytesIO
 import zipfile
 import tempfile
+from realtime import (
+    CallQualityAggregator, CallSignaling, ChatInbox, ClusterPresence, ChatMembershipCache, ChatSequencer, ConnectionRegistry, DeliveryOutbox, GameRoomEngine, GameRoomRouter, HeartbeatScheduler,
+    Matchmaker, MessagePipeline, OutboundQueue, PresenceService, PresenceWriter, QueuePolicy, ReactionAggregator, ReceiptWatermarks, RoomIndex, RoomOwnerIndex, TypingCoalescer,
+    Frame, FrameError, chat_summary, create_fanout_bus, direct_peer_id, message_preview, negotiate
+)
 
 # Military-grade security configuration
 SECURITY_CONFIG = {
@@ -88,6 +96,57 @@ limiter = Limiter(key_func=get_remote_address)
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Realtime (WebSocket) delivery configuration
+REALTIME_CONFIG = {
+    'FANOUT_CONCURRENCY': int(os.environ.get('WS_FANOUT_CONCURRENCY', 64)),  # max sends in flight per fan-out
+    'SEND_TIMEOUT': float(os.environ.get('WS_SEND_TIMEOUT', 5.0)),  # seconds before a socket is dropped
+    'QUEUE_MAX_SIZE': int(os.environ.get('WS_QUEUE_MAX_SIZE', 256)),  # frames buffered per socket
+    'QUEUE_MAX_OVERFLOWS': int(os.environ.get('WS_QUEUE_MAX_OVERFLOWS', 32)),  # overflows before eviction
+    'QUEUE_DROPPABLE_TYPES': ('typing_status',),  # oldest of these are dropped first when full
+    'QUEUE_COALESCE_TYPES': ('typing_status', 'message_reaction'),  # full-state frames: newest pending one per key wins
+    'CHAT_MEMBERSHIP_TTL': int(os.environ.get('CHAT_MEMBERSHIP_TTL', 300)),  # seconds; bounds staleness only
+    'CHAT_MEMBERSHIP_MAX_ENTRIES': int(os.environ.get('CHAT_MEMBERSHIP_MAX_ENTRIES', 100000)),
+    'TYPING_TICK': float(os.environ.get('WS_TYPING_TICK', 0.25)),  # seconds between typing flushes
+    'TYPING_TTL': float(os.environ.get('WS_TYPING_TTL', 6.0)),  # typing expires unless refreshed
+    'PRESENCE_FLUSH_INTERVAL': float(os.environ.get('WS_PRESENCE_FLUSH_INTERVAL', 1.0)),  # seconds between diffs
+    'PRESENCE_WATCHER_TTL': int(os.environ.get('WS_PRESENCE_WATCHER_TTL', 600)),
+    'PRESENCE_QUERY_LIMIT': 1000,  # max user ids per bulk presence query
+    'PRESENCE_ANNOUNCE_INTERVAL': float(os.environ.get('WS_PRESENCE_ANNOUNCE_INTERVAL', 5.0)),  # cluster presence heartbeat
+    'PRESENCE_WORKER_TTL': float(os.environ.get('WS_PRESENCE_WORKER_TTL', 15.0)),  # silent workers' users go offline
+    'HEARTBEAT_INTERVAL': float(os.environ.get('WS_HEARTBEAT_INTERVAL', 30)),  # ping sockets idle this long
+    'HEARTBEAT_TIMEOUT': float(os.environ.get('WS_HEARTBEAT_TIMEOUT', 60)),  # close sockets silent this long
+    'HEARTBEAT_TICK': float(os.environ.get('WS_HEARTBEAT_TICK', 1.0)),  # timing wheel resolution
+    'PRESENCE_WRITE_INTERVAL': float(os.environ.get('WS_PRESENCE_WRITE_INTERVAL', 2.0)),  # is_online/last_seen flush
+    'GAME_SNAPSHOT_INTERVAL': float(os.environ.get('GAME_SNAPSHOT_INTERVAL', 5.0)),  # seconds between state saves
+    'GAME_LOG_FLUSH_INTERVAL': float(os.environ.get('GAME_LOG_FLUSH_INTERVAL', 1.0)),  # seconds between move log appends
+    'GAME_MAX_CATCH_UP': int(os.environ.get('GAME_MAX_CATCH_UP', 500)),  # beyond this, resync sends full state
+    'GAME_WORKER_ANNOUNCE_INTERVAL': float(os.environ.get('GAME_WORKER_ANNOUNCE_INTERVAL', 2.0)),  # room ring liveness
+    'GAME_WORKER_TTL': float(os.environ.get('GAME_WORKER_TTL', 6.0)),  # silent workers leave the room ring
+    'GAME_WORKER_SYNC_WAIT': float(os.environ.get('GAME_WORKER_SYNC_WAIT', 1.0)),  # a new worker hears from the others before owning rooms
+    'MATCHMAKING_TICK': float(os.environ.get('MATCHMAKING_TICK', 1.0)),  # seconds between matching passes
+    'CALL_ICE_WINDOW': float(os.environ.get('CALL_ICE_WINDOW', 0.05)),  # seconds ICE candidates are batched
+    'CALL_ICE_MAX_BATCH': int(os.environ.get('CALL_ICE_MAX_BATCH', 16)),  # flush a batch early at this size
+    'CALL_MISSING_TTL': float(os.environ.get('CALL_MISSING_TTL', 30)),  # unknown/ended call ids skip the database this long
+    'CALL_QUALITY_REGION_WINDOW': float(os.environ.get('CALL_QUALITY_REGION_WINDOW', 3600)),  # rolling region stats
+    'CALL_QUALITY_REGION_SLOT': float(os.environ.get('CALL_QUALITY_REGION_SLOT', 300)),  # rolling window granularity
+    'CALL_QUALITY_IDLE_TTL': float(os.environ.get('CALL_QUALITY_IDLE_TTL', 900)),  # summarise calls gone quiet
+    'WS_COMPRESS_THRESHOLD': int(os.environ.get('WS_COMPRESS_THRESHOLD', 1024)),  # deflate msgpack frames this large
+    'OUTBOX_FLUSH_INTERVAL': float(os.environ.get('OUTBOX_FLUSH_INTERVAL', 0.05)),  # offline delivery write batching
+    'OUTBOX_DRAIN_LIMIT': int(os.environ.get('OUTBOX_DRAIN_LIMIT', 500)),  # missed messages per reconnect batch
+    'OUTBOX_TTL': int(os.environ.get('OUTBOX_TTL', 30 * 86400)),  # unacked entries expire after this many seconds
+    'RECEIPT_FLUSH_INTERVAL': float(os.environ.get('RECEIPT_FLUSH_INTERVAL', 1.0)),  # receipt watermark batching
+    'SYNC_PAGE_LIMIT': int(os.environ.get('SYNC_PAGE_LIMIT', 500)),  # changed messages per delta sync page
+    'MESSAGE_PAGE_SIZE': int(os.environ.get('MESSAGE_PAGE_SIZE', 50)),  # default history page (newest first)
+    'MESSAGE_PAGE_MAX': int(os.environ.get('MESSAGE_PAGE_MAX', 200)),
+    'MESSAGE_UNPAGED_LIMIT': int(os.environ.get('MESSAGE_UNPAGED_LIMIT', 1000)),  # callers sending neither cursor nor limit
+    'INBOX_FLUSH_INTERVAL': float(os.environ.get('INBOX_FLUSH_INTERVAL', 0.1)),  # chat list row write batching
+    'MESSAGE_COMMIT_WINDOW': float(os.environ.get('MESSAGE_COMMIT_WINDOW', 0.003)),  # seconds sends wait to share a write
+    'MESSAGE_COMMIT_MAX_BATCH': int(os.environ.get('MESSAGE_COMMIT_MAX_BATCH', 256)),  # commit early at this many
+    'REACTION_BROADCAST_WINDOW': float(os.environ.get('REACTION_BROADCAST_WINDOW', 0.25)),  # one reaction frame per message
+    'FANOUT_BUS': os.environ.get('WS_FANOUT_BUS', 'local'),  # local (single worker) | redis | loopback
+    'REDIS_URL': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+}
+
 # Military-grade security class
 class SecurityManager:
     def __init__(self):
@@ -450,6 +509,9 @@ class E2EConversationInit(BaseModel):
 
 # Legacy encryption (kept for backward compatibility)
 class MessageEncryption:
+    # Pages with at least this many encrypted messages are decrypted on a worker thread
+    DECRYPT_OFFLOAD_THRESHOLD = int(os.environ.get('DECRYPT_OFFLOAD_THRESHOLD', 64))
+    
     @staticmethod
     def generate_key() -> str:
         """Generate a new encryption key"""
@@ -466,11 +528,17 @@ class MessageEncryption:
         )
         return base64.urlsafe_b64encode(kdf.derive(password.encode()))
     
+    @staticmethod
+    @lru_cache(maxsize=int(os.environ.get('FERNET_CACHE_SIZE', 4096)))
+    def cipher(key: str) -> Fernet:
+        """Initialized Fernet for a key; bounded LRU, so active users skip key parsing"""
+        return Fernet(key.encode())
+    
     @staticmethod
     def encrypt_message(message: str, key: str) -> str:
         """Encrypt a message using the provided key"""
         try:
-            f = Fernet(key.encode())
+            f = MessageEncryption.cipher(key)
             encrypted = f.encrypt(message.encode())
             return base64.urlsafe_b64encode(encrypted).decode()
         except Exception as e:
@@ -481,13 +549,40 @@ class MessageEncryption:
     def decrypt_message(encrypted_message: str, key: str) -> str:
         """Decrypt a message using the provided key"""
         try:
-            f = Fernet(key.encode())
+            f = MessageEncryption.cipher(key)
             encrypted_bytes = base64.urlsafe_b64decode(encrypted_message.encode())
             decrypted = f.decrypt(encrypted_bytes)
             return decrypted.decode()
         except Exception as e:
             logging.error(f"Decryption error: {e}")
             return encrypted_message  # Fallback to encrypted text
+    
+    @staticmethod
+    def decrypt_messages(encrypted_messages: List[str], key: str) -> List[str]:
+        """Decrypt a page with one key; like decrypt_message, failures come back as the encrypted text"""
+        try:
+            f = MessageEncryption.cipher(key)
+        except Exception as e:
+            logging.error(f"Decryption error: {e}")
+            return list(encrypted_messages)
+        decrypted = []
+        failures = 0
+        for encrypted_message in encrypted_messages:
+            try:
+                decrypted.append(f.decrypt(base64.urlsafe_b64decode(encrypted_message.encode())).decode())
+            except Exception:
+                failures += 1
+                decrypted.append(encrypted_message)
+        if failures:
+            logging.error(f"Decryption error: {failures} of {len(encrypted_messages)} messages")
+        return decrypted
+    
+    @staticmethod
+    async def decrypt_page(encrypted_messages: List[str], key: str) -> List[str]:
+        """Batch decrypt, off the event loop once the page is large"""
+        if len(encrypted_messages) < MessageEncryption.DECRYPT_OFFLOAD_THRESHOLD:
+            return MessageEncryption.decrypt_messages(encrypted_messages, key)
+        return await asyncio.to_thread(MessageEncryption.decrypt_messages, encrypted_messages, key)
 
 # Helper function to convert MongoDB documents to JSON serializable format
 def serialize_mongo_doc(doc):
@@ -566,100 +661,710 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production-' + str(int(time.time())))
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # Token expires in 30 minutes
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Chat fields kept alongside cached membership (never changed after creation)
+CHAT_MEMBERSHIP_FIELDS = ("chat_id", "chat_type", "type", "team_id", "encryption_enabled", "disappearing_timer")
+
+async def load_chat_membership(chat_id: str):
+    """Membership cache loader: members plus the chat fields hot paths read"""
+    projection = {field: 1 for field in CHAT_MEMBERSHIP_FIELDS}
+    projection["members"] = 1
+    return await db.chats.find_one({"chat_id": chat_id}, projection)
+
+async def load_presence_watchers(user_ids: List[str]) -> Dict[str, List[str]]:
+    """Presence index loader: for each user, who has them as a contact (one $in query)"""
+    watchers = {user_id: [] for user_id in user_ids}
+    cursor = db.contacts.find({"contact_user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "contact_user_id": 1})
+    async for contact in cursor:
+        watchers[contact["contact_user_id"]].append(contact["user_id"])
+    return watchers
+
+async def save_call_quality(call_id: str, summary: Dict[str, Any]):
+    """Call quality writer: one compact summary per call instead of raw samples"""
+    await db.call_quality.insert_one({"call_id": call_id, **summary, "recorded_at": datetime.utcnow()})
+
+def inbox_peer(user: dict) -> dict:
+    """The other member of a direct chat as stored on inbox rows"""
+    return {
+        "user_id": user["user_id"],
+        "username": user.get("username"),
+        "display_name": user.get("display_name"),
+        "email": user.get("email"),
+        "avatar": user.get("avatar"),
+        "status_message": user.get("status_message")
+    }
+
+async def write_inbox_operations(operations: list):
+    # Unordered: the inbox writes dependent phases in separate calls and retries what fails
+    await db.chat_inbox.bulk_write(operations, ordered=False)
+
+async def load_inbox_chats(chat_ids: List[str]) -> List[dict]:
+    return await db.chats.find({"chat_id": {"$in": chat_ids}}).to_list(len(chat_ids))
+
+async def load_inbox_peers(user_ids: List[str]) -> Dict[str, dict]:
+    users = await db.users.find({"user_id": {"$in": user_ids}}).to_list(len(user_ids))
+    return {user["user_id"]: inbox_peer(user) for user in users}
 
 # Enhanced Connection manager with advanced features
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_connections: Dict[str, str] = {}  # user_id -> connection_id
-        self.voice_rooms: Dict[str, List[str]] = {}  # room_id -> [user_ids]
-        self.typing_users: Dict[str, List[str]] = {}  # chat_id -> [user_ids]
-        self.screen_sharing: Dict[str, str] = {}  # room_id -> user_id (who's sharing)
-        self.call_quality: Dict[str, Dict] = {}  # call_id -> quality metrics
-        self.user_status: Dict[str, Dict] = {}  # user_id -> {status, activity, game}
+        self.registry = ConnectionRegistry(
+            max_concurrency=REALTIME_CONFIG['FANOUT_CONCURRENCY'],
+            send_timeout=REALTIME_CONFIG['SEND_TIMEOUT'],
+            queue_policy=QueuePolicy(
+                max_size=REALTIME_CONFIG['QUEUE_MAX_SIZE'],
+                droppable_types=REALTIME_CONFIG['QUEUE_DROPPABLE_TYPES'],
+                coalesce_types=REALTIME_CONFIG['QUEUE_COALESCE_TYPES'],
+                max_overflows=REALTIME_CONFIG['QUEUE_MAX_OVERFLOWS']
+            )
+        )
+        self.active_connections: Dict[str, WebSocket] = self.registry.connections
+        self.user_connections: Dict[str, set] = self.registry.user_connections  # user_id -> {connection_ids}
+        self.voice = RoomIndex()
+        self.voice_rooms: Dict[str, set] = self.voice.rooms  # room_id -> {user_ids}
+        self.typing = TypingCoalescer(
+            self._flush_typing,
+            tick=REALTIME_CONFIG['TYPING_TICK'],
+            ttl=REALTIME_CONFIG['TYPING_TTL']
+        )  # chat_id -> typing users, flushed once per tick
+        self.screen_shares = RoomOwnerIndex()
+        self.screen_sharing: Dict[str, str] = self.screen_shares.owners  # room_id -> user_id (who's sharing)
+        self.call_quality = CallQualityAggregator(
+            save_call_quality,
+            region_window=REALTIME_CONFIG['CALL_QUALITY_REGION_WINDOW'],
+            region_slot=REALTIME_CONFIG['CALL_QUALITY_REGION_SLOT'],
+            idle_ttl=REALTIME_CONFIG['CALL_QUALITY_IDLE_TTL']
+        )
+        self.presence = PresenceService(
+            load_presence_watchers,
+            self._deliver_presence_diffs,
+            interval=REALTIME_CONFIG['PRESENCE_FLUSH_INTERVAL'],
+            watcher_ttl=REALTIME_CONFIG['PRESENCE_WATCHER_TTL']
+        )
+        self.user_status: Dict[str, Dict] = self.presence.statuses  # user_id -> {status, activity, game}
+        
+        # Users connected to any worker, so one worker letting go does not mean offline
+        self.cluster = ClusterPresence(
+            lambda: self.registry.user_connections.keys(),
+            self.registry.is_online,
+            self._report_online,
+            self._report_offline,
+            announce_interval=REALTIME_CONFIG['PRESENCE_ANNOUNCE_INTERVAL'],
+            worker_ttl=REALTIME_CONFIG['PRESENCE_WORKER_TTL']
+        )
+        
+        # chat_id -> members, so broadcasts and membership checks skip Mongo
+        self.chat_members = ChatMembershipCache(
+            load_chat_membership,
+            ttl=REALTIME_CONFIG['CHAT_MEMBERSHIP_TTL'],
+            max_entries=REALTIME_CONFIG['CHAT_MEMBERSHIP_MAX_ENTRIES'],
+            meta_fields=CHAT_MEMBERSHIP_FIELDS
+        )
+        
+        # Per-user chat list rows, maintained by the same write-through hooks
+        self.inbox = ChatInbox(
+            write_inbox_operations,
+            load_inbox_chats,
+            load_inbox_peers,
+            interval=REALTIME_CONFIG['INBOX_FLUSH_INTERVAL']
+        )
+        
+        # Cross-worker backplane: each worker delivers only to sockets it owns
+        self.bus = create_fanout_bus(REALTIME_CONFIG['FANOUT_BUS'], REALTIME_CONFIG['REDIS_URL'])
+        if self.bus is not None:
+            self.bus.set_handler(self._handle_bus_envelope)
     
     async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        connection_id = str(uuid.uuid4())
-        self.active_connections[connection_id] = websocket
-        self.user_connections[user_id] = connection_id
+        # JSON unless the client offers a binary protocol (subprotocol or ?protocol=)
+        codec, subprotocol = negotiate(
+            websocket.scope.get("subprotocols", ()),
+            websocket.query_params.get("protocol"),
+            REALTIME_CONFIG['WS_COMPRESS_THRESHOLD']
+        )
+        await websocket.accept(subprotocol=subprotocol)
+        first_device = not self.registry.is_online(user_id)
+        connection_id = self.registry.add(user_id, websocket, codec=codec)
+        if first_device and await self.cluster.connected(user_id):
+            await self._report_online(user_id)
         return connection_id
     
-    def disconnect(self, connection_id: str, user_id: str):
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
+    async def disconnect(self, connection_id: str, user_id: str):
+        self.registry.remove(connection_id)
         
-        # Clean up all user presence
-        for chat_id in list(self.typing_users.keys()):
-            if user_id in self.typing_users[chat_id]:
-                self.typing_users[chat_id].remove(user_id)
+        # Other devices of the same user keep their presence
+        if self.registry.is_online(user_id):
+            return
         
-        for room_id in list(self.voice_rooms.keys()):
-            if user_id in self.voice_rooms[room_id]:
-                self.voice_rooms[room_id].remove(user_id)
-                
-        if user_id in self.user_status:
-            del self.user_status[user_id]
-    
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.user_connections:
-            connection_id = self.user_connections[user_id]
-            if connection_id in self.active_connections:
-                websocket = self.active_connections[connection_id]
-                try:
-                    await asyncio.wait_for(websocket.send_text(message), timeout=5.0)
-                except asyncio.TimeoutError:
-                    logging.warning(f"WebSocket send timeout for user {user_id}")
-                    self.disconnect(connection_id, user_id)
-                except Exception as e:
-                    logging.error(f"WebSocket send error for user {user_id}: {str(e)}")
-                    self.disconnect(connection_id, user_id)
-    
-    async def broadcast_to_chat(self, message: str, chat_id: str, sender_id: str):
-        chat = await db.chats.find_one({"chat_id": chat_id})
-        if chat:
-            for member_id in chat['members']:
-                if member_id != sender_id:
-                    await self.send_personal_message(message, member_id)
+        # Clean up all user presence (reverse indexes: only what the user was in)
+        self.typing.clear_user(user_id)
+        self.voice.remove_user(user_id)
+        self.screen_shares.remove_user(user_id)
+        # Still connected to another worker: not offline yet
+        if await self.cluster.disconnected(user_id):
+            await self._report_offline(user_id)
+    
+    async def _report_online(self, user_id: str):
+        self.presence.update(user_id, {"status": "online", "activity": None, "game": None})
+        presence_writer.mark(user_id, True)
+    
+    async def _report_offline(self, user_id: str):
+        self.presence.set_offline(user_id)
+        presence_writer.mark(user_id, False)
+    
+    async def send_personal_message(self, message: str, user_id: str, frame_type: str = None, coalesce_key: str = None):
+        """Queue a message for every connected device of a user"""
+        await self.broadcast_to_users(message, [user_id], frame_type=frame_type, coalesce_key=coalesce_key)
+    
+    async def broadcast(self, payload: dict, user_ids: List[str], exclude: str = None, frame_type: str = None, coalesce_key: str = None):
+        """Fan out a payload dict, serialized once per wire protocol rather than per member"""
+        await self.broadcast_to_users(Frame(payload), user_ids, exclude=exclude, frame_type=frame_type, coalesce_key=coalesce_key)
+    
+    async def broadcast_to_users(
+        self,
+        message: Union[str, Frame],
+        user_ids: List[str],
+        exclude: str = None,
+        frame_type: str = None,
+        coalesce_key: str = None
+    ):
+        """
+        Fan out one message to many users
+        
+        Frames are only enqueued on each socket's outbound queue, so the caller
+        never waits on a recipient's network. frame_type/coalesce_key let the
+        queue policy drop stale typing frames and coalesce presence updates.
+        Every socket shares one Frame, so binary clients cost one encoding per
+        protocol variant however many members receive it.
+        """
+        user_ids = list(user_ids)
+        frame = message if isinstance(message, Frame) else Frame(text=message)
+        self.registry.fan_out(frame, user_ids, exclude=exclude, frame_type=frame_type, coalesce_key=coalesce_key)
+        
+        # Users may also have sockets on other workers
+        if self.bus is not None:
+            try:
+                await self.bus.publish({
+                    "type": "deliver",
+                    "user_ids": user_ids,
+                    "exclude": exclude,
+                    "message": frame.text,
+                    "frame_type": frame_type,
+                    "coalesce_key": coalesce_key
+                })
+            except Exception as e:
+                logging.error(f"Fan-out bus publish error: {e}")
+    
+    async def _handle_bus_envelope(self, envelope: dict):
+        """Apply an envelope published by another worker"""
+        if envelope.get("type") == "deliver":
+            self.registry.fan_out(
+                Frame(text=envelope["message"]),
+                envelope["user_ids"],
+                exclude=envelope.get("exclude"),
+                frame_type=envelope.get("frame_type"),
+                coalesce_key=envelope.get("coalesce_key")
+            )
+        elif envelope.get("type") == "chat_membership":
+            self._apply_membership_change(envelope["op"], envelope["chat_id"], envelope.get("user_id"))
+        elif envelope.get("type") == "presence_diffs":
+            for subscriber_id, changes in envelope["diffs"].items():
+                self._send_presence_diff(subscriber_id, changes)
+        elif envelope.get("type") == "presence_watch":
+            self._apply_presence_watch(envelope["op"], envelope["subscriber_id"], envelope["target_id"])
+        elif envelope.get("type") == "typing_changes":
+            self.typing.apply_remote(envelope["chat_id"], envelope["changes"])
+        elif envelope.get("type") == "call_state":
+            apply_call_state(envelope["call_id"], envelope["status"])
+        elif envelope.get("type") == "presence_worker":
+            await self.cluster.handle_envelope(envelope)
+        elif envelope.get("type", "").startswith("game_"):
+            await game_router.handle_envelope(envelope)
+    
+    async def broadcast_to_chat(self, message: str, chat_id: str, sender_id: str, frame_type: str = None):
+        members = await self.chat_members.get_members(chat_id)
+        if members:
+            await self.broadcast_to_users(message, members, exclude=sender_id, frame_type=frame_type)
+    
+    async def _deliver_presence_diffs(self, diffs: Dict[str, Dict[str, Dict]]):
+        """A presence flush: local subscribers now, other workers in one envelope for the whole flush"""
+        for subscriber_id, changes in diffs.items():
+            self._send_presence_diff(subscriber_id, changes)
+        if self.bus is not None:
+            try:
+                await self.bus.publish({"type": "presence_diffs", "diffs": diffs})
+            except Exception as e:
+                logging.error(f"Fan-out bus publish error: {e}")
+    
+    def _send_presence_diff(self, subscriber_id: str, changes: Dict[str, Dict]):
+        # Only subscribers with a socket on this worker
+        if not self.registry.is_online(subscriber_id):
+            return
+        self.registry.fan_out(
+            Frame(text=json.dumps({"type": "presence_diff", "data": {"changes": changes}}, default=str)),
+            [subscriber_id],
+            frame_type="presence_diff"
+        )
+    
+    def presence_snapshot(self, user_ids: List[str]) -> Dict[str, Dict]:
+        return self.presence.snapshot(user_ids[:REALTIME_CONFIG['PRESENCE_QUERY_LIMIT']], self.is_user_online)
+    
+    async def presence_watch_added(self, subscriber_id: str, target_id: str):
+        await self._presence_watch_changed("add", subscriber_id, target_id)
+    
+    async def presence_watch_removed(self, subscriber_id: str, target_id: str):
+        await self._presence_watch_changed("remove", subscriber_id, target_id)
+    
+    async def _presence_watch_changed(self, op: str, subscriber_id: str, target_id: str):
+        self._apply_presence_watch(op, subscriber_id, target_id)
+        if self.bus is not None:
+            try:
+                await self.bus.publish({"type": "presence_watch", "op": op, "subscriber_id": subscriber_id, "target_id": target_id})
+            except Exception as e:
+                logging.error(f"Fan-out bus publish error: {e}")
+    
+    def _apply_presence_watch(self, op: str, subscriber_id: str, target_id: str):
+        if op == "add":
+            self.presence.add_watch(subscriber_id, target_id)
+        else:
+            self.presence.remove_watch(subscriber_id, target_id)
+    
+    # Chat membership write-through (keeps the membership cache authoritative)
+    def cache_chat(self, chat: dict):
+        """Record a chat that was just created"""
+        self.chat_members.set_chat(chat)
+        self.inbox.chat_created(chat)
+    
+    async def chat_member_added(self, chat_id: str, user_id: str):
+        self.inbox.member_added(chat_id, user_id)
+        await self._membership_changed("add", chat_id, user_id)
+    
+    async def chat_member_removed(self, chat_id: str, user_id: str):
+        self.inbox.member_removed(chat_id, user_id)
+        await self._membership_changed("remove", chat_id, user_id)
+    
+    async def chat_removed(self, chat_id: str):
+        self.inbox.chat_removed(chat_id)
+        await self._membership_changed("invalidate", chat_id)
+    
+    async def _membership_changed(self, op: str, chat_id: str, user_id: str = None):
+        self._apply_membership_change(op, chat_id, user_id)
+        if self.bus is not None:
+            try:
+                await self.bus.publish({"type": "chat_membership", "op": op, "chat_id": chat_id, "user_id": user_id})
+            except Exception as e:
+                logging.error(f"Fan-out bus publish error: {e}")
+    
+    def _apply_membership_change(self, op: str, chat_id: str, user_id: str = None):
+        if op == "add":
+            self.chat_members.add_member(chat_id, user_id)
+        elif op == "remove":
+            self.chat_members.remove_member(chat_id, user_id)
+        else:
+            self.chat_members.invalidate(chat_id)
     
     async def broadcast_to_voice_room(self, message: str, room_id: str, sender_id: str = None):
-        if room_id in self.voice_rooms:
-            for user_id in self.voice_rooms[room_id]:
-                if sender_id is None or user_id != sender_id:
-                    await self.send_personal_message(message, user_id)
+        members = self.voice.members(room_id)
+        if members:
+            await self.broadcast_to_users(message, list(members), exclude=sender_id)
     
     async def broadcast_typing(self, chat_id: str, user_id: str, is_typing: bool):
-        if is_typing:
-            if chat_id not in self.typing_users:
-                self.typing_users[chat_id] = []
-            if user_id not in self.typing_users[chat_id]:
-                self.typing_users[chat_id].append(user_id)
-        else:
-            if chat_id in self.typing_users and user_id in self.typing_users[chat_id]:
-                self.typing_users[chat_id].remove(user_id)
+        """Record a typing frame; the coalescer broadcasts changed sets once per tick"""
+        self.typing.set_typing(chat_id, user_id, is_typing)
+    
+    async def _flush_typing(self, chat_id: str, typing_users: List[str], changes: List[Dict[str, Any]]):
+        """
+        One typing_status frame per chat per tick
+        
+        typing_users is the chat's typing set across workers; changes lists
+        who started or stopped here, and a frame with a single change also
+        carries its user_id and is_typing at the top level, like the
+        per-keystroke frame did. Nobody is told about their own typing.
+        """
+        # Other workers merge our changes into the sets their frames carry
+        if self.bus is not None:
+            try:
+                await self.bus.publish({"type": "typing_changes", "chat_id": chat_id, "changes": changes})
+            except Exception as e:
+                logging.error(f"Fan-out bus publish error: {e}")
+        members = await self.chat_members.get_members(chat_id)
+        if not members:
+            return
+        typing_users = [user_id for user_id in typing_users if user_id in members]
+        changes = [change for change in changes if change["user_id"] in members]
+        if not changes:
+            return
         
-        await self.broadcast_to_chat(
-            json.dumps({
-                "type": "typing_status",
-                "data": {
-                    "chat_id": chat_id,
-                    "user_id": user_id,
-                    "is_typing": is_typing,
-                    "typing_users": self.typing_users.get(chat_id, [])
-                }
-            }),
-            chat_id,
-            user_id
-        )
+        def typing_frame(recipient_id: str = None) -> dict:
+            own_changes = [change for change in changes if change["user_id"] != recipient_id]
+            data = {
+                "chat_id": chat_id,
+                "typing_users": [user_id for user_id in typing_users if user_id != recipient_id],
+                "changes": own_changes
+            }
+            if len(own_changes) == 1:
+                data.update(own_changes[0])
+            return {"type": "typing_status", "data": data}
+        
+        # Everyone not involved shares one frame; each typer gets it without themselves
+        involved = set(typing_users) | {change["user_id"] for change in changes}
+        others = [member for member in members if member not in involved]
+        if others:
+            await self.broadcast(typing_frame(), others, frame_type="typing_status", coalesce_key=f"typing:{chat_id}")
+        for user_id in involved:
+            frame = typing_frame(user_id)
+            if frame["data"]["changes"]:
+                await self.broadcast(frame, [user_id], frame_type="typing_status", coalesce_key=f"typing:{chat_id}")
     
     def is_user_online(self, user_id: str) -> bool:
-        """Check if a user is currently online (has active WebSocket connection)"""
-        return user_id in self.user_connections
+        """Check if a user is currently online (has an active WebSocket connection on any worker)"""
+        return self.cluster.is_online(user_id)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Realtime delivery statistics"""
+        return {
+            "registry": self.registry.get_stats(),
+            "chat_membership_cache": self.chat_members.get_stats(),
+            "chat_inbox": self.inbox.get_stats(),
+            "typing": self.typing.get_stats(),
+            "presence": self.presence.get_stats(),
+            "cluster_presence": self.cluster.get_stats(),
+            "voice_rooms": self.voice.get_stats(),
+            "screen_shares": self.screen_shares.get_stats(),
+            "call_quality": self.call_quality.get_stats(),
+            "bus": self.bus.get_stats() if self.bus is not None else None
+        }
 
 manager = ConnectionManager()
 
+# Shared by chat and game sockets: one timing wheel instead of a timer per socket
+heartbeat = HeartbeatScheduler(
+    ping_interval=REALTIME_CONFIG['HEARTBEAT_INTERVAL'],
+    timeout=REALTIME_CONFIG['HEARTBEAT_TIMEOUT'],
+    tick=REALTIME_CONFIG['HEARTBEAT_TICK']
+)
+
+# is_online/last_seen are persisted write-behind; live state comes from manager
+presence_writer = PresenceWriter(db.users, interval=REALTIME_CONFIG['PRESENCE_WRITE_INTERVAL'])
+
+async def load_live_call(call_id: str) -> Optional[Dict[str, Any]]:
+    """Call signaling loader: a ringing or active call created on another worker"""
+    return await db.voice_calls.find_one(
+        {"call_id": call_id, "status": {"$in": ["ringing", "active"]}},
+        {"_id": 0, "call_id": 1, "chat_id": 1, "caller_id": 1, "participants": 1, "call_type": 1, "status": 1, "started_at": 1}
+    )
+
+async def deliver_call_signal(user_ids: List[str], payload: dict):
+    """Call signaling delivery over the users' chat sockets"""
+    await manager.broadcast_to_users(json.dumps(payload, default=str), user_ids, frame_type=payload["type"])
+
+# Live calls are kept in memory; WebRTC signals skip the database
+call_signaling = CallSignaling(
+    load_live_call,
+    deliver_call_signal,
+    ice_window=REALTIME_CONFIG['CALL_ICE_WINDOW'],
+    ice_max_batch=REALTIME_CONFIG['CALL_ICE_MAX_BATCH'],
+    missing_ttl=REALTIME_CONFIG['CALL_MISSING_TTL']
+)
+
+async def call_state_changed(call_id: str, status: str):
+    """Apply a call status change here and on every other worker's cached CallState"""
+    apply_call_state(call_id, status)
+    if manager.bus is not None:
+        try:
+            await manager.bus.publish({"type": "call_state", "call_id": call_id, "status": status})
+        except Exception as e:
+            logging.error(f"Fan-out bus publish error: {e}")
+
+def apply_call_state(call_id: str, status: str):
+    if status in ("ringing", "active"):
+        call_signaling.set_status(call_id, status)
+    else:
+        call_signaling.end(call_id)
+
+async def write_outbox_entries(entries: List[dict]):
+    """Idempotent: a message already waiting for a user is not queued twice"""
+    await db.delivery_outbox.bulk_write([
+        UpdateOne({"user_id": entry["user_id"], "message_id": entry["message_id"]}, {"$setOnInsert": entry}, upsert=True)
+        for entry in entries
+    ], ordered=False)
+
+async def read_outbox(user_id: str, limit: int):
+    """The user's oldest unacked messages in two indexed reads"""
+    entries = await db.delivery_outbox.find(
+        {"user_id": user_id}, {"message_id": 1}
+    ).sort("created_at", 1).limit(limit + 1).to_list(limit + 1)
+    more = len(entries) > limit
+    message_ids = [entry["message_id"] for entry in entries[:limit]]
+    if not message_ids:
+        return [], False
+    found = {
+        message["message_id"]: message
+        for message in await db.messages.find({"message_id": {"$in": message_ids}, "is_deleted": {"$ne": True}}).to_list(len(message_ids))
+    }
+    # Deleted since: nothing left to deliver
+    gone = [message_id for message_id in message_ids if message_id not in found]
+    if gone:
+        await db.delivery_outbox.delete_many({"user_id": user_id, "message_id": {"$in": gone}})
+    return [serialize_mongo_doc(found[message_id]) for message_id in message_ids if message_id in found], more
+
+async def remove_outbox_entries(user_id: str, message_ids: List[str]):
+    await db.delivery_outbox.delete_many({"user_id": user_id, "message_id": {"$in": message_ids}})
+
+delivery_outbox = DeliveryOutbox(
+    write_outbox_entries,
+    read_outbox,
+    remove_outbox_entries,
+    interval=REALTIME_CONFIG['OUTBOX_FLUSH_INTERVAL'],
+    drain_limit=REALTIME_CONFIG['OUTBOX_DRAIN_LIMIT']
+)
+
+async def send_missed_messages(connection_id: str, user_id: str):
+    """One missed_messages frame with what the user missed while offline"""
+    messages, more = await delivery_outbox.drain(user_id)
+    if messages:
+        manager.registry.send_to_connection(
+            connection_id,
+            Frame({"type": "missed_messages", "data": {"messages": messages, "more": more}})
+        )
+
+async def write_receipt_watermarks(watermarks: List[dict]):
+    for watermark in watermarks:
+        if watermark["kind"] == "read":
+            manager.inbox.mark_read(watermark["chat_id"], watermark["user_id"], watermark["at"])
+    await db.chat_receipts.bulk_write([
+        UpdateOne(
+            {"chat_id": watermark["chat_id"], "user_id": watermark["user_id"]},
+            {"$max": {f"{watermark['kind']}_at": watermark["at"]}},
+            upsert=True
+        )
+        for watermark in watermarks
+    ], ordered=False)
+
+async def publish_receipt_watermarks(chat_id: str, watermarks: List[dict]):
+    """One receipt_update frame per chat per flush, minus read receipts of users who hide them"""
+    readers = list({watermark["user_id"] for watermark in watermarks if watermark["kind"] == "read"})
+    hidden = set()
+    if readers:
+        hidden = {
+            user["user_id"]
+            for user in await db.users.find(
+                {"user_id": {"$in": readers}, "privacy_settings.read_receipts": False}, {"user_id": 1}
+            ).to_list(len(readers))
+        }
+    receipts = [
+        {"user_id": watermark["user_id"], "kind": watermark["kind"], "at": watermark["at"], "message_id": watermark["message_id"]}
+        for watermark in watermarks
+        if not (watermark["kind"] == "read" and watermark["user_id"] in hidden)
+    ]
+    members = await manager.chat_members.get_members(chat_id)
+    if receipts and members:
+        await manager.broadcast(
+            {"type": "receipt_update", "data": {"chat_id": chat_id, "receipts": receipts}},
+            members,
+            frame_type="receipt_update"
+        )
+
+receipt_watermarks = ReceiptWatermarks(
+    write_receipt_watermarks,
+    publish_receipt_watermarks,
+    interval=REALTIME_CONFIG['RECEIPT_FLUSH_INTERVAL']
+)
+
+def parse_receipt_time(value: Optional[str]) -> datetime:
+    """Client-reported watermark time, never in the future; now if absent"""
+    now = datetime.utcnow()
+    if not value:
+        return now
+    try:
+        at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid receipt time")
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(at, now)
+
+async def mark_receipt(chat_id: str, user_id: str, receipt: dict):
+    if not await manager.chat_members.is_member(chat_id, user_id):
+        raise HTTPException(status_code=403, detail="Access denied")
+    kind = receipt.get("kind", "read")
+    if kind not in ("delivered", "read"):
+        raise HTTPException(status_code=400, detail="Receipt kind must be delivered or read")
+    receipt_watermarks.mark(chat_id, user_id, kind, parse_receipt_time(receipt.get("up_to")), receipt.get("message_id"))
+
+async def increment_chat_seq(chat_id: str, count: int) -> int:
+    counter = await db.chat_sequences.find_one_and_update(
+        {"chat_id": chat_id},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+async def current_chat_seq(chat_id: str) -> int:
+    counter = await db.chat_sequences.find_one({"chat_id": chat_id})
+    return counter["seq"] if counter else 0
+
+# Every message insert, edit, delete and reaction advances its chat's sequence
+chat_sequences = ChatSequencer(increment_chat_seq)
+
+async def write_message_batch(messages: List[dict]) -> set:
+    """Message pipeline writer: one unordered insert, returning the positions that failed"""
+    try:
+        await db.messages.insert_many(messages, ordered=False)
+    except BulkWriteError as e:
+        return {error["index"] for error in e.details.get("writeErrors", [])}
+    return set()
+
+async def update_chat_last_messages(latest: Dict[str, dict]):
+    """Message pipeline chat updater: one write per batch for every chat it touched"""
+    now = datetime.utcnow()
+    await db.chats.bulk_write([
+        UpdateOne({"chat_id": chat_id}, {"$set": {"last_message": message_preview(message), "last_activity": now}})
+        for chat_id, message in latest.items()
+    ], ordered=False)
+
+async def fan_out_messages(messages: List[dict]):
+    """Message pipeline fan-out: chat list rows, live sockets and offline outboxes"""
+    for message in messages:
+        chat_id = message["chat_id"]
+        manager.inbox.message_posted(chat_id, message)
+        members = await manager.chat_members.get_members(chat_id)
+        if not members:
+            continue
+        await manager.broadcast({"type": "new_message", "data": serialize_mongo_doc(message)}, members)
+        
+        # Members with no socket on any worker get it from their outbox on reconnect;
+        # a member on another worker is online and gets the frame over the bus
+        offline = [
+            member for member in members
+            if member != message["sender_id"] and not manager.is_user_online(member)
+        ]
+        if offline:
+            delivery_outbox.record(offline, chat_id, message["message_id"], message["timestamp"])
+
+# Message fields a reaction toggle reads back (atomically, as they were before the toggle)
+REACTION_PROJECTION = {"_id": 0, "reactions": 1, "reaction_counts": 1, "emoji_counts": 1, "reaction_seq": 1, "reaction_version": 1}
+
+def reaction_emoji(emoji: Optional[str]) -> str:
+    """An emoji that is safe to use as a field name (reactions.<emoji>)"""
+    if not emoji or not isinstance(emoji, str):
+        raise HTTPException(status_code=400, detail="Emoji required")
+    if len(emoji) > 32 or "." in emoji or emoji.startswith("$"):
+        raise HTTPException(status_code=400, detail="Invalid emoji")
+    return emoji
+
+def reaction_state(before: dict, seq: int) -> dict:
+    """A copy of the reaction fields to apply this request's toggle to"""
+    return {
+        "reactions": {emoji: list(users) for emoji, users in (before.get("reactions") or {}).items()},
+        "reaction_counts": dict(before.get("reaction_counts") or {}),
+        "emoji_counts": dict(before.get("emoji_counts") or {}),
+        "seq": max(before.get("reaction_seq") or 0, seq)
+    }
+
+async def publish_reactions(chat_id: str, message_id: str, state: dict, changes: List[dict]):
+    """Reaction aggregator publisher: the message's latest reaction state plus recent toggles"""
+    members = await manager.chat_members.get_members(chat_id)
+    if members:
+        await manager.broadcast(
+            {"type": "message_reaction", "data": {"message_id": message_id, "chat_id": chat_id, **state, "changes": changes}},
+            members,
+            frame_type="message_reaction",
+            coalesce_key=f"reaction:{message_id}"
+        )
+
+# Reaction storms reach each member as one frame per message per window
+reaction_broadcasts = ReactionAggregator(publish_reactions, window=REALTIME_CONFIG['REACTION_BROADCAST_WINDOW'])
+
+# Sends are group-committed; the response waits for the write, not the fan-out
+message_pipeline = MessagePipeline(
+    write_message_batch,
+    update_chat_last_messages,
+    fan_out_messages,
+    window=REALTIME_CONFIG['MESSAGE_COMMIT_WINDOW'],
+    max_batch=REALTIME_CONFIG['MESSAGE_COMMIT_MAX_BATCH']
+)
+
+@app.on_event("startup")
+async def start_realtime_services():
+    """Start realtime background services"""
+    heartbeat.start()
+    presence_writer.start()
+    call_signaling.start()
+    try:
+        await db.game_moves.create_index([("room_id", 1), ("from_seq", 1)])
+    except Exception as e:
+        logging.error(f"Failed to create game move log index: {e}")
+    try:
+        await db.delivery_outbox.create_index([("user_id", 1), ("message_id", 1)], unique=True)
+        await db.delivery_outbox.create_index([("user_id", 1), ("created_at", 1)])
+        await db.delivery_outbox.create_index("created_at", expireAfterSeconds=REALTIME_CONFIG['OUTBOX_TTL'])
+        await db.chat_receipts.create_index([("chat_id", 1), ("user_id", 1)], unique=True)
+    except Exception as e:
+        logging.error(f"Failed to create delivery outbox indexes: {e}")
+    try:
+        await db.chat_sequences.create_index("chat_id", unique=True)
+        await db.messages.create_index([("chat_id", 1), ("updated_seq", 1)])
+        # Keyset pagination: every history page is one range scan
+        await db.messages.create_index([("chat_id", 1), ("timestamp", 1), ("message_id", 1)])
+        await db.e2e_messages.create_index([("conversation_id", 1), ("timestamp", 1), ("message_id", 1)])
+    except Exception as e:
+        logging.error(f"Failed to create chat sync indexes: {e}")
+    try:
+        # Concurrent toggles by one user cannot add the same reaction twice
+        await db.emoji_reactions.create_index([("message_id", 1), ("user_id", 1), ("emoji", 1)], unique=True)
+    except Exception as e:
+        logging.error(f"Failed to create emoji reaction index: {e}")
+    try:
+        await db.chat_inbox.create_index([("user_id", 1), ("chat_id", 1)], unique=True)
+        await db.chat_inbox.create_index([("user_id", 1), ("sort_key", -1)])
+        await db.chat_inbox.create_index("chat_id")
+        await db.chat_inbox.create_index("peer.user_id", sparse=True)
+    except Exception as e:
+        logging.error(f"Failed to create chat inbox indexes: {e}")
+    message_pipeline.start()
+    reaction_broadcasts.start()
+    delivery_outbox.start()
+    receipt_watermarks.start()
+    game_rooms.start()
+    manager.typing.start()
+    manager.presence.start()
+    manager.inbox.start()
+    manager.call_quality.start()
+    if manager.bus is not None:
+        try:
+            await manager.bus.start()
+        except Exception as e:
+            logging.error(f"Fan-out bus unavailable, running single-worker: {e}")
+            manager.bus = None
+    await manager.cluster.start(manager.bus)
+    await game_router.start(manager.bus)
+    if manager.bus is not None:
+        logging.warning("Matchmaking queues are per worker; route /games/matchmaking to a single worker")
+    matchmaker.start()
+
+@app.on_event("shutdown")
+async def stop_realtime_services():
+    """Stop realtime background services"""
+    await heartbeat.stop()
+    await manager.typing.stop()
+    await manager.presence.stop()
+    await manager.call_quality.stop()
+    await presence_writer.stop()
+    await message_pipeline.stop()
+    await reaction_broadcasts.stop()
+    await manager.inbox.stop()
+    await delivery_outbox.stop()
+    await receipt_watermarks.stop()
+    await call_signaling.stop()
+    await matchmaker.stop()
+    await game_router.stop()
+    await game_rooms.stop()
+    await manager.cluster.stop()
+    if manager.bus is not None:
+        await manager.bus.stop()
+
 # Enhanced Models
 class User(BaseModel):
     user_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -735,6 +1440,8 @@ class Message(BaseModel):
     reply_to: Optional[str] = None
     forward_from: Optional[str] = None
     reactions: Dict[str, List[str]] = Field(default_factory=dict)
+    reaction_counts: Dict[str, int] = Field(default_factory=dict)  # emoji -> len(reactions[emoji])
+    emoji_counts: Dict[str, int] = Field(default_factory=dict)  # emoji -> emoji_reactions documents
     mentions: List[str] = Field(default_factory=list)
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     edited_at: Optional[datetime] = None
@@ -746,6 +1453,8 @@ class Message(BaseModel):
     is_deleted: bool = False
     is_pinned: bool = False
     thread_id: Optional[str] = None
+    seq: Optional[int] = None  # per-chat sequence of the insert
+    updated_seq: Optional[int] = None  # per-chat sequence of the latest mutation
 
 class Chat(BaseModel):
     chat_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -1247,6 +1956,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
+async def get_admin_user(current_user = Depends(get_current_user)):
+    """Users listed in ADMIN_USER_IDS or flagged is_admin; everyone else gets a 403"""
+    if current_user["user_id"] not in ADMIN_USER_IDS and not current_user.get("is_admin"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 async def check_user_blocked(user1_id: str, user2_id: str) -> bool:
     """Check if user1 has blocked user2 or vice versa"""
     block = await db.blocked_users.find_one({
@@ -1437,6 +2152,7 @@ async def cleanup_expired_chats():
             
             # Delete the chat itself
             await db.chats.delete_one({"chat_id": chat["chat_id"]})
+            await manager.chat_removed(chat["chat_id"])
             
             print(f"✅ Cleaned up expired temporary chat: {chat['chat_id']}")
             
@@ -1721,10 +2437,7 @@ async def login(request: Request, login_data: UserLogin):
         await security_manager.log_failed_attempt(client_ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    await db.users.update_one(
-        {"user_id": user["user_id"]},
-        {"$set": {"is_online": True, "last_seen": datetime.utcnow()}}
-    )
+    presence_writer.mark(user["user_id"], True)
     
     access_token = create_access_token(data={"sub": user["user_id"]})
     
@@ -1771,6 +2484,8 @@ async def update_profile(profile_data: dict, current_user = Depends(get_current_
         )
     
     updated_user = await db.users.find_one({"user_id": current_user["user_id"]})
+    if update_data:
+        manager.inbox.peer_updated(inbox_peer(updated_user))
     return serialize_mongo_doc({
         "user_id": updated_user["user_id"],
         "username": updated_user["username"],
@@ -2000,6 +2715,7 @@ async def complete_profile(profile_data: dict, current_user = Depends(get_curren
     
     # Return updated user
     updated_user = await db.users.find_one({"user_id": current_user["user_id"]})
+    manager.inbox.peer_updated(inbox_peer(updated_user))
     return serialize_mongo_doc({
         "user_id": updated_user["user_id"],
         "username": updated_user["username"],
@@ -2182,7 +2898,7 @@ async def get_voice_rooms(current_user = Depends(get_current_user)):
     
     # Add current participant info
     for room in rooms:
-        room["current_participants"] = manager.voice_rooms.get(room["room_id"], [])
+        room["current_participants"] = list(manager.voice.members(room["room_id"]))
         room["participant_count"] = len(room["current_participants"])
     
     return serialize_mongo_doc(rooms)
@@ -2193,16 +2909,12 @@ async def join_voice_room(room_id: str, current_user = Depends(get_current_user)
     if not room:
         raise HTTPException(status_code=404, detail="Voice room not found")
     
-    current_count = len(manager.voice_rooms.get(room_id, []))
+    current_count = manager.voice.count(room_id)
     if current_count >= room["max_participants"]:
         raise HTTPException(status_code=400, detail="Room is full")
     
     # Add to participants
-    if room_id not in manager.voice_rooms:
-        manager.voice_rooms[room_id] = []
-    
-    if current_user["user_id"] not in manager.voice_rooms[room_id]:
-        manager.voice_rooms[room_id].append(current_user["user_id"])
+    manager.voice.join(room_id, current_user["user_id"])
     
     # Notify other participants
     await manager.broadcast_to_voice_room(
@@ -2218,7 +2930,7 @@ async def join_voice_room(room_id: str, current_user = Depends(get_current_user)
         current_user["user_id"]
     )
     
-    return {"status": "joined", "participants": manager.voice_rooms[room_id]}
+    return {"status": "joined", "participants": list(manager.voice.members(room_id))}
 
 # Advanced Calls with Screen Sharing
 @api_router.post("/calls/initiate")
@@ -2237,6 +2949,7 @@ async def initiate_call(call_data: dict, current_user = Depends(get_current_user
     
     call_dict = call.dict()
     await db.voice_calls.insert_one(call_dict)
+    call_signaling.register(call_dict)
     
     # Notify all participants
     await manager.broadcast_to_chat(
@@ -2252,11 +2965,11 @@ async def initiate_call(call_data: dict, current_user = Depends(get_current_user
 
 @api_router.post("/calls/{call_id}/screen-share")
 async def toggle_screen_share(call_id: str, enable: bool, current_user = Depends(get_current_user)):
-    call = await db.voice_calls.find_one({"call_id": call_id})
+    call = await call_signaling.get(call_id)
     if not call:
         raise HTTPException(status_code=404, detail="Call not found")
     
-    if current_user["user_id"] not in call["participants"]:
+    if current_user["user_id"] not in call.participants:
         raise HTTPException(status_code=403, detail="Not in this call")
     
     # Update screen sharing status
@@ -2264,6 +2977,10 @@ async def toggle_screen_share(call_id: str, enable: bool, current_user = Depends
         {"call_id": call_id},
         {"$set": {"screen_sharing_enabled": enable}}
     )
+    if enable:
+        manager.screen_shares.set(call_id, current_user["user_id"])
+    elif manager.screen_shares.owner(call_id) == current_user["user_id"]:
+        manager.screen_shares.clear(call_id)
     
     # Notify participants
     await manager.broadcast_to_chat(
@@ -2275,7 +2992,7 @@ async def toggle_screen_share(call_id: str, enable: bool, current_user = Depends
                 "enabled": enable
             }
         }),
-        call["chat_id"],
+        call.chat_id,
         current_user["user_id"]
     )
     
@@ -2284,18 +3001,19 @@ async def toggle_screen_share(call_id: str, enable: bool, current_user = Depends
 @api_router.put("/calls/{call_id}/respond")
 async def respond_to_call(call_id: str, response_data: dict, current_user = Depends(get_current_user)):
     """Respond to an incoming call (accept/decline)"""
-    call = await db.voice_calls.find_one({"call_id": call_id})
+    call = await call_signaling.get(call_id)
     if not call:
         raise HTTPException(status_code=404, detail="Call not found")
     
-    if current_user["user_id"] not in call["participants"]:
+    if current_user["user_id"] not in call.participants:
         raise HTTPException(status_code=403, detail="Not in this call")
     
     action = response_data.get("action")  # "accept" or "decline"
     
     if action == "accept":
         # Update call status to active if caller accepts or if it's not the caller
-        if call["status"] == "ringing":
+        if call.status == "ringing":
+            await call_state_changed(call_id, "active")
             await db.voice_calls.update_one(
                 {"call_id": call_id},
                 {"$set": {"status": "active"}}
@@ -2311,7 +3029,7 @@ async def respond_to_call(call_id: str, response_data: dict, current_user = Depe
                     "user_name": current_user.get("display_name", current_user["username"])
                 }
             }),
-            call["chat_id"],
+            call.chat_id,
             current_user["user_id"]
         )
         
@@ -2319,6 +3037,7 @@ async def respond_to_call(call_id: str, response_data: dict, current_user = Depe
         
     elif action == "decline":
         # Update call status to declined
+        await call_state_changed(call_id, "declined")
         await db.voice_calls.update_one(
             {"call_id": call_id},
             {
@@ -2339,7 +3058,7 @@ async def respond_to_call(call_id: str, response_data: dict, current_user = Depe
                     "user_name": current_user.get("display_name", current_user["username"])
                 }
             }),
-            call["chat_id"],
+            call.chat_id,
             current_user["user_id"]
         )
         
@@ -2351,28 +3070,38 @@ async def respond_to_call(call_id: str, response_data: dict, current_user = Depe
 @api_router.put("/calls/{call_id}/end")
 async def end_call(call_id: str, current_user = Depends(get_current_user)):
     """End an active call"""
-    call = await db.voice_calls.find_one({"call_id": call_id})
+    call = await call_signaling.get(call_id)
     if not call:
         raise HTTPException(status_code=404, detail="Call not found")
     
-    if current_user["user_id"] not in call["participants"]:
+    if current_user["user_id"] not in call.participants:
         raise HTTPException(status_code=403, detail="Not in this call")
+    await call_state_changed(call_id, "ended")
     
     # Calculate duration if call was active
     duration = 0
-    if call["status"] == "active" and call.get("started_at"):
-        duration = int((datetime.utcnow() - call["started_at"]).total_seconds())
+    if call.status == "active" and call.started_at:
+        duration = int((datetime.utcnow() - call.started_at).total_seconds())
+    
+    update = {
+        "status": "ended",
+        "ended_at": datetime.utcnow(),
+        "duration": duration
+    }
+    
+    # Persist the call's quality summary (written to call_quality) and its headline numbers
+    quality = await manager.call_quality.finish(call_id)
+    if quality:
+        metrics = quality["metrics"]
+        if metrics["rtt_ms"]["count"]:
+            update["quality_metrics.avg_latency"] = metrics["rtt_ms"]["mean"]
+        if metrics["packet_loss"]["count"]:
+            update["quality_metrics.packet_loss"] = metrics["packet_loss"]["mean"]
     
     # Update call status to ended
     await db.voice_calls.update_one(
         {"call_id": call_id},
-        {
-            "$set": {
-                "status": "ended",
-                "ended_at": datetime.utcnow(),
-                "duration": duration
-            }
-        }
+        {"$set": update}
     )
     
     # Notify all participants
@@ -2385,90 +3114,37 @@ async def end_call(call_id: str, current_user = Depends(get_current_user)):
                 "duration": duration
             }
         }),
-        call["chat_id"],
+        call.chat_id,
         current_user["user_id"]
     )
     
     return {"status": "ended", "call_id": call_id, "duration": duration}
 
+async def relay_call_signal(call_id: str, user_id: str, kind: str, data: dict):
+    """HTTP fallback for signaling; clients with an open socket send webrtc_* frames instead"""
+    try:
+        await call_signaling.relay(call_id, user_id, kind, data, to_user_id=data.get("to_user_id"))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Call not found")
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Not in this call")
+
 @api_router.post("/calls/{call_id}/webrtc/offer")
 async def exchange_webrtc_offer(call_id: str, offer_data: dict, current_user = Depends(get_current_user)):
     """Exchange WebRTC offer for peer-to-peer connection"""
-    call = await db.voice_calls.find_one({"call_id": call_id})
-    if not call:
-        raise HTTPException(status_code=404, detail="Call not found")
-    
-    if current_user["user_id"] not in call["participants"]:
-        raise HTTPException(status_code=403, detail="Not in this call")
-    
-    # Broadcast WebRTC offer to other participants
-    await manager.broadcast_to_chat(
-        json.dumps({
-            "type": "webrtc_offer",
-            "data": {
-                "call_id": call_id,
-                "from_user_id": current_user["user_id"],
-                "offer": offer_data.get("offer"),
-                "ice_candidates": offer_data.get("ice_candidates", [])
-            }
-        }),
-        call["chat_id"],
-        current_user["user_id"]
-    )
-    
+    await relay_call_signal(call_id, current_user["user_id"], "offer", offer_data)
     return {"status": "offer_sent"}
 
 @api_router.post("/calls/{call_id}/webrtc/answer")
 async def exchange_webrtc_answer(call_id: str, answer_data: dict, current_user = Depends(get_current_user)):
     """Exchange WebRTC answer for peer-to-peer connection"""
-    call = await db.voice_calls.find_one({"call_id": call_id})
-    if not call:
-        raise HTTPException(status_code=404, detail="Call not found")
-    
-    if current_user["user_id"] not in call["participants"]:
-        raise HTTPException(status_code=403, detail="Not in this call")
-    
-    # Broadcast WebRTC answer to other participants
-    await manager.broadcast_to_chat(
-        json.dumps({
-            "type": "webrtc_answer",
-            "data": {
-                "call_id": call_id,
-                "from_user_id": current_user["user_id"],
-                "answer": answer_data.get("answer"),
-                "ice_candidates": answer_data.get("ice_candidates", [])
-            }
-        }),
-        call["chat_id"],
-        current_user["user_id"]
-    )
-    
+    await relay_call_signal(call_id, current_user["user_id"], "answer", answer_data)
     return {"status": "answer_sent"}
 
 @api_router.post("/calls/{call_id}/webrtc/ice")
 async def exchange_ice_candidate(call_id: str, ice_data: dict, current_user = Depends(get_current_user)):
-    """Exchange ICE candidates for WebRTC connection"""
-    call = await db.voice_calls.find_one({"call_id": call_id})
-    if not call:
-        raise HTTPException(status_code=404, detail="Call not found")
-    
-    if current_user["user_id"] not in call["participants"]:
-        raise HTTPException(status_code=403, detail="Not in this call")
-    
-    # Broadcast ICE candidate to other participants
-    await manager.broadcast_to_chat(
-        json.dumps({
-            "type": "webrtc_ice",
-            "data": {
-                "call_id": call_id,
-                "from_user_id": current_user["user_id"],
-                "candidate": ice_data.get("candidate")
-            }
-        }),
-        call["chat_id"],
-        current_user["user_id"]
-    )
-    
+    """Exchange ICE candidates for WebRTC connection (batched before delivery)"""
+    await relay_call_signal(call_id, current_user["user_id"], "ice", ice_data)
     return {"status": "ice_sent"}
 
 # Public Discovery
@@ -2524,101 +3200,133 @@ async def discover_channels(query: Optional[str] = None, category: Optional[str]
 # Enhanced messaging continues with existing functionality...
 # (All previous message, chat, contact, blocking functionality remains the same)
 
+async def receive_ws_frame(websocket: WebSocket, codec) -> dict:
+    """Next client frame: binary in the negotiated codec, text always JSON; malformed frames are dropped"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        try:
+            if message.get("bytes") is not None:
+                frame = codec.decode(message["bytes"])
+            else:
+                frame = json.loads(message.get("text") or "")
+        except (FrameError, ValueError) as e:
+            logging.warning(f"Dropped malformed WebSocket frame: {e}")
+            continue
+        if isinstance(frame, dict) and "type" in frame:
+            return frame
+        logging.warning("Dropped WebSocket frame without a type")
+
 # WebSocket endpoint with enhanced features and timeout handling
 @api_router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     connection_id = await manager.connect(websocket, user_id)
+    codec = manager.registry.codec(connection_id)
     
-    await db.users.update_one(
-        {"user_id": user_id},
-        {"$set": {"is_online": True, "last_seen": datetime.utcnow()}}
-    )
+    async def send_ping():
+        manager.registry.send_to_connection(
+            connection_id,
+            json.dumps({"type": "ping", "timestamp": time.time()}),
+            frame_type="ping"
+        )
     
-    # Heartbeat configuration
-    last_heartbeat = time.time()
-    heartbeat_interval = 30  # Send heartbeat every 30 seconds
-    timeout_threshold = 60  # Disconnect if no response for 60 seconds
+    async def close_idle():
+        await websocket.close(code=1001)
+    
+    heartbeat.register(connection_id, send_ping, close_idle)
     
     try:
+        # Only what was missed while offline, instead of re-downloading whole chats
+        await send_missed_messages(connection_id, user_id)
+        
         while True:
-            try:
-                # Wait for message with timeout
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=heartbeat_interval)
-                message_data = json.loads(data)
-                last_heartbeat = time.time()
+            message_data = await receive_ws_frame(websocket, codec)
+            heartbeat.touch(connection_id)
+            
+            if message_data["type"] == "pong":
+                continue
+            elif message_data["type"] == "ack":
+                delivery_outbox.ack(user_id, list(message_data.get("message_ids", [])))
+                if message_data.get("drain"):
+                    await send_missed_messages(connection_id, user_id)
+            elif message_data["type"] == "receipt":
+                try:
+                    await mark_receipt(message_data.get("chat_id", ""), user_id, message_data)
+                except HTTPException as e:
+                    manager.registry.send_to_connection(
+                        connection_id,
+                        json.dumps({"type": "receipt_error", "data": {"chat_id": message_data.get("chat_id"), "error": e.detail}})
+                    )
+            elif message_data["type"] == "typing":
+                await manager.broadcast_typing(
+                    message_data["chat_id"],
+                    user_id,
+                    message_data["is_typing"]
+                )
+            elif message_data["type"] == "join_voice_room":
+                room_id = message_data["room_id"]
+                manager.voice.join(room_id, user_id)
                 
-                if message_data["type"] == "pong":
-                    # Update heartbeat timestamp
-                    last_heartbeat = time.time()
-                    continue
-                elif message_data["type"] == "typing":
-                    await manager.broadcast_typing(
-                        message_data["chat_id"],
+                await manager.broadcast_to_voice_room(
+                    json.dumps({
+                        "type": "user_joined_voice",
+                        "data": {"room_id": room_id, "user_id": user_id}
+                    }),
+                    room_id,
+                    user_id
+                )
+            elif message_data["type"] == "user_status":
+                # Contacts receive it in the next batched presence_diff
+                manager.presence.update(user_id, {
+                    "status": message_data.get("status", "online"),
+                    "activity": message_data.get("activity"),
+                    "game": message_data.get("game")
+                })
+            elif message_data["type"] == "presence_query":
+                manager.registry.send_to_connection(
+                    connection_id,
+                    json.dumps({
+                        "type": "presence_snapshot",
+                        "data": manager.presence_snapshot(list(message_data.get("user_ids", [])))
+                    })
+                )
+            elif message_data["type"] in ("webrtc_offer", "webrtc_answer", "webrtc_ice"):
+                # Same frames as the /calls/{call_id}/webrtc/* endpoints, without a request per signal
+                try:
+                    await call_signaling.relay(
+                        message_data.get("call_id"),
                         user_id,
-                        message_data["is_typing"]
+                        message_data["type"][len("webrtc_"):],
+                        message_data,
+                        to_user_id=message_data.get("to_user_id")
                     )
-                elif message_data["type"] == "join_voice_room":
-                    room_id = message_data["room_id"]
-                    if room_id not in manager.voice_rooms:
-                        manager.voice_rooms[room_id] = []
-                    if user_id not in manager.voice_rooms[room_id]:
-                        manager.voice_rooms[room_id].append(user_id)
-                    
-                    await manager.broadcast_to_voice_room(
-                        json.dumps({
-                            "type": "user_joined_voice",
-                            "data": {"room_id": room_id, "user_id": user_id}
-                        }),
-                        room_id,
-                        user_id
+                except (LookupError, PermissionError) as e:
+                    manager.registry.send_to_connection(
+                        connection_id,
+                        json.dumps({"type": "webrtc_error", "data": {"call_id": message_data.get("call_id"), "error": str(e)}})
                     )
-                elif message_data["type"] == "user_status":
-                    manager.user_status[user_id] = {
-                        "status": message_data.get("status", "online"),
-                        "activity": message_data.get("activity"),
-                        "game": message_data.get("game")
-                    }
-                    
-                    # Broadcast status to contacts
-                    contacts = await db.contacts.find({"contact_user_id": user_id}).to_list(100)
-                    for contact in contacts:
-                        await manager.send_personal_message(
-                            json.dumps({
-                                "type": "status_update",
-                                "data": {
-                                    "user_id": user_id,
-                                    "status": manager.user_status[user_id]
-                                }
-                            }),
-                            contact["user_id"]
-                        )
-                
-            except asyncio.TimeoutError:
-                # Send heartbeat ping
-                current_time = time.time()
-                if current_time - last_heartbeat > timeout_threshold:
-                    # Connection timed out
-                    break
-                
-                try:
-                    await websocket.send_json({
-                        "type": "ping",
-                        "timestamp": current_time
-                    })
-                except:
-                    # Connection is broken
-                    break
+            elif message_data["type"] == "call_quality":
+                # Periodic client sample: folded into histograms, never stored raw
+                call = await call_signaling.get(message_data.get("call_id", ""))
+                if call is not None and user_id in call.participants:
+                    manager.call_quality.record(call.call_id, user_id, message_data, region=message_data.get("region"))
                     
     except WebSocketDisconnect:
         pass
     except Exception as e:
         logging.error(f"WebSocket error for user {user_id}: {str(e)}")
     finally:
-        manager.disconnect(connection_id, user_id)
-        await db.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"is_online": False, "last_seen": datetime.utcnow()}}
-        )
+        heartbeat.unregister(connection_id)
+        await manager.disconnect(connection_id, user_id)
+
+@api_router.post("/presence/query")
+async def query_presence(query_data: dict, current_user = Depends(get_current_user)):
+    """Bulk presence lookup for up to PRESENCE_QUERY_LIMIT users, served from memory"""
+    user_ids = query_data.get("user_ids", [])
+    if not isinstance(user_ids, list):
+        raise HTTPException(status_code=400, detail="user_ids must be a list")
+    return {"presence": manager.presence_snapshot(user_ids)}
 
 # E2E ENCRYPTION ENDPOINTS - Zero Knowledge Implementation
 
@@ -2814,8 +3522,14 @@ async def send_e2e_message(request: Request, message: E2EMessage, current_user =
         raise HTTPException(status_code=500, detail=f"Failed to store E2E message: {str(e)}")
 
 @api_router.get("/e2e/messages/{conversation_id}")
-async def get_e2e_messages(conversation_id: str, current_user = Depends(get_current_user), limit: int = 50, offset: int = 0):
-    """Get encrypted E2E messages for a conversation"""
+async def get_e2e_messages(
+    conversation_id: str,
+    current_user = Depends(get_current_user),
+    limit: int = 50,
+    offset: int = 0,
+    before: str = None
+):
+    """Get encrypted E2E messages for a conversation; page back with `before` (offset is deprecated)"""
     try:
         # Verify user is part of this conversation
         sender_id, recipient_id = conversation_id.split('_', 1)
@@ -2823,9 +3537,17 @@ async def get_e2e_messages(conversation_id: str, current_user = Depends(get_curr
             raise HTTPException(status_code=403, detail="Access denied to this conversation")
         
         # Fetch encrypted messages
-        messages = await db.e2e_messages.find({
-            "conversation_id": conversation_id
-        }).sort("timestamp", -1).skip(offset).limit(limit).to_list(limit)
+        limit = max(1, min(limit, REALTIME_CONFIG['MESSAGE_PAGE_MAX']))
+        if offset and not before:
+            messages = await db.e2e_messages.find({
+                "conversation_id": conversation_id
+            }).sort("timestamp", -1).skip(offset).limit(limit).to_list(limit)
+            messages.reverse()
+            more = len(messages) == limit
+        else:
+            messages, more = await fetch_message_page(
+                db.e2e_messages, {"conversation_id": conversation_id}, limit, before=before
+            )
         
         # Mark messages as delivered for current user
         await db.e2e_messages.update_many(
@@ -2837,7 +3559,10 @@ async def get_e2e_messages(conversation_id: str, current_user = Depends(get_curr
             {"$set": {"delivered": True}}
         )
         
-        return {"messages": [serialize_mongo_doc(msg) for msg in reversed(messages)]}
+        return {
+            "messages": [serialize_mongo_doc(msg) for msg in messages],
+            "before_cursor": encode_page_cursor(messages[0]) if messages and more else None
+        }
         
     except HTTPException:
         raise
@@ -2860,57 +3585,74 @@ async def refresh_one_time_prekeys(request: Request, new_keys: List[str], curren
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to refresh pre-keys: {str(e)}")
 
+def temporary_chat_info(chat: dict) -> Optional[dict]:
+    expires_at = chat.get("expires_at")
+    if not chat.get("is_temporary", False) or not expires_at:
+        return None
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
+    return {
+        "expires_at": expires_at.isoformat(),
+        "time_remaining": format_time_remaining(expires_at),
+        "expiry_duration": chat.get("expiry_duration", ""),
+        "is_expired": expires_at < datetime.utcnow()
+    }
+
+async def backfill_chat_inbox(user_id: str):
+    """Inbox rows for chats that predate the inbox, built from the chats themselves (once per user)"""
+    chats = await db.chats.find({"members": user_id}).to_list(None)
+    peer_ids = list({peer_id for peer_id in (direct_peer_id(chat, user_id) for chat in chats) if peer_id})
+    peers = await load_inbox_peers(peer_ids) if peer_ids else {}
+    rows = []
+    for chat in chats:
+        last_message = message_preview(chat["last_message"]) if chat.get("last_message") else None
+        rows.append({
+            "user_id": user_id,
+            "chat_id": chat["chat_id"],
+            "chat": chat_summary(chat),
+            "peer": peers.get(direct_peer_id(chat, user_id)),
+            "last_message": last_message,
+            "unread_count": 0,
+            "sort_key": (last_message or {}).get("timestamp") or chat.get("created_at") or datetime.utcnow()
+        })
+    if rows:
+        # $setOnInsert: rows the live path already maintains win
+        await db.chat_inbox.bulk_write([
+            UpdateOne({"user_id": user_id, "chat_id": row["chat_id"]}, {"$setOnInsert": row}, upsert=True)
+            for row in rows
+        ], ordered=False)
+    await db.users.update_one({"user_id": user_id}, {"$set": {"inbox_backfilled_at": datetime.utcnow()}})
+
 # Original message endpoints (for backward compatibility)
 @api_router.get("/chats")
 async def get_chats(current_user = Depends(get_current_user)):
-    """Get all chats for the current user"""
-    chats = await db.chats.find({
-        "members": current_user["user_id"]
-    }).to_list(100)
+    """Get all chats for the current user, most recent activity first (one indexed inbox query)"""
+    if not current_user.get("inbox_backfilled_at"):
+        await backfill_chat_inbox(current_user["user_id"])
+    rows = await db.chat_inbox.find(
+        {"user_id": current_user["user_id"]}
+    ).sort("sort_key", -1).to_list(100)
+    # Rows give the order, unread counts and peers; the chat documents themselves are read
+    # fresh (one $in query) so settings written outside the inbox hooks are never stale
+    chat_ids = [row["chat_id"] for row in rows]
+    current = {
+        chat["chat_id"]: chat
+        for chat in await db.chats.find({"chat_id": {"$in": chat_ids}}).to_list(len(chat_ids))
+    }
     
-    # Get last message for each chat and serialize
-    for chat in chats:
-        if chat.get("last_message"):
-            # Get the actual last message
-            last_msg = await db.messages.find_one(
-                {"chat_id": chat["chat_id"]},
-                sort=[("timestamp", -1)]
-            )
-            if last_msg:
-                chat["last_message"] = serialize_mongo_doc(last_msg)
-        
-        # Add temporary chat status information
-        if chat.get("is_temporary", False):
-            expires_at = chat.get("expires_at")
-            if expires_at:
-                if isinstance(expires_at, str):
-                    expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-                
-                chat["temporary_info"] = {
-                    "expires_at": expires_at.isoformat(),
-                    "time_remaining": format_time_remaining(expires_at),
-                    "expiry_duration": chat.get("expiry_duration", ""),
-                    "is_expired": expires_at < datetime.utcnow()
-                }
-        
-        # Get other chat member info for direct chats
-        if chat.get("chat_type") == "direct" or chat.get("type") == "direct":
-            other_member_id = next(
-                (member for member in chat["members"] if member != current_user["user_id"]), 
-                None
-            )
-            if other_member_id:
-                other_user = await db.users.find_one({"user_id": other_member_id})
-                if other_user:
-                    chat["other_user"] = {
-                        "user_id": other_user["user_id"],
-                        "username": other_user["username"],
-                        "display_name": other_user.get("display_name"),
-                        "email": other_user.get("email"),
-                        "avatar": other_user.get("avatar"),
-                        "status_message": other_user.get("status_message"),
-                        "is_online": other_user.get("is_online", False)
-                    }
+    chats = []
+    for row in rows:
+        chat_doc = current.get(row["chat_id"])
+        if not chat_doc or current_user["user_id"] not in chat_doc.get("members", []):
+            continue  # removed since the row was written; the inbox deletes it on its next flush
+        chat = {**chat_doc, "last_message": row.get("last_message") or chat_doc.get("last_message"), "unread_count": row.get("unread_count", 0)}
+        temporary_info = temporary_chat_info(chat)
+        if temporary_info:
+            chat["temporary_info"] = temporary_info
+        peer = row.get("peer")
+        if peer:
+            chat["other_user"] = {**peer, "is_online": manager.is_user_online(peer["user_id"])}
+        chats.append(chat)
     
     return serialize_mongo_doc(chats)
 
@@ -2983,17 +3725,17 @@ async def create_chat(chat_data: dict, current_user = Depends(get_current_user))
     
     chat_dict = chat.dict()
     await db.chats.insert_one(chat_dict)
+    manager.cache_chat(chat_dict)
     
     # Notify other members via WebSocket
-    for member_id in chat.members:
-        if member_id != current_user["user_id"]:
-            await manager.send_personal_message(
-                json.dumps({
-                    "type": "new_chat",
-                    "data": serialize_mongo_doc(chat_dict)
-                }),
-                member_id
-            )
+    await manager.broadcast_to_users(
+        json.dumps({
+            "type": "new_chat",
+            "data": serialize_mongo_doc(chat_dict)
+        }),
+        chat.members,
+        exclude=current_user["user_id"]
+    )
     
     return serialize_mongo_doc(chat_dict)
 
@@ -3054,6 +3796,7 @@ async def create_temporary_chat(chat_data: TemporaryChatCreate, current_user = D
         
         chat_dict = chat.dict()
         await db.chats.insert_one(chat_dict)
+        manager.cache_chat(chat_dict)
         
         # Create initial system message
         welcome_message = {
@@ -3066,20 +3809,19 @@ async def create_temporary_chat(chat_data: TemporaryChatCreate, current_user = D
             "is_system": True,
             "is_encrypted": False
         }
-        await db.messages.insert_one(welcome_message)
-        
-        # Notify other members via WebSocket
-        for member_id in chat.members:
-            if member_id != current_user["user_id"]:
-                await manager.send_personal_message(
-                    json.dumps({
-                        "type": "new_temporary_chat",
-                        "data": serialize_mongo_doc(chat_dict),
-                        "expires_at": expires_at.isoformat(),
-                        "duration": chat_data.expiry_duration
-                    }),
-                    member_id
-                )
+        await db.messages.insert_one(welcome_message)
+        
+        # Notify other members via WebSocket
+        await manager.broadcast_to_users(
+            json.dumps({
+                "type": "new_temporary_chat",
+                "data": serialize_mongo_doc(chat_dict),
+                "expires_at": expires_at.isoformat(),
+                "duration": chat_data.expiry_duration
+            }),
+            chat.members,
+            exclude=current_user["user_id"]
+        )
         
         return {
             "chat": serialize_mongo_doc(chat_dict),
@@ -3139,6 +3881,7 @@ async def extend_temporary_chat(chat_id: str, extend_data: ExtendChatRequest, cu
                 }
             }
         )
+        manager.inbox.chat_updated(chat_id, {"expires_at": new_expiry})
         
         # Create system message about extension
         extension_message = {
@@ -3154,17 +3897,16 @@ async def extend_temporary_chat(chat_id: str, extend_data: ExtendChatRequest, cu
         await db.messages.insert_one(extension_message)
         
         # Notify all members
-        for member_id in chat["members"]:
-            await manager.send_personal_message(
-                json.dumps({
-                    "type": "chat_extended",
-                    "chat_id": chat_id,
-                    "new_expires_at": new_expiry.isoformat(),
-                    "extension": extend_data.extension_duration,
-                    "message": serialize_mongo_doc(extension_message)
-                }),
-                member_id
-            )
+        await manager.broadcast_to_users(
+            json.dumps({
+                "type": "chat_extended",
+                "chat_id": chat_id,
+                "new_expires_at": new_expiry.isoformat(),
+                "extension": extend_data.extension_duration,
+                "message": serialize_mongo_doc(extension_message)
+            }),
+            chat["members"]
+        )
         
         return {
             "success": True,
@@ -3218,47 +3960,225 @@ async def get_chat_status(chat_id: str, current_user = Depends(get_current_user)
         print(f"Error getting chat status: {e}")
         raise HTTPException(status_code=500, detail="Failed to get chat status")
 
+def encode_page_cursor(message: dict) -> str:
+    """Opaque position of a message in (timestamp, message_id) order"""
+    position = json.dumps([message["timestamp"].isoformat(), message["message_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+def decode_page_cursor(cursor: str):
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(timestamp), str(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_message_page(collection, query: dict, limit: int, before: str = None, after: str = None):
+    """
+    One keyset page in chronological order, plus whether more lie beyond it
+    
+    Walks (timestamp, message_id) backwards from `before`, forwards from
+    `after`, or backwards from the newest message when neither is given.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+    forward = bool(after)
+    cursor = before or after
+    if cursor:
+        timestamp, message_id = decode_page_cursor(cursor)
+        op = "$gt" if forward else "$lt"
+        query = {**query, "$or": [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "message_id": {op: message_id}}
+        ]}
+    direction = 1 if forward else -1
+    page = await collection.find(query).sort(
+        [("timestamp", direction), ("message_id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    more = len(page) > limit
+    page = page[:limit]
+    if not forward:
+        page.reverse()
+    return page, more
+
+async def decrypt_history_page(messages: List[dict], key: Optional[str]):
+    """Fill in `content` of the page's encrypted messages in one batch; plain ones are left alone"""
+    encrypted = [message for message in messages if message.get("is_encrypted") and message.get("encrypted_content")]
+    if key and encrypted:
+        contents = await MessageEncryption.decrypt_page([message["encrypted_content"] for message in encrypted], key)
+        for message, content in zip(encrypted, contents):
+            message["content"] = content
+
 @api_router.get("/chats/{chat_id}/messages")
-async def get_chat_messages(chat_id: str, current_user = Depends(get_current_user)):
-    """Get messages for a specific chat"""
+async def get_chat_messages(
+    chat_id: str,
+    response: Response,
+    before: str = None,
+    after: str = None,
+    limit: int = None,
+    current_user = Depends(get_current_user)
+):
+    """
+    Get a page of messages for a specific chat, oldest first
+    
+    Without a cursor this is the newest page. X-Before-Cursor is set when
+    older messages exist and X-After-Cursor when newer ones do; pass them
+    back as `before` / `after` to page. Callers that send neither a cursor
+    nor a limit do not page, so they get the newest MESSAGE_UNPAGED_LIMIT
+    messages as before.
+    """
     # Verify user is member of chat
-    chat = await db.chats.find_one({"chat_id": chat_id})
-    if not chat or current_user["user_id"] not in chat["members"]:
+    if not await manager.chat_members.is_member(chat_id, current_user["user_id"]):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    messages = await db.messages.find({
-        "chat_id": chat_id,
-        "is_deleted": {"$ne": True}
-    }).sort("timestamp", 1).to_list(1000)
-    
-    # Decrypt messages if user has access
-    for message in messages:
-        if message.get("is_encrypted") and message.get("encrypted_content"):
-            user_key = current_user.get("encryption_key")
-            if user_key:
-                try:
-                    decrypted = MessageEncryption.decrypt_message(
-                        message["encrypted_content"], 
-                        user_key
-                    )
-                    message["content"] = decrypted
-                except:
-                    message["content"] = "[Encrypted Message]"
+    if limit is None and not (before or after):
+        limit = REALTIME_CONFIG['MESSAGE_UNPAGED_LIMIT']
+    else:
+        limit = max(1, min(limit or REALTIME_CONFIG['MESSAGE_PAGE_SIZE'], REALTIME_CONFIG['MESSAGE_PAGE_MAX']))
+    messages, more = await fetch_message_page(
+        db.messages, {"chat_id": chat_id, "is_deleted": {"$ne": True}}, limit, before=before, after=after
+    )
+    if messages:
+        # More lies beyond the page in the direction walked; the cursor's own side always has more
+        older = True if after else more
+        newer = more if after else bool(before)
+        if older:
+            response.headers["X-Before-Cursor"] = encode_page_cursor(messages[0])
+        if newer:
+            response.headers["X-After-Cursor"] = encode_page_cursor(messages[-1])
+    
+    # Decrypt messages if user has access (the whole page in one batch)
+    await decrypt_history_page(messages, current_user.get("encryption_key"))
     
     return serialize_mongo_doc(messages)
 
+@api_router.get("/chats/{chat_id}/sync")
+async def sync_chat(chat_id: str, since: int = 0, limit: int = None, current_user = Depends(get_current_user)):
+    """
+    Everything that changed in a chat after sequence `since`
+    
+    Each changed message appears once in its latest state: new messages in
+    full, then compact edit, delete and reaction entries for messages the
+    client already has. Store the returned `seq` and pass it as `since` next
+    time; `more` means another page is waiting.
+    """
+    if not await manager.chat_members.is_member(chat_id, current_user["user_id"]):
+        raise HTTPException(status_code=403, detail="Access denied")
+    page = max(1, min(limit or REALTIME_CONFIG['SYNC_PAGE_LIMIT'], REALTIME_CONFIG['SYNC_PAGE_LIMIT']))
+    
+    changed = await db.messages.find(
+        {"chat_id": chat_id, "updated_seq": {"$gt": since}}
+    ).sort("updated_seq", 1).limit(page + 1).to_list(page + 1)
+    more = len(changed) > page
+    changed = changed[:page]
+    head = changed[-1]["updated_seq"] if more else max(await current_chat_seq(chat_id), since)
+    
+    inserts, edits, deletes, reaction_ids = [], [], [], []
+    for message in changed:
+        if message.get("seq", 0) > since:
+            # Never seen by this client: send the current state, or nothing if already gone
+            if not message.get("is_deleted"):
+                inserts.append(message)
+            continue
+        if message.get("is_deleted"):
+            deletes.append(message["message_id"])
+            continue
+        if message.get("edit_seq", 0) > since:
+            edits.append({
+                "message_id": message["message_id"],
+                "content": message.get("content"),
+                "edited_at": message.get("edited_at"),
+                "seq": message["edit_seq"]
+            })
+        if message.get("reaction_seq", 0) > since:
+            reaction_ids.append(message["message_id"])
+    
+    reactions = []
+    if reaction_ids:
+        by_id = {message["message_id"]: message for message in changed}
+        # Counts are maintained on the message; only older messages need their reactions counted
+        uncounted = [message_id for message_id in reaction_ids if "emoji_counts" not in by_id[message_id]]
+        emoji_counts: Dict[str, Dict[str, int]] = {}
+        if uncounted:
+            for reaction in await db.emoji_reactions.find(
+                {"message_id": {"$in": uncounted}}, {"message_id": 1, "emoji": 1}
+            ).to_list(None):
+                counts = emoji_counts.setdefault(reaction["message_id"], {})
+                counts[reaction["emoji"]] = counts.get(reaction["emoji"], 0) + 1
+        reactions = [
+            {
+                "message_id": message_id,
+                "reactions": by_id[message_id].get("reactions", {}),
+                "reaction_counts": by_id[message_id].get("reaction_counts") or {
+                    emoji: len(users) for emoji, users in by_id[message_id].get("reactions", {}).items()
+                },
+                "emoji_counts": by_id[message_id].get("emoji_counts", emoji_counts.get(message_id, {})),
+                "seq": by_id[message_id]["reaction_seq"]
+            }
+            for message_id in reaction_ids
+        ]
+    
+    return serialize_mongo_doc({
+        "chat_id": chat_id,
+        "since": since,
+        "seq": chat_sequences.stable(chat_id, head),
+        "more": more,
+        "inserts": inserts,
+        "edits": edits,
+        "deletes": deletes,
+        "reactions": reactions
+    })
+
+@api_router.get("/outbox")
+async def get_outbox(current_user = Depends(get_current_user)):
+    """Messages missed while offline, oldest first; ack them to get the next batch"""
+    messages, more = await delivery_outbox.drain(current_user["user_id"])
+    return {"messages": messages, "more": more}
+
+@api_router.post("/outbox/ack")
+async def ack_outbox(ack_data: dict, current_user = Depends(get_current_user)):
+    """Confirm receipt of missed messages"""
+    message_ids = ack_data.get("message_ids", [])
+    if not isinstance(message_ids, list):
+        raise HTTPException(status_code=400, detail="message_ids must be a list")
+    delivery_outbox.ack(current_user["user_id"], message_ids)
+    return {"acked": len(message_ids)}
+
+@api_router.post("/chats/{chat_id}/receipts")
+async def post_receipt(chat_id: str, receipt_data: dict, current_user = Depends(get_current_user)):
+    """Mark everything in the chat up to `up_to` as delivered or read"""
+    await mark_receipt(chat_id, current_user["user_id"], receipt_data)
+    return {"message": "Receipt recorded"}
+
+@api_router.get("/chats/{chat_id}/receipts")
+async def get_receipts(chat_id: str, current_user = Depends(get_current_user)):
+    """Delivered/read watermarks of every member"""
+    if not await manager.chat_members.is_member(chat_id, current_user["user_id"]):
+        raise HTTPException(status_code=403, detail="Access denied")
+    receipts = await db.chat_receipts.find({"chat_id": chat_id}, {"_id": 0}).to_list(1000)
+    hidden = {
+        user["user_id"]
+        for user in await db.users.find(
+            {"user_id": {"$in": [receipt["user_id"] for receipt in receipts]}, "privacy_settings.read_receipts": False},
+            {"user_id": 1}
+        ).to_list(len(receipts))
+    } if receipts else set()
+    for receipt in receipts:
+        if receipt["user_id"] in hidden:
+            receipt.pop("read_at", None)
+    return {"receipts": serialize_mongo_doc(receipts)}
+
 @api_router.post("/chats/{chat_id}/messages")
 async def send_message(chat_id: str, message_data: dict, current_user = Depends(get_current_user)):
     """Send a message to a chat"""
     # Verify user is member of chat
-    chat = await db.chats.find_one({"chat_id": chat_id})
-    if not chat or current_user["user_id"] not in chat["members"]:
+    chat = await manager.chat_members.get(chat_id)
+    if not chat or current_user["user_id"] not in chat.members:
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Check for blocks in direct chats
     if chat.get("chat_type") == "direct":
         other_user_id = next(
-            (member for member in chat["members"] if member != current_user["user_id"]), 
+            (member for member in chat.members if member != current_user["user_id"]), 
             None
         )
         if other_user_id:
@@ -3299,24 +4219,14 @@ async def send_message(chat_id: str, message_data: dict, current_user = Depends(
     if chat.get("disappearing_timer"):
         message.expires_at = datetime.utcnow() + timedelta(seconds=chat["disappearing_timer"])
     
-    message_dict = message.dict()
-    await db.messages.insert_one(message_dict)
-    
-    # Update chat's last message
-    await db.chats.update_one(
-        {"chat_id": chat_id},
-        {"$set": {"last_message": message_dict}}
-    )
-    
-    # Broadcast to chat members via WebSocket
-    for member_id in chat["members"]:
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "new_message",
-                "data": serialize_mongo_doc(message_dict)
-            }),
-            member_id
-        )
+    # Group commit: the chat's last message, the broadcast and offline outboxes follow in the background
+    async with chat_sequences.mutation(chat_id) as seq:
+        message.seq = message.updated_seq = seq
+        message_dict = message.dict()
+        try:
+            await message_pipeline.submit(message_dict)
+        except Exception:
+            raise HTTPException(status_code=503, detail="Message could not be saved, please retry")
     
     return serialize_mongo_doc(message_dict)
 
@@ -3328,60 +4238,38 @@ async def upload_file_to_chat(
 ):
     """Upload file to chat"""
     # Verify user is member of chat
-    chat = await db.chats.find_one({
-        "chat_id": chat_id,
-        "members": current_user["user_id"]
-    })
-    
-    if not chat:
+    chat = await manager.chat_members.get(chat_id)
+    if not chat or current_user["user_id"] not in chat.members:
         raise HTTPException(status_code=404, detail="Chat not found")
     
     # Create file message
-    message = {
-        "message_id": str(uuid.uuid4()),
-        "chat_id": chat_id,
-        "sender_id": current_user["user_id"],
-        "message_type": "file",
-        "content": f"📎 {file_data['filename']}",
-        "file_data": {
+    message = Message(
+        chat_id=chat_id,
+        sender_id=current_user["user_id"],
+        content=f"📎 {file_data['filename']}",
+        message_type="file",
+        file_name=file_data["filename"],
+        file_size=file_data["size"],
+        is_encrypted=False
+    )
+    
+    # Sequenced and group-committed like send_message, so /sync and offline outboxes see it too
+    async with chat_sequences.mutation(chat_id) as seq:
+        message.seq = message.updated_seq = seq
+        message_dict = message.dict()
+        message_dict["file_data"] = {
             "filename": file_data["filename"],
             "size": file_data["size"],
             "type": file_data["type"],
             "data": file_data["data"]  # base64 encoded file
-        },
-        "timestamp": datetime.utcnow(),
-        "is_encrypted": False,
-        "edited": False
-    }
-    
-    await db.chat_messages.insert_one(message)
-    
-    # Update chat last activity
-    await db.chats.update_one(
-        {"chat_id": chat_id},
-        {
-            "$set": {
-                "last_activity": datetime.utcnow(),
-                "last_message": {
-                    "content": message["content"],
-                    "timestamp": message["timestamp"],
-                    "sender_id": current_user["user_id"]
-                }
-            }
         }
-    )
-    
-    # Broadcast to chat members via WebSocket
-    await manager.broadcast_to_chat(
-        json.dumps({
-            "type": "new_message",
-            "data": serialize_mongo_doc(message)
-        }),
-        chat_id,
-        current_user["user_id"]
-    )
+        message_dict["edited"] = False
+        try:
+            await message_pipeline.submit(message_dict)
+        except Exception:
+            raise HTTPException(status_code=503, detail="File could not be saved, please retry")
     
-    return serialize_mongo_doc(message)
+    return serialize_mongo_doc(message_dict)
 
 # Teams Management Endpoints
 @api_router.get("/teams")
@@ -4809,6 +5697,7 @@ async def join_team(team_id: str, current_user = Depends(get_current_user)):
             {"team_id": team_id},
             {"$push": {"members": current_user["user_id"]}}
         )
+        await manager.chat_member_added(team_chat["chat_id"], current_user["user_id"])
     
     return {"message": "Successfully joined team"}
 
@@ -4841,6 +5730,7 @@ async def leave_team(team_id: str, current_user = Depends(get_current_user)):
             {"team_id": team_id},
             {"$pull": {"members": current_user["user_id"]}}
         )
+        await manager.chat_member_removed(team_chat["chat_id"], current_user["user_id"])
     
     return {"message": "Successfully left team"}
 
@@ -4918,6 +5808,7 @@ async def create_team(
     }
     
     await db.chats.insert_one(team_chat)
+    manager.cache_chat(team_chat)
     
     # Add member count and creator info for the response
     if created_team:
@@ -4992,7 +5883,7 @@ async def get_contacts(current_user = Depends(get_current_user)):
                 "username": contact_user["username"],
                 "email": contact_user["email"],
                 "display_name": contact_user.get("display_name"),
-                "is_online": contact_user.get("is_online", False)
+                "is_online": manager.is_user_online(contact_user["user_id"])
             }
     
     return serialize_mongo_doc(contacts)
@@ -5049,6 +5940,8 @@ async def add_contact(
     }
     
     await db.contacts.insert_one(reciprocal_contact)
+    await manager.presence_watch_added(current_user["user_id"], contact_user["user_id"])
+    await manager.presence_watch_added(contact_user["user_id"], current_user["user_id"])
     
     # Create a direct chat between the users
     chat = {
@@ -5063,6 +5956,7 @@ async def add_contact(
     }
     
     await db.chats.insert_one(chat)
+    manager.cache_chat(chat)
     
     return serialize_mongo_doc(contact)
 
@@ -5092,12 +5986,18 @@ async def delete_contact(
         "user_id": contact["contact_user_id"],
         "contact_user_id": current_user["user_id"]
     })
+    await manager.presence_watch_removed(current_user["user_id"], contact["contact_user_id"])
+    await manager.presence_watch_removed(contact["contact_user_id"], current_user["user_id"])
     
     # Delete associated direct chat
-    await db.chats.delete_many({
+    direct_chat_filter = {
         "members": {"$all": [current_user["user_id"], contact["contact_user_id"]]},
         "$or": [{"chat_type": "direct"}, {"type": "direct"}]
-    })
+    }
+    direct_chats = await db.chats.find(direct_chat_filter, {"chat_id": 1}).to_list(None)
+    await db.chats.delete_many(direct_chat_filter)
+    for direct_chat in direct_chats:
+        await manager.chat_removed(direct_chat["chat_id"])
     
     return {"message": "Contact deleted successfully"}
 
@@ -5273,7 +6173,7 @@ async def get_connections(status: str = None, current_user = Depends(get_current
                 "display_name": other_user.get("display_name"),
                 "avatar": other_user.get("avatar"),
                 "status_message": other_user.get("status_message"),
-                "is_online": other_user.get("is_online", False),
+                "is_online": manager.is_user_online(other_user["user_id"]),
                 "trust_level": other_user.get("trust_level", 1),
                 "authenticity_rating": other_user.get("authenticity_rating", 0.0)
             }
@@ -5482,6 +6382,7 @@ async def respond_to_connection_request(request_id: str, response_data: dict, cu
             }
             
             await db.chats.insert_one(chat)
+            manager.cache_chat(chat)
             
             # Update request status
             await db.connection_requests.update_one(
@@ -5890,6 +6791,7 @@ async def block_user(user_id: str, current_user = Depends(get_current_user)):
         "user_id": current_user["user_id"],
         "contact_user_id": user_id
     })
+    await manager.presence_watch_removed(current_user["user_id"], user_id)
     
     return {"message": "User blocked successfully"}
 
@@ -6391,54 +7293,74 @@ async def subscribe_to_channel(channel_id: str, current_user = Depends(get_curre
 @api_router.put("/messages/{message_id}/react")
 async def react_to_message(message_id: str, reaction_data: dict, current_user = Depends(get_current_user)):
     """Add or remove reaction from a message"""
-    message = await db.messages.find_one({"message_id": message_id})
+    message = await db.messages.find_one({"message_id": message_id}, {"chat_id": 1})
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
     # Verify user has access to the chat
-    chat = await db.chats.find_one({"chat_id": message["chat_id"]})
-    if not chat or current_user["user_id"] not in chat["members"]:
+    chat = await manager.chat_members.get(message["chat_id"])
+    if not chat or current_user["user_id"] not in chat.members:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    emoji = reaction_data.get("emoji")
-    if not emoji:
-        raise HTTPException(status_code=400, detail="Emoji required")
+    emoji = reaction_emoji(reaction_data.get("emoji"))
+    user_id = current_user["user_id"]
     
-    # Get current reactions
-    reactions = message.get("reactions", {})
+    # Toggle with one conditional update: add unless present, otherwise remove
+    async with chat_sequences.mutation(message["chat_id"]) as seq:
+        stamp = {"$max": {"reaction_seq": seq, "updated_seq": seq}}
+        action = "added"
+        before = await db.messages.find_one_and_update(
+            {"message_id": message_id, f"reactions.{emoji}": {"$ne": user_id}},
+            {
+                "$addToSet": {f"reactions.{emoji}": user_id},
+                "$inc": {f"reaction_counts.{emoji}": 1, "reaction_version": 1},
+                **stamp
+            },
+            projection=REACTION_PROJECTION,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            action = "removed"
+            before = await db.messages.find_one_and_update(
+                {"message_id": message_id, f"reactions.{emoji}": user_id},
+                {
+                    "$pull": {f"reactions.{emoji}": user_id},
+                    "$inc": {f"reaction_counts.{emoji}": -1, "reaction_version": 1},
+                    **stamp
+                },
+                projection=REACTION_PROJECTION,
+                return_document=ReturnDocument.BEFORE
+            )
+    if before is None:
+        raise HTTPException(status_code=409, detail="Reaction changed concurrently, please retry")
     
-    # Toggle reaction
-    if emoji in reactions:
-        if current_user["user_id"] in reactions[emoji]:
-            reactions[emoji].remove(current_user["user_id"])
-            if not reactions[emoji]:
-                del reactions[emoji]
-        else:
-            reactions[emoji].append(current_user["user_id"])
+    state = reaction_state(before, seq)
+    users = state["reactions"].setdefault(emoji, [])
+    if action == "added":
+        users.append(user_id)
+    else:
+        users.remove(user_id)
+    if "reaction_counts" in before:
+        state["reaction_counts"][emoji] = len(users)
     else:
-        reactions[emoji] = [current_user["user_id"]]
+        # Message predates maintained counts: derive them once from the lists
+        state["reaction_counts"] = {name: len(members) for name, members in state["reactions"].items()}
+        await db.messages.update_one({"message_id": message_id}, {"$set": {"reaction_counts": state["reaction_counts"]}})
+    if not users:
+        # Drop the emptied emoji unless someone re-added it meanwhile
+        await db.messages.update_one(
+            {"message_id": message_id, f"reactions.{emoji}": {"$size": 0}},
+            {"$unset": {f"reactions.{emoji}": "", f"reaction_counts.{emoji}": ""}}
+        )
+        del state["reactions"][emoji]
+        state["reaction_counts"].pop(emoji, None)
     
-    await db.messages.update_one(
-        {"message_id": message_id},
-        {"$set": {"reactions": reactions}}
+    reaction_broadcasts.record(
+        message["chat_id"], message_id, (before.get("reaction_version") or 0) + 1, state,
+        {"user_id": user_id, "emoji": emoji, "action": action}
     )
     
-    # Broadcast reaction update
-    for member_id in chat["members"]:
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "message_reaction",
-                "data": {
-                    "message_id": message_id,
-                    "reactions": reactions,
-                    "user_id": current_user["user_id"],
-                    "emoji": emoji
-                }
-            }),
-            member_id
-        )
-    
-    return {"message": "Reaction updated"}
+    return {"message": "Reaction updated", "action": action, "reactions": state["reactions"], "reaction_counts": state["reaction_counts"]}
 
 @api_router.put("/messages/{message_id}/edit")
 async def edit_message(message_id: str, edit_data: dict, current_user = Depends(get_current_user)):
@@ -6455,29 +7377,31 @@ async def edit_message(message_id: str, edit_data: dict, current_user = Depends(
         raise HTTPException(status_code=400, detail="Content cannot be empty")
     
     # Update message
-    await db.messages.update_one(
-        {"message_id": message_id},
-        {"$set": {
-            "content": new_content,
-            "edited_at": datetime.utcnow()
-        }}
-    )
+    edited_at = datetime.utcnow()
+    async with chat_sequences.mutation(message["chat_id"]) as seq:
+        await db.messages.update_one(
+            {"message_id": message_id},
+            {"$set": {
+                "content": new_content,
+                "edited_at": edited_at,
+                "edit_seq": seq,
+                "updated_seq": seq
+            }}
+        )
+    manager.inbox.message_changed(message["chat_id"], message_id, content=new_content)
     
     # Broadcast edit
-    chat = await db.chats.find_one({"chat_id": message["chat_id"]})
+    chat = await manager.chat_members.get(message["chat_id"])
     if chat:
-        for member_id in chat["members"]:
-            await manager.send_personal_message(
-                json.dumps({
-                    "type": "message_edit",
-                    "data": {
-                        "message_id": message_id,
-                        "content": new_content,
-                        "edited_at": datetime.utcnow().isoformat()
-                    }
-                }),
-                member_id
-            )
+        await manager.broadcast({
+            "type": "message_edit",
+            "data": {
+                "message_id": message_id,
+                "content": new_content,
+                "edited_at": edited_at.isoformat(),
+                "seq": seq
+            }
+        }, chat.members)
     
     return {"message": "Message edited"}
 
@@ -6492,22 +7416,20 @@ async def delete_message(message_id: str, current_user = Depends(get_current_use
         raise HTTPException(status_code=403, detail="Can only delete your own messages")
     
     # Soft delete
-    await db.messages.update_one(
-        {"message_id": message_id},
-        {"$set": {"is_deleted": True}}
-    )
+    async with chat_sequences.mutation(message["chat_id"]) as seq:
+        await db.messages.update_one(
+            {"message_id": message_id},
+            {"$set": {"is_deleted": True, "updated_seq": seq}}
+        )
+    manager.inbox.message_changed(message["chat_id"], message_id, deleted=True)
     
     # Broadcast deletion
-    chat = await db.chats.find_one({"chat_id": message["chat_id"]})
+    chat = await manager.chat_members.get(message["chat_id"])
     if chat:
-        for member_id in chat["members"]:
-            await manager.send_personal_message(
-                json.dumps({
-                    "type": "message_delete",
-                    "data": {"message_id": message_id}
-                }),
-                member_id
-            )
+        await manager.broadcast({
+            "type": "message_delete",
+            "data": {"message_id": message_id, "seq": seq}
+        }, chat.members)
     
     return {"message": "Message deleted"}
 
@@ -6707,7 +7629,7 @@ async def search_users(query: str, current_user = Depends(get_current_user)):
             "display_name": user.get("display_name"),
             "avatar": user.get("avatar"),
             "status_message": user.get("status_message"),
-            "is_online": user.get("is_online", False),
+            "is_online": manager.is_user_online(user["user_id"]),
             "is_blocked": bool(is_blocked),
             "is_contact": bool(is_contact)
         })
@@ -6788,6 +7710,7 @@ async def execute_genie_action(action: dict, user_id: str, interaction_id: str =
                             "interaction_id": interaction_id
                         }
                         result = await db.contacts.insert_one(contact)
+                        await manager.presence_watch_added(user_id, user["user_id"])
                         logging.info(f"Added contact: {contact}")
                     else:
                         logging.info(f"Contact already exists or trying to add self as contact")
@@ -7100,6 +8023,7 @@ async def perform_undo(action: dict, user_id: str):
             )
             if recent_chat:
                 await db.chats.delete_one({"chat_id": recent_chat["chat_id"]})
+                await manager.chat_removed(recent_chat["chat_id"])
                 return {"success": True, "message": "The mystical conversation portal has been dissolved!"}
             else:
                 return {"success": False, "message": "No recent chat found to undo!"}
@@ -7115,6 +8039,7 @@ async def perform_undo(action: dict, user_id: str):
             if recent_contact:
                 logging.info(f"Found contact to undo: {recent_contact}")
                 await db.contacts.delete_one({"contact_id": recent_contact["contact_id"]})
+                await manager.presence_watch_removed(recent_contact["user_id"], recent_contact["contact_user_id"])
                 return {"success": True, "message": "The friendship bond has been gently severed!"}
             else:
                 # Try without the added_by_genie flag as fallback
@@ -7127,6 +8052,7 @@ async def perform_undo(action: dict, user_id: str):
                 if recent_contact:
                     logging.info(f"Found contact without flag to undo: {recent_contact}")
                     await db.contacts.delete_one({"contact_id": recent_contact["contact_id"]})
+                    await manager.presence_watch_removed(recent_contact["user_id"], recent_contact["contact_user_id"])
                     return {"success": True, "message": "The friendship bond has been gently severed!"}
                 else:
                     logging.info("No contacts found to undo")
@@ -7492,19 +8418,16 @@ async def update_document(
 # Emoji Reactions Endpoints
 @api_router.post("/messages/{message_id}/reactions")
 async def add_emoji_reaction(message_id: str, reaction_data: dict, current_user = Depends(get_current_user)):
-    """Add an emoji reaction to a message"""
-    emoji = reaction_data.get("emoji")
-    if not emoji:
-        raise HTTPException(status_code=400, detail="Emoji is required")
+    """Add an emoji reaction to a message (toggles: reacting again removes it)"""
+    emoji = reaction_emoji(reaction_data.get("emoji"))
     
     # Check if message exists
-    message = await db.messages.find_one({"message_id": message_id})
+    message = await db.messages.find_one({"message_id": message_id}, {"chat_id": 1})
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
     # Check if user has access to the chat
-    chat = await db.chats.find_one({"chat_id": message["chat_id"]})
-    if not chat or current_user["user_id"] not in chat["members"]:
+    if not await manager.chat_members.is_member(message["chat_id"], current_user["user_id"]):
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Create reaction document
@@ -7516,52 +8439,61 @@ async def add_emoji_reaction(message_id: str, reaction_data: dict, current_user
         "created_at": datetime.utcnow()
     }
     
-    # Check if user already reacted with this emoji
-    existing_reaction = await db.emoji_reactions.find_one({
-        "message_id": message_id,
-        "user_id": current_user["user_id"],
-        "emoji": emoji
-    })
+    # Toggle without a read: remove if present, otherwise insert (the unique index rejects a racing duplicate)
+    async with chat_sequences.mutation(message["chat_id"]) as seq:
+        removed = await db.emoji_reactions.delete_one({"message_id": message_id, "user_id": current_user["user_id"], "emoji": emoji})
+        delta = -1 if removed.deleted_count else 1
+        if delta > 0:
+            try:
+                await db.emoji_reactions.insert_one(reaction)
+            except DuplicateKeyError:
+                delta = 0  # a concurrent request from this user added it first
+        before = None
+        if delta:
+            before = await db.messages.find_one_and_update(
+                {"message_id": message_id},
+                {
+                    "$inc": {f"emoji_counts.{emoji}": delta, "reaction_version": 1},
+                    "$max": {"reaction_seq": seq, "updated_seq": seq}
+                },
+                projection=REACTION_PROJECTION,
+                return_document=ReturnDocument.BEFORE
+            )
     
-    if existing_reaction:
-        # Remove existing reaction (toggle behavior)
-        await db.emoji_reactions.delete_one({"reaction_id": existing_reaction["reaction_id"]})
-        
-        # Notify via WebSocket
-        await manager.broadcast_to_chat(
-            json.dumps({
-                "type": "reaction_removed",
-                "data": {
-                    "message_id": message_id,
-                    "user_id": current_user["user_id"],
-                    "emoji": emoji
-                }
-            }),
-            message["chat_id"],
-            current_user["user_id"]
+    if before is not None:
+        state = reaction_state(before, seq)
+        if "emoji_counts" in before:
+            state["emoji_counts"][emoji] = state["emoji_counts"].get(emoji, 0) + delta
+        else:
+            # Message predates maintained counts: count its reactions once
+            counts: Dict[str, int] = {}
+            for existing in await db.emoji_reactions.find({"message_id": message_id}, {"emoji": 1}).to_list(None):
+                counts[existing["emoji"]] = counts.get(existing["emoji"], 0) + 1
+            state["emoji_counts"] = counts
+            await db.messages.update_one({"message_id": message_id}, {"$set": {"emoji_counts": counts}})
+        if state["emoji_counts"].get(emoji, 0) <= 0:
+            await db.messages.update_one(
+                {"message_id": message_id, f"emoji_counts.{emoji}": {"$lte": 0}},
+                {"$unset": {f"emoji_counts.{emoji}": ""}}
+            )
+            state["emoji_counts"].pop(emoji, None)
+        reaction_broadcasts.record(
+            message["chat_id"], message_id, (before.get("reaction_version") or 0) + 1, state,
+            {
+                "user_id": current_user["user_id"],
+                "user_name": current_user.get("display_name", current_user["username"]),
+                "emoji": emoji,
+                "action": "added" if delta > 0 else "removed"
+            }
         )
-        
+    
+    if delta < 0:
         return {"status": "reaction_removed", "emoji": emoji}
-    else:
-        # Add new reaction
-        await db.emoji_reactions.insert_one(reaction)
-        
-        # Notify via WebSocket
-        await manager.broadcast_to_chat(
-            json.dumps({
-                "type": "reaction_added",
-                "data": {
-                    "message_id": message_id,
-                    "user_id": current_user["user_id"],
-                    "user_name": current_user.get("display_name", current_user["username"]),
-                    "emoji": emoji
-                }
-            }),
-            message["chat_id"],
-            current_user["user_id"]
-        )
-        
-        return {"status": "reaction_added", "emoji": emoji, "reaction_id": reaction["reaction_id"]}
+    if delta == 0:
+        reaction = await db.emoji_reactions.find_one(
+            {"message_id": message_id, "user_id": current_user["user_id"], "emoji": emoji}, {"reaction_id": 1}
+        ) or reaction
+    return {"status": "reaction_added", "emoji": emoji, "reaction_id": reaction["reaction_id"]}
 
 @api_router.get("/messages/{message_id}/reactions")
 async def get_message_reactions(message_id: str, current_user = Depends(get_current_user)):
@@ -7571,8 +8503,7 @@ async def get_message_reactions(message_id: str, current_user = Depends(get_curr
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    chat = await db.chats.find_one({"chat_id": message["chat_id"]})
-    if not chat or current_user["user_id"] not in chat["members"]:
+    if not await manager.chat_members.is_member(message["chat_id"], current_user["user_id"]):
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Get all reactions for this message
@@ -8059,6 +8990,7 @@ async def send_marketplace_message(request: Request, listing_id: str, message_da
                 "marketplace_listing_id": listing_id  # Link to marketplace listing
             }
             await db.chats.insert_one(chat_data)
+            manager.cache_chat(chat_data)
         
         # Create message with marketplace context
         message_content = message_data.message
@@ -9002,6 +9934,7 @@ async def submit_reel_bid(request: Request, reel_id: str, bid: ReelBid, current_
             "bid_id": bid_data["bid_id"]
         }
         await db.chats.insert_one(chat_data)
+        manager.cache_chat(chat_data)
         
         # Send notification message
         message_id = str(uuid.uuid4())
@@ -9102,9 +10035,32 @@ async def get_performance_stats(current_user = Depends(get_current_user)):
     return {
         "cache_stats": cache_manager.get_stats(),
         "performance_stats": performance_monitor.get_stats(),
+        "realtime_stats": manager.get_stats(),
+        "heartbeat_stats": heartbeat.get_stats(),
+        "presence_write_stats": presence_writer.get_stats(),
+        "delivery_stats": {"outbox": delivery_outbox.get_stats(), "receipts": receipt_watermarks.get_stats()},
+        "chat_sequence_stats": chat_sequences.get_stats(),
+        "message_pipeline_stats": message_pipeline.get_stats(),
+        "reaction_stats": reaction_broadcasts.get_stats(),
+        "cipher_cache_stats": MessageEncryption.cipher.cache_info()._asdict(),
+        "call_signaling_stats": call_signaling.get_stats(),
+        "game_room_stats": {
+            **game_rooms.get_stats(),
+            "routing": game_router.get_stats(),
+            "matchmaking": matchmaker.get_stats()
+        },
         "redis_available": REDIS_AVAILABLE
     }
 
+@api_router.get("/admin/call-quality")
+async def get_call_quality_stats(region: Optional[str] = None, current_user = Depends(get_admin_user)):
+    """Rolling call quality histograms per region (admin only)"""
+    return {
+        "window_seconds": manager.call_quality.region_window,
+        "regions": manager.call_quality.region_report(region),
+        "stats": manager.call_quality.get_stats()
+    }
+
 @api_router.get("/admin/cache/clear")
 async def clear_cache(pattern: str = None, current_user = Depends(get_current_user)):
     """Clear cache (admin only)"""
@@ -9232,16 +10188,17 @@ async def get_game_rooms(current_user = Depends(get_current_user)):
             "status": {"$in": ["waiting", "playing"]}
         }).sort("created_at", -1).to_list(100)
         
-        # Add player names and current status
+        # Add player names (one query for every room) and current status
+        player_ids = list({player_id for room in rooms for player_id in room.get("players", [])})
+        names = {}
+        async for player in db.users.find(
+            {"user_id": {"$in": player_ids}},
+            {"_id": 0, "user_id": 1, "username": 1, "display_name": 1}
+        ):
+            names[player["user_id"]] = player.get("display_name", player["username"])
+        
         for room in rooms:
-            # Get player names
-            player_names = {}
-            for player_id in room.get("players", []):
-                player = await db.users.find_one({"user_id": player_id})
-                if player:
-                    player_names[player_id] = player.get("display_name", player["username"])
-            
-            room["player_names"] = player_names
+            room["player_names"] = {player_id: names[player_id] for player_id in room.get("players", []) if player_id in names}
             room["current_players"] = len(room.get("players", []))
             room["is_joined"] = current_user["user_id"] in room.get("players", [])
         
@@ -9346,6 +10303,9 @@ async def start_game(room_id: str, current_user = Depends(get_current_user)):
             }
         )
         
+        # Applied by the worker that owns the room (a fresh move log if it is not active)
+        await game_router.set_state(room_id, initial_game_state)
+        
         return {"status": "game_started", "game_state": initial_game_state}
         
     except Exception as e:
@@ -9439,8 +10399,175 @@ def initialize_mafia_game(players: list):
         "status": "playing"
     }
 
-# Global game connections storage
-game_connections = {}
+async def load_game_room(room_id: str) -> Optional[Dict[str, Any]]:
+    """Game engine loader: the fields a room actor needs"""
+    return await db.game_rooms.find_one(
+        {"room_id": room_id},
+        {"_id": 0, "room_id": 1, "game_type": 1, "game_state": 1, "status": 1, "move_seq": 1}
+    )
+
+async def save_game_snapshot(room_id: str, game_state: dict, finished: bool, move_seq: int):
+    """Game engine snapshot writer; move_seq is the last move the state includes"""
+    update = {"game_state": game_state, "move_seq": move_seq}
+    if finished:
+        update["status"] = "finished"
+        update["finished_at"] = datetime.utcnow()
+    await db.game_rooms.update_one({"room_id": room_id}, {"$set": update})
+
+async def apply_game_move(game_type: str, game_state: dict, move: dict, player_id: str):
+    """Game engine move processor (process_game_move is defined with the game WebSocket below)"""
+    return await process_game_move(game_type, game_state, move, player_id)
+
+def resolve_game_move(game_type: str, move: dict) -> dict:
+    """Fix a move's random outcome before it is logged so replay is deterministic"""
+    if game_type == "ludo" and move.get("type") == "roll_dice":
+        import random
+        return {**move, "dice_value": random.randint(1, 6)}
+    return move
+
+async def append_game_moves(room_id: str, from_seq: int, to_seq: int, data: bytes):
+    """Game engine log writer: one document per flushed batch of encoded moves"""
+    await db.game_moves.insert_one({
+        "room_id": room_id,
+        "from_seq": from_seq,
+        "to_seq": to_seq,
+        "data": data,
+        "created_at": datetime.utcnow()
+    })
+
+async def read_game_moves(room_id: str, after_seq: int) -> List[bytes]:
+    """Game engine log reader: batches holding any move after after_seq, oldest first"""
+    cursor = db.game_moves.find(
+        {"room_id": room_id, "to_seq": {"$gt": after_seq}},
+        {"_id": 0, "data": 1}
+    ).sort("from_seq", 1)
+    return [bytes(doc["data"]) async for doc in cursor]
+
+# Active game rooms live in memory; Mongo gets an append-only move log and periodic snapshots
+game_rooms = GameRoomEngine(
+    load_game_room,
+    apply_game_move,
+    save_game_snapshot,
+    resolver=resolve_game_move,
+    log_writer=append_game_moves,
+    log_reader=read_game_moves,
+    snapshot_interval=REALTIME_CONFIG['GAME_SNAPSHOT_INTERVAL'],
+    log_flush_interval=REALTIME_CONFIG['GAME_LOG_FLUSH_INTERVAL'],
+    max_catch_up=REALTIME_CONFIG['GAME_MAX_CATCH_UP'],
+    send_timeout=REALTIME_CONFIG['SEND_TIMEOUT']
+)
+
+async def reset_game_log(room_id: str):
+    """Game router idle reset: a room started while inactive begins a fresh move log"""
+    await db.game_moves.delete_many({"room_id": room_id})
+    await db.game_rooms.update_one({"room_id": room_id}, {"$set": {"move_seq": 0}})
+
+async def handle_game_frame(room_id: str, websocket, data: dict):
+    """Game router frame handler, run on the worker that owns the room"""
+    if data.get("type") == "game_move":
+        # Applied serially by the room actor, which broadcasts the new state
+        game_rooms.submit_move(room_id, data.get("player_id"), data.get("move", {}))
+    elif data.get("type") == "sync":
+        # Reconnecting client: only the moves after the last seq it saw
+        await game_rooms.send_catch_up(room_id, websocket, int(data.get("since", 0)))
+    elif data.get("type") == "chat_message":
+        await handle_game_chat(room_id, data, websocket)
+
+# Each room is owned by one worker; sockets accepted elsewhere are proxied over the fan-out bus
+game_router = GameRoomRouter(
+    game_rooms,
+    handle_game_frame,
+    on_idle_reset=reset_game_log,
+    announce_interval=REALTIME_CONFIG['GAME_WORKER_ANNOUNCE_INTERVAL'],
+    worker_ttl=REALTIME_CONFIG['GAME_WORKER_TTL'],
+    sync_wait=REALTIME_CONFIG['GAME_WORKER_SYNC_WAIT']
+)
+
+async def create_matched_room(game_type: str, players: List[str]) -> Dict[str, Any]:
+    """Matchmaker match creator: the room is inserted already playing, with its initial state"""
+    now = datetime.utcnow()
+    room = {
+        "room_id": str(uuid.uuid4()),
+        "name": f"{game_type.replace('-', ' ').title()} match",
+        "game_type": game_type,
+        "max_players": len(players),
+        "is_private": True,
+        "password": None,
+        "created_by": players[0],
+        "players": players,
+        "spectators": [],
+        "status": "playing",
+        "game_state": await initialize_game_state(game_type, players),
+        "move_seq": 0,
+        "matchmade": True,
+        "created_at": now,
+        "started_at": now,
+        "finished_at": None
+    }
+    await db.game_rooms.insert_one(room)
+    return {"room_id": room["room_id"], "game_type": game_type, "players": players}
+
+# user_id -> outbound queue of the user's matchmaking socket on this worker
+matchmaking_sockets: Dict[str, OutboundQueue] = {}
+
+async def notify_match(user_ids: List[str], payload: dict):
+    """Matchmaker notifier: the matchmaking socket if open here, else the user's chat sockets"""
+    message = json.dumps(payload, default=str)
+    elsewhere = []
+    for user_id in user_ids:
+        queue = matchmaking_sockets.get(user_id)
+        if queue is None or not queue.enqueue(message, frame_type=payload["type"]):
+            elsewhere.append(user_id)
+    if elsewhere:
+        await manager.broadcast_to_users(message, elsewhere, frame_type=payload["type"])
+
+# Players queue per game type instead of polling the room list
+matchmaker = Matchmaker(create_matched_room, notify_match, tick=REALTIME_CONFIG['MATCHMAKING_TICK'])
+
+@api_router.post("/games/matchmaking/queue")
+async def join_matchmaking(queue_data: dict, current_user = Depends(get_current_user)):
+    """Wait for a match; it is pushed over the matchmaking or chat WebSocket"""
+    game_type = queue_data.get("game_type") or queue_data.get("gameType")
+    rating = current_user.get("game_ratings", {}).get(game_type)
+    try:
+        return matchmaker.join(current_user["user_id"], game_type, rating)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.get("/games/matchmaking/queue")
+async def get_matchmaking_status(current_user = Depends(get_current_user)):
+    """Queue position, or the match formed in the last minute"""
+    return matchmaker.status(current_user["user_id"])
+
+@api_router.delete("/games/matchmaking/queue")
+async def leave_matchmaking(current_user = Depends(get_current_user)):
+    """Stop waiting for a match"""
+    left = matchmaker.leave(current_user["user_id"])
+    return {"status": "left" if left else "idle"}
+
+@api_router.get("/games/rooms/{room_id}/moves")
+async def get_game_moves(room_id: str, since: int = 0, current_user = Depends(get_current_user)):
+    """Moves after a sequence number, or the full state if too far behind"""
+    try:
+        room = await db.game_rooms.find_one({"room_id": room_id}, {"_id": 0, "players": 1, "spectators": 1})
+        if not room:
+            raise HTTPException(status_code=404, detail="Game room not found")
+        
+        user_id = current_user["user_id"]
+        if user_id not in room.get("players", []) and user_id not in room.get("spectators", []):
+            raise HTTPException(status_code=403, detail="Not in this game room")
+        
+        # Asked of the owning worker: its unflushed moves are not in the log yet
+        result = await game_router.catch_up(room_id, since)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Game room not found")
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Get game moves error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get game moves")
 
 # Include the router in the main app after all endpoints are defined
 app.include_router(api_router)
@@ -9454,16 +10581,17 @@ async def get_game_rooms(current_user = Depends(get_current_user)):
             "status": {"$in": ["waiting", "playing"]}
         }).sort("created_at", -1).to_list(100)
         
-        # Add player names and current status
+        # Add player names (one query for every room) and current status
+        player_ids = list({player_id for room in rooms for player_id in room.get("players", [])})
+        names = {}
+        async for player in db.users.find(
+            {"user_id": {"$in": player_ids}},
+            {"_id": 0, "user_id": 1, "username": 1, "display_name": 1}
+        ):
+            names[player["user_id"]] = player.get("display_name", player["username"])
+        
         for room in rooms:
-            # Get player names
-            player_names = {}
-            for player_id in room.get("players", []):
-                player = await db.users.find_one({"user_id": player_id})
-                if player:
-                    player_names[player_id] = player.get("display_name", player["username"])
-            
-            room["player_names"] = player_names
+            room["player_names"] = {player_id: names[player_id] for player_id in room.get("players", []) if player_id in names}
             room["current_players"] = len(room.get("players", []))
             room["is_joined"] = current_user["user_id"] in room.get("players", [])
         
@@ -9568,6 +10696,9 @@ async def start_game(room_id: str, current_user = Depends(get_current_user)):
             }
         )
         
+        # Applied by the worker that owns the room (a fresh move log if it is not active)
+        await game_router.set_state(room_id, initial_game_state)
+        
         return {"status": "game_started", "game_state": initial_game_state}
         
     except Exception as e:
@@ -9661,100 +10792,101 @@ def initialize_mafia_game(players: list):
         "status": "playing"
     }
 
+# WebSocket for matchmaking: queue frames in, match_found pushed out
+@app.websocket("/ws/games/matchmaking/{user_id}")
+async def matchmaking_websocket_endpoint(websocket: WebSocket, user_id: str):
+    await websocket.accept()
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "game_ratings": 1})
+    if user is None:
+        await websocket.close(code=1008)
+        return
+    
+    queue = OutboundQueue(
+        websocket,
+        policy=manager.registry.queue_policy,
+        send_timeout=REALTIME_CONFIG['SEND_TIMEOUT']
+    )
+    previous = matchmaking_sockets.get(user_id)
+    matchmaking_sockets[user_id] = queue
+    if previous is not None:
+        previous.close()
+    
+    heartbeat_key = f"matchmaking:{user_id}:{uuid.uuid4()}"
+    
+    async def send_ping():
+        queue.enqueue(json.dumps({"type": "ping", "timestamp": time.time()}), frame_type="ping")
+    
+    async def close_idle():
+        await websocket.close(code=1001)
+    
+    heartbeat.register(heartbeat_key, send_ping, close_idle)
+    
+    try:
+        while True:
+            data = await websocket.receive_json()
+            heartbeat.touch(heartbeat_key)
+            
+            if data.get("type") == "pong":
+                continue
+            elif data.get("type") == "queue_join":
+                game_type = data.get("game_type")
+                try:
+                    status = matchmaker.join(user_id, game_type, user.get("game_ratings", {}).get(game_type))
+                    queue.enqueue(json.dumps({"type": "queue_status", **status}), frame_type="queue_status")
+                except ValueError as e:
+                    queue.enqueue(json.dumps({"type": "error", "message": str(e)}), frame_type="error")
+            elif data.get("type") == "queue_leave":
+                matchmaker.leave(user_id)
+                queue.enqueue(json.dumps({"type": "queue_status", "status": "idle"}), frame_type="queue_status")
+            elif data.get("type") == "queue_status":
+                queue.enqueue(json.dumps({"type": "queue_status", **matchmaker.status(user_id)}), frame_type="queue_status")
+                    
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error(f"Matchmaking WebSocket error for {user_id}: {str(e)}")
+    finally:
+        heartbeat.unregister(heartbeat_key)
+        if matchmaking_sockets.get(user_id) is queue:
+            del matchmaking_sockets[user_id]
+            # Nobody left to tell about a match
+            matchmaker.leave(user_id)
+        queue.close()
+
 # WebSocket for real-time gaming with timeout handling
 @app.websocket("/ws/games/{room_id}")
 async def game_websocket_endpoint(websocket: WebSocket, room_id: str):
     await websocket.accept()
     
-    # Add connection to room
-    if room_id not in game_connections:
-        game_connections[room_id] = []
-    game_connections[room_id].append(websocket)
+    # Add connection to room (loads the room actor on first connection, or proxies to its owner)
+    proxy_id = await game_router.attach(room_id, websocket)
     
-    # Heartbeat configuration
-    last_heartbeat = time.time()
-    heartbeat_interval = 30  # Send heartbeat every 30 seconds
-    timeout_threshold = 60  # Disconnect if no response for 60 seconds
+    heartbeat_key = f"game:{room_id}:{uuid.uuid4()}"
+    
+    async def send_ping():
+        game_router.send(room_id, websocket, proxy_id, json.dumps({"type": "ping", "timestamp": time.time()}), "ping")
+    
+    async def close_idle():
+        await websocket.close(code=1001)
+    
+    heartbeat.register(heartbeat_key, send_ping, close_idle)
     
     try:
         while True:
-            try:
-                # Wait for message with timeout
-                data = await asyncio.wait_for(websocket.receive_json(), timeout=heartbeat_interval)
-                last_heartbeat = time.time()
-                
-                if data.get("type") == "pong":
-                    # Update heartbeat timestamp
-                    last_heartbeat = time.time()
-                    continue
-                elif data["type"] == "game_move":
-                    await handle_game_move(room_id, data, websocket)
-                elif data["type"] == "chat_message":
-                    await handle_game_chat(room_id, data, websocket)
-                    
-            except asyncio.TimeoutError:
-                # Send heartbeat ping
-                current_time = time.time()
-                if current_time - last_heartbeat > timeout_threshold:
-                    # Connection timed out
-                    break
-                
-                try:
-                    await websocket.send_json({
-                        "type": "ping",
-                        "timestamp": current_time
-                    })
-                except:
-                    # Connection is broken
-                    break
+            data = await websocket.receive_json()
+            heartbeat.touch(heartbeat_key)
+            
+            if data.get("type") == "pong":
+                continue
+            await game_router.handle_frame(room_id, websocket, proxy_id, data)
                     
     except WebSocketDisconnect:
         pass
     except Exception as e:
         logging.error(f"Game WebSocket error for room {room_id}: {str(e)}")
     finally:
-        # Remove connection
-        if room_id in game_connections:
-            try:
-                game_connections[room_id].remove(websocket)
-                if not game_connections[room_id]:
-                    del game_connections[room_id]
-            except ValueError:
-                pass  # Connection already removed
-
-async def handle_game_move(room_id: str, data: dict, websocket: WebSocket):
-    """Handle game moves and update game state"""
-    try:
-        room = await db.game_rooms.find_one({"room_id": room_id})
-        if not room:
-            return
-        
-        game_type = room["game_type"]
-        current_state = room.get("game_state", {})
-        move = data.get("move", {})
-        
-        # Process move based on game type
-        new_state = await process_game_move(game_type, current_state, move, data.get("player_id"))
-        
-        # Update database
-        await db.game_rooms.update_one(
-            {"room_id": room_id},
-            {"$set": {"game_state": new_state}}
-        )
-        
-        # Broadcast update to all connections in room
-        if room_id in game_connections:
-            for connection in game_connections[room_id]:
-                try:
-                    await connection.send_json({
-                        "type": "game_state_update",
-                        "game_state": new_state
-                    })
-                except:
-                    pass  # Connection might be closed
-        
-    except Exception as e:
-        logging.error(f"Game move error: {e}")
+        heartbeat.unregister(heartbeat_key)
+        await game_router.detach(room_id, websocket, proxy_id)
 
 async def process_game_move(game_type: str, current_state: dict, move: dict, player_id: str):
     """Process move for specific game type"""
@@ -9838,7 +10970,8 @@ def process_ludo_move(state: dict, move: dict, player_id: str):
     """Process Ludo move"""
     if move.get("type") == "roll_dice":
         import random
-        dice_value = random.randint(1, 6)
+        # Resolved before logging (resolve_game_move) so replays roll the same value
+        dice_value = move.get("dice_value") or random.randint(1, 6)
         return {
             **state,
             "dice_value": dice_value
@@ -9871,19 +11004,11 @@ async def handle_game_chat(room_id: str, data: dict, websocket: WebSocket):
         }
         
         # Broadcast to all connections in room
-        if room_id in game_connections:
-            for connection in game_connections[room_id]:
-                try:
-                    await connection.send_json(message)
-                except:
-                    pass
+        game_rooms.broadcast(room_id, message)
         
     except Exception as e:
         logging.error(f"Game chat error: {e}")
 
-# Global game connections storage
-game_connections = {}
-
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
\ No newline at end of file
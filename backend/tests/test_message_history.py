@@ -0,0 +1,278 @@
+"""
+Pulse Backend - Message History Tests
+Keyset paging cursors over (timestamp, message_id) and batch decryption of pages
+"""
+
+import pytest
+import base64
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+from server import (  # noqa: E402
+    MessageEncryption, decode_page_cursor, decrypt_history_page, encode_page_cursor, fetch_message_page
+)
+
+
+# ==========================================
+# TEST FIXTURES
+# ==========================================
+
+def _matches(doc, query):
+    """The query operators fetch_message_page uses: equality, $ne, $lt, $gt and $or"""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for op, operand in condition.items():
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$lt" and not value < operand:
+                return False
+            if op == "$gt" and not value > operand:
+                return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self._limit = None
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:self._limit]
+
+
+class FakeMessages:
+    """Just enough of a Motor collection for fetch_message_page"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query):
+        self.queries.append(query)
+        return FakeCursor([dict(doc) for doc in self.docs if _matches(doc, query)])
+
+
+def _message(message_id, timestamp, **fields):
+    return {"message_id": message_id, "chat_id": "c1", "timestamp": timestamp, **fields}
+
+
+async def _walk_back(collection, limit):
+    """Every page from the newest, following before-cursors; returns message ids oldest first"""
+    pages = []
+    before = None
+    while True:
+        page, more = await fetch_message_page(collection, {"chat_id": "c1"}, limit, before=before)
+        pages.append([message["message_id"] for message in page])
+        if not more:
+            break
+        before = encode_page_cursor(page[0])
+    return [message_id for page in reversed(pages) for message_id in page]
+
+
+# ==========================================
+# CURSOR TESTS
+# ==========================================
+
+class TestPageCursor:
+    """Cursors are opaque, round-trip exactly and reject garbage with a 400"""
+
+    def test_round_trip(self):
+        timestamp = datetime(2024, 3, 1, 12, 30, 45, 123456)
+        cursor = encode_page_cursor({"timestamp": timestamp, "message_id": "m-1"})
+
+        assert "=" not in cursor
+        assert decode_page_cursor(cursor) == (timestamp, "m-1")
+
+    @pytest.mark.parametrize("cursor", [
+        "!!!not-base64!!!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        base64.urlsafe_b64encode(b"[1]").decode(),
+        base64.urlsafe_b64encode(b'["2024-01-01T00:00:00"]').decode(),
+        base64.urlsafe_b64encode(b'[12345, "m1"]').decode(),
+        base64.urlsafe_b64encode(b'["yesterday", "m1"]').decode(),
+        base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+        base64.urlsafe_b64encode(b"null").decode(),
+    ])
+    def test_malformed_cursor_is_a_400(self, cursor):
+        with pytest.raises(HTTPException) as raised:
+            decode_page_cursor(cursor)
+        assert raised.value.status_code == 400
+
+    def test_tampered_cursor_is_a_400(self):
+        cursor = encode_page_cursor({"timestamp": datetime(2024, 1, 1), "message_id": "m1"})
+        tampered = cursor[:5] + ("A" if cursor[5] != "A" else "B") + cursor[6:]
+
+        with pytest.raises(HTTPException) as raised:
+            decode_page_cursor(tampered)
+        assert raised.value.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_both_directions_at_once_is_a_400(self):
+        cursor = encode_page_cursor({"timestamp": datetime(2024, 1, 1), "message_id": "m1"})
+
+        with pytest.raises(HTTPException) as raised:
+            await fetch_message_page(FakeMessages([]), {"chat_id": "c1"}, 10, before=cursor, after=cursor)
+        assert raised.value.status_code == 400
+
+
+# ==========================================
+# KEYSET PAGING TESTS
+# ==========================================
+
+class TestFetchMessagePage:
+    """Pages never skip or repeat a message, even when timestamps tie"""
+
+    @pytest.mark.asyncio
+    async def test_newest_page_is_chronological(self):
+        start = datetime(2024, 1, 1)
+        collection = FakeMessages([_message(f"m{i:02d}", start + timedelta(seconds=i)) for i in range(10)])
+
+        page, more = await fetch_message_page(collection, {"chat_id": "c1"}, 3)
+
+        assert [message["message_id"] for message in page] == ["m07", "m08", "m09"]
+        assert more
+        assert "$or" not in collection.queries[0]
+
+    @pytest.mark.asyncio
+    async def test_timestamp_ties_are_paged_by_message_id(self):
+        tied = datetime(2024, 1, 1, 12)
+        docs = [_message("a0", tied - timedelta(seconds=1))]
+        docs += [_message(f"t{i}", tied) for i in (3, 0, 4, 1, 2)]
+        docs += [_message("z0", tied + timedelta(seconds=1))]
+        collection = FakeMessages(docs)
+
+        # A page boundary lands inside the tie at every page size
+        for limit in (1, 2, 3, 4):
+            assert await _walk_back(collection, limit) == ["a0", "t0", "t1", "t2", "t3", "t4", "z0"]
+
+    @pytest.mark.asyncio
+    async def test_or_boundary_excludes_the_cursor_message(self):
+        tied = datetime(2024, 1, 1, 12)
+        collection = FakeMessages([
+            _message("early", tied - timedelta(seconds=1)),
+            _message("b", tied),
+            _message("c", tied),
+            _message("d", tied),
+            _message("late", tied + timedelta(seconds=1)),
+        ])
+        cursor = encode_page_cursor({"timestamp": tied, "message_id": "c"})
+
+        before, more_before = await fetch_message_page(collection, {"chat_id": "c1"}, 10, before=cursor)
+        after, more_after = await fetch_message_page(collection, {"chat_id": "c1"}, 10, after=cursor)
+
+        assert [message["message_id"] for message in before] == ["early", "b"]
+        assert [message["message_id"] for message in after] == ["d", "late"]
+        assert not more_before and not more_after
+        assert collection.queries[-1]["$or"] == [
+            {"timestamp": {"$gt": tied}},
+            {"timestamp": tied, "message_id": {"$gt": "c"}}
+        ]
+
+    @pytest.mark.asyncio
+    async def test_base_query_is_kept_with_the_cursor(self):
+        start = datetime(2024, 1, 1)
+        collection = FakeMessages([
+            _message(f"m{i}", start + timedelta(seconds=i), is_deleted=(i == 2)) for i in range(5)
+        ])
+        cursor = encode_page_cursor(collection.docs[4])
+
+        page, _ = await fetch_message_page(collection, {"chat_id": "c1", "is_deleted": {"$ne": True}}, 10, before=cursor)
+
+        assert [message["message_id"] for message in page] == ["m0", "m1", "m3"]
+
+
+# ==========================================
+# HISTORY DECRYPTION TESTS
+# ==========================================
+
+class TestHistoryDecryption:
+    """A page is decrypted in one batch with the same results as one message at a time"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("offload_threshold", [1000, 1])
+    async def test_batch_matches_per_message(self, monkeypatch, offload_threshold):
+        monkeypatch.setattr(MessageEncryption, "DECRYPT_OFFLOAD_THRESHOLD", offload_threshold)
+        key = MessageEncryption.generate_key()
+        texts = [f"message {i} \u00e9\u2603" for i in range(20)]
+        encrypted = [MessageEncryption.encrypt_message(text, key) for text in texts]
+
+        batch = await MessageEncryption.decrypt_page(encrypted, key)
+
+        assert batch == [MessageEncryption.decrypt_message(token, key) for token in encrypted]
+        assert batch == texts
+
+    @pytest.mark.asyncio
+    async def test_mixed_page_only_decrypts_encrypted_messages(self):
+        key = MessageEncryption.generate_key()
+        messages = [
+            {"message_id": "plain", "content": "hello"},
+            {"message_id": "secret", "is_encrypted": True, "content": "[encrypted]",
+             "encrypted_content": MessageEncryption.encrypt_message("the plan", key)},
+            {"message_id": "flag-only", "is_encrypted": True, "content": "legacy"},
+            {"message_id": "secret-2", "is_encrypted": True, "content": "[encrypted]",
+             "encrypted_content": MessageEncryption.encrypt_message("at noon", key)},
+        ]
+
+        await decrypt_history_page(messages, key)
+
+        assert [message["content"] for message in messages] == ["hello", "the plan", "legacy", "at noon"]
+
+    @pytest.mark.asyncio
+    async def test_no_key_leaves_page_untouched(self):
+        key = MessageEncryption.generate_key()
+        messages = [{"is_encrypted": True, "content": "[encrypted]", "encrypted_content": MessageEncryption.encrypt_message("x", key)}]
+
+        await decrypt_history_page(messages, None)
+
+        assert messages[0]["content"] == "[encrypted]"
+
+    def test_bad_token_mid_page_only_affects_that_message(self):
+        key = MessageEncryption.generate_key()
+        other_key = MessageEncryption.generate_key()
+        page = [
+            MessageEncryption.encrypt_message("first", key),
+            MessageEncryption.encrypt_message("wrong key", other_key),
+            "not-a-token",
+            MessageEncryption.encrypt_message("last", key),
+        ]
+
+        decrypted = MessageEncryption.decrypt_messages(page, key)
+
+        # Failures come back as the stored text, like decrypt_message
+        assert decrypted == ["first", page[1], "not-a-token", "last"]
+
+    def test_invalid_key_returns_page_as_stored(self):
+        page = [MessageEncryption.encrypt_message("hi", MessageEncryption.generate_key())]
+
+        assert MessageEncryption.decrypt_messages(page, "not a fernet key") == page
+
+    def test_cipher_is_cached_per_key(self):
+        key, other_key = MessageEncryption.generate_key(), MessageEncryption.generate_key()
+        hits = MessageEncryption.cipher.cache_info().hits
+
+        first = MessageEncryption.cipher(key)
+        MessageEncryption.decrypt_messages([MessageEncryption.encrypt_message("x", key)] * 5, key)
+
+        assert MessageEncryption.cipher(key) is first
+        assert MessageEncryption.cipher(other_key) is not first
+        assert MessageEncryption.cipher.cache_info().hits >= hits + 3
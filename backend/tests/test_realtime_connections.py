@@ -0,0 +1,658 @@
+"""
+Pulse Backend - Realtime Connection Tests
+Multi-device registry and concurrent fan-out
+"""
+
+import pytest
+import asyncio
+import json
+import time
+import zlib
+
+import msgpack
+
+from realtime.cluster_presence import ClusterPresence
+from realtime.connection_registry import ConnectionRegistry
+from realtime.fanout_bus import FanoutBus, LoopbackBus, RedisFanoutBus, create_fanout_bus
+from realtime.heartbeat import HeartbeatScheduler
+from realtime.outbound_queue import OutboundQueue, QueuePolicy
+from realtime.wire_protocol import FLAG_DEFLATE, FLAG_PLAIN, MAX_INBOUND_FRAME, Frame, FrameError, MsgpackCodec, WireCodec, negotiate
+
+
+# ==========================================
+# TEST FIXTURES
+# ==========================================
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("socket closed")
+        self.sent.append(message)
+
+    async def send_bytes(self, message: bytes):
+        self.sent.append(bytes(message))
+
+
+class FakePubSub:
+    """redis.asyncio PubSub stand-in whose connection can be dropped"""
+
+    def __init__(self):
+        self.items = asyncio.Queue()
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.items.put_nowait({"type": "subscribe", "channel": channel, "data": 1})
+
+    async def unsubscribe(self, channel):
+        pass
+
+    async def aclose(self):
+        self.closed = True
+
+    def drop(self):
+        self.items.put_nowait(None)
+
+    async def listen(self):
+        while True:
+            item = await self.items.get()
+            if item is None:
+                raise ConnectionError("Connection closed by server.")
+            yield item
+
+
+class FakeRedis:
+    """Hands out pub/subs; the first `failed_subscribes` after the initial one fail"""
+
+    def __init__(self, failed_subscribes: int = 0):
+        self.failed_subscribes = failed_subscribes
+        self.subscriptions = []
+
+    def pubsub(self):
+        if self.subscriptions and self.failed_subscribes:
+            self.failed_subscribes -= 1
+            raise ConnectionError("Connection refused")
+        pubsub = FakePubSub()
+        self.subscriptions.append(pubsub)
+        return pubsub
+
+    async def deliver(self, envelope):
+        self.subscriptions[-1].items.put_nowait({"type": "message", "data": json.dumps(envelope)})
+        await asyncio.sleep(0.01)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def registry():
+    return ConnectionRegistry(max_concurrency=16, send_timeout=0.2)
+
+
+# ==========================================
+# REGISTRY TESTS
+# ==========================================
+
+class TestConnectionRegistry:
+    """Every device of a user stays registered"""
+
+    def test_second_device_does_not_replace_first(self, registry):
+        phone = registry.add("alice", FakeWebSocket())
+        laptop = registry.add("alice", FakeWebSocket())
+
+        assert phone != laptop
+        assert registry.connection_count("alice") == 2
+
+        registry.remove(phone)
+        assert registry.is_online("alice")
+
+        registry.remove(laptop)
+        assert not registry.is_online("alice")
+        assert "alice" not in registry.user_connections
+
+    @pytest.mark.asyncio
+    async def test_send_reaches_all_devices(self, registry):
+        phone, laptop = FakeWebSocket(), FakeWebSocket()
+        registry.add("alice", phone)
+        registry.add("alice", laptop)
+
+        delivered = registry.send_to_user("alice", "hello")
+        await registry.flush(timeout=1)
+
+        assert delivered == 2
+        assert phone.sent == ["hello"]
+        assert laptop.sent == ["hello"]
+
+    @pytest.mark.asyncio
+    async def test_fan_out_excludes_sender(self, registry):
+        sockets = {user: FakeWebSocket() for user in ("alice", "bob", "carol")}
+        for user, ws in sockets.items():
+            registry.add(user, ws)
+
+        delivered = registry.fan_out("hi", ["alice", "bob", "carol"], exclude="alice")
+        await registry.flush(timeout=1)
+
+        assert delivered == 2
+        assert sockets["alice"].sent == []
+        assert sockets["bob"].sent == ["hi"]
+
+    @pytest.mark.asyncio
+    async def test_slow_member_does_not_serialize_delivery(self, registry):
+        members = [f"user_{i}" for i in range(50)]
+        for member in members:
+            registry.add(member, FakeWebSocket(delay=0.05))
+
+        start = time.perf_counter()
+        delivered = registry.fan_out("msg", members)
+        enqueue_time = time.perf_counter() - start
+        await registry.flush(timeout=2)
+        elapsed = time.perf_counter() - start
+
+        assert delivered == 50
+        # Enqueueing never waits on the network
+        assert enqueue_time < 0.05
+        # Sequential delivery would take 50 * 0.05s = 2.5s
+        assert elapsed < 1.0
+
+    @pytest.mark.asyncio
+    async def test_broken_socket_is_evicted(self, registry):
+        registry.add("bob", FakeWebSocket(fail=True))
+        healthy = FakeWebSocket()
+        registry.add("bob", healthy)
+
+        registry.send_to_user("bob", "ping")
+        await asyncio.sleep(0.05)
+
+        assert registry.connection_count("bob") == 1
+        assert registry.evictions == 1
+        assert healthy.sent == ["ping"]
+
+    @pytest.mark.asyncio
+    async def test_timed_out_socket_is_evicted(self, registry):
+        registry.add("carol", FakeWebSocket(delay=1.0))
+
+        registry.send_to_user("carol", "ping")
+        await asyncio.sleep(0.4)
+
+        assert not registry.is_online("carol")
+
+
+# ==========================================
+# CROSS-WORKER FAN-OUT TESTS
+# ==========================================
+
+class TestFanoutBus:
+    """Workers deliver only to the sockets they own"""
+
+    @staticmethod
+    async def _make_worker(hub):
+        registry = ConnectionRegistry()
+        bus = LoopbackBus(hub=hub)
+
+        async def deliver(envelope):
+            registry.fan_out(envelope["message"], envelope["user_ids"], exclude=envelope.get("exclude"))
+
+        bus.set_handler(deliver)
+        await bus.start()
+        return registry, bus
+
+    @pytest.mark.asyncio
+    async def test_message_reaches_socket_on_other_worker(self):
+        hub = []
+        registry_a, bus_a = await self._make_worker(hub)
+        registry_b, bus_b = await self._make_worker(hub)
+
+        alice_ws, bob_ws = FakeWebSocket(), FakeWebSocket()
+        registry_a.add("alice", alice_ws)
+        registry_b.add("bob", bob_ws)
+
+        # Worker A handles the HTTP request: local delivery, then publish
+        registry_a.fan_out("hello", ["alice", "bob"], exclude="alice")
+        await bus_a.publish({"type": "deliver", "user_ids": ["alice", "bob"], "exclude": "alice", "message": "hello"})
+        await registry_b.flush(timeout=1)
+
+        assert bob_ws.sent == ["hello"]
+        assert alice_ws.sent == []
+        assert bus_b.stats["received"] == 1
+
+    @pytest.mark.asyncio
+    async def test_publisher_does_not_receive_own_envelope(self):
+        hub = []
+        registry_a, bus_a = await self._make_worker(hub)
+        ws = FakeWebSocket()
+        registry_a.add("alice", ws)
+
+        await bus_a.publish({"type": "deliver", "user_ids": ["alice"], "exclude": None, "message": "x"})
+        await registry_a.flush(timeout=1)
+
+        assert ws.sent == []
+        assert bus_a.stats["received"] == 0
+
+
+    @pytest.mark.asyncio
+    async def test_redis_listener_resubscribes_after_connection_drop(self):
+        client = FakeRedis(failed_subscribes=1)
+        bus = RedisFanoutBus(worker_id="w2", reconnect_delay=0.01, client=client)
+        received = []
+
+        async def deliver(envelope):
+            received.append(envelope["message"])
+
+        bus.set_handler(deliver)
+        await bus.start()
+        await client.deliver({"origin": "w1", "message": "before"})
+
+        # The connection drops, the first resubscribe fails, the second one sticks
+        client.subscriptions[-1].drop()
+        for _ in range(100):
+            await asyncio.sleep(0.005)
+            if bus.stats["reconnects"]:
+                break
+        await client.deliver({"origin": "w1", "message": "after"})
+
+        assert received == ["before", "after"]
+        assert bus.stats["disconnects"] == 1
+        assert bus.stats["reconnects"] == 1
+        assert bus.stats["connected"] is True
+        assert len(client.subscriptions) == 2
+        await bus.stop()
+        assert bus.stats["connected"] is False
+
+    def test_create_fanout_bus_rejects_unknown_backends(self):
+        assert create_fanout_bus("local") is None
+        assert isinstance(create_fanout_bus("loopback"), LoopbackBus)
+        with pytest.raises(ValueError):
+            create_fanout_bus("reddis")
+        with pytest.raises(TypeError):
+            FanoutBus()
+
+
+# ==========================================
+# CLUSTER PRESENCE TESTS
+# ==========================================
+
+class PresenceWorker:
+    """A registry plus cluster presence, connected and disconnected like ConnectionManager does"""
+
+    def __init__(self, hub, worker_id, reported):
+        self.registry = ConnectionRegistry()
+        self.bus = LoopbackBus(hub=hub, worker_id=worker_id)
+        self.reported = reported
+
+        async def online(user_id):
+            reported.append((worker_id, user_id, "online"))
+
+        async def offline(user_id):
+            reported.append((worker_id, user_id, "offline"))
+
+        self.cluster = ClusterPresence(
+            lambda: self.registry.user_connections.keys(), self.registry.is_online, online, offline,
+            announce_interval=60, worker_ttl=0.05
+        )
+        self.bus.set_handler(self.cluster.handle_envelope)
+
+    async def start(self):
+        await self.bus.start()
+        await self.cluster.start(self.bus)
+        return self
+
+    async def connect(self, user_id):
+        first = not self.registry.is_online(user_id)
+        connection_id = self.registry.add(user_id, FakeWebSocket())
+        if first and await self.cluster.connected(user_id):
+            self.reported.append((self.bus.worker_id, user_id, "online"))
+        return connection_id
+
+    async def disconnect(self, connection_id, user_id):
+        self.registry.remove(connection_id)
+        if not self.registry.is_online(user_id) and await self.cluster.disconnected(user_id):
+            self.reported.append((self.bus.worker_id, user_id, "offline"))
+
+
+class TestClusterPresence:
+    """A user is offline only once no worker holds a socket for them"""
+
+    @staticmethod
+    async def _cluster(*worker_ids):
+        hub, reported = [], []
+        workers = [await PresenceWorker(hub, worker_id, reported).start() for worker_id in worker_ids]
+        return workers, reported
+
+    @pytest.mark.asyncio
+    async def test_leaving_one_worker_keeps_user_online(self):
+        (w1, w2), reported = await self._cluster("w1", "w2")
+
+        first = await w1.connect("alice")
+        second = await w2.connect("alice")
+        await w1.disconnect(first, "alice")
+
+        assert reported == [("w1", "alice", "online")]
+        assert w1.cluster.is_online("alice") and w2.cluster.is_online("alice")
+
+        await w2.disconnect(second, "alice")
+        assert reported == [("w1", "alice", "online"), ("w2", "alice", "offline")]
+        assert not w1.cluster.is_online("alice")
+
+    @pytest.mark.asyncio
+    async def test_new_worker_learns_existing_users(self):
+        (w1,), reported = await self._cluster("w1")
+        await w1.connect("alice")
+        w2 = await PresenceWorker(w1.bus.hub, "w2", reported).start()
+
+        assert w2.cluster.is_online("alice")
+        assert await w2.cluster.connected("alice") is False
+
+    @pytest.mark.asyncio
+    async def test_simultaneous_disconnects_still_report_offline(self):
+        (w1, w2), reported = await self._cluster("w1", "w2")
+        first = await w1.connect("alice")
+        second = await w2.connect("alice")
+
+        # Each worker still sees the other holding alice when it lets go
+        w1.bus.hub.clear()
+        await w1.disconnect(first, "alice")
+        await w2.disconnect(second, "alice")
+        assert ("w1", "alice", "offline") not in reported and ("w2", "alice", "offline") not in reported
+        await w2.cluster.handle_envelope({"type": "presence_worker", "origin": "w1", "offline": ["alice"], "reported": False})
+
+        assert reported[-1] == ("w2", "alice", "offline")
+
+    @pytest.mark.asyncio
+    async def test_silent_worker_users_go_offline_once(self):
+        (w1, w2, w3), reported = await self._cluster("w1", "w2", "w3")
+        await w3.connect("alice")
+        w1.bus.hub.remove(w3.bus)  # shared hub: w3 is cut off from everyone
+
+        await asyncio.sleep(0.1)
+        await w2.cluster.handle_envelope({"type": "presence_worker", "origin": "w1", "count": 0})
+        await w1.cluster._expire_workers()
+        await w2.cluster._expire_workers()
+
+        assert [entry for entry in reported if entry[2] == "offline"] == [("w1", "alice", "offline")]
+        assert not w1.cluster.is_online("alice")
+
+    @pytest.mark.asyncio
+    async def test_count_mismatch_requests_full_set(self):
+        (w1, w2), reported = await self._cluster("w1", "w2")
+        await w1.connect("alice")
+        w2.cluster.remote["w1"].clear()  # as if the online envelope was lost
+
+        await w1.cluster._publish({"type": "presence_worker", "count": 1})
+
+        assert w2.cluster.is_online("alice")
+        assert w2.cluster.stats["resyncs"] == 1
+
+
+# ==========================================
+# OUTBOUND QUEUE TESTS
+# ==========================================
+
+class TestOutboundQueue:
+    """Backpressure policy for slow consumers"""
+
+    @pytest.mark.asyncio
+    async def test_oldest_typing_frame_dropped_first(self):
+        ws = FakeWebSocket(delay=0.01)
+        queue = OutboundQueue(ws, QueuePolicy(max_size=3))
+
+        queue.enqueue("typing-1", frame_type="typing_status")
+        queue.enqueue("msg-1", frame_type="new_message")
+        queue.enqueue("typing-2", frame_type="typing_status")
+        queue.enqueue("msg-2", frame_type="new_message")
+
+        assert queue.stats["dropped"] == 1
+        await queue.join(timeout=1)
+        assert "msg-1" in ws.sent and "msg-2" in ws.sent
+        assert "typing-1" not in ws.sent
+
+    @pytest.mark.asyncio
+    async def test_full_state_frames_coalesce(self):
+        ws = FakeWebSocket(delay=0.01)
+        queue = OutboundQueue(ws, QueuePolicy())
+
+        queue.enqueue("first", frame_type="new_message")
+        for i in range(5):
+            queue.enqueue(f"reaction-{i}", frame_type="message_reaction", coalesce_key="reaction:m1")
+        queue.enqueue("typing-1", frame_type="typing_status", coalesce_key="typing:c1")
+        queue.enqueue("typing-2", frame_type="typing_status", coalesce_key="typing:c1")
+        # Diffs only name who changed, so they must all arrive
+        queue.enqueue("diff-1", frame_type="presence_diff", coalesce_key="presence")
+        queue.enqueue("diff-2", frame_type="presence_diff", coalesce_key="presence")
+
+        await queue.join(timeout=1)
+        assert ws.sent == ["first", "reaction-4", "typing-2", "diff-1", "diff-2"]
+        assert queue.stats["coalesced"] == 5
+
+    @pytest.mark.asyncio
+    async def test_consumer_evicted_after_repeated_overflow(self):
+        evicted = []
+
+        async def on_evict(reason):
+            evicted.append(reason)
+
+        queue = OutboundQueue(FakeWebSocket(delay=1.0), QueuePolicy(max_size=2, max_overflows=3), on_evict=on_evict)
+        for i in range(10):
+            queue.enqueue(f"msg-{i}", frame_type="new_message")
+        await asyncio.sleep(0)
+
+        assert queue.closed
+        assert queue.stats["overflows"] == 3
+        assert evicted == ["slow consumer"]
+
+    @pytest.mark.asyncio
+    async def test_overflow_count_restarts_when_queue_drains(self):
+        queue = OutboundQueue(FakeWebSocket(delay=0.005), QueuePolicy(max_size=2, max_overflows=3))
+
+        # Bursts that overflow twice each, with the consumer catching up in between
+        for burst in range(5):
+            for i in range(4):
+                queue.enqueue(f"msg-{burst}-{i}", frame_type="new_message")
+            await queue.join(timeout=1)
+
+        assert not queue.closed
+        assert queue.stats["overflows"] == 10
+
+
+# ==========================================
+# HEARTBEAT SCHEDULER TESTS
+# ==========================================
+
+class TestHeartbeatScheduler:
+    """Timing wheel pings idle sockets and closes dead ones"""
+
+    @staticmethod
+    def _register(scheduler, key, events, now=0.0):
+        async def ping():
+            events.append(("ping", key))
+
+        async def close():
+            events.append(("close", key))
+
+        scheduler.register(key, ping, close, now=now)
+
+    @pytest.mark.asyncio
+    async def test_silent_socket_is_pinged_then_closed(self):
+        scheduler = HeartbeatScheduler(ping_interval=30, timeout=60, tick=1.0)
+        events = []
+        self._register(scheduler, "c1", events)
+
+        await scheduler.advance(now=29.0)
+        assert events == []
+        await scheduler.advance(now=31.0)
+        assert events == [("ping", "c1")]
+        await scheduler.advance(now=61.0)
+
+        assert events == [("ping", "c1"), ("close", "c1")]
+        assert scheduler.get_stats(now=61.0)["tracked"] == 0
+
+    @pytest.mark.asyncio
+    async def test_active_socket_is_never_pinged(self):
+        scheduler = HeartbeatScheduler(ping_interval=30, timeout=60, tick=1.0)
+        events = []
+        self._register(scheduler, "c1", events)
+
+        for second in range(0, 300, 10):
+            scheduler.touch("c1", now=float(second))
+            await scheduler.advance(now=float(second))
+
+        assert events == []
+
+    @pytest.mark.asyncio
+    async def test_pings_are_batched_per_slot(self):
+        scheduler = HeartbeatScheduler(ping_interval=30, timeout=60, tick=1.0, batch_size=100)
+        events = []
+        for i in range(1000):
+            self._register(scheduler, f"c{i}", events)
+
+        await scheduler.advance(now=31.0)
+
+        assert len(events) == 1000
+        assert scheduler.stats["pings"] == 1000
+
+    @pytest.mark.asyncio
+    async def test_unregister_and_histograms(self):
+        scheduler = HeartbeatScheduler(ping_interval=30, timeout=60, tick=1.0)
+        events = []
+        self._register(scheduler, "old", events, now=0.0)
+        self._register(scheduler, "new", events, now=100.0)
+        scheduler.touch("old", now=100.0)
+        scheduler.unregister("new")
+
+        stats = scheduler.get_stats(now=110.0)
+
+        assert stats["tracked"] == 1
+        assert stats["connection_age"]["<=300s"] == 1
+        assert stats["liveness"]["<=15s"] == 1
+
+
+# ==========================================
+# WIRE PROTOCOL TESTS
+# ==========================================
+
+class TestWireProtocol:
+    """Negotiated per-connection frame encodings"""
+
+    def test_negotiation_defaults_to_json(self):
+        codec, subprotocol = negotiate([], None)
+        assert codec.name == "json" and subprotocol is None
+
+        codec, subprotocol = negotiate(["chat.v2"], "protobuf")
+        assert codec.name == "json" and subprotocol is None
+
+    def test_negotiation_prefers_offered_subprotocol(self):
+        codec, subprotocol = negotiate(["chat.v2", "pulse.msgpack+deflate", "pulse.json"], None, 512)
+        assert subprotocol == "pulse.msgpack+deflate"
+        assert codec.name == "msgpack+deflate"
+        assert codec.compress_threshold == 512
+
+        # Query parameter for clients that cannot set Sec-WebSocket-Protocol; nothing to echo
+        codec, subprotocol = negotiate([], "msgpack")
+        assert codec.name == "msgpack" and subprotocol is None
+
+    def test_msgpack_round_trip_is_smaller(self):
+        codec = MsgpackCodec()
+        payload = {"type": "new_message", "data": {"message_id": "m1", "content": "hi", "read_by": ["alice"]}}
+
+        frame = codec.encode(json.dumps(payload))
+        assert isinstance(frame, bytes)
+        assert codec.decode(frame) == payload
+        assert len(frame) < len(json.dumps(payload))
+        # Clients may still send JSON text on a binary connection
+        assert codec.decode(json.dumps(payload)) == payload
+
+    def test_oversized_deflated_frame_is_rejected(self):
+        codec = MsgpackCodec(compress_threshold=0)
+        # ~8 KB on the wire, far past the limit once inflated
+        bomb = bytes((FLAG_DEFLATE,)) + zlib.compress(msgpack.packb({"type": "x", "pad": "a" * (MAX_INBOUND_FRAME * 4)}), 9)
+        assert len(bomb) < 16 * 1024
+        with pytest.raises(FrameError):
+            codec.decode(bomb)
+
+        within = codec.encode({"type": "x", "pad": "a" * 4096})
+        assert codec.decode(within)["pad"] == "a" * 4096
+
+    def test_empty_and_garbage_binary_frames_are_rejected(self):
+        codec = MsgpackCodec()
+        for data in (b"", b"\x07abc", bytes((FLAG_DEFLATE,)) + b"not zlib", bytes((FLAG_PLAIN,)) + b"\xc1"):
+            with pytest.raises(FrameError):
+                codec.decode(data)
+
+    def test_compression_only_above_threshold(self):
+        codec = MsgpackCodec(compress_threshold=256)
+        small = {"type": "ping"}
+        large = {"type": "messages", "data": [{"content": "hello there " * 4}] * 20}
+
+        assert codec.encode(small)[0] == 0
+        frame = codec.encode(large)
+        assert frame[0] == 1
+        assert len(frame) < len(MsgpackCodec().encode(large))
+        assert codec.decode(frame) == large
+
+    def test_json_codec_passes_strings_through(self):
+        codec = WireCodec()
+        assert codec.encode('{"type":"ping"}') == '{"type":"ping"}'
+        assert json.loads(codec.encode({"type": "ping"})) == {"type": "ping"}
+
+    @pytest.mark.asyncio
+    async def test_registry_sends_binary_to_msgpack_sockets(self, registry):
+        json_socket, binary_socket = FakeWebSocket(), FakeWebSocket()
+        registry.add("alice", json_socket)
+        binary_id = registry.add("bob", binary_socket, codec=MsgpackCodec())
+
+        frame = json.dumps({"type": "new_message", "data": {"content": "hi"}})
+        registry.fan_out(frame, ["alice", "bob"])
+        await registry.flush(timeout=1)
+
+        assert json_socket.sent == [frame]
+        assert isinstance(binary_socket.sent[0], bytes)
+        assert registry.codec(binary_id).decode(binary_socket.sent[0]) == json.loads(frame)
+
+    def test_negotiated_codecs_are_shared(self):
+        first, _ = negotiate(["pulse.msgpack"], None)
+        second, _ = negotiate([], "msgpack")
+        assert first is second
+
+    @pytest.mark.asyncio
+    async def test_broadcast_frame_encodes_once_per_codec(self, registry):
+        class CountingCodec(MsgpackCodec):
+            encoded = 0
+
+            def encode_payload(self, frame):
+                CountingCodec.encoded += 1
+                return super().encode_payload(frame)
+
+        codec = CountingCodec()
+        sockets = {f"user{i}": FakeWebSocket() for i in range(20)}
+        for i, (user_id, websocket) in enumerate(sockets.items()):
+            registry.add(user_id, websocket, codec=codec if i % 2 else None)
+
+        frame = Frame({"type": "message_delete", "data": {"message_id": "m1"}})
+        registry.fan_out(frame, list(sockets))
+        await registry.flush(timeout=1)
+
+        assert CountingCodec.encoded == 1
+        sent = [websocket.sent[0] for websocket in sockets.values()]
+        texts = [message for message in sent if isinstance(message, str)]
+        binaries = [message for message in sent if isinstance(message, bytes)]
+        assert len(texts) == len(binaries) == 10
+        assert all(message is texts[0] for message in texts)
+        assert all(message is binaries[0] for message in binaries)
+        assert json.loads(texts[0]) == codec.decode(binaries[0]) == frame.payload
+
+    def test_frame_from_text_parses_lazily(self):
+        frame = Frame(text='{"type": "ping"}')
+        assert WireCodec().encode(frame) == '{"type": "ping"}'
+        assert frame._payload is None
+        assert MsgpackCodec().decode(MsgpackCodec().encode(frame)) == {"type": "ping"}
@@ -0,0 +1,746 @@
+"""
+Pulse Backend - Realtime Game Tests
+In-memory game room actors and their persistence
+"""
+
+import pytest
+import asyncio
+import json
+from collections import deque
+
+from realtime.fanout_bus import LoopbackBus
+from realtime.game_rooms import GameRoomEngine
+from realtime.matchmaking import Matchmaker, QueueSpec
+from realtime.room_affinity import CLOSE_ROOM_MOVED, GameRoomRouter, HashRing
+from realtime.move_log import decode_records, encode_move, encode_reset
+
+
+# ==========================================
+# TEST FIXTURES
+# ==========================================
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self.close_code = code
+
+    async def send_text(self, message: str):
+        self.sent.append(json.loads(message))
+
+
+class FakeGameStore:
+    """Room documents, a log of snapshot writes and an append-only move log"""
+
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.loads = 0
+        self.snapshots = []
+        self.moves = []  # (room_id, from_seq, to_seq, data)
+
+    async def load(self, room_id):
+        self.loads += 1
+        await asyncio.sleep(0)
+        return self.rooms.get(room_id)
+
+    async def save(self, room_id, game_state, finished, move_seq):
+        await asyncio.sleep(0)
+        self.snapshots.append((room_id, game_state, finished))
+        if room_id in self.rooms:
+            self.rooms[room_id] = {**self.rooms[room_id], "game_state": game_state, "move_seq": move_seq}
+
+    async def append_moves(self, room_id, from_seq, to_seq, data):
+        await asyncio.sleep(0)
+        self.moves.append((room_id, from_seq, to_seq, data))
+
+    async def read_moves(self, room_id, after_seq):
+        return [data for rid, _, to_seq, data in self.moves if rid == room_id and to_seq > after_seq]
+
+
+async def counting_processor(game_type, state, move, player_id):
+    """Read-modify-write with a yield in between, like a real move handler"""
+    count = state.get("count", 0)
+    await asyncio.sleep(0)
+    new_state = {**state, "count": count + move.get("by", 1)}
+    if new_state["count"] >= state.get("target", 1_000_000):
+        new_state["status"] = "finished"
+    return new_state
+
+
+def make_engine(store, **kwargs):
+    return GameRoomEngine(store.load, counting_processor, store.save, snapshot_interval=60, **kwargs)
+
+
+def make_logged_engine(store, **kwargs):
+    return make_engine(store, log_writer=store.append_moves, log_reader=store.read_moves, **kwargs)
+
+
+async def settle(engine, room_id):
+    room = engine.rooms[room_id]
+    while not room.mailbox.empty():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    for queue in room.sockets.values():
+        await queue.join(timeout=1)
+
+
+# ==========================================
+# GAME ROOM ENGINE TESTS
+# ==========================================
+
+class TestGameRoomEngine:
+    """Moves are serialised per room and persisted by snapshot"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_moves_are_not_lost(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_engine(store)
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for ws in sockets:
+            await engine.attach("r1", ws)
+
+        for _ in range(100):
+            engine.submit_move("r1", "p1", {"by": 1})
+        await settle(engine, "r1")
+
+        assert engine.rooms["r1"].state["count"] == 100
+        assert all(len(ws.sent) == 100 for ws in sockets)
+        assert sockets[0].sent[-1] == {
+            "type": "game_state_update", "game_state": {"count": 100}, "seq": 100, "player_id": "p1", "move": {"by": 1}
+        }
+        assert store.snapshots == []  # no database write per move
+        assert store.loads == 1
+
+    @pytest.mark.asyncio
+    async def test_periodic_snapshot_writes_dirty_rooms_once(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+
+        for _ in range(10):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.snapshot_dirty()
+        await engine.snapshot_dirty()
+
+        assert store.snapshots == [("r1", {"count": 10}, False)]
+
+    @pytest.mark.asyncio
+    async def test_game_end_snapshots_immediately_and_ignores_later_moves(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0, "target": 2}}})
+        engine = make_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+
+        for _ in range(5):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+
+        assert store.snapshots == [("r1", {"count": 2, "target": 2, "status": "finished"}, True)]
+        assert engine.get_stats()["ignored_moves"] == 3
+
+    @pytest.mark.asyncio
+    async def test_last_socket_out_snapshots_and_unloads(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_engine(store)
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await engine.attach("r1", first)
+        await engine.attach("r1", second)
+        engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+
+        await engine.detach("r1", first)
+        assert "r1" in engine.rooms
+        await engine.detach("r1", second)
+
+        assert "r1" not in engine.rooms
+        assert store.snapshots == [("r1", {"count": 1}, False)]
+
+    @pytest.mark.asyncio
+    async def test_unknown_room_ignores_moves_but_relays_chat(self):
+        engine = make_engine(FakeGameStore({}))
+        ws = FakeWebSocket()
+        await engine.attach("ghost", ws)
+
+        engine.submit_move("ghost", "p1", {})
+        engine.broadcast("ghost", {"type": "chat_message", "message": "hi"})
+        await settle(engine, "ghost")
+
+        assert ws.sent == [{"type": "chat_message", "message": "hi"}]
+        assert engine.get_stats()["ignored_moves"] == 1
+
+
+    @pytest.mark.asyncio
+    async def test_failing_move_leaves_state_untouched_and_reports_error(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0, "log": []}}})
+
+        async def processor(game_type, state, move, player_id):
+            state["log"].append(move)  # mutates in place, like the real move handlers
+            if move.get("bad"):
+                raise ValueError("illegal move")
+            return {**state, "count": state["count"] + 1}
+
+        def resolver(game_type, move):
+            if move.get("unresolvable"):
+                raise KeyError("dice")
+            return move
+
+        engine = GameRoomEngine(store.load, processor, store.save, resolver=resolver, snapshot_interval=60)
+        ws = FakeWebSocket()
+        await engine.attach("r1", ws)
+
+        first = engine.submit_move("r1", "p1", {"n": 1})
+        bad = engine.submit_move("r1", "p1", {"bad": True})
+        unresolvable = engine.submit_move("r1", "p1", {"unresolvable": True})
+        last = engine.submit_move("r1", "p1", {"n": 2})
+
+        assert await first == 1
+        with pytest.raises(ValueError):
+            await bad
+        with pytest.raises(KeyError):
+            await unresolvable
+        assert await last == 2
+
+        # The actor survives, and the failed move's half-applied changes never reach the room
+        assert engine.rooms["r1"].state == {"count": 2, "log": [{"n": 1}, {"n": 2}]}
+        assert engine.get_stats()["move_errors"] == 2
+        await settle(engine, "r1")
+        assert [frame["seq"] for frame in ws.sent] == [1, 2]
+        assert engine.submit_move("ghost", "p1", {}) is None
+
+
+# ==========================================
+# MOVE LOG TESTS
+# ==========================================
+
+class TestMoveLog:
+    """Compact records round-trip and replay after a snapshot"""
+
+    def test_records_round_trip_and_concatenate(self):
+        player = "6f1c2a8e-1b7d-4c1e-9a0b-2f3d4e5f6a7b"
+        blob = (
+            encode_move(1, 1700000000000, player, {"type": "roll_dice", "dice_value": 6})
+            + encode_move(2, 1700000000001, player, {"type": "teleport", "to": [-3, 2.5], "ok": True})
+            + encode_reset(3, 1700000000002, {"board": [None, "X"], "status": "playing"})
+        )
+
+        assert decode_records(blob) == [
+            {"seq": 1, "ts": 1700000000000, "player_id": player, "move": {"type": "roll_dice", "dice_value": 6}},
+            {"seq": 2, "ts": 1700000000001, "player_id": player,
+             "move": {"type": "teleport", "to": [-3, 2.5], "ok": True}},
+            {"seq": 3, "ts": 1700000000002, "reset": {"board": [None, "X"], "status": "playing"}},
+        ]
+
+    def test_known_move_is_much_smaller_than_json(self):
+        player = "6f1c2a8e-1b7d-4c1e-9a0b-2f3d4e5f6a7b"
+        move = {"type": "cell_click", "position": 4}
+        record = encode_move(12, 1700000000000, player, move)
+        as_json = json.dumps({"seq": 12, "ts": 1700000000000, "player_id": player, "move": move})
+
+        assert len(record) * 3 < len(as_json)
+
+    @pytest.mark.asyncio
+    async def test_moves_are_logged_in_batches_and_snapshot_records_seq(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+
+        for _ in range(5):
+            engine.submit_move("r1", "p1", {"by": 2})
+        await settle(engine, "r1")
+        await engine.flush_logs()
+
+        assert [(from_seq, to_seq) for _, from_seq, to_seq, _ in store.moves] == [(1, 5)]
+        assert [record["move"] for record in decode_records(store.moves[0][3])] == [{"by": 2}] * 5
+
+        await engine.snapshot_dirty()
+        assert store.rooms["r1"]["move_seq"] == 5
+
+    @pytest.mark.asyncio
+    async def test_overlapping_flushes_write_each_record_once(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        released = asyncio.Event()
+
+        async def slow_append(room_id, from_seq, to_seq, data):
+            await released.wait()
+            await store.append_moves(room_id, from_seq, to_seq, data)
+
+        engine = make_engine(store, log_writer=slow_append, log_reader=store.read_moves)
+        await engine.attach("r1", FakeWebSocket())
+        for _ in range(3):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+
+        # The periodic flush and a snapshot race; a move lands while the first write is in flight
+        first = asyncio.create_task(engine.flush_logs())
+        await asyncio.sleep(0)
+        engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        second = asyncio.create_task(engine._write_snapshot(engine.rooms["r1"]))
+        await asyncio.sleep(0)
+        released.set()
+        await asyncio.gather(first, second)
+        await engine.flush_logs()
+
+        seqs = [record["seq"] for *_, data in store.moves for record in decode_records(data)]
+        assert seqs == [1, 2, 3, 4]
+        assert engine.rooms["r1"].log_buffer == []
+
+    @pytest.mark.asyncio
+    async def test_load_replays_log_after_last_snapshot(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+        for _ in range(3):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.snapshot_dirty()  # count 3 at seq 3
+        for _ in range(4):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.flush_logs()  # logged but not snapshotted, as after a crash
+
+        restarted = make_logged_engine(store)
+        room = await restarted.attach("r1", FakeWebSocket())
+
+        assert room.state == {"count": 7}
+        assert room.seq == 7
+        assert restarted.get_stats()["replayed"] == 4
+
+    @pytest.mark.asyncio
+    async def test_duplicate_log_chunks_replay_once(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+        for _ in range(3):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.flush_logs()
+        store.moves.append(store.moves[0])  # a retried append that had already landed
+
+        restarted = make_logged_engine(store)
+        room = await restarted.attach("r1", FakeWebSocket())
+
+        assert room.state == {"count": 3}
+        assert restarted.get_stats()["replayed"] == 3
+
+    @pytest.mark.asyncio
+    async def test_resolver_outcome_is_logged_and_replayed(self):
+        rolls = iter([5, 2])
+
+        def resolver(game_type, move):
+            return {**move, "by": next(rolls)}
+
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store, resolver=resolver)
+        await engine.attach("r1", FakeWebSocket())
+        engine.submit_move("r1", "p1", {"type": "roll_dice"})
+        engine.submit_move("r1", "p1", {"type": "roll_dice"})
+        await settle(engine, "r1")
+        await engine.flush_logs()
+
+        room = await make_logged_engine(store).attach("r1", FakeWebSocket())
+        assert room.state == {"count": 7}
+
+
+# ==========================================
+# CATCH-UP TESTS
+# ==========================================
+
+class TestCatchUp:
+    """Reconnecting clients get only what they missed"""
+
+    @pytest.mark.asyncio
+    async def test_active_room_serves_missed_moves(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        ws = FakeWebSocket()
+        await engine.attach("r1", ws)
+        for i in range(5):
+            engine.submit_move("r1", f"p{i}", {})
+        await settle(engine, "r1")
+
+        result = await engine.catch_up("r1", 3)
+        assert result["seq"] == 5
+        assert [(move["seq"], move["player_id"]) for move in result["moves"]] == [(4, "p3"), (5, "p4")]
+        assert await engine.catch_up("r1", 5) == {"seq": 5, "moves": []}
+
+        await engine.send_catch_up("r1", ws, 4)
+        await settle(engine, "r1")
+        assert ws.sent[-1]["type"] == "game_moves"
+        assert [move["seq"] for move in ws.sent[-1]["moves"]] == [5]
+
+    @pytest.mark.asyncio
+    async def test_moves_older_than_tail_come_from_the_log(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        await engine.attach("r1", FakeWebSocket())
+        engine.rooms["r1"].tail = deque(maxlen=2)
+        for _ in range(6):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.flush_logs()
+        engine.submit_move("r1", "p1", {})  # still buffered
+        await settle(engine, "r1")
+
+        result = await engine.catch_up("r1", 1)
+        assert [move["seq"] for move in result["moves"]] == [2, 3, 4, 5, 6, 7]
+
+    @pytest.mark.asyncio
+    async def test_too_far_behind_gets_full_state(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store, max_catch_up=3)
+        await engine.attach("r1", FakeWebSocket())
+        for _ in range(5):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+
+        assert await engine.catch_up("r1", 0) == {"seq": 5, "game_state": {"count": 5}}
+        assert await engine.catch_up("r1", 9) == {"seq": 5, "game_state": {"count": 5}}
+
+    @pytest.mark.asyncio
+    async def test_inactive_room_catch_up_from_snapshot_and_log(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        engine = make_logged_engine(store)
+        ws = FakeWebSocket()
+        await engine.attach("r1", ws)
+        for _ in range(4):
+            engine.submit_move("r1", "p1", {})
+        await settle(engine, "r1")
+        await engine.detach("r1", ws)
+
+        result = await engine.catch_up("r1", 2)
+        assert [move["seq"] for move in result["moves"]] == [3, 4]
+        assert "r1" not in engine.rooms
+        assert await engine.catch_up("ghost", 0) is None
+
+
+# ==========================================
+# ROOM AFFINITY TESTS
+# ==========================================
+
+def make_router(store):
+    engine = make_engine(store)
+
+    async def handle_frame(room_id, websocket, data):
+        if data.get("type") == "game_move":
+            engine.submit_move(room_id, data.get("player_id"), data.get("move", {}))
+
+    return GameRoomRouter(engine, handle_frame, sync_wait=0.01)
+
+
+async def add_worker(hub, store, worker_id):
+    bus = LoopbackBus(hub=hub, worker_id=worker_id)
+    router = make_router(store)
+    bus.set_handler(router.handle_envelope)
+    await bus.start()
+    await router.start(bus)
+    return router
+
+
+async def start_cluster(store, worker_ids):
+    hub = []
+    return {worker_id: await add_worker(hub, store, worker_id) for worker_id in worker_ids}
+
+
+async def drain(routers, rounds=20):
+    for _ in range(rounds):
+        await asyncio.sleep(0)
+        for router in routers.values():
+            for room in router.engine.rooms.values():
+                for queue in room.sockets.values():
+                    await queue.join(timeout=1)
+            for entry in router.proxies.values():
+                await entry[3].join(timeout=1)
+
+
+class TestRoomAffinity:
+    """One owner per room; sockets on other workers are proxied to it"""
+
+    def test_ring_moves_few_keys_when_a_worker_joins(self):
+        ring = HashRing()
+        for worker_id in ("w1", "w2", "w3"):
+            ring.add(worker_id)
+        rooms = [f"room-{i}" for i in range(3000)]
+        before = {room: ring.owner(room) for room in rooms}
+
+        ring.add("w4")
+        moved = [room for room in rooms if ring.owner(room) != before[room]]
+
+        assert all(ring.owner(room) == "w4" for room in moved)
+        assert 0.1 < len(moved) / len(rooms) < 0.4
+        assert {ring.owner(room) for room in rooms} == {"w1", "w2", "w3", "w4"}
+
+    @pytest.mark.asyncio
+    async def test_workers_agree_on_owner(self):
+        routers = await start_cluster(FakeGameStore({}), ["w1", "w2", "w3"])
+
+        for room_id in (f"room-{i}" for i in range(50)):
+            assert len({router.owner(room_id) for router in routers.values()}) == 1
+        assert all(len(router.ring.nodes) == 3 for router in routers.values())
+
+    @pytest.mark.asyncio
+    async def test_proxied_socket_plays_in_the_owners_room(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        routers = await start_cluster(store, ["w1", "w2"])
+        owner_id = routers["w1"].owner("r1")
+        other_id = "w2" if owner_id == "w1" else "w1"
+        owner, other = routers[owner_id], routers[other_id]
+
+        local_ws, proxied_ws = FakeWebSocket(), FakeWebSocket()
+        assert await owner.attach("r1", local_ws) is None
+        proxy_id = await other.attach("r1", proxied_ws)
+        assert proxy_id is not None
+        await drain(routers)
+
+        for _ in range(3):
+            await other.handle_frame("r1", proxied_ws, proxy_id, {"type": "game_move", "player_id": "p2", "move": {}})
+        await owner.handle_frame("r1", local_ws, None, {"type": "game_move", "player_id": "p1", "move": {}})
+        await drain(routers)
+
+        assert owner.engine.rooms["r1"].state == {"count": 4}
+        assert "r1" not in other.engine.rooms
+        assert [frame["seq"] for frame in proxied_ws.sent] == [1, 2, 3, 4]
+        assert local_ws.sent == proxied_ws.sent
+        assert store.loads == 1
+
+        await other.detach("r1", proxied_ws, proxy_id)
+        await drain(routers)
+        assert len(owner.engine.rooms["r1"].sockets) == 1
+
+    @pytest.mark.asyncio
+    async def test_catch_up_is_answered_by_the_owner(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        routers = await start_cluster(store, ["w1", "w2"])
+        owner = routers[routers["w1"].owner("r1")]
+        other = next(router for router in routers.values() if router is not owner)
+        await owner.attach("r1", FakeWebSocket())
+        for _ in range(3):
+            owner.engine.submit_move("r1", "p1", {})
+        await drain(routers)
+
+        # Nothing is snapshotted yet; only the owner knows these moves
+        result = await other.catch_up("r1", 1)
+
+        assert result["seq"] == 3
+        assert [move["seq"] for move in result["moves"]] == [2, 3]
+        assert "r1" not in other.engine.rooms
+        assert other.stats["remote_catch_ups"] == 1
+
+    @pytest.mark.asyncio
+    async def test_pings_go_through_the_socket_queue(self):
+        store = FakeGameStore({"r1": {"room_id": "r1", "game_type": "count", "game_state": {"count": 0}}})
+        routers = await start_cluster(store, ["w1", "w2"])
+        owner = routers[routers["w1"].owner("r1")]
+        other = next(router for router in routers.values() if router is not owner)
+        local_ws, proxied_ws = FakeWebSocket(), FakeWebSocket()
+        await owner.attach("r1", local_ws)
+        proxy_id = await other.attach("r1", proxied_ws)
+
+        ping = json.dumps({"type": "ping"})
+        assert owner.send("r1", local_ws, None, ping, "ping")
+        assert other.send("r1", proxied_ws, proxy_id, ping, "ping")
+        await drain(routers)
+
+        assert local_ws.sent == proxied_ws.sent == [{"type": "ping"}]
+        await other.detach("r1", proxied_ws, proxy_id)
+        assert not other.send("r1", proxied_ws, proxy_id, ping, "ping")
+
+    @pytest.mark.asyncio
+    async def test_moved_rooms_are_closed_for_reconnect(self):
+        store = FakeGameStore({})
+        routers = await start_cluster(store, ["w1"])
+        rooms = [f"room-{i}" for i in range(40)]
+        sockets = {room_id: FakeWebSocket() for room_id in rooms}
+        for room_id, ws in sockets.items():
+            await routers["w1"].attach(room_id, ws)
+
+        joining = await add_worker(routers["w1"].bus.hub, store, "w2")
+        await drain(routers)
+
+        moved = [room_id for room_id in rooms if joining.owner(room_id) == "w2"]
+        assert moved
+        assert all(sockets[room_id].close_code == CLOSE_ROOM_MOVED for room_id in moved)
+        assert not any(sockets[room_id].closed for room_id in rooms if room_id not in moved)
+        assert not any(room_id in routers["w1"].engine.rooms for room_id in moved)
+
+    @pytest.mark.asyncio
+    async def test_new_owner_waits_for_the_old_owner_to_persist(self):
+        rooms = [f"room-{i}" for i in range(40)]
+        store = FakeGameStore({room_id: {"room_id": room_id, "game_type": "count", "game_state": {"count": 0}} for room_id in rooms})
+        routers = await start_cluster(store, ["w1"])
+        old = routers["w1"]
+        for room_id in rooms:
+            await old.attach(room_id, FakeWebSocket())
+            for _ in range(3):
+                old.engine.submit_move(room_id, "p1", {})
+
+        # Before the new worker's first sync its ring is only itself; it must not claim rooms yet
+        new = await add_worker(old.bus.hub, store, "w2")
+        routers["w2"] = new
+        room_id = next(room_id for room_id in rooms if new.owner(room_id) == "w2")
+        ws = FakeWebSocket()
+        await new.attach(room_id, ws)
+
+        # The queued moves were applied and snapshotted by the old owner before the new one loaded
+        assert new.engine.rooms[room_id].state == {"count": 3}
+        assert room_id not in old.engine.rooms
+        assert new.stats['handoffs'] >= 1
+        assert new.stats['handoff_timeouts'] == 0
+
+
+# ==========================================
+# MATCHMAKING TESTS
+# ==========================================
+
+class FakeMatchStore:
+    """Records created matches and the notifications pushed for them"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.created = []
+        self.notified = []
+
+    async def create(self, game_type, players):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        room_id = f"room-{len(self.created) + 1}"
+        self.created.append((game_type, players))
+        return {"room_id": room_id, "game_type": game_type, "players": players}
+
+    async def notify(self, user_ids, payload):
+        self.notified.append((user_ids, payload))
+
+
+def make_matchmaker(store, **kwargs):
+    specs = {"tic-tac-toe": QueueSpec(2, 2), "ludo": QueueSpec(2, 4, fill_wait=10), "mafia": QueueSpec(5, 10, fill_wait=20)}
+    return Matchmaker(store.create, store.notify, specs=specs, **kwargs)
+
+
+class TestMatchmaker:
+    """Queues form matches by size rules and optional ratings"""
+
+    @pytest.mark.asyncio
+    async def test_pairs_form_in_arrival_order_and_are_pushed(self):
+        store = FakeMatchStore()
+        matchmaker = make_matchmaker(store)
+        for user_id in ("a", "b", "c"):
+            matchmaker.join(user_id, "tic-tac-toe", now=0)
+
+        assert await matchmaker.match(now=0) == 1
+        assert store.created == [("tic-tac-toe", ["a", "b"])]
+        assert store.notified == [(["a", "b"], {
+            "type": "match_found", "room_id": "room-1", "game_type": "tic-tac-toe", "players": ["a", "b"]
+        })]
+        assert matchmaker.status("a")["status"] == "matched"
+        assert matchmaker.status("c") == {"status": "queued", "game_type": "tic-tac-toe", "position": 1, "waiting": 1}
+
+    @pytest.mark.asyncio
+    async def test_ludo_waits_to_fill_then_starts_with_minimum(self):
+        store = FakeMatchStore()
+        matchmaker = make_matchmaker(store)
+        matchmaker.join("a", "ludo", now=0)
+        matchmaker.join("b", "ludo", now=1)
+        matchmaker.join("c", "ludo", now=2)
+
+        assert await matchmaker.match(now=5) == 0
+        assert await matchmaker.match(now=10) == 1
+        assert store.created == [("ludo", ["a", "b", "c"])]
+
+        for user_id in ("d", "e", "f", "g"):
+            matchmaker.join(user_id, "ludo", now=20)
+        assert await matchmaker.match(now=20) == 1
+        assert store.created[-1] == ("ludo", ["d", "e", "f", "g"])
+
+    @pytest.mark.asyncio
+    async def test_mafia_needs_five(self):
+        store = FakeMatchStore()
+        matchmaker = make_matchmaker(store)
+        for user_id in "abcd":
+            matchmaker.join(user_id, "mafia", now=0)
+
+        assert await matchmaker.match(now=100) == 0
+        matchmaker.join("e", "mafia", now=100)
+        assert await matchmaker.match(now=100) == 1
+        assert store.created == [("mafia", list("abcde"))]
+
+    @pytest.mark.asyncio
+    async def test_ratings_match_close_players_and_widen_with_wait(self):
+        store = FakeMatchStore()
+        matchmaker = make_matchmaker(store, rating_window=100, window_growth=10)
+        matchmaker.join("strong", "tic-tac-toe", rating=1800, now=0)
+        matchmaker.join("new", "tic-tac-toe", rating=1000, now=0)
+        matchmaker.join("close", "tic-tac-toe", rating=1050, now=0)
+
+        await matchmaker.match(now=0)
+        assert store.created == [("tic-tac-toe", ["new", "close"])]
+
+        matchmaker.join("weak", "tic-tac-toe", rating=1300, now=0)
+        assert await matchmaker.match(now=30) == 0  # window 400 < 500
+        assert await matchmaker.match(now=41) == 1  # window 510
+        assert store.created[-1] == ("tic-tac-toe", ["strong", "weak"])
+
+    @pytest.mark.asyncio
+    async def test_failed_room_creation_requeues_players(self):
+        store = FakeMatchStore(fail=True)
+        matchmaker = make_matchmaker(store)
+        matchmaker.join("a", "tic-tac-toe", now=0)
+        matchmaker.join("b", "tic-tac-toe", now=0)
+
+        assert await matchmaker.match(now=0) == 0
+        assert matchmaker.status("a")["status"] == "queued"
+        assert matchmaker.get_stats()["match_errors"] == 1
+
+    @pytest.mark.asyncio
+    async def test_every_rated_pair_in_a_group_is_within_the_window(self):
+        store = FakeMatchStore()
+        matchmaker = make_matchmaker(store, rating_window=100, window_growth=0)
+        matchmaker.join("mid", "ludo", rating=1090, now=0)
+        matchmaker.join("low", "ludo", rating=1000, now=0)
+        matchmaker.join("high", "ludo", rating=1180, now=0)
+
+        # Both others are within 100 of "mid", but not of each other
+        assert await matchmaker.match(now=10) == 1
+        assert store.created == [("ludo", ["mid", "low"])]
+        assert matchmaker.status("high")["status"] == "queued"
+
+    @pytest.mark.asyncio
+    async def test_failed_creation_keeps_requeues_and_cancellations(self):
+        store = FakeMatchStore(fail=True)
+        started = asyncio.Event()
+        failing = store.create
+
+        async def slow_create(game_type, players):
+            started.set()
+            await asyncio.sleep(0.01)
+            return await failing(game_type, players)
+
+        matchmaker = Matchmaker(slow_create, store.notify, specs={"tic-tac-toe": QueueSpec(2, 2), "ludo": QueueSpec(2, 4)})
+        matchmaker.join("a", "tic-tac-toe", now=0)
+        matchmaker.join("b", "tic-tac-toe", now=0)
+
+        matching = asyncio.create_task(matchmaker.match(now=0))
+        await started.wait()
+        matchmaker.join("a", "ludo", now=1)  # re-queued for another game
+        assert matchmaker.leave("b") is True  # cancelled
+        assert await matching == 0
+
+        assert matchmaker.status("a")["game_type"] == "ludo"
+        assert matchmaker.status("b") == {"status": "idle"}
+        assert matchmaker.get_stats()["queued"] == {"tic-tac-toe": 0, "ludo": 1}
+
+    def test_switching_queues_and_unknown_game(self):
+        matchmaker = make_matchmaker(FakeMatchStore())
+        matchmaker.join("a", "ludo")
+        matchmaker.join("a", "mafia")
+
+        assert matchmaker.get_stats()["queued"] == {"tic-tac-toe": 0, "ludo": 0, "mafia": 1}
+        with pytest.raises(ValueError):
+            matchmaker.join("a", "chess")
+        assert matchmaker.leave("a") is True
+        assert matchmaker.status("a") == {"status": "idle"}
@@ -0,0 +1,1210 @@
+"""
+Pulse Backend - Realtime State Tests
+In-memory indexes that keep realtime traffic off MongoDB
+"""
+
+import pytest
+import asyncio
+from datetime import datetime, timedelta
+
+from realtime.call_quality import CallQualityAggregator, QualityHistogram
+from realtime.call_signaling import CallSignaling
+from realtime.chat_inbox import ChatInbox
+from realtime.chat_sequences import ChatSequencer
+from realtime.delivery_outbox import DeliveryOutbox, ReceiptWatermarks
+from realtime.membership_cache import ChatMembershipCache
+from realtime.message_pipeline import MessagePipeline
+from realtime.presence_service import PresenceService
+from realtime.presence_writer import PresenceWriter
+from realtime.reaction_aggregator import ReactionAggregator
+from realtime.room_index import RoomIndex, RoomOwnerIndex
+from realtime.typing_coalescer import TypingCoalescer
+
+
+# ==========================================
+# CHAT MEMBERSHIP CACHE TESTS
+# ==========================================
+
+class FakeChatStore:
+    """Counts loader round trips"""
+
+    def __init__(self, chats):
+        self.chats = chats
+        self.queries = 0
+
+    async def load(self, chat_id):
+        self.queries += 1
+        await asyncio.sleep(0)
+        chat = self.chats.get(chat_id)
+        return dict(chat) if chat else None
+
+
+class TestChatMembershipCache:
+    """Membership lookups hit memory after the first load"""
+
+    @pytest.mark.asyncio
+    async def test_repeated_lookups_use_one_query(self):
+        store = FakeChatStore({"c1": {"chat_id": "c1", "members": ["a", "b"], "chat_type": "direct"}})
+        cache = ChatMembershipCache(store.load, ttl=60)
+
+        for _ in range(100):
+            assert await cache.is_member("c1", "a")
+
+        assert store.queries == 1
+        assert cache.get_stats()["hits"] == 99
+        assert (await cache.get("c1")).get("chat_type") == "direct"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_query(self):
+        store = FakeChatStore({"c1": {"chat_id": "c1", "members": ["a"]}})
+        cache = ChatMembershipCache(store.load, ttl=60)
+
+        results = await asyncio.gather(*(cache.get_members("c1") for _ in range(20)))
+
+        assert all(members == {"a"} for members in results)
+        assert store.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_write_through_member_changes(self):
+        store = FakeChatStore({"team": {"chat_id": "team", "members": ["owner"]}})
+        cache = ChatMembershipCache(store.load, ttl=60)
+        await cache.get("team")
+
+        cache.add_member("team", "joiner")
+        assert await cache.is_member("team", "joiner")
+
+        cache.remove_member("team", "joiner")
+        assert not await cache.is_member("team", "joiner")
+        assert store.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry_reloads(self):
+        store = FakeChatStore({"c1": {"chat_id": "c1", "members": ["a"]}})
+        cache = ChatMembershipCache(store.load, ttl=0)
+
+        await cache.get("c1")
+        await cache.get("c1")
+
+        assert store.queries == 2
+        assert cache.get_stats()["expired"] == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_chat_is_not_cached(self):
+        store = FakeChatStore({})
+        cache = ChatMembershipCache(store.load, ttl=60)
+
+        assert not await cache.is_member("ghost", "a")
+        store.chats["ghost"] = {"chat_id": "ghost", "members": ["a"]}
+        assert await cache.is_member("ghost", "a")
+
+    def test_lru_bound(self):
+        cache = ChatMembershipCache(FakeChatStore({}).load, ttl=60, max_entries=2)
+        for chat_id in ("c1", "c2", "c3"):
+            cache.set_chat({"chat_id": chat_id, "members": []})
+
+        assert cache.get_stats()["entries"] == 2
+        assert cache.get_stats()["evictions"] == 1
+
+
+# ==========================================
+# TYPING COALESCER TESTS
+# ==========================================
+
+class TestTypingCoalescer:
+    """One flush per tick, only when the typing set changed"""
+
+    @staticmethod
+    def _make(ttl=6.0, changes=None):
+        flushed = []
+
+        async def flush(chat_id, typing_users, chat_changes):
+            flushed.append((chat_id, typing_users))
+            if changes is not None:
+                changes.append(chat_changes)
+
+        return TypingCoalescer(flush, tick=0.25, ttl=ttl), flushed
+
+    @pytest.mark.asyncio
+    async def test_burst_collapses_to_one_flush(self):
+        coalescer, flushed = self._make()
+
+        for _ in range(50):
+            coalescer.set_typing("c1", "alice", True)
+        coalescer.set_typing("c1", "bob", True)
+        await coalescer.flush_pending()
+
+        assert flushed == [("c1", ["alice", "bob"])]
+
+    @pytest.mark.asyncio
+    async def test_unchanged_set_is_not_resent(self):
+        coalescer, flushed = self._make()
+
+        coalescer.set_typing("c1", "alice", True)
+        await coalescer.flush_pending()
+        coalescer.set_typing("c1", "alice", True)  # keep-alive refresh
+        await coalescer.flush_pending()
+
+        assert len(flushed) == 1
+        assert coalescer.stats["suppressed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_start_then_stop_within_tick_sends_nothing(self):
+        coalescer, flushed = self._make()
+
+        coalescer.set_typing("c1", "alice", True)
+        coalescer.set_typing("c1", "alice", False)
+        await coalescer.flush_pending()
+
+        assert flushed == []
+
+    @pytest.mark.asyncio
+    async def test_flush_reports_who_started_and_stopped(self):
+        changes = []
+        coalescer, flushed = self._make(changes=changes)
+
+        coalescer.set_typing("c1", "alice", True)
+        coalescer.set_typing("c1", "bob", True)
+        await coalescer.flush_pending()
+        coalescer.set_typing("c1", "alice", False)
+        coalescer.set_typing("c1", "carol", True)
+        await coalescer.flush_pending()
+
+        assert flushed[1] == ("c1", ["bob", "carol"])
+        assert changes == [
+            [{"user_id": "alice", "is_typing": True}, {"user_id": "bob", "is_typing": True}],
+            [{"user_id": "alice", "is_typing": False}, {"user_id": "carol", "is_typing": True}],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_other_workers_typers_are_merged_into_the_set(self):
+        changes = []
+        coalescer, flushed = self._make(changes=changes)
+
+        coalescer.apply_remote("c1", [{"user_id": "bob", "is_typing": True}])
+        coalescer.set_typing("c1", "alice", True)
+        await coalescer.flush_pending()
+        coalescer.apply_remote("c1", [{"user_id": "bob", "is_typing": False}])
+        coalescer.set_typing("c1", "carol", True)
+        await coalescer.flush_pending()
+
+        # The set spans workers; the changes are only this worker's own
+        assert flushed == [("c1", ["alice", "bob"]), ("c1", ["alice", "carol"])]
+        assert changes[1] == [{"user_id": "carol", "is_typing": True}]
+
+    @pytest.mark.asyncio
+    async def test_vanished_client_expires(self):
+        coalescer, flushed = self._make(ttl=0.05)
+
+        coalescer.set_typing("c1", "alice", True)
+        await coalescer.flush_pending()
+        await asyncio.sleep(0.1)
+        await coalescer.flush_pending()
+
+        assert flushed == [("c1", ["alice"]), ("c1", [])]
+        assert coalescer.typing_users("c1") == []
+
+    @pytest.mark.asyncio
+    async def test_clear_user_on_disconnect(self):
+        coalescer, flushed = self._make()
+
+        coalescer.set_typing("c1", "alice", True)
+        coalescer.set_typing("c2", "alice", True)
+        await coalescer.flush_pending()
+        coalescer.clear_user("alice")
+        await coalescer.flush_pending()
+
+        assert sorted(flushed[2:]) == [("c1", []), ("c2", [])]
+
+
+# ==========================================
+# PRESENCE SERVICE TESTS
+# ==========================================
+
+class TestPresenceService:
+    """Presence changes reach watchers as one batched diff per subscriber"""
+
+    @staticmethod
+    def _make(watchers, failures=(), **kwargs):
+        failures = list(failures)
+        loads = []
+        frames = []
+        deliveries = []
+
+        async def loader(user_ids):
+            loads.extend(user_ids)
+            if failures:
+                raise failures.pop()
+            return {user_id: watchers[user_id] for user_id in user_ids if user_id in watchers}
+
+        async def deliver(diffs):
+            deliveries.append(diffs)
+            frames.extend(diffs.items())
+
+        presence = PresenceService(loader, deliver, interval=1.0, **kwargs)
+        presence.deliveries = deliveries
+        return presence, loads, frames
+
+    @pytest.mark.asyncio
+    async def test_many_changes_one_frame_per_subscriber(self):
+        presence, _, frames = self._make({"a": ["viewer"], "b": ["viewer"], "c": ["viewer", "other"]})
+
+        for user_id in ("a", "b", "c"):
+            presence.update(user_id, {"status": "busy"})
+        presence.update("a", {"status": "away"})  # latest wins
+        await presence.flush_pending()
+
+        by_subscriber = dict(frames)
+        assert len(frames) == 2
+        assert len(presence.deliveries) == 1  # one publish for the whole flush
+        assert by_subscriber["viewer"] == {"a": {"status": "away"}, "b": {"status": "busy"}, "c": {"status": "busy"}}
+        assert by_subscriber["other"] == {"c": {"status": "busy"}}
+
+    @pytest.mark.asyncio
+    async def test_watchers_are_not_capped(self):
+        watchers = [f"w{i}" for i in range(1500)]
+        presence, _, frames = self._make({"popular": watchers})
+
+        presence.update("popular", {"status": "online"})
+        await presence.flush_pending()
+
+        assert len(frames) == 1500
+
+    @pytest.mark.asyncio
+    async def test_watch_index_loaded_once_and_written_through(self):
+        presence, loads, frames = self._make({"a": ["x"]})
+
+        presence.update("a", {"status": "online"})
+        await presence.flush_pending()
+        presence.add_watch("y", "a")
+        presence.remove_watch("x", "a")
+        presence.set_offline("a")
+        await presence.flush_pending()
+
+        assert loads == ["a"]
+        assert frames[-1] == ("y", {"a": {"status": "offline"}})
+
+    @pytest.mark.asyncio
+    async def test_watchers_of_all_changed_users_load_in_one_call(self):
+        presence, loads, frames = self._make({f"u{i}": ["viewer"] for i in range(50)})
+        calls = []
+        loader = presence.watcher_loader
+
+        async def counting_loader(user_ids):
+            calls.append(len(user_ids))
+            return await loader(user_ids)
+
+        presence.watcher_loader = counting_loader
+        for i in range(50):
+            presence.update(f"u{i}", {"status": "online"})
+        await presence.flush_pending()
+
+        assert calls == [50]
+        assert len(dict(frames)["viewer"]) == 50
+
+    @pytest.mark.asyncio
+    async def test_failed_watcher_load_is_retried_next_flush(self):
+        presence, _, frames = self._make({"a": ["x"], "b": ["x"]}, failures=[RuntimeError("replica set has no primary")])
+
+        presence.update("a", {"status": "online"})
+        presence.update("b", {"status": "online"})
+        await presence.flush_pending()
+        assert frames == []
+        assert presence.get_stats()['watcher_load_errors'] == 1
+        assert presence.get_stats()['pending'] == 2
+
+        presence.update("a", {"status": "away"})  # newer than the change that failed
+        await presence.flush_pending()
+        assert frames == [("x", {"a": {"status": "away"}, "b": {"status": "online"}})]
+
+    @pytest.mark.asyncio
+    async def test_expired_watcher_lists_are_evicted(self):
+        presence, loads, _ = self._make({"a": ["x"], "b": ["y"]}, watcher_ttl=0.01)
+
+        presence.update("a", {"status": "online"})
+        presence.update("b", {"status": "online"})
+        await presence.flush_pending()
+        assert presence.get_stats()['indexed_targets'] == 2
+
+        await asyncio.sleep(0.02)
+        await presence.flush_pending()  # nothing pending: still sweeps
+        assert presence.get_stats()['indexed_targets'] == 0
+        assert presence.get_stats()['evicted_watchers'] == 2
+
+    def test_snapshot_from_memory(self):
+        presence, _, _ = self._make({})
+        presence.update("a", {"status": "busy", "activity": "gaming"})
+
+        snapshot = presence.snapshot(["a", "b"], lambda user_id: user_id == "a")
+
+        assert snapshot["a"] == {"is_online": True, "status": "busy", "activity": "gaming"}
+        assert snapshot["b"] == {"is_online": False, "status": "offline"}
+
+
+# ==========================================
+# PRESENCE WRITE-BEHIND TESTS
+# ==========================================
+
+class FakeUsersCollection:
+    """Records bulk_write batches"""
+
+    def __init__(self, fail_times=0):
+        self.batches = []
+        self.fail_times = fail_times
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("primary stepped down")
+        self.batches.append(operations)
+
+
+class TestPresenceWriter:
+    """Presence writes are coalesced per user and flushed in bulk"""
+
+    @pytest.mark.asyncio
+    async def test_reconnect_storm_coalesces_to_one_write_per_user(self):
+        users = FakeUsersCollection()
+        writer = PresenceWriter(users, batch_size=1000)
+
+        for _ in range(10):
+            for i in range(100):
+                writer.mark(f"u{i}", True)
+                writer.mark(f"u{i}", False)
+        await writer.flush_pending()
+
+        assert len(users.batches) == 1
+        assert len(users.batches[0]) == 100
+        assert users.batches[0][0]._doc["$set"]["is_online"] is False
+
+    @pytest.mark.asyncio
+    async def test_batches_are_bounded(self):
+        users = FakeUsersCollection()
+        writer = PresenceWriter(users, batch_size=40)
+
+        for i in range(100):
+            writer.mark(f"u{i}", True)
+        await writer.flush_pending()
+
+        assert [len(batch) for batch in users.batches] == [40, 40, 20]
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_retried_without_overwriting_newer_state(self):
+        users = FakeUsersCollection(fail_times=1)
+        writer = PresenceWriter(users)
+
+        writer.mark("a", True)
+        writer.mark("b", True)
+        await writer.flush_pending()
+        writer.mark("a", False)
+        await writer.stop()
+
+        written = {op._filter["user_id"]: op._doc["$set"]["is_online"] for op in users.batches[0]}
+        assert written == {"a": False, "b": True}
+        assert writer.get_stats()["errors"] == 1
+
+
+# ==========================================
+# ROOM INDEX TESTS
+# ==========================================
+
+class TestRoomIndex:
+    """Disconnect cleanup only touches the rooms a user was in"""
+
+    def test_remove_user_returns_only_their_rooms(self):
+        index = RoomIndex()
+        for i in range(1000):
+            index.join(f"room{i}", f"user{i}")
+        index.join("room1", "leaver")
+        index.join("room2", "leaver")
+
+        assert sorted(index.remove_user("leaver")) == ["room1", "room2"]
+        assert index.members("room1") == {"user1"}
+        assert index.rooms_of("leaver") == set()
+
+    def test_join_leave_and_empty_rooms_dropped(self):
+        index = RoomIndex()
+
+        assert index.join("r", "a")
+        assert not index.join("r", "a")
+        assert index.count("r") == 1
+        assert index.leave("r", "a")
+        assert not index.leave("r", "a")
+        assert index.get_stats() == {"rooms": 0, "users": 0}
+
+    def test_owner_index(self):
+        shares = RoomOwnerIndex()
+        shares.set("call1", "a")
+        shares.set("call2", "a")
+        shares.set("call2", "b")  # b takes over
+
+        assert shares.remove_user("a") == ["call1"]
+        assert shares.owner("call2") == "b"
+        assert shares.owner("call1") is None
+
+
+# ==========================================
+# CALL SIGNALING TESTS
+# ==========================================
+
+class FakeCallStore:
+    """Calls in the database plus every delivered signal"""
+
+    def __init__(self, calls=None):
+        self.calls = calls or {}
+        self.loads = 0
+        self.delivered = []
+
+    async def load(self, call_id):
+        self.loads += 1
+        return self.calls.get(call_id)
+
+    async def deliver(self, user_ids, payload):
+        self.delivered.append((sorted(user_ids), payload))
+
+
+def make_call(call_id="c1", participants=("a", "b")):
+    return {"call_id": call_id, "chat_id": "chat1", "caller_id": participants[0], "participants": list(participants)}
+
+
+class TestCallSignaling:
+    """Signals relay from memory and ICE candidates are batched"""
+
+    @pytest.mark.asyncio
+    async def test_offer_relays_without_database_read(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver)
+        signaling.register(make_call())
+
+        await signaling.relay("c1", "a", "offer", {"offer": {"sdp": "v=0"}})
+
+        assert store.loads == 0
+        assert store.delivered == [(["b"], {
+            "type": "webrtc_offer",
+            "data": {"call_id": "c1", "from_user_id": "a", "offer": {"sdp": "v=0"}, "ice_candidates": []}
+        })]
+
+    @pytest.mark.asyncio
+    async def test_ice_candidates_batch_within_window(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver, ice_window=0.01)
+        signaling.register(make_call())
+
+        for i in range(5):
+            await signaling.relay("c1", "a", "ice", {"candidate": f"cand{i}"})
+        assert store.delivered == []
+        await asyncio.sleep(0.05)
+
+        assert store.delivered == [(["b"], {
+            "type": "webrtc_ice",
+            "data": {"call_id": "c1", "from_user_id": "a", "candidates": [f"cand{i}" for i in range(5)]}
+        })]
+
+    @pytest.mark.asyncio
+    async def test_batch_flushes_on_size_and_end_of_candidates(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver, ice_window=60, ice_max_batch=3)
+        signaling.register(make_call())
+
+        for i in range(4):
+            await signaling.relay("c1", "a", "ice", {"candidate": f"cand{i}"})
+        await signaling.relay("c1", "a", "ice", {"candidate": None})
+
+        assert [payload["data"]["candidates"] for _, payload in store.delivered] == [
+            ["cand0", "cand1", "cand2"], ["cand3"]
+        ]
+        assert signaling.get_stats()["pending_ice"] == 0
+
+    @pytest.mark.asyncio
+    async def test_offer_flushes_pending_candidates_first(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver, ice_window=60)
+        signaling.register(make_call())
+
+        await signaling.relay("c1", "a", "ice", {"candidate": "old"})
+        await signaling.relay("c1", "a", "offer", {"offer": "renegotiate"})
+
+        assert [payload["type"] for _, payload in store.delivered] == ["webrtc_ice", "webrtc_offer"]
+
+    @pytest.mark.asyncio
+    async def test_directed_signal_and_rejections(self):
+        store = FakeCallStore({"c2": make_call("c2", ("a", "b", "c"))})
+        signaling = CallSignaling(store.load, store.deliver)
+
+        await signaling.relay("c2", "a", "answer", {"answer": "x"}, to_user_id="c")
+        await signaling.relay("c2", "b", "answer", {"answer": "y"})
+        assert [user_ids for user_ids, _ in store.delivered] == [["c"], ["a", "c"]]
+        assert store.loads == 1
+
+        with pytest.raises(PermissionError):
+            await signaling.relay("c2", "mallory", "offer", {})
+        with pytest.raises(LookupError):
+            await signaling.relay("missing", "a", "offer", {})
+
+    @pytest.mark.asyncio
+    async def test_end_drops_call_and_pending_candidates(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver, ice_window=0.01)
+        signaling.register(make_call())
+        await signaling.relay("c1", "a", "ice", {"candidate": "late"})
+
+        signaling.end("c1")
+        await asyncio.sleep(0.03)
+
+        assert store.delivered == []
+        assert signaling.get_stats()["calls"] == 0
+
+    @pytest.mark.asyncio
+    async def test_unknown_and_ended_calls_are_not_reloaded(self):
+        store = FakeCallStore({"c2": make_call("c2")})
+        signaling = CallSignaling(store.load, store.deliver, missing_ttl=60)
+
+        for _ in range(5):
+            assert await signaling.get("gone") is None
+        # Ended on another worker before its database write landed
+        signaling.end("c2")
+        assert await signaling.get("c2") is None
+
+        assert store.loads == 1
+        assert signaling.stats["missing_hits"] == 5
+
+    @pytest.mark.asyncio
+    async def test_negative_lookup_expires(self):
+        store = FakeCallStore()
+        signaling = CallSignaling(store.load, store.deliver, missing_ttl=0.01)
+        assert await signaling.get("c1") is None
+
+        store.calls["c1"] = make_call()
+        await asyncio.sleep(0.02)
+
+        assert (await signaling.get("c1")).participants == {"a", "b"}
+        assert signaling.expire_idle() == 0 and signaling.get_stats()["missing"] == 0
+
+
+# ==========================================
+# CALL QUALITY TESTS
+# ==========================================
+
+class TestCallQuality:
+    """Samples fold into histograms; only summaries are persisted"""
+
+    def test_histogram_buckets_and_percentiles(self):
+        histogram = QualityHistogram((50, 100, 250))
+        for value in [20, 40, 60, 80, 90, 120, 300, 900]:
+            histogram.add(value)
+
+        assert histogram.counts == [2, 3, 1, 2]
+        assert histogram.percentile(0.5) == 100
+        assert histogram.percentile(0.95) == 900  # overflow bucket reports the max
+        assert histogram.summary()["mean"] == 201.25
+
+    def test_invalid_metrics_are_dropped(self):
+        aggregator = CallQualityAggregator()
+
+        assert not aggregator.record("c1", "a", {"rtt_ms": "fast", "packet_loss": 250})
+        assert aggregator.record("c1", "a", {"rtt_ms": 80, "jitter_ms": True, "bogus": 1})
+        assert aggregator.call_summary("c1")["metrics"]["jitter_ms"] == {"count": 0}
+        assert aggregator.get_stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_finish_persists_one_summary_per_call(self):
+        written = []
+
+        async def writer(call_id, summary):
+            written.append((call_id, summary))
+
+        aggregator = CallQualityAggregator(writer)
+        for i in range(100):
+            aggregator.record("c1", "a" if i % 2 else "b", {"rtt_ms": 80 + i % 3, "packet_loss": 1}, region="eu", now=i)
+
+        summary = await aggregator.finish("c1")
+
+        assert written == [("c1", summary)]
+        assert summary["samples"] == 100
+        assert summary["participants"] == 2
+        assert summary["regions"] == ["eu"]
+        assert summary["metrics"]["rtt_ms"]["p95"] == 100
+        assert await aggregator.finish("c1") is None
+
+    def test_region_report_is_a_rolling_window(self):
+        aggregator = CallQualityAggregator(region_window=600, region_slot=60)
+        aggregator.record("c1", "a", {"rtt_ms": 500}, region="ap-south", now=0)
+        aggregator.record("c2", "b", {"rtt_ms": 40}, region="ap-south", now=500)
+        aggregator.record("c3", "c", {"rtt_ms": 60}, region="eu", now=500)
+
+        report = aggregator.region_report(now=550)
+        assert report["ap-south"]["rtt_ms"]["count"] == 2
+        assert set(report) == {"ap-south", "eu"}
+
+        report = aggregator.region_report("ap-south", now=700)
+        assert report["ap-south"]["rtt_ms"]["count"] == 1
+        assert report["ap-south"]["rtt_ms"]["max"] == 40
+
+    @pytest.mark.asyncio
+    async def test_quiet_calls_are_summarised(self):
+        written = []
+
+        async def writer(call_id, summary):
+            written.append(call_id)
+
+        aggregator = CallQualityAggregator(writer, idle_ttl=60)
+        aggregator.record("old", "a", {"rtt_ms": 50}, now=0)
+        aggregator.record("live", "a", {"rtt_ms": 50}, now=100)
+
+        assert await aggregator.expire_idle(now=120) == 1
+        assert written == ["old"]
+        assert list(aggregator.calls) == ["live"]
+
+
+# ==========================================
+# DELIVERY OUTBOX TESTS
+# ==========================================
+
+class FakeOutboxStore:
+    """Outbox entries keyed by (user, message); messages looked up by id"""
+
+    def __init__(self, fail_writes=0):
+        self.entries = {}
+        self.messages = {}
+        self.writes = 0
+        self.removals = 0
+        self.fail_writes = fail_writes
+
+    async def write(self, entries):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise RuntimeError("primary stepped down")
+        self.writes += 1
+        for entry in entries:
+            self.entries.setdefault((entry["user_id"], entry["message_id"]), entry)
+
+    async def read(self, user_id, limit):
+        mine = sorted(
+            (entry for (owner, _), entry in self.entries.items() if owner == user_id),
+            key=lambda entry: entry["created_at"]
+        )
+        return [self.messages[entry["message_id"]] for entry in mine[:limit]], len(mine) > limit
+
+    async def remove(self, user_id, message_ids):
+        self.removals += 1
+        for message_id in message_ids:
+            self.entries.pop((user_id, message_id), None)
+
+
+class TestDeliveryOutbox:
+    """Offline recipients get what they missed, once acked it is gone"""
+
+    def make_outbox(self, store, drain_limit=500):
+        return DeliveryOutbox(store.write, store.read, store.remove, drain_limit=drain_limit)
+
+    @pytest.mark.asyncio
+    async def test_group_message_is_one_write(self):
+        store = FakeOutboxStore()
+        outbox = self.make_outbox(store)
+        offline = [f"u{i}" for i in range(200)]
+
+        outbox.record(offline, "chat1", "m1")
+        await outbox.flush_pending()
+
+        assert store.writes == 1
+        assert len(store.entries) == 200
+
+    @pytest.mark.asyncio
+    async def test_drain_returns_missed_until_acked(self):
+        store = FakeOutboxStore()
+        outbox = self.make_outbox(store, drain_limit=2)
+        start = datetime.utcnow()
+        for i in range(3):
+            store.messages[f"m{i}"] = {"message_id": f"m{i}"}
+            outbox.record(["bob"], "chat1", f"m{i}", at=start + timedelta(seconds=i))
+
+        # Still buffered: drain flushes first
+        messages, more = await outbox.drain("bob")
+        assert [message["message_id"] for message in messages] == ["m0", "m1"]
+        assert more
+
+        # Unacked messages come back on the next reconnect
+        messages, _ = await outbox.drain("bob")
+        assert [message["message_id"] for message in messages] == ["m0", "m1"]
+
+        outbox.ack("bob", ["m0", "m1"])
+        messages, more = await outbox.drain("bob")
+        assert [message["message_id"] for message in messages] == ["m2"]
+        assert not more
+        assert store.removals == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_write_is_retried(self):
+        store = FakeOutboxStore(fail_writes=1)
+        outbox = self.make_outbox(store)
+
+        outbox.record(["bob"], "chat1", "m1")
+        await outbox.flush_pending()
+        assert not store.entries
+        assert outbox.stats['errors'] == 1
+
+        await outbox.flush_pending()
+        assert ("bob", "m1") in store.entries
+
+
+class TestReceiptWatermarks:
+    """Receipt bursts collapse to one watermark per chat, user and kind"""
+
+    @pytest.mark.asyncio
+    async def test_burst_collapses_to_newest_watermark(self):
+        written, published = [], []
+
+        async def writer(watermarks):
+            written.extend(watermarks)
+
+        async def publisher(chat_id, watermarks):
+            published.append((chat_id, watermarks))
+
+        receipts = ReceiptWatermarks(writer, publisher)
+        start = datetime.utcnow()
+        for i in range(50):
+            receipts.mark("chat1", "bob", "read", start + timedelta(seconds=i), f"m{i}")
+        # An older receipt arriving late does not move the watermark back
+        receipts.mark("chat1", "bob", "delivered", start, "m0")
+        receipts.mark("chat2", "bob", "delivered", start, "x1")
+        await receipts.flush_pending()
+
+        marks = {(watermark["chat_id"], watermark["kind"]): watermark for watermark in written}
+        assert len(written) == 3
+        assert marks[("chat1", "read")]["message_id"] == "m49"
+        # Read implies delivered
+        assert marks[("chat1", "delivered")]["message_id"] == "m49"
+        assert sorted(chat_id for chat_id, _ in published) == ["chat1", "chat2"]
+
+    def test_unknown_kind_is_rejected(self):
+        async def noop(*args):
+            pass
+
+        with pytest.raises(ValueError):
+            ReceiptWatermarks(noop, noop).mark("chat1", "bob", "seen", datetime.utcnow())
+
+
+# ==========================================
+# CHAT SEQUENCE TESTS
+# ==========================================
+
+class FakeSequenceStore:
+    """Atomic per-chat counters"""
+
+    def __init__(self):
+        self.counters = {}
+        self.increments = []
+
+    async def increment(self, chat_id, count):
+        await asyncio.sleep(0)
+        self.increments.append((chat_id, count))
+        self.counters[chat_id] = self.counters.get(chat_id, 0) + count
+        return self.counters[chat_id]
+
+
+class TestChatSequencer:
+    """Sequence numbers are unique, gap-free and allocated in batches"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_increment(self):
+        store = FakeSequenceStore()
+        sequencer = ChatSequencer(store.increment)
+
+        seqs = await asyncio.gather(*(sequencer.next("chat1") for _ in range(50)), sequencer.next("chat2"))
+
+        assert sorted(seqs[:50]) == list(range(1, 51))
+        assert seqs[50] == 1
+        assert sorted(store.increments) == [("chat1", 50), ("chat2", 1)]
+
+        assert await sequencer.next("chat1") == 51
+
+    @pytest.mark.asyncio
+    async def test_stable_watermark_waits_for_in_flight_writes(self):
+        store = FakeSequenceStore()
+        sequencer = ChatSequencer(store.increment)
+        slow_write = asyncio.Event()
+
+        async def slow_mutation():
+            async with sequencer.mutation("chat1"):
+                await slow_write.wait()
+
+        slow = asyncio.create_task(slow_mutation())
+        await asyncio.sleep(0.01)
+        async with sequencer.mutation("chat1") as seq:
+            pass
+
+        # Seq 2 is written but seq 1 is not: a client must not skip past 1
+        assert seq == 2
+        assert sequencer.stable("chat1", 2) == 0
+
+        slow_write.set()
+        await slow
+        assert sequencer.stable("chat1", 2) == 2
+        assert sequencer.get_stats()['in_flight'] == 0
+
+    @pytest.mark.asyncio
+    async def test_allocated_seq_is_in_flight_before_its_writer_resumes(self):
+        store = FakeSequenceStore()
+        sequencer = ChatSequencer(store.increment)
+        seen = []
+
+        async def reader():
+            seq = await sequencer.next("chat1")
+            seen.append(("reader", seq, sequencer.stable("chat1", 2)))
+
+        async def writer():
+            async with sequencer.mutation("chat1") as seq:
+                seen.append(("writer", seq, None))
+
+        # One increment serves both; the reader resumes first and must not see seq 2 as stable
+        await asyncio.gather(reader(), writer())
+
+        assert seen == [("reader", 1, 1), ("writer", 2, None)]
+        assert store.increments == [("chat1", 2)]
+        assert sequencer.get_stats()['in_flight'] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_mutation_does_not_pin_the_watermark(self):
+        store = FakeSequenceStore()
+        sequencer = ChatSequencer(store.increment)
+
+        async def mutate():
+            async with sequencer.mutation("chat1"):
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(mutate())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert sequencer.stable("chat1", 1) == 1
+        assert sequencer.get_stats()['in_flight'] == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_increment_fails_its_requests(self):
+        async def failing(chat_id, count):
+            raise RuntimeError("primary stepped down")
+
+        sequencer = ChatSequencer(failing)
+        with pytest.raises(RuntimeError):
+            await sequencer.next("chat1")
+        assert not sequencer._waiting
+
+
+# ==========================================
+# CHAT INBOX TESTS
+# ==========================================
+
+class FakeInboxStore:
+    """Records each bulk write; serves chats and peers"""
+
+    def __init__(self, chats=None, users=None):
+        self.chats = chats or {}
+        self.users = users or {}
+        self.batches = []
+
+    async def write(self, operations):
+        self.batches.append(operations)
+
+    async def load_chats(self, chat_ids):
+        return [self.chats[chat_id] for chat_id in chat_ids if chat_id in self.chats]
+
+    async def load_peers(self, user_ids):
+        return {user_id: {"user_id": user_id, "username": self.users[user_id]} for user_id in user_ids if user_id in self.users}
+
+
+class TestChatInbox:
+    """Inbox rows are maintained with a bounded number of writes per flush"""
+
+    def make_inbox(self, store):
+        return ChatInbox(store.write, store.load_chats, store.load_peers)
+
+    @pytest.mark.asyncio
+    async def test_message_burst_coalesces_per_chat_and_sender(self):
+        store = FakeInboxStore()
+        inbox = self.make_inbox(store)
+        start = datetime(2024, 1, 1)
+
+        for i in range(200):
+            sender = "alice" if i % 2 else "bob"
+            inbox.message_posted("group1", {"message_id": f"m{i}", "sender_id": sender, "content": f"hi {i}", "timestamp": start + timedelta(seconds=i)})
+        await inbox.flush_pending()
+
+        # One preview update plus one unread increment per sender, whatever the burst size
+        [operations] = store.batches
+        assert len(operations) == 3
+        preview = operations[0]._doc["$set"]
+        assert preview["last_message"]["message_id"] == "m199"
+        assert preview["sort_key"] == start + timedelta(seconds=199)
+        increments = {op._filter["user_id"]["$ne"]: op._doc["$inc"]["unread_count"] for op in operations[1:]}
+        assert increments == {"alice": 100, "bob": 100}
+
+        await inbox.flush_pending()
+        assert len(store.batches) == 1
+
+    @pytest.mark.asyncio
+    async def test_new_chat_and_join_create_rows_with_peers(self):
+        store = FakeInboxStore(
+            chats={"group1": {"chat_id": "group1", "chat_type": "group", "members": ["alice", "bob", "carol"]}},
+            users={"alice": "Alice", "bob": "Bob"}
+        )
+        inbox = self.make_inbox(store)
+
+        inbox.chat_created({"chat_id": "dm1", "chat_type": "direct", "members": ["alice", "bob"], "created_at": datetime(2024, 1, 1)})
+        inbox.member_added("group1", "carol")
+        inbox.message_posted("dm1", {"message_id": "m1", "sender_id": "alice", "content": "hello", "timestamp": datetime(2024, 1, 2)})
+        await inbox.flush_pending()
+
+        # Rows are created before this flush's activity touches them
+        [rows, activity, updates] = store.batches
+        rows = {(op._filter["chat_id"], op._filter["user_id"]): op._doc for op in rows}
+        assert set(rows) == {("dm1", "alice"), ("dm1", "bob"), ("group1", "carol")}
+        assert rows[("dm1", "alice")]["$set"]["peer"]["username"] == "Bob"
+        assert rows[("dm1", "bob")]["$set"]["peer"]["username"] == "Alice"
+        assert rows[("group1", "carol")]["$set"]["peer"] is None
+        assert rows[("dm1", "alice")]["$setOnInsert"]["unread_count"] == 0
+        assert activity[-1]._doc == {"$inc": {"unread_count": 1}}
+
+        # Every member's copy of the group lists the new member
+        assert updates[0]._filter == {"chat_id": "group1"}
+        assert updates[0]._doc == {"$addToSet": {"chat.members": "carol"}}
+
+    @pytest.mark.asyncio
+    async def test_rows_keep_full_chat_document(self):
+        store = FakeInboxStore()
+        inbox = self.make_inbox(store)
+        chat = {
+            "_id": "oid", "chat_id": "group1", "chat_type": "group", "members": ["alice"],
+            "pinned_messages": ["m1"], "topics": ["general"], "last_message": {"message_id": "m1"}
+        }
+
+        inbox.chat_created(chat)
+        await inbox.flush_pending()
+
+        [[row]] = store.batches
+        assert row._doc["$set"]["chat"] == {
+            "chat_id": "group1", "chat_type": "group", "members": ["alice"], "pinned_messages": ["m1"], "topics": ["general"]
+        }
+
+    @pytest.mark.asyncio
+    async def test_leave_updates_remaining_rows(self):
+        store = FakeInboxStore()
+        inbox = self.make_inbox(store)
+
+        inbox.member_added("group1", "carol")
+        inbox.member_removed("group1", "carol")
+        await inbox.flush_pending()
+
+        # The join is cancelled by the leave; the row goes and the member lists follow in order
+        [rows, updates] = store.batches
+        assert [type(op).__name__ for op in rows] == ["DeleteOne"]
+        assert [op._doc for op in updates] == [
+            {"$addToSet": {"chat.members": "carol"}}, {"$pull": {"chat.members": "carol"}}
+        ]
+
+    @pytest.mark.asyncio
+    async def test_read_is_applied_after_buffered_messages(self):
+        store = FakeInboxStore()
+        inbox = self.make_inbox(store)
+
+        inbox.message_posted("dm1", {"message_id": "m1", "sender_id": "alice", "timestamp": datetime(2024, 1, 1)})
+        inbox.mark_read("dm1", "bob", datetime(2024, 1, 2))
+        await inbox.flush_pending()
+
+        [activity, [read]] = store.batches
+        assert activity[-1]._doc == {"$inc": {"unread_count": 1}}
+        assert read._doc == {"$set": {"unread_count": 0, "read_at": datetime(2024, 1, 2)}}
+        assert read._filter["sort_key"] == {"$lte": datetime(2024, 1, 2)}
+
+    @pytest.mark.asyncio
+    async def test_failed_row_write_retries_everything(self):
+        store = FakeInboxStore(chats={"group1": {"chat_id": "group1", "chat_type": "group", "members": ["alice", "bob"]}})
+        failures = [RuntimeError("not primary")]
+
+        async def flaky(operations):
+            if failures:
+                raise failures.pop()
+            await store.write(operations)
+
+        inbox = ChatInbox(flaky, store.load_chats, store.load_peers)
+        inbox.member_added("group1", "bob")
+        inbox.message_posted("group1", {"message_id": "m1", "sender_id": "alice", "timestamp": datetime(2024, 1, 1)})
+        await inbox.flush_pending()
+
+        # Nothing reached the database, so the unread increment is safe to retry too
+        assert store.batches == []
+        assert inbox.get_stats()['errors'] == 1
+        assert inbox.get_stats()['pending_rows'] == 1
+        assert inbox.get_stats()['pending_chats'] == 1
+
+        await inbox.flush_pending()
+        [rows, activity, updates] = store.batches
+        assert [op._filter for op in rows] == [{"chat_id": "group1", "user_id": "bob"}]
+        assert activity[-1]._doc == {"$inc": {"unread_count": 1}}
+        assert updates[0]._doc == {"$addToSet": {"chat.members": "bob"}}
+
+    @pytest.mark.asyncio
+    async def test_failed_activity_write_drops_increments_and_retries_preview(self):
+        store = FakeInboxStore()
+        failures = [RuntimeError("write concern timeout")]
+
+        async def flaky(operations):
+            if failures and any("$inc" in op._doc for op in operations):
+                raise failures.pop()
+            await store.write(operations)
+
+        inbox = ChatInbox(flaky, store.load_chats, store.load_peers)
+        inbox.message_posted("dm1", {"message_id": "m1", "sender_id": "alice", "timestamp": datetime(2024, 1, 1)})
+        inbox.mark_read("dm1", "bob", datetime(2024, 1, 2))
+        await inbox.flush_pending()
+
+        # The increment may have partly applied: it is not retried, the preview and read are
+        [[read]] = store.batches
+        assert read._doc["$set"]["unread_count"] == 0
+        assert inbox.get_stats()['dropped_increments'] == 1
+        assert inbox.get_stats()['pending_operations'] == 1
+
+        await inbox.flush_pending()
+        [[preview]] = store.batches[1:]
+        assert preview._doc["$set"]["last_message"]["message_id"] == "m1"
+        assert inbox.get_stats()['pending_operations'] == 0
+
+
+# ==========================================
+# MESSAGE PIPELINE TESTS
+# ==========================================
+
+class FakeMessageStore:
+    """Records batch writes, chat updates and fan-outs"""
+
+    def __init__(self, failing_ids=()):
+        self.failing_ids = set(failing_ids)
+        self.batches = []
+        self.chat_updates = []
+        self.fanned_out = []
+        self.fanout_gate = asyncio.Event()
+        self.fanout_gate.set()
+
+    async def write(self, messages):
+        await asyncio.sleep(0)
+        self.batches.append([message["message_id"] for message in messages])
+        return {index for index, message in enumerate(messages) if message["message_id"] in self.failing_ids}
+
+    async def update_chats(self, latest):
+        self.chat_updates.append({chat_id: message["message_id"] for chat_id, message in latest.items()})
+
+    async def fanout(self, messages):
+        await self.fanout_gate.wait()
+        self.fanned_out.extend(message["message_id"] for message in messages)
+
+
+def pipeline_message(message_id, chat_id="chat1", seconds=0):
+    return {"message_id": message_id, "chat_id": chat_id, "timestamp": datetime(2024, 1, 1) + timedelta(seconds=seconds)}
+
+
+class TestMessagePipeline:
+    """Concurrent sends share one write; fan-out never delays the response"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_sends_share_one_commit(self):
+        store = FakeMessageStore()
+        pipeline = MessagePipeline(store.write, store.update_chats, store.fanout, window=0.01)
+        pipeline.start()
+
+        await asyncio.gather(*(
+            pipeline.submit(pipeline_message(f"m{i}", chat_id=f"chat{i % 2}", seconds=i)) for i in range(20)
+        ))
+
+        assert len(store.batches) == 1
+        assert store.chat_updates == [{"chat0": "m18", "chat1": "m19"}]
+        await pipeline.stop()
+        assert sorted(store.fanned_out) == sorted(f"m{i}" for i in range(20))
+
+    @pytest.mark.asyncio
+    async def test_full_batch_commits_without_waiting_for_window(self):
+        store = FakeMessageStore()
+        pipeline = MessagePipeline(store.write, store.update_chats, store.fanout, window=10, max_batch=4)
+
+        await asyncio.wait_for(asyncio.gather(*(pipeline.submit(pipeline_message(f"m{i}")) for i in range(4))), 1)
+
+        assert store.batches == [["m0", "m1", "m2", "m3"]]
+
+    @pytest.mark.asyncio
+    async def test_response_does_not_wait_for_fan_out(self):
+        store = FakeMessageStore()
+        store.fanout_gate.clear()
+        pipeline = MessagePipeline(store.write, store.update_chats, store.fanout, window=0.001)
+        pipeline.start()
+
+        await asyncio.wait_for(pipeline.submit(pipeline_message("m1")), 1)
+        assert store.fanned_out == []
+        assert pipeline.get_stats()['messages'] == 1
+
+        store.fanout_gate.set()
+        await pipeline.stop()
+        assert store.fanned_out == ["m1"]
+
+    @pytest.mark.asyncio
+    async def test_failed_positions_fail_only_their_senders(self):
+        store = FakeMessageStore(failing_ids={"m1"})
+        pipeline = MessagePipeline(store.write, store.update_chats, store.fanout, window=0.001)
+
+        results = await asyncio.gather(
+            *(pipeline.submit(pipeline_message(f"m{i}", seconds=i)) for i in range(3)),
+            return_exceptions=True
+        )
+
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], RuntimeError)
+        assert store.chat_updates == [{"chat1": "m2"}]
+        assert store.fanned_out == ["m0", "m2"]
+        assert pipeline.get_stats()['failed'] == 1
+
+
+# ==========================================
+# REACTION AGGREGATOR TESTS
+# ==========================================
+
+class TestReactionAggregator:
+    """Reaction storms become one broadcast per message per window"""
+
+    @pytest.mark.asyncio
+    async def test_burst_publishes_newest_state_once_per_message(self):
+        published = []
+
+        async def publish(chat_id, message_id, state, changes):
+            published.append((chat_id, message_id, state, list(changes)))
+
+        aggregator = ReactionAggregator(publish, max_changes=3)
+        # Requests finish out of order: version 5 arrives before version 4
+        for version in (1, 2, 3, 5, 4):
+            aggregator.record("chat1", "m1", version, {"reaction_counts": {"👍": version}}, {"user_id": f"u{version}", "emoji": "👍"})
+        aggregator.record("chat1", "m2", 1, {"reaction_counts": {"🔥": 1}}, {"user_id": "u1", "emoji": "🔥"})
+        await aggregator.flush_pending()
+
+        assert len(published) == 2
+        chat_id, message_id, state, changes = published[0]
+        assert (chat_id, message_id) == ("chat1", "m1")
+        assert state == {"reaction_counts": {"👍": 5}}
+        assert [change["user_id"] for change in changes] == ["u3", "u5", "u4"]
+        assert aggregator.get_stats()['coalesced'] == 4
+
+        await aggregator.flush_pending()
+        assert len(published) == 2
+
+    @pytest.mark.asyncio
+    async def test_publish_failure_does_not_block_other_messages(self):
+        published = []
+
+        async def publish(chat_id, message_id, state, changes):
+            if message_id == "m1":
+                raise RuntimeError("membership load failed")
+            published.append(message_id)
+
+        aggregator = ReactionAggregator(publish)
+        aggregator.record("chat1", "m1", 1, {}, {})
+        aggregator.record("chat1", "m2", 1, {}, {})
+        await aggregator.flush_pending()
+
+        assert published == ["m2"]
+        assert aggregator.get_stats()['errors'] == 1
@@ -498,7 +498,7 @@ const ChatsInterface = ({
       
       ws.onmessage = (event) => {
         const message = JSON.parse(event.data);
-        handleWebSocketMessage(message);
+        handleWebSocketMessage(message, ws);
       };
       
       ws.onclose = () => {
@@ -519,7 +519,7 @@ const ChatsInterface = ({
   };
 
   // Enhanced WebSocket message handling with emoji reactions
-  const handleWebSocketMessage = (message) => {
+  const handleWebSocketMessage = (message, ws = socket) => {
     console.log('Received WebSocket message:', message);
     
     switch (message.type) {
@@ -529,7 +529,31 @@ const ChatsInterface = ({
           onSelectChat(selectedChat); // This will refresh messages
         }
         break;
-        
+
+      case 'missed_messages': {
+        // Delivered while we were offline; ack so the server drops them from our outbox
+        const missed = message.data.messages || [];
+        if (ws && ws.readyState === WebSocket.OPEN) {
+          ws.send(JSON.stringify({
+            type: 'ack',
+            message_ids: missed.map(m => m.message_id),
+            drain: message.data.more
+          }));
+        }
+        if (selectedChat && missed.some(m => m.chat_id === selectedChat.chat_id)) {
+          onSelectChat(selectedChat);
+        }
+        break;
+      }
+
+      case 'receipt_update':
+        message.data.receipts.forEach(receipt => {
+          if (receipt.message_id && receipt.kind === 'read') {
+            handleMessageStatus({ message_id: receipt.message_id, status: 'read' });
+          }
+        });
+        break;
+
       case 'typing':
         setTypingUsers(prev => ({
           ...prev,
@@ -550,6 +574,11 @@ const ChatsInterface = ({
         break;
 
       // Emoji reaction WebSocket messages
+      case 'message_reaction':
+        // One frame per message per broadcast window, however many reactions it covers
+        fetchMessageReactions(message.data.message_id);
+        break;
+
       case 'reaction_added':
         fetchMessageReactions(message.data.message_id);
         break;
@@ -1422,15 +1451,11 @@ const ChatsInterface = ({
         setRemoteStream(event.streams[0]);
       };
       
-      // Handle ICE candidates
+      // Handle ICE candidates (a null candidate marks the end of gathering)
       peerConnection.current.onicecandidate = async (event) => {
-        if (event.candidate && currentCall) {
+        if (currentCall) {
           try {
-            await axios.post(`${api}/calls/${currentCall.call_id}/webrtc/ice`, {
-              candidate: event.candidate
-            }, {
-              headers: { Authorization: `Bearer ${token}` }
-            });
+            await sendWebRTCSignal(currentCall.call_id, 'ice', { candidate: event.candidate });
           } catch (error) {
             console.error('Failed to send ICE candidate:', error);
           }
@@ -1445,6 +1470,18 @@ const ChatsInterface = ({
     }
   };
 
+  // WebRTC signals go over the chat socket when it is open, HTTP otherwise
+  const sendWebRTCSignal = async (callId, kind, payload) => {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: `webrtc_${kind}`, call_id: callId, ...payload }));
+      return;
+    }
+    if (kind === 'ice' && !payload.candidate) return;
+    await axios.post(`${api}/calls/${callId}/webrtc/${kind}`, payload, {
+      headers: { Authorization: `Bearer ${token}` }
+    });
+  };
+
   // WebRTC Signaling Handlers
   const handleWebRTCOffer = async (data) => {
     if (!currentCall || data.call_id !== currentCall.call_id) return;
@@ -1458,11 +1495,7 @@ const ChatsInterface = ({
       await peerConnection.current.setLocalDescription(answer);
       
       // Send answer
-      await axios.post(`${api}/calls/${currentCall.call_id}/webrtc/answer`, {
-        answer: answer
-      }, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
+      await sendWebRTCSignal(currentCall.call_id, 'answer', { answer: answer });
       
     } catch (error) {
       console.error('Error handling WebRTC offer:', error);
@@ -1483,7 +1516,11 @@ const ChatsInterface = ({
     if (!currentCall || data.call_id !== currentCall.call_id) return;
     
     try {
-      await peerConnection.current.addIceCandidate(data.candidate);
+      // Candidates arrive batched; older servers sent one per frame
+      const candidates = data.candidates || [data.candidate];
+      for (const candidate of candidates) {
+        await peerConnection.current.addIceCandidate(candidate);
+      }
     } catch (error) {
       console.error('Error adding ICE candidate:', error);
     }
@@ -1515,11 +1552,7 @@ const ChatsInterface = ({
       const offer = await peerConnection.current.createOffer();
       await peerConnection.current.setLocalDescription(offer);
       
-      await axios.post(`${api}/calls/${call.call_id}/webrtc/offer`, {
-        offer: offer
-      }, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
+      await sendWebRTCSignal(call.call_id, 'offer', { offer: offer });
       
     } catch (error) {
       console.error('Failed to initiate call:', error);
@@ -1601,6 +1634,46 @@ const ChatsInterface = ({
     setIsScreenSharing(false);
   };
 
+  // Stream call quality samples (aggregated server-side, never stored raw)
+  useEffect(() => {
+    if (!isCallActive || !currentCall) return;
+    let lastBytesSent = null;
+    let lastTimestamp = null;
+
+    const interval = setInterval(async () => {
+      if (!peerConnection.current || !socket || socket.readyState !== WebSocket.OPEN) return;
+      try {
+        const sample = { type: 'call_quality', call_id: currentCall.call_id };
+        const report = await peerConnection.current.getStats();
+        let bytesSent = 0;
+        let timestamp = null;
+        report.forEach((stat) => {
+          if (stat.type === 'candidate-pair' && stat.nominated && stat.currentRoundTripTime !== undefined) {
+            sample.rtt_ms = stat.currentRoundTripTime * 1000;
+          } else if (stat.type === 'inbound-rtp' && stat.kind === 'audio') {
+            if (stat.jitter !== undefined) sample.jitter_ms = stat.jitter * 1000;
+            const received = (stat.packetsReceived || 0) + (stat.packetsLost || 0);
+            if (received > 0) sample.packet_loss = (100 * (stat.packetsLost || 0)) / received;
+          } else if (stat.type === 'outbound-rtp' && stat.bytesSent !== undefined) {
+            bytesSent += stat.bytesSent;
+            timestamp = stat.timestamp;
+          }
+        });
+        // Bytes per millisecond * 8 = kbit/s, across audio and video
+        if (lastBytesSent !== null && timestamp > lastTimestamp) {
+          sample.bitrate_kbps = (8 * (bytesSent - lastBytesSent)) / (timestamp - lastTimestamp);
+        }
+        lastBytesSent = bytesSent;
+        lastTimestamp = timestamp;
+        socket.send(JSON.stringify(sample));
+      } catch (error) {
+        console.error('Failed to collect call quality:', error);
+      }
+    }, 5000);
+
+    return () => clearInterval(interval);
+  }, [isCallActive, currentCall, socket]);
+
   // Call Control Functions
   const toggleMute = () => {
     if (localStream) {